@@ -162,8 +162,8 @@ def build(settings: Settings) -> dict:
     openai = OpenAIClient(settings.openai_api_key)
     yd = YandexDiskClient(settings.yandex_disk_token, settings.yandex_root_path)
 
-    retriever = Retriever(kb_repo, openai, settings.pgvector_dim)
     embedder = Embedder(openai, settings.embedding_model)
+    retriever = Retriever(kb_repo, embedder)
 
     rag = RagService(retriever)
     gen = GenService(openai, rag, settings)
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import array
+import base64
 import logging
 import os
 import time
@@ -8,6 +10,11 @@ from typing import Any, Dict, List, Optional, Sequence, Literal, Set
 
 from openai import OpenAI
 
+try:
+    import numpy as np  # зависимость pgvector
+except Exception:
+    np = None
+
 log = logging.getLogger(__name__)
 
 
@@ -21,6 +28,19 @@ def _mask_key(k: str) -> str:
 ModelKind = Literal["text", "image", "transcribe", "embeddings"]
 
 
+def _decode_embedding(value: Any) -> Any:
+    """
+    base64 (little-endian float32) -> numpy.ndarray float32 поверх декодированных байт, без списка
+    из 3072 Python float на вектор. Без numpy — list[float]; если прокси вернул числа — как есть.
+    """
+    if not isinstance(value, str):
+        return value
+    raw = base64.b64decode(value)
+    if np is not None:
+        return np.frombuffer(raw, dtype="<f4")
+    return array.array("f", raw).tolist()
+
+
 class OpenAIClient:
     """
     OpenAI API client wrapper.
@@ -189,22 +209,34 @@ class OpenAIClient:
         return fallback
 
     # -------- embeddings (KB/RAG) --------
-    def embeddings(self, texts: Sequence[str], model: str) -> List[List[float]]:
+    def embeddings(self, texts: Sequence[str], model: str, dimensions: Optional[int] = None) -> List[Any]:
+        """
+        Векторы float32 (numpy.ndarray, без numpy — list[float]).
+
+        encoding_format="base64" задаётся явно: тогда SDK отдаёт строку как есть, и она декодируется
+        сразу в float32. Без явного формата SDK тоже качает base64, но раскладывает каждый вектор в
+        список Python float и валидирует его pydantic'ом.
+        dimensions — укороченные векторы text-embedding-3-* (API сам обрезает и нормирует).
+        """
         if not texts:
             return []
 
+        kwargs: Dict[str, Any] = {"model": model, "input": list(texts), "encoding_format": "base64"}
+        if dimensions:
+            kwargs["dimensions"] = int(dimensions)
+
         last_err: Optional[Exception] = None
         for attempt in range(1, 4):
             try:
-                resp = self.client.embeddings.create(model=model, input=list(texts))
-                return [d.embedding for d in resp.data]
+                resp = self.client.embeddings.create(**kwargs)
+                return [_decode_embedding(d.embedding) for d in resp.data]
             except Exception as e:
                 last_err = e
                 time.sleep(0.5 * attempt)
 
         raise last_err or RuntimeError("embeddings() failed")
 
-    def embed(self, texts: Sequence[str], model: Optional[str] = None) -> List[List[float]]:
+    def embed(self, texts: Sequence[str], model: Optional[str] = None) -> List[Any]:
         # Backward-compatible alias
         if model is None:
             try:
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import tempfile
+import threading
+from typing import IO, Any, Dict, Iterable, Optional, Union
+
+try:
+    import httpx  # optional
+except Exception:
+    httpx = None
+
+from app.clients.yandex_disk_client import full_path
+
+log = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+class AsyncYandexDiskClient:
+    """
+    Асинхронный (httpx) вариант YandexDiskClient для скачивания многих файлов сразу:
+    один пул keep-alive соединений, потоковая запись в SpooledTemporaryFile, докачка через Range.
+    """
+
+    def __init__(
+        self,
+        token: str | None,
+        root: str | None,
+        *,
+        base_url: str = "https://cloud-api.yandex.net/v1/disk",
+        max_connections: int = 32,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 120.0,
+        max_retries: int = 3,
+        chunk_size: int = 1 * MB,
+        spool_max_mb: int = 8,
+    ):
+        if httpx is None:
+            raise RuntimeError("httpx is not installed: AsyncYandexDiskClient is unavailable")
+        self.token = token
+        self.root = (root or "/kb").rstrip("/")
+        self.base = base_url.rstrip("/")
+        self._max_retries = max(0, int(max_retries))
+        self._chunk_size = max(64 * 1024, int(chunk_size))
+        self._spool_max = max(0, int(spool_max_mb)) * MB
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=int(max_connections), max_keepalive_connections=int(max_connections)),
+            timeout=httpx.Timeout(float(read_timeout), connect=float(connect_timeout)),
+            follow_redirects=True,
+        )
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    def _h(self) -> Dict[str, str]:
+        return {"Authorization": f"OAuth {self.token}"} if self.token else {}
+
+    def _full(self, path: str) -> str:
+        return full_path(self.root, path)
+
+    async def list(self, path: str, *, limit: int = 1000, offset: int = 0) -> Dict[str, Any]:
+        if not self.token:
+            return {"_stub": True, "items": []}
+        r = await self._client.get(
+            f"{self.base}/resources",
+            headers=self._h(),
+            params={"path": self._full(path), "limit": int(limit), "offset": int(offset)},
+        )
+        r.raise_for_status()
+        return r.json()
+
+    async def download_to_spool(self, path: str, *, size: int | None = None) -> IO[bytes]:  # noqa: ARG002
+        spool = tempfile.SpooledTemporaryFile(max_size=self._spool_max, mode="w+b")
+        if not self.token:
+            return spool
+        try:
+            r = await self._client.get(
+                f"{self.base}/resources/download", headers=self._h(), params={"path": self._full(path)}
+            )
+            r.raise_for_status()
+            href = r.json()["href"]
+
+            pos = 0
+            attempts = 0
+            while True:
+                headers = {"Range": f"bytes={pos}-"} if pos else {}
+                try:
+                    async with self._client.stream("GET", href, headers=headers) as resp:
+                        resp.raise_for_status()
+                        if headers and resp.status_code != 206:
+                            raise RuntimeError("Disk server ignored Range request")
+                        async for block in resp.aiter_bytes(self._chunk_size):
+                            spool.write(block)
+                            pos += len(block)
+                    break
+                except httpx.TransportError as e:
+                    attempts += 1
+                    if attempts > self._max_retries:
+                        raise
+                    log.warning("Disk download interrupted at %s bytes, resuming (%s/%s): %s", pos, attempts, self._max_retries, e)
+
+            spool.seek(0)
+            return spool
+        except Exception:
+            spool.close()
+            raise
+
+    async def download_many(
+        self, paths: Iterable[str], *, concurrency: int = 16
+    ) -> Dict[str, Union[IO[bytes], Exception]]:
+        """Скачивает пачку файлов, держа в полёте не больше concurrency загрузок."""
+        sem = asyncio.Semaphore(max(1, int(concurrency)))
+        out: Dict[str, Union[IO[bytes], Exception]] = {}
+
+        async def one(p: str) -> None:
+            async with sem:
+                try:
+                    out[p] = await self.download_to_spool(p)
+                except Exception as e:
+                    out[p] = e
+
+        await asyncio.gather(*(one(p) for p in paths))
+        return out
+
+
+class BlockingAsyncDownloader:
+    """
+    Мост для потокового конвейера sync: event loop с AsyncYandexDiskClient живёт в отдельном
+    потоке, а download_to_spool() блокирует только вызывающий воркер. Так можно держать
+    много загрузок в полёте на одном пуле соединений, не плодя HTTP-сессии.
+    """
+
+    def __init__(self, **client_kwargs: Any):
+        if httpx is None:
+            raise RuntimeError("httpx is not installed: BlockingAsyncDownloader is unavailable")
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="disk-async", daemon=True)
+        self._thread.start()
+        self._client: Optional[AsyncYandexDiskClient] = None
+
+        async def _make() -> AsyncYandexDiskClient:
+            # httpx.AsyncClient создаём внутри своего loop
+            return AsyncYandexDiskClient(**client_kwargs)
+
+        self._client = asyncio.run_coroutine_threadsafe(_make(), self._loop).result()
+
+    def download_to_spool(self, path: str, *, size: int | None = None) -> IO[bytes]:
+        assert self._client is not None
+        fut = asyncio.run_coroutine_threadsafe(self._client.download_to_spool(path, size=size), self._loop)
+        return fut.result()
+
+    def close(self) -> None:
+        if self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+            self._client = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
@@ -1,72 +1,323 @@
 from __future__ import annotations
 
+import logging
+import tempfile
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import IO, Any, Dict, List, Optional, Tuple
+
 import requests
-from typing import Any, Dict, List
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+log = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+LIST_MODES = ("walk", "flat")
+
+_FILE_FIELDS = ("path", "type", "resource_id", "modified", "md5", "size")
+
+
+def full_path(root: str, path: str) -> str:
+    """Абсолютный путь на Диске: '/…' и 'disk:/…' как есть, иначе — относительно root."""
+    path = (path or "").strip()
+    if not path:
+        return root
+    if path.startswith("/") or path.startswith("disk:"):
+        return path
+    return f"{root}/{path}".rstrip("/")
 
 
 class YandexDiskClient:
-    def __init__(self, token: str | None, root: str | None):
+    """
+    Клиент REST API Яндекс.Диска.
+
+    Все запросы идут через одну keep-alive сессию (пул соединений, таймауты, ретраи),
+    скачивание — потоково в SpooledTemporaryFile (download_to_spool) с докачкой
+    через Range и, для больших файлов, параллельными сегментами.
+    """
+
+    def __init__(
+        self,
+        token: str | None,
+        root: str | None,
+        *,
+        base_url: str = "https://cloud-api.yandex.net/v1/disk",
+        pool_size: int = 16,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 120.0,
+        max_retries: int = 3,
+        chunk_size: int = 1 * MB,
+        spool_max_mb: int = 8,
+        segment_threshold_mb: int = 64,
+        segments: int = 4,
+        list_mode: str = "walk",
+        list_workers: int = 8,
+        list_page_size: int = 1000,
+    ):
         self.token = token
         self.root = (root or "/kb").rstrip("/")
-        self.base = "https://cloud-api.yandex.net/v1/disk"
+        self.base = base_url.rstrip("/")
+
+        self._timeout = (float(connect_timeout), float(read_timeout))
+        self._max_retries = max(0, int(max_retries))
+        self._chunk_size = max(64 * 1024, int(chunk_size))
+        self._spool_max = max(0, int(spool_max_mb)) * MB
+        self._segment_threshold = max(0, int(segment_threshold_mb)) * MB
+        self._segments = max(1, int(segments))
+
+        mode = (list_mode or "walk").strip().lower()
+        if mode not in LIST_MODES:
+            log.warning("Unknown Disk list mode %r, using 'walk'", list_mode)
+            mode = "walk"
+        self._list_mode = mode
+        self._list_workers = max(1, int(list_workers))
+        self._list_page = max(1, int(list_page_size))
+
+        self._session = requests.Session()
+        retry = Retry(
+            total=self._max_retries,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=int(pool_size), pool_maxsize=int(pool_size), max_retries=retry)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    def close(self) -> None:
+        self._session.close()
 
     def _h(self) -> Dict[str, str]:
         return {"Authorization": f"OAuth {self.token}"} if self.token else {}
 
     def _full(self, path: str) -> str:
-        path = (path or "").strip()
-        if not path:
-            return self.root
-        if path.startswith("/"):
-            return path
-        return f"{self.root}/{path}".rstrip("/")
-
-    def list(self, path: str) -> Dict[str, Any]:
+        return full_path(self.root, path)
+
+    def list(self, path: str, *, limit: int = 1000, offset: int = 0, fields: str | None = None) -> Dict[str, Any]:
         if not self.token:
             return {"_stub": True, "items": []}
         url = f"{self.base}/resources"
-        r = requests.get(url, headers=self._h(), params={"path": self._full(path), "limit": 1000})
+        params: Dict[str, Any] = {"path": self._full(path), "limit": int(limit), "offset": int(offset)}
+        if fields:
+            params["fields"] = fields
+        r = self._session.get(url, headers=self._h(), params=params, timeout=self._timeout)
         r.raise_for_status()
         return r.json()
 
-    def download(self, path: str) -> bytes:
+    def list_files_page(self, *, limit: int = 1000, offset: int = 0, fields: str | None = None) -> Dict[str, Any]:
+        """Одна страница плоского списка всех файлов Диска (/resources/files)."""
         if not self.token:
-            return b""
+            return {"_stub": True, "items": []}
+        params: Dict[str, Any] = {"limit": int(limit), "offset": int(offset)}
+        if fields:
+            params["fields"] = fields
+        r = self._session.get(f"{self.base}/resources/files", headers=self._h(), params=params, timeout=self._timeout)
+        r.raise_for_status()
+        return r.json()
+
+    # -----------------------------
+    # download
+    # -----------------------------
+    def _download_href(self, path: str) -> str:
         url = f"{self.base}/resources/download"
-        r = requests.get(url, headers=self._h(), params={"path": self._full(path)})
+        r = self._session.get(url, headers=self._h(), params={"path": self._full(path)}, timeout=self._timeout)
         r.raise_for_status()
-        href = r.json()["href"]
-        f = requests.get(href)
-        f.raise_for_status()
-        return f.content
+        return r.json()["href"]
 
-    def list_kb_files_metadata(self) -> List[Dict[str, Any]]:
+    def _new_spool(self) -> IO[bytes]:
+        return tempfile.SpooledTemporaryFile(max_size=self._spool_max, mode="w+b")
+
+    def _stream_range(self, href: str, out: IO[bytes], start: int, end: Optional[int], lock: Optional[threading.Lock]) -> int:
+        """
+        Качает [start, end] (end включительно, None — до конца) в out с позиции start.
+        При обрыве соединения докачивает с места обрыва через Range.
+        Возвращает число записанных байт.
+        """
+        pos = start
+        attempts = 0
+        while True:
+            headers: Dict[str, str] = {}
+            if pos > 0 or end is not None:
+                headers["Range"] = f"bytes={pos}-" + ("" if end is None else str(end))
+            try:
+                with self._session.get(href, headers=headers, stream=True, timeout=self._timeout) as r:
+                    r.raise_for_status()
+                    if headers and r.status_code != 206:
+                        raise RuntimeError("Disk server ignored Range request")
+                    for block in r.iter_content(chunk_size=self._chunk_size):
+                        if not block:
+                            continue
+                        if lock is None:
+                            out.write(block)
+                        else:
+                            with lock:
+                                out.seek(pos)
+                                out.write(block)
+                        pos += len(block)
+                if end is None or pos > end:
+                    return pos - start
+                raise requests.exceptions.ChunkedEncodingError(f"short read: {pos - start} bytes")
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                attempts += 1
+                if attempts > self._max_retries:
+                    raise
+                log.warning("Disk download interrupted at %s bytes, resuming (%s/%s): %s", pos, attempts, self._max_retries, e)
+
+    def _segments_for(self, size: int) -> List[Tuple[int, int]]:
+        n = min(self._segments, max(1, size // self._chunk_size))
+        step = -(-size // n)
+        return [(lo, min(size, lo + step) - 1) for lo in range(0, size, step)]
+
+    def _download_segments(self, href: str, out: IO[bytes], size: int) -> None:
+        lock = threading.Lock()
+        parts = self._segments_for(size)
+        with ThreadPoolExecutor(max_workers=len(parts), thread_name_prefix="disk-seg") as ex:
+            futures = [ex.submit(self._stream_range, href, out, lo, hi, lock) for lo, hi in parts]
+            got = sum(f.result() for f in futures)
+        if got != size:
+            raise RuntimeError(f"segmented download size mismatch: {got} != {size}")
+
+    def download_to_spool(self, path: str, *, size: int | None = None) -> IO[bytes]:
+        """
+        Скачивает файл потоково во временный spool (в памяти до spool_max_mb, дальше — на диске).
+        Файлы от segment_threshold_mb качаются параллельными Range-сегментами.
+        Возвращает файл, позиционированный в начало; закрыть — обязанность вызывающего.
+        """
+        segmented = bool(size and self._segments > 1 and self._segment_threshold and size >= self._segment_threshold)
+        # большой файл всё равно уйдёт на диск — сразу пишем в обычный временный файл
+        spool = tempfile.TemporaryFile(mode="w+b") if segmented else self._new_spool()
+        if not self.token:
+            return spool
+        try:
+            href = self._download_href(path)
+            if segmented:
+                try:
+                    self._download_segments(href, spool, int(size or 0))
+                except RuntimeError as e:
+                    log.warning("Segmented download failed for %s, falling back to one stream: %s", path, e)
+                    spool.seek(0)
+                    spool.truncate()
+                    self._stream_range(href, spool, 0, None, None)
+            else:
+                self._stream_range(href, spool, 0, None, None)
+            spool.seek(0)
+            return spool
+        except Exception:
+            spool.close()
+            raise
+
+    def download(self, path: str) -> bytes:
+        if not self.token:
+            return b""
+        with self.download_to_spool(path) as f:
+            return f.read()
+
+    # -----------------------------
+    # listing
+    # -----------------------------
+    @staticmethod
+    def _strip_scheme(p: str) -> str:
+        return p[len("disk:"):] if p.startswith("disk:") else p
+
+    def _rel_key(self, p: Any) -> Any:
+        # ключ документа в БД — как и раньше: путь относительно root, если он под root
+        if isinstance(p, str) and p.startswith(self.root):
+            return p[len(self.root):].lstrip("/")
+        return p
+
+    def _under_root(self, p: Any) -> bool:
+        if not isinstance(p, str):
+            return False
+        root = self._strip_scheme(self.root).rstrip("/")
+        return self._strip_scheme(p).startswith(root + "/")
+
+    def _file_meta(self, it: Dict[str, Any]) -> Dict[str, Any]:
+        p = it.get("path")
+        return {
+            "resource_id": it.get("resource_id") or p,
+            "path": self._rel_key(p),
+            "modified": it.get("modified"),
+            "md5": it.get("md5"),
+            "size": it.get("size"),
+        }
+
+    def _list_flat(self) -> List[Dict[str, Any]]:
+        """
+        Плоский режим: /resources/files отдаёт все файлы Диска страницами по list_page_size.
+        Страницы запрашиваются волнами по list_workers штук, пока не придёт неполная;
+        файлы вне root отбрасываются.
+        """
+        limit = self._list_page
+        fields = ",".join(f"items.{f}" for f in _FILE_FIELDS)
         out: List[Dict[str, Any]] = []
+        offset = 0
+        with ThreadPoolExecutor(max_workers=self._list_workers, thread_name_prefix="disk-list") as ex:
+            while True:
+                offsets = [offset + k * limit for k in range(self._list_workers)]
+                pages = list(ex.map(lambda off: self.list_files_page(limit=limit, offset=off, fields=fields), offsets))
+                done = False
+                for data in pages:
+                    items = data.get("items") or []
+                    for it in items:
+                        if it.get("type", "file") == "file" and self._under_root(it.get("path")):
+                            out.append(self._file_meta(it))
+                    if len(items) < limit:
+                        done = True
+                        break
+                if done:
+                    return out
+                offset = offsets[-1] + limit
+
+    def _list_walk(self) -> List[Dict[str, Any]]:
+        """
+        Обход дерева: страницы каталогов (path, offset) листаются параллельно в пуле из
+        list_workers потоков. По _embedded.total первой страницы сразу ставятся в очередь
+        остальные страницы каталога; без total — следующая, пока страница полная.
+        """
+        limit = self._list_page
+        fields = ",".join(["_embedded.total"] + [f"_embedded.items.{f}" for f in _FILE_FIELDS])
+        out: List[Dict[str, Any]] = []
+        with ThreadPoolExecutor(max_workers=self._list_workers, thread_name_prefix="disk-list") as ex:
+            pending: Dict[Future, Tuple[str, int, bool]] = {}
+
+            def submit(path: str, offset: int, chained: bool) -> None:
+                fut = ex.submit(self.list, path, limit=limit, offset=offset, fields=fields)
+                pending[fut] = (path, offset, chained)
+
+            submit(self.root, 0, True)
+            while pending:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for fut in done:
+                    path, offset, chained = pending.pop(fut)
+                    emb = fut.result().get("_embedded") or {}
+                    items = emb.get("items") or []
+                    total = emb.get("total")
+                    if offset == 0 and isinstance(total, int):
+                        for off in range(limit, total, limit):
+                            submit(path, off, False)
+                    elif chained and len(items) >= limit:
+                        submit(path, offset + limit, True)
+                    for it in items:
+                        p = it.get("path")
+                        if it.get("type") == "dir":
+                            if isinstance(p, str) and p:
+                                submit(p, 0, True)
+                        else:
+                            out.append(self._file_meta(it))
+        return out
+
+    def list_kb_files_metadata(self, *, mode: str | None = None) -> List[Dict[str, Any]]:
+        """
+        Все файлы под root: [{resource_id, path, modified, md5, size}], path — ключ документа в БД.
+        mode: "walk" (параллельный обход каталогов) или "flat" (/resources/files), по умолчанию — из конструктора.
+        """
         if not self.token:
-            return out
-
-        def walk(rel: str) -> None:
-            data = self.list(rel)
-            emb = data.get("_embedded") or {}
-            items = emb.get("items") or []
-            for it in items:
-                it_type = it.get("type")
-                p = it.get("path")
-                if it_type == "dir":
-                    rel_next = p
-                    if isinstance(rel_next, str) and rel_next.startswith(self.root):
-                        rel_next = rel_next[len(self.root):].lstrip("/")
-                    walk(rel_next)
-                else:
-                    out.append(
-                        {
-                            "resource_id": it.get("resource_id") or it.get("path"),
-                            "path": (p[len(self.root):].lstrip("/") if isinstance(p, str) and p.startswith(self.root) else p),
-                            "modified": it.get("modified"),
-                            "md5": it.get("md5"),
-                            "size": it.get("size"),
-                        }
-                    )
-
-        walk("")
-        return [x for x in out if x.get("path")]
+            return []
+        mode = (mode or self._list_mode).lower()
+        out = self._list_flat() if mode == "flat" else self._list_walk()
+        out = [x for x in out if x.get("path")]
+        out.sort(key=lambda x: str(x["path"]))
+        return out
@@ -21,6 +21,12 @@ class RetrievedChunk:
     document_title: Optional[str] = None
     document_path: Optional[str] = None
 
+    # место в полнотекстовой выдаче гибридного поиска (1 = лучшее совпадение по словам), None — не найден по словам
+    lexical_rank: Optional[int] = None
+
+    # (первый, последний) chunk_order фрагмента: с контекстным окном или после слияния соседних чанков — шире одного
+    span: Optional[tuple[int, int]] = None
+
 
 @dataclass
 class ModelAnswer:
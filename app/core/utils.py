@@ -1,6 +1,34 @@
 from __future__ import annotations
 
-from typing import Any, Optional
+from functools import lru_cache
+from typing import Any, List, Optional, Sequence
+
+
+@lru_cache(maxsize=4)
+def get_token_encoder(name: str = "cl100k_base") -> Any:
+    """Cached tiktoken encoder, or None if `tiktoken` is not installed."""
+    try:
+        import tiktoken  # optional
+
+        return tiktoken.get_encoding(name)
+    except Exception:
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    """Dependency-free upper-ish estimate: ~3 UTF-8 bytes per token (safe for Cyrillic and Latin)."""
+    return len((text or "").encode("utf-8")) // 3 + 1
+
+
+def count_tokens_batch(texts: Sequence[str]) -> tuple[List[int], bool]:
+    """Token counts per text + flag "exact" (True if counted by tiktoken, False if estimated)."""
+    enc = get_token_encoder()
+    if enc is not None:
+        try:
+            return [len(t) for t in enc.encode_ordinary_batch([t or "" for t in texts])], True
+        except Exception:
+            pass
+    return [estimate_tokens(t) for t in texts], False
 
 
 def split_by_tokens(text: str, max_tokens: int, model: str = "gpt-4o-mini") -> list[str]:
@@ -9,17 +37,17 @@ def split_by_tokens(text: str, max_tokens: int, model: str = "gpt-4o-mini") -> l
     We *try* to use `tiktoken` if installed. If it isn't available (e.g., minimal Railway image),
     we fall back to a rough character-based split.
     """
-    try:
-        import tiktoken  # optional
-
-        enc = tiktoken.get_encoding("cl100k_base")
-        tokens = enc.encode(text or "")
-        return [enc.decode(tokens[i : i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
-    except Exception:
-        # Fallback: 1 token ~ 4 chars (very rough), but safe and dependency-free.
-        s = text or ""
-        step = max(1, int(max_tokens) * 4)
-        return [s[i : i + step] for i in range(0, len(s), step)]
+    enc = get_token_encoder()
+    if enc is not None:
+        try:
+            tokens = enc.encode(text or "")
+            return [enc.decode(tokens[i : i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+        except Exception:
+            pass
+    # Fallback: 1 token ~ 4 chars (very rough), but safe and dependency-free.
+    s = text or ""
+    step = max(1, int(max_tokens) * 4)
+    return [s[i : i + step] for i in range(0, len(s), step)]
 
 
 def with_mode_prefix(context: Any, user_id: Optional[int], text: str) -> str:
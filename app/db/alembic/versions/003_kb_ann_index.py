@@ -0,0 +1,75 @@
+from alembic import op
+
+revision = "003_kb_ann_index"
+down_revision = "002_add_users_cols"
+branch_labels = None
+depends_on = None
+
+# то же, что ensure_schema (app/db/session.py) + первый ANN-индекс активного поколения.
+# Рантайм строит недостающий индекс сам (KbSyncer._ensure_ann_index), миграция — для тех,
+# кто хочет получить его заранее, до первого sync.
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE kb_chunks ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)")
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS kb_generations (
+            id SERIAL PRIMARY KEY,
+            status VARCHAR NOT NULL DEFAULT 'building',
+            chunk_size INTEGER,
+            chunk_overlap INTEGER,
+            embedding_model VARCHAR,
+            note TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            activated_at TIMESTAMP,
+            retired_at TIMESTAMP
+        )
+        """
+    )
+    op.execute("ALTER TABLE kb_chunks ADD COLUMN IF NOT EXISTS generation INTEGER NOT NULL DEFAULT 1")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_kb_chunks_generation_document ON kb_chunks (generation, document_id)")
+    op.execute(
+        "INSERT INTO kb_generations (id, status, activated_at) "
+        "SELECT 1, 'active', NOW() WHERE NOT EXISTS (SELECT 1 FROM kb_generations)"
+    )
+    op.execute("SELECT setval(pg_get_serial_sequence('kb_generations', 'id'), (SELECT MAX(id) FROM kb_generations))")
+
+    # индекс из 001 — по vector(3072) не создаётся (лимит hnsw 2000 измерений), а если и был,
+    # то общий на все поколения; заменяется частичным halfvec-индексом поколения
+    op.execute("DROP INDEX IF EXISTS ix_kb_chunks_embedding_hnsw")
+
+    # DO-блок выполняется в транзакции, поэтому без CONCURRENTLY: запись в kb_chunks ждёт конца сборки
+    op.execute(
+        """
+DO $$
+DECLARE
+  g INTEGER;
+BEGIN
+  SELECT id INTO g FROM kb_generations WHERE status='active' ORDER BY id DESC LIMIT 1;
+  IF g IS NULL OR (SELECT string_to_array(extversion, '.')::int[] FROM pg_extension WHERE extname='vector') < ARRAY[0, 7] THEN
+    RAISE NOTICE 'halfvec needs pgvector >= 0.7: ANN index was not created, search stays exact.';
+    RETURN;
+  END IF;
+  EXECUTE format(
+    'CREATE INDEX IF NOT EXISTS ix_kb_chunks_ann_g%s ON kb_chunks '
+    'USING hnsw ((embedding::halfvec(3072)) halfvec_cosine_ops) WITH (m = 16, ef_construction = 64) '
+    'WHERE generation = %s', g, g);
+END$$;
+"""
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+DO $$
+DECLARE
+  r RECORD;
+BEGIN
+  FOR r IN SELECT relname FROM pg_class WHERE relkind = 'i' AND relname LIKE 'ix\\_kb\\_chunks\\_ann\\_g%' LOOP
+    EXECUTE format('DROP INDEX IF EXISTS %I', r.relname);
+  END LOOP;
+END$$;
+"""
+    )
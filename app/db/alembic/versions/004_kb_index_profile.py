@@ -0,0 +1,24 @@
+from alembic import op
+
+revision = "004_kb_index_profile"
+down_revision = "003_kb_ann_index"
+branch_labels = None
+depends_on = None
+
+# профиль индекса в kb_generations; kb_chunks.embedding — без фиксированной размерности
+# (её задаёт профиль поколения, например text-embedding-3-large с dimensions=1024).
+# Снятие typmod не переписывает таблицу: тип тот же, меняется только проверка размерности.
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE kb_generations ADD COLUMN IF NOT EXISTS embedding_dims INTEGER")
+    op.execute("ALTER TABLE kb_generations ADD COLUMN IF NOT EXISTS metric VARCHAR")
+    op.execute("ALTER TABLE kb_chunks ALTER COLUMN embedding TYPE vector")
+
+
+def downgrade() -> None:
+    # вернуть vector(3072) можно, только если все векторы такой размерности
+    op.execute("DELETE FROM kb_chunks WHERE vector_dims(embedding) <> 3072")
+    op.execute("ALTER TABLE kb_chunks ALTER COLUMN embedding TYPE vector(3072)")
+    op.execute("ALTER TABLE kb_generations DROP COLUMN IF EXISTS metric")
+    op.execute("ALTER TABLE kb_generations DROP COLUMN IF EXISTS embedding_dims")
@@ -0,0 +1,32 @@
+from alembic import op
+
+revision = "005_kb_fts"
+down_revision = "004_kb_index_profile"
+branch_labels = None
+depends_on = None
+
+# полнотекстовая часть гибридного поиска: хранимый kb_chunks.text_tsv (russian), заполняется триггером
+# (в том числе при COPY). GIN-индекс строит приложение (KBRepo.ensure_fts_index, CONCURRENTLY) после
+# дозаполнения старых строк пачками — здесь индекс не создаётся, чтобы миграция не переписывала таблицу.
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE kb_chunks ADD COLUMN IF NOT EXISTS text_tsv tsvector")
+    op.execute(
+        "CREATE OR REPLACE FUNCTION kb_chunks_tsv() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+        "IF NEW.text_tsv IS NULL OR (TG_OP = 'UPDATE' AND NEW.text IS DISTINCT FROM OLD.text) THEN "
+        "NEW.text_tsv := to_tsvector('russian', COALESCE(NEW.text, '')); "
+        "END IF; RETURN NEW; END $$"
+    )
+    op.execute("DROP TRIGGER IF EXISTS kb_chunks_tsv ON kb_chunks")
+    op.execute(
+        "CREATE TRIGGER kb_chunks_tsv BEFORE INSERT OR UPDATE OF text ON kb_chunks "
+        "FOR EACH ROW EXECUTE FUNCTION kb_chunks_tsv()"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_kb_chunks_text_tsv")
+    op.execute("DROP TRIGGER IF EXISTS kb_chunks_tsv ON kb_chunks")
+    op.execute("DROP FUNCTION IF EXISTS kb_chunks_tsv()")
+    op.execute("ALTER TABLE kb_chunks DROP COLUMN IF EXISTS text_tsv")
@@ -0,0 +1,22 @@
+from alembic import op
+
+revision = "006_kb_chunk_order_index"
+down_revision = "005_kb_fts"
+branch_labels = None
+depends_on = None
+
+# контекстное окно поиска: соседние чанки документа по chunk_order одним range scan;
+# прежний индекс (generation, document_id) — префикс нового
+
+
+def upgrade() -> None:
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_kb_chunks_generation_document_order "
+        "ON kb_chunks (generation, document_id, chunk_order)"
+    )
+    op.execute("DROP INDEX IF EXISTS ix_kb_chunks_generation_document")
+
+
+def downgrade() -> None:
+    op.execute("CREATE INDEX IF NOT EXISTS ix_kb_chunks_generation_document ON kb_chunks (generation, document_id)")
+    op.execute("DROP INDEX IF EXISTS ix_kb_chunks_generation_document_order")
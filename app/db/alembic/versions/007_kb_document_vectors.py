@@ -0,0 +1,28 @@
+from alembic import op
+
+revision = "007_kb_document_vectors"
+down_revision = "006_kb_chunk_order_index"
+branch_labels = None
+depends_on = None
+
+# центроиды документов для двухуровневого поиска (KB_ROUTE_DOCS). Заполняет приложение: после индексации
+# документа и дозаполнением на /kb sync (KBRepo.backfill_document_vectors)
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS kb_document_vectors (
+            generation INTEGER NOT NULL,
+            document_id INTEGER NOT NULL REFERENCES kb_documents(id) ON DELETE CASCADE,
+            chunks INTEGER NOT NULL DEFAULT 0,
+            embedding vector NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (generation, document_id)
+        )
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS kb_document_vectors")
@@ -0,0 +1,17 @@
+from alembic import op
+
+revision = "008_kb_generation_chunker"
+down_revision = "007_kb_document_vectors"
+branch_labels = None
+depends_on = None
+
+# чанкер поколения (KB_CHUNKER): chars — символы с перекрытием, structured — по структуре документа,
+# chunk_size у такого поколения — бюджет в токенах. Старые поколения нарезаны chars.
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE kb_generations ADD COLUMN IF NOT EXISTS chunker VARCHAR")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE kb_generations DROP COLUMN IF EXISTS chunker")
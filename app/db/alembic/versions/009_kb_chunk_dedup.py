@@ -0,0 +1,31 @@
+from alembic import op
+
+revision = "009_kb_chunk_dedup"
+down_revision = "008_kb_generation_chunker"
+branch_labels = None
+depends_on = None
+
+# почти-дубликаты чанков (app.kb.dedup): SimHash текста и ссылка на оригинал. Копия хранит вектор оригинала
+# и пропускается поиском по всей БЗ; удаление оригинала делает копию оригиналом (ON DELETE SET NULL).
+# Кандидаты ищутся по 4 полосам подписи по 16 бит (KBRepo.find_near_duplicates).
+
+BANDS = ("(simhash & 65535)", "((simhash >> 16) & 65535)", "((simhash >> 32) & 65535)", "((simhash >> 48) & 65535)")
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE kb_chunks ADD COLUMN IF NOT EXISTS simhash BIGINT")
+    op.execute("ALTER TABLE kb_chunks ADD COLUMN IF NOT EXISTS dup_of INTEGER REFERENCES kb_chunks(id) ON DELETE SET NULL")
+    for j, expr in enumerate(BANDS):
+        op.execute(
+            f"CREATE INDEX IF NOT EXISTS ix_kb_chunks_simhash_b{j} ON kb_chunks (generation, {expr}) "
+            "WHERE dup_of IS NULL AND simhash IS NOT NULL"
+        )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_kb_chunks_dup_of ON kb_chunks (dup_of) WHERE dup_of IS NOT NULL")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_kb_chunks_dup_of")
+    for j in range(len(BANDS)):
+        op.execute(f"DROP INDEX IF EXISTS ix_kb_chunks_simhash_b{j}")
+    op.execute("ALTER TABLE kb_chunks DROP COLUMN IF EXISTS dup_of")
+    op.execute("ALTER TABLE kb_chunks DROP COLUMN IF EXISTS simhash")
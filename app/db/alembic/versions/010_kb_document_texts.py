@@ -0,0 +1,29 @@
+from alembic import op
+
+revision = "010_kb_document_texts"
+down_revision = "009_kb_chunk_dedup"
+branch_labels = None
+depends_on = None
+
+# кэш извлечённого текста (app.kb.text_cache): сжатый текст версии файла, чтобы /kb rechunk
+# не скачивал и не разбирал документы заново. Заполняет sync при разборе файла.
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS kb_document_texts (
+            document_id INTEGER NOT NULL REFERENCES kb_documents(id) ON DELETE CASCADE,
+            md5 VARCHAR NOT NULL,
+            codec VARCHAR(16) NOT NULL,
+            text_bytes BIGINT NOT NULL DEFAULT 0,
+            data BYTEA NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (document_id, md5)
+        )
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS kb_document_texts")
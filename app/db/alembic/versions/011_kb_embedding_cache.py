@@ -0,0 +1,28 @@
+from alembic import op
+
+revision = "011_kb_embedding_cache"
+down_revision = "010_kb_document_texts"
+branch_labels = None
+depends_on = None
+
+# кэш embeddings по содержимому чанка (app.kb.embedding_cache) и, с префиксом модели 'query:', запросов
+# (app.kb.query_cache): ключ — (модель, sha256 нормализованного текста). Размерность зависит от модели,
+# поэтому vector без фиксированного dim. До этой миграции таблица создавалась только через create_all.
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS kb_embedding_cache (
+            model VARCHAR NOT NULL,
+            text_hash VARCHAR(64) NOT NULL,
+            embedding vector NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (model, text_hash)
+        )
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS kb_embedding_cache")
@@ -11,9 +11,11 @@ from sqlalchemy import (
     JSON,
     Boolean,
     BigInteger,
+    LargeBinary,
     UniqueConstraint,
     Index,
 )
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship
 
 from pgvector.sqlalchemy import Vector
@@ -99,25 +101,122 @@ class KBDocument(Base):
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
 
 
+class KBGeneration(Base):
+    """
+    Поколение индекса БЗ: полный набор kb_chunks, построенный с одними настройками
+    нарезки/эмбеддингов. Поиск читает только активное поколение; полная переиндексация
+    строит новое в фоне и переключает его одним UPDATE (см. KBRepo.activate_generation).
+    """
+
+    __tablename__ = "kb_generations"
+
+    id = Column(Integer, primary_key=True)
+    status = Column(String, nullable=False, default="building")  # building|active|retired|failed
+
+    chunker = Column(String, nullable=True)  # chars|structured; NULL — chars (поколения до KB_CHUNKER)
+    chunk_size = Column(Integer, nullable=True)  # structured: бюджет чанка в токенах
+    chunk_overlap = Column(Integer, nullable=True)
+    embedding_model = Column(String, nullable=True)
+    embedding_dims = Column(Integer, nullable=True)  # параметр dimensions; NULL — родная размерность модели
+    metric = Column(String, nullable=True)  # cosine
+    note = Column(Text, nullable=True)
+
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    activated_at = Column(DateTime, nullable=True)
+    retired_at = Column(DateTime, nullable=True)
+
+
 class KBChunk(Base):
     __tablename__ = "kb_chunks"
 
+    __table_args__ = (Index("ix_kb_chunks_generation_document_order", "generation", "document_id", "chunk_order"),)
+
     id = Column(Integer, primary_key=True)
     document_id = Column(Integer, ForeignKey("kb_documents.id", ondelete="CASCADE"), nullable=False, index=True)
 
+    # Поколение индекса (kb_generations.id); поиск читает только активное
+    generation = Column(Integer, nullable=False, default=1, server_default="1")
+
     # Порядок чанка в документе для воспроизводимых цитат
     chunk_order = Column(Integer, nullable=False, default=0)
 
     text = Column(Text, nullable=False)
 
-    # pgvector: хранение эмбеддинга как VECTOR(dim)
-    embedding = Column(Vector(3072), nullable=False)
+    # sha256 нормализованного текста — для инкрементальной переиндексации (diff по содержимому)
+    content_hash = Column(String(64), nullable=True)
+
+    # SimHash текста (app.kb.dedup) и оригинал, почти-копией которого чанк является: копия хранит вектор
+    # оригинала и не участвует в поиске по всей БЗ; удалён оригинал — копия становится оригиналом (SET NULL)
+    simhash = Column(BigInteger, nullable=True)
+    dup_of = Column(Integer, ForeignKey("kb_chunks.id", ondelete="SET NULL"), nullable=True)
+
+    # pgvector: VECTOR без фиксированной размерности — её задаёт профиль поколения (kb_generations);
+    # с внешним хранилищем векторов (KB_VECTOR_STORE=numpy) — заглушка KBRepo.EXTERNAL_EMBEDDING
+    embedding = Column(Vector(), nullable=False)
+
+    # to_tsvector('russian', text) для полнотекстовой части гибридного поиска; заполняет триггер kb_chunks_tsv
+    # (в SQLite-режиме колонка пустая: полнотекстового поиска там нет)
+    text_tsv = Column(TSVECTOR().with_variant(Text(), "sqlite"), nullable=True)
 
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
 
     document = relationship("KBDocument")
 
 
+class KBDocumentVector(Base):
+    """
+    Вектор документа в поколении индекса — среднее embeddings его чанков (центроид). Первая ступень
+    двухуровневого поиска (KB_ROUTE_DOCS): ближайшие документы по центроидам, затем чанки только в них.
+    Пересчитывается после каждой переиндексации документа (KBRepo.update_document_vectors).
+    """
+
+    __tablename__ = "kb_document_vectors"
+
+    generation = Column(Integer, primary_key=True)
+    document_id = Column(Integer, ForeignKey("kb_documents.id", ondelete="CASCADE"), primary_key=True)
+
+    chunks = Column(Integer, nullable=False, default=0)
+    embedding = Column(Vector(), nullable=False)
+
+    updated_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+
+class KBDocumentText(Base):
+    """
+    Кэш извлечённого текста документа: сжатый (zstd/gzip) результат парсинга версии файла (md5 с Диска).
+    /kb rechunk перестраивает чанки и embeddings из него, не скачивая и не разбирая файлы заново.
+    Хранится одна версия на документ: запись новой версии удаляет прежнюю.
+    """
+
+    __tablename__ = "kb_document_texts"
+
+    document_id = Column(Integer, ForeignKey("kb_documents.id", ondelete="CASCADE"), primary_key=True)
+    md5 = Column(String, primary_key=True)
+
+    codec = Column(String(16), nullable=False)
+    text_bytes = Column(BigInteger, nullable=False, default=0)  # размер текста в UTF-8 до сжатия
+    data = Column(LargeBinary, nullable=False)
+
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+
+class KBEmbeddingCache(Base):
+    """
+    Кэш embeddings по содержимому: (модель, sha256 нормализованного текста чанка) -> вектор.
+    Позволяет не пересчитывать embeddings для неизменившихся чанков при переиндексации.
+    """
+
+    __tablename__ = "kb_embedding_cache"
+
+    model = Column(String, primary_key=True)
+    text_hash = Column(String(64), primary_key=True)
+
+    # размерность зависит от модели, поэтому VECTOR без фиксированного dim
+    embedding = Column(Vector(), nullable=False)
+
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+
 class DialogKBDocument(Base):
     """
     Связь диалог ↔ документ БЗ (many-to-many через таблицу).
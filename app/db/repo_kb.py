@@ -1,18 +1,232 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional, Sequence, Tuple
+import io
+import logging
+import math
+import re
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Sequence, Tuple
 from datetime import datetime
 
 from sqlalchemy.orm import Session
-from sqlalchemy import text as sqltext
+from sqlalchemy import bindparam, text as sqltext
+
+
+try:
+    import numpy as np  # зависимость pgvector
+except Exception:
+    np = None
+
+if TYPE_CHECKING:
+    from .vector_store import VectorStore
+
+log = logging.getLogger(__name__)
+
+
+_PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_PGCOPY_TRAILER = struct.pack(">h", -1)
+_CHUNK_COPY_SQL = (
+    "COPY kb_chunks (document_id, chunk_order, text, embedding, content_hash, generation, simhash, dup_of) "
+    "FROM STDIN WITH (FORMAT binary)"
+)
+
+# id активного поколения индекса (kb_generations); подставляется подзапросом в чтение kb_chunks
+ACTIVE_GENERATION_SQL = "(SELECT id FROM kb_generations WHERE status='active' ORDER BY id DESC LIMIT 1)"
+
+# ANN-индексы: по одному частичному индексу на поколение (WHERE generation = N), строится после загрузки
+# bit — hnsw по binary_quantize(embedding) (pgvector >= 0.7): знаковый бит на координату, расстояние Хэмминга;
+# индекс в 32 раза меньше векторов, кандидаты (limit * ann_binary_candidates) пересортировываются точным косинусом
+ANN_INDEX_KINDS = ("hnsw", "ivfflat", "bit")
+ANN_MAX_DIM_VECTOR = 2000  # pgvector: hnsw/ivfflat по vector — до 2000 измерений
+ANN_MAX_DIM_HALFVEC = 4000  # по halfvec (pgvector >= 0.7) — до 4000, 3072 помещается
+
+# полнотекстовая часть гибридного поиска: kb_chunks.text_tsv (заполняет триггер, см. app/db/session.py)
+FTS_CONFIG = "russian"
+FTS_INDEX = "ix_kb_chunks_text_tsv"
+
+# активное поколение + его валидный ANN-индекс (метод доступа и определение) + готовность FTS одним запросом
+_SEARCH_TARGET_SQL = f"""
+    SELECT g.id, CASE WHEN i.indisvalid THEN am.amname END, pg_get_indexdef(c.oid),
+           (SELECT fi.indisvalid FROM pg_class fc JOIN pg_index fi ON fi.indexrelid = fc.oid
+            WHERE fc.relname = '{FTS_INDEX}') AS fts
+    FROM (SELECT {ACTIVE_GENERATION_SQL} AS id) g
+    LEFT JOIN pg_class c ON c.relname = 'ix_kb_chunks_ann_g' || g.id
+    LEFT JOIN pg_index i ON i.indexrelid = c.oid
+    LEFT JOIN pg_am am ON am.oid = c.relam
+"""
+
+
+def _ids_sql(s: Session, sql: str) -> Any:
+    """
+    Запрос с фильтром «= ANY(:ids)» (список id одним параметром-массивом). Вне Postgres (SQLite-режим
+    с внешним хранилищем векторов) массивов нет — «IN (...)» с раскрытием списка в параметры.
+    """
+    if s.get_bind().dialect.name == "postgresql":
+        return sqltext(sql)
+    return sqltext(sql.replace("= ANY(:ids)", "IN :ids")).bindparams(bindparam("ids", expanding=True))
+
+
+def _age_cutoff(s: Session, param: str) -> str:
+    """SQL-выражение «сейчас минус :param секунд» для сравнения с timestamp-колонками (Postgres / SQLite)."""
+    if s.get_bind().dialect.name == "postgresql":
+        return f"CURRENT_TIMESTAMP - make_interval(secs => :{param})"
+    return f"datetime('now', '-' || :{param} || ' seconds')"
+
+
+def _as_datetime(v: Any) -> Any:
+    """Timestamp из сырого запроса: SQLite отдаёт его строкой, Postgres — datetime."""
+    if isinstance(v, str):
+        try:
+            return datetime.fromisoformat(v)
+        except ValueError:
+            return None
+    return v
+
+
+def _index_precision(indexdef: str | None) -> str:
+    d = indexdef or ""
+    return "binary" if "binary_quantize" in d else "half" if "halfvec" in d else "full"
+
+
+def ann_index_name(generation: int) -> str:
+    return f"ix_kb_chunks_ann_g{int(generation)}"
+
+
+def _vector_binary(v: Any) -> bytes:
+    """Бинарный формат pgvector (vector_recv): int16 dim, int16 unused, dim x float4 big-endian."""
+    if np is not None:
+        a = np.asarray(v, dtype=">f4").ravel()
+        return struct.pack(">hh", a.shape[0], 0) + a.tobytes()
+    vals = [float(x) for x in v]
+    return struct.pack(f">hh{len(vals)}f", len(vals), 0, *vals)
+
+
+def vector_literal(v: Any) -> str:
+    """
+    Текстовый литерал pgvector '[...]' для параметров запроса (psycopg2 передаёт параметры только
+    текстом, адаптер pgvector тоже). 9 значащих цифр — ровно столько нужно float4, .tolist()
+    у numpy-массива разворачивает числа в C, а не поэлементно в Python.
+    """
+    vals = v.tolist() if hasattr(v, "tolist") else v
+    return "[" + ",".join(map("{:.9g}".format, vals)) + "]"
+
+
+def encode_chunk_copy(rows: Sequence[Tuple], generation: int) -> bytes:
+    """
+    rows (document_id, chunk_order, text, embedding[, content_hash[, simhash[, dup_of]]]) -> поток COPY ... (FORMAT binary).
+    Эмбеддинг уходит 4 байтами на число вместо десятичного литерала '[0.0123,...]'.
+    """
+    out = io.BytesIO()
+    out.write(_PGCOPY_HEADER)
+    i4 = struct.Struct(">i")
+    i8 = struct.Struct(">iq")
+    row_head = struct.Struct(">hii")  # 8 полей; длина+значение document_id
+    gen = struct.pack(">ii", 4, int(generation))
+    null = i4.pack(-1)
+    for r in rows:
+        out.write(row_head.pack(8, 4, int(r[0])))
+        out.write(i4.pack(4))
+        out.write(i4.pack(int(r[1])))
+        t = (r[2] or "").encode("utf-8")
+        out.write(i4.pack(len(t)))
+        out.write(t)
+        e = _vector_binary(r[3])
+        out.write(i4.pack(len(e)))
+        out.write(e)
+        h = r[4] if len(r) > 4 else None
+        if h is None:
+            out.write(i4.pack(-1))
+        else:
+            hb = h.encode("ascii")
+            out.write(i4.pack(len(hb)))
+            out.write(hb)
+        out.write(gen)
+        sig = r[5] if len(r) > 5 else None
+        out.write(null if sig is None else i8.pack(8, int(sig)))
+        dup = r[6] if len(r) > 6 else None
+        out.write(null if dup is None else struct.pack(">ii", 4, int(dup)))
+    out.write(_PGCOPY_TRAILER)
+    return out.getvalue()
+
+
+class ChunkWriter:
+    """Изменения kb_chunks одного документа (в одном поколении) внутри открытой сессии (см. KBRepo.chunk_writer)."""
+
+    def __init__(self, repo: "KBRepo", s: Session, document_id: int, generation: int):
+        self._repo = repo
+        self._s = s
+        self.document_id = int(document_id)
+        self.generation = int(generation)
+
+    def apply(
+        self,
+        *,
+        insert_rows: Sequence[Tuple] = (),
+        delete_ids: Sequence[int] = (),
+        renumber: Sequence[Tuple[int, int]] = (),
+        set_hashes: Sequence[Tuple[int, str]] = (),
+    ) -> None:
+        s, did = self._s, self.document_id
+        if delete_ids:
+            ids = [int(x) for x in delete_ids]
+            s.execute(_ids_sql(s, "DELETE FROM kb_chunks WHERE document_id=:did AND id = ANY(:ids)"), {"did": did, "ids": ids})
+            self._repo._vector_op(s, "delete", generation=self.generation, chunk_ids=ids)
+        if renumber:
+            s.execute(
+                sqltext("UPDATE kb_chunks SET chunk_order=:o WHERE id=:id AND document_id=:did"),
+                [{"o": int(o), "id": int(cid), "did": did} for (cid, o) in renumber],
+            )
+        if set_hashes:
+            s.execute(
+                sqltext("UPDATE kb_chunks SET content_hash=:h WHERE id=:id AND document_id=:did"),
+                [{"h": h, "id": int(cid), "did": did} for (cid, h) in set_hashes],
+            )
+        if insert_rows:
+            self._repo._insert_chunks(s, insert_rows, self.generation)
 
 
 class KBRepo:
-    """Repository for KB documents and pgvector-backed chunks."""
+    """
+    Repository for KB documents and chunks. Векторы — в kb_chunks.embedding (pgvector) или во внешнем
+    хранилище vector_store (app/db/vector_store.py; тогда колонка — заглушка, ANN/FTS не строятся).
+    """
 
-    def __init__(self, session_factory, dim: int):
+    def __init__(
+        self,
+        session_factory,
+        dim: int = 0,
+        *,
+        ann_ef_search: int = 100,
+        ann_probes: int = 10,
+        ann_candidates: int = 4,
+        ann_binary_candidates: int = 10,
+        ann_exact_max_rows: int = 10_000,
+        ann_max_candidates: int = 1000,
+        doc_counts_ttl_sec: int = 300,
+        vector_store: Optional[VectorStore] = None,
+    ):
         self.sf = session_factory
+        self.vectors = vector_store
+        # не используется: размерность векторов задаёт профиль поколения (kb_generations.embedding_dims)
         self.dim = int(dim)
+        self.ann_ef_search = max(1, int(ann_ef_search))
+        self.ann_probes = max(1, int(ann_probes))
+        self.ann_candidates = max(1, int(ann_candidates))
+        self.ann_binary_candidates = max(1, int(ann_binary_candidates))
+        # планировщик поиска с фильтром по документам (_plan_search)
+        self.ann_exact_max_rows = max(0, int(ann_exact_max_rows))
+        self.ann_max_candidates = max(1, int(ann_max_candidates))
+        self.doc_counts_ttl_sec = max(0, int(doc_counts_ttl_sec))
+        self._plan_lock = threading.Lock()
+        self._doc_counts: Dict[int, Tuple[float, Dict[int, int]]] = {}
+        self._pgvector: Optional[Tuple[int, ...]] = None
+        self.plan_stats: Dict[str, int] = {}  # сколько раз выбран каждый план — для /kb status
+        # растёт при каждом activate_generation этого процесса: кэши профиля активного поколения
+        # (Retriever.query_embedder) сбрасываются сразу, а не по TTL
+        self.generation_epoch = 0
 
     # ----------------------------
     # Documents
@@ -46,8 +260,8 @@ class KBRepo:
                     "path": r[1],
                     "md5": r[2],
                     "size": int(r[3]) if r[3] is not None else None,
-                    "modified_at": r[4],
-                    "indexed_at": r[5],
+                    "modified_at": _as_datetime(r[4]),
+                    "indexed_at": _as_datetime(r[5]),
                     "status": r[6],
                     "is_active": bool(r[7]),
                 }
@@ -67,11 +281,11 @@ class KBRepo:
         q = (search or "").strip()
         where = "WHERE d.is_active=TRUE"
         params: Dict[str, Any] = {"off": off, "lim": page_size}
-        if q:
-            where += " AND (d.title ILIKE :q OR d.path ILIKE :q)"
-            params["q"] = f"%{q}%"
-
         with self.sf() as s:
+            if q:
+                like = "ILIKE" if s.get_bind().dialect.name == "postgresql" else "LIKE"
+                where += f" AND (d.title {like} :q OR d.path {like} :q)"
+                params["q"] = f"%{q}%"
             total_row = s.execute(
                 sqltext(f"SELECT COUNT(*) FROM kb_documents d {where}"),
                 params if q else None,
@@ -90,11 +304,11 @@ class KBRepo:
                         d.last_error,
                         COUNT(c.id) AS chunks
                     FROM kb_documents d
-                    LEFT JOIN kb_chunks c ON c.document_id = d.id
+                    LEFT JOIN kb_chunks c ON c.document_id = d.id AND c.generation = {ACTIVE_GENERATION_SQL}
                     {where}
                     GROUP BY d.id
                     ORDER BY d.path ASC
-                    OFFSET :off LIMIT :lim
+                    LIMIT :lim OFFSET :off
                     """
                 ),
                 params,
@@ -132,13 +346,15 @@ class KBRepo:
         """
         with self.sf() as s:
             docs = s.execute(sqltext("SELECT COUNT(*) FROM kb_documents WHERE is_active=TRUE")).first()
-            chunks = s.execute(sqltext("SELECT COUNT(*) FROM kb_chunks")).first()
+            chunks = s.execute(
+                sqltext(f"SELECT COUNT(*) FROM kb_chunks WHERE generation = {ACTIVE_GENERATION_SQL}")
+            ).first()
             top = s.execute(
                 sqltext(
-                    """
+                    f"""
                     SELECT d.id, COALESCE(d.title, '') AS title, d.path, COUNT(c.id) AS cnt
                     FROM kb_documents d
-                    LEFT JOIN kb_chunks c ON c.document_id = d.id
+                    LEFT JOIN kb_chunks c ON c.document_id = d.id AND c.generation = {ACTIVE_GENERATION_SQL}
                     WHERE d.is_active=TRUE
                     GROUP BY d.id
                     ORDER BY cnt DESC
@@ -172,22 +388,24 @@ class KBRepo:
 
         with self.sf() as s:
             docs_row = s.execute(
-                sqltext(
+                _ids_sql(
+                    s,
                     """
                     SELECT COUNT(*)
                     FROM kb_documents
                     WHERE is_active=TRUE AND id = ANY(:ids)
-                    """
+                    """,
                 ),
                 {"ids": ids},
             ).first()
             chunks_row = s.execute(
-                sqltext(
-                    """
+                _ids_sql(
+                    s,
+                    f"""
                     SELECT COUNT(*)
                     FROM kb_chunks
-                    WHERE document_id = ANY(:ids)
-                    """
+                    WHERE document_id = ANY(:ids) AND generation = {ACTIVE_GENERATION_SQL}
+                    """,
                 ),
                 {"ids": ids},
             ).first()
@@ -204,7 +422,18 @@ class KBRepo:
         with self.sf() as s:
             active_docs = s.execute(sqltext("SELECT COUNT(*) FROM kb_documents WHERE is_active=TRUE")).first()
             all_docs = s.execute(sqltext("SELECT COUNT(*) FROM kb_documents")).first()
-            chunks = s.execute(sqltext("SELECT COUNT(*) FROM kb_chunks")).first()
+            chunks = s.execute(
+                sqltext(f"SELECT COUNT(*) FROM kb_chunks WHERE generation = {ACTIVE_GENERATION_SQL}")
+            ).first()
+            doc_vectors = s.execute(
+                sqltext(f"SELECT COUNT(*) FROM kb_document_vectors WHERE generation = {ACTIVE_GENERATION_SQL}")
+            ).first()
+            duplicates = s.execute(
+                sqltext(f"SELECT COUNT(*) FROM kb_chunks WHERE generation = {ACTIVE_GENERATION_SQL} AND dup_of IS NOT NULL")
+            ).first()
+            gens = s.execute(
+                sqltext("SELECT status, MAX(id) FROM kb_generations WHERE status IN ('active', 'building') GROUP BY status")
+            ).fetchall()
 
             last_indexed = s.execute(sqltext("SELECT MAX(indexed_at) FROM kb_documents WHERE indexed_at IS NOT NULL")).first()
             err_docs = s.execute(sqltext("SELECT COUNT(*) FROM kb_documents WHERE is_active=TRUE AND status='error'")).first()
@@ -215,10 +444,16 @@ class KBRepo:
             "documents_active": int(active_docs[0]) if active_docs else 0,
             "documents_total": int(all_docs[0]) if all_docs else 0,
             "chunks_total": int(chunks[0]) if chunks else 0,
+            "document_vectors": int(doc_vectors[0]) if doc_vectors else 0,
+            "chunks_duplicate": int(duplicates[0]) if duplicates else 0,
             "documents_indexed": int(indexed_docs[0]) if indexed_docs else 0,
             "documents_skipped": int(skipped_docs[0]) if skipped_docs else 0,
             "documents_error": int(err_docs[0]) if err_docs else 0,
             "last_indexed_at": last_indexed[0] if last_indexed else None,
+            "generation_active": next((int(g[1]) for g in gens if g[0] == "active"), None),
+            "generation_building": next((int(g[1]) for g in gens if g[0] == "building"), None),
+            "search_plans": ", ".join(f"{k}={v}" for k, v in sorted(self.plan_stats.items())) or "n/a",
+            **(self.vectors.stats() if self.vectors is not None else {}),
         }
 
     def upsert_document(
@@ -262,6 +497,174 @@ class KBRepo:
             s.commit()
             return int(doc.id)
 
+    UPSERT_BATCH = 1000
+
+    def upsert_documents_bulk(self, rows: Sequence[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Пакетный upsert метаданных документов (по UPSERT_BATCH строк на запрос):
+        INSERT ... SELECT FROM unnest(...) ON CONFLICT (path) DO UPDATE ... RETURNING id, path.
+
+        rows: {path, title, resource_id, md5, size, modified_at, status}; None в метаданных — оставить как было.
+        Все строки становятся is_active=TRUE, их припаркованные чанки возвращаются в поиск. Возвращает {path: id}.
+        """
+        out: Dict[str, int] = {}
+        if not rows:
+            return out
+        with self.sf() as s:
+            if s.get_bind().dialect.name != "postgresql":
+                out = self._upsert_documents_rows(s, rows)
+                self._park_chunks(s, list(out.values()), park=False)
+                s.commit()
+                self._apply_vector_ops(s)
+                return out
+            for i in range(0, len(rows), self.UPSERT_BATCH):
+                part = rows[i : i + self.UPSERT_BATCH]
+                params = {
+                    "paths": [r["path"] for r in part],
+                    "titles": [r.get("title") for r in part],
+                    "rids": [r.get("resource_id") for r in part],
+                    "md5s": [r.get("md5") for r in part],
+                    "sizes": [int(r["size"]) if r.get("size") is not None else None for r in part],
+                    "mods": [r.get("modified_at") for r in part],
+                    "statuses": [r.get("status") for r in part],
+                }
+                # файл переехал/переименован: resource_id уже висит на документе со старым path (unique)
+                s.execute(
+                    sqltext(
+                        """
+                        UPDATE kb_documents d SET resource_id = NULL
+                        FROM unnest(CAST(:paths AS text[]), CAST(:rids AS text[])) AS v(path, rid)
+                        WHERE v.rid IS NOT NULL AND d.resource_id = v.rid AND d.path <> v.path
+                        """
+                    ),
+                    params,
+                )
+                res = s.execute(
+                    sqltext(
+                        """
+                        INSERT INTO kb_documents (path, title, resource_id, md5, size, modified_at, is_active, status)
+                        SELECT v.path, v.title, v.rid, v.md5, v.size, v.mod, TRUE, COALESCE(v.status, 'new')
+                        FROM unnest(
+                            CAST(:paths AS text[]), CAST(:titles AS text[]), CAST(:rids AS text[]),
+                            CAST(:md5s AS text[]), CAST(:sizes AS bigint[]), CAST(:mods AS timestamp[]),
+                            CAST(:statuses AS text[])
+                        ) AS v(path, title, rid, md5, size, mod, status)
+                        ON CONFLICT (path) DO UPDATE SET
+                            title = COALESCE(EXCLUDED.title, kb_documents.title),
+                            resource_id = COALESCE(EXCLUDED.resource_id, kb_documents.resource_id),
+                            md5 = COALESCE(EXCLUDED.md5, kb_documents.md5),
+                            size = COALESCE(EXCLUDED.size, kb_documents.size),
+                            modified_at = COALESCE(EXCLUDED.modified_at, kb_documents.modified_at),
+                            is_active = TRUE,
+                            status = EXCLUDED.status
+                        RETURNING id, path
+                        """
+                    ),
+                    params,
+                )
+                for r in res.fetchall():
+                    out[r[1]] = int(r[0])
+            self._park_chunks(s, list(out.values()), park=False)
+            s.commit()
+            self._apply_vector_ops(s)
+        return out
+
+    @staticmethod
+    def _upsert_documents_rows(s: Session, rows: Sequence[Dict[str, Any]]) -> Dict[str, int]:
+        """upsert_documents_bulk без массивов (SQLite): те же два запроса построчно."""
+        out: Dict[str, int] = {}
+        for r in rows:
+            p = {
+                "path": r["path"],
+                "title": r.get("title"),
+                "rid": r.get("resource_id"),
+                "md5": r.get("md5"),
+                "size": int(r["size"]) if r.get("size") is not None else None,
+                "mod": r.get("modified_at"),
+                "status": r.get("status"),
+            }
+            if p["rid"] is not None:
+                s.execute(
+                    sqltext("UPDATE kb_documents SET resource_id = NULL WHERE resource_id = :rid AND path <> :path"), p
+                )
+            row = s.execute(
+                sqltext(
+                    """
+                    INSERT INTO kb_documents (path, title, resource_id, md5, size, modified_at, is_active, status)
+                    VALUES (:path, :title, :rid, :md5, :size, :mod, TRUE, COALESCE(:status, 'new'))
+                    ON CONFLICT (path) DO UPDATE SET
+                        title = COALESCE(EXCLUDED.title, kb_documents.title),
+                        resource_id = COALESCE(EXCLUDED.resource_id, kb_documents.resource_id),
+                        md5 = COALESCE(EXCLUDED.md5, kb_documents.md5),
+                        size = COALESCE(EXCLUDED.size, kb_documents.size),
+                        modified_at = COALESCE(EXCLUDED.modified_at, kb_documents.modified_at),
+                        is_active = TRUE,
+                        status = EXCLUDED.status
+                    RETURNING id
+                    """
+                ),
+                p,
+            ).scalar_one()
+            out[r["path"]] = int(row)
+        return out
+
+    def deactivate_documents(self, document_ids: Sequence[int]) -> int:
+        """
+        is_active=FALSE только для перечисленных документов (вместо UPDATE всей таблицы); их чанки
+        паркуются (_park_chunks) и сразу выпадают из поиска. updated_at — начало отсчёта для gc_documents.
+        """
+        ids = [int(x) for x in document_ids]
+        if not ids:
+            return 0
+        with self.sf() as s:
+            res = s.execute(
+                _ids_sql(
+                    s,
+                    "UPDATE kb_documents SET is_active=FALSE, updated_at=CURRENT_TIMESTAMP "
+                    "WHERE id = ANY(:ids) AND is_active=TRUE",
+                ),
+                {"ids": ids},
+            )
+            self._park_chunks(s, ids, park=True)
+            s.commit()
+            self._apply_vector_ops(s)
+            return int(res.rowcount or 0)
+
+    def _park_chunks(self, s: Session, document_ids: List[int], *, park: bool) -> int:
+        """
+        Чанки неактивных документов «паркуются» в поколение -g: поиск, частичный ANN-индекс поколения
+        и btree (generation, document_id, chunk_order) читают generation = g, так что такие документы
+        исключаются тем же индексированным предикатом, а не фильтром после поиска. park=False возвращает
+        чанки активного поколения вернувшегося на Диск документа — без переиндексации. С vector_store
+        векторы переезжают в поколение -g хранилища (после commit, _apply_vector_ops).
+        """
+        if not document_ids:
+            return 0
+        params: Dict[str, Any] = {"ids": document_ids}
+        if park:
+            where = "generation > 0"
+        else:
+            where = "generation = :pg"
+            params["pg"] = -self._resolve_generation(s, None)
+        where += " AND document_id = ANY(:ids)"
+        if self.vectors is not None:
+            by_gen: Dict[int, List[Tuple[int, int]]] = {}
+            for r in s.execute(_ids_sql(s, f"SELECT id, document_id, generation FROM kb_chunks WHERE {where}"), params):
+                by_gen.setdefault(int(r[2]), []).append((int(r[0]), int(r[1])))
+            for g, pairs in by_gen.items():
+                vecs = self.vectors.get(g, [c for c, _ in pairs])
+                moved = [(c, d) for c, d in pairs if c in vecs]
+                self._vector_op(s, "add", -g, [c for c, _ in moved], [d for _, d in moved], [vecs[c] for c, _ in moved])
+                self._vector_op(s, "delete", generation=g, chunk_ids=[c for c, _ in pairs])
+        if park:
+            # копии паркуемых чанков в других документах становятся оригиналами — иначе пропадут из поиска по БЗ
+            s.execute(
+                _ids_sql(s, f"UPDATE kb_chunks SET dup_of = NULL WHERE dup_of IN (SELECT id FROM kb_chunks WHERE {where})"),
+                params,
+            )
+        res = s.execute(_ids_sql(s, f"UPDATE kb_chunks SET generation = -generation WHERE {where}"), params)
+        return int(res.rowcount or 0)
+
     def mark_all_documents_inactive(self) -> None:
         with self.sf() as s:
             s.execute(sqltext("UPDATE kb_documents SET is_active=FALSE"))
@@ -315,7 +718,8 @@ class KBRepo:
                 sqltext(
                     """
                     UPDATE kb_documents
-                    SET status=:status, last_error=:err
+                    SET updated_at = CASE WHEN status = :status THEN updated_at ELSE CURRENT_TIMESTAMP END,
+                        status=:status, last_error=:err
                     WHERE id=:id
                     """
                 ),
@@ -329,7 +733,7 @@ class KBRepo:
                 sqltext(
                     """
                     UPDATE kb_documents
-                    SET indexed_at=NOW(), status='indexed', last_error=NULL
+                    SET indexed_at=CURRENT_TIMESTAMP, status='indexed', last_error=NULL
                     WHERE id=:id
                     """
                 ),
@@ -343,65 +747,1615 @@ class KBRepo:
     def delete_chunks_by_document_id(self, document_id: int) -> None:
         with self.sf() as s:
             s.execute(sqltext("DELETE FROM kb_chunks WHERE document_id=:id"), {"id": int(document_id)})
+            s.execute(sqltext("DELETE FROM kb_document_vectors WHERE document_id=:id"), {"id": int(document_id)})
+            self._vector_op(s, "delete", document_ids=[int(document_id)])
             s.commit()
+            self._apply_vector_ops(s)
+
+    # ----------------------------
+    # Внешнее хранилище векторов (vector_store)
+    # ----------------------------
+    # значение kb_chunks.embedding при внешнем хранилище: колонка NOT NULL, вектор в ней не нужен
+    EXTERNAL_EMBEDDING = "[0]"
+
+    def _vector_op(self, s: Session, op: str, *args: Any, **kwargs: Any) -> None:
+        """
+        Откладывает изменение vector_store до commit транзакции s (_apply_vector_ops): после rollback
+        id чанков могут выдаваться заново, и вектор «чужого» чанка остался бы в хранилище.
+        """
+        if self.vectors is not None:
+            s.info.setdefault("kb_vector_ops", []).append((op, args, kwargs))
 
-    def insert_chunks_bulk(self, rows: Sequence[Tuple[int, int, str, list[float]]]) -> None:
+    def _apply_vector_ops(self, s: Session) -> None:
+        for op, args, kwargs in s.info.pop("kb_vector_ops", []):
+            getattr(self.vectors, op)(*args, **kwargs)
+
+    def reconcile_vector_store(self) -> Dict[int, Dict[str, int]]:
+        """
+        Сверка vector_store с kb_chunks при старте: векторы чанков, которых нет в БД (пересозданная БД,
+        сбой между commit и записью в хранилище), удаляются. Чанки без векторов в поиск не попадают —
+        о них пишется предупреждение (нужен /kb rebuild).
+        """
+        if self.vectors is None:
+            return {}
+        out: Dict[int, Dict[str, int]] = {}
+        with self.sf() as s:
+            gens = set(self.vectors.generations()) | {
+                int(r[0]) for r in s.execute(sqltext("SELECT DISTINCT generation FROM kb_chunks")).fetchall()
+            }
+            for g in sorted(gens):
+                ids = s.execute(sqltext("SELECT id FROM kb_chunks WHERE generation=:g"), {"g": g}).scalars().all()
+                if not ids and g in self.vectors.generations():
+                    self.vectors.drop_generation(g)
+                    out[g] = {"dropped": 1}
+                    continue
+                removed = self.vectors.retain(g, ids)
+                missing = len(ids) - len(self.vectors.get(g, ids)) if ids else 0
+                out[g] = {"chunks": len(ids), "removed": removed, "missing": missing}
+                if missing:
+                    log.warning("KB vector store: generation %s has %s chunks without vectors (run /kb rebuild)", g, missing)
+        return out
+
+    # меньше — обычный INSERT: COPY выигрывает на сериализации, а не на паре строк
+    COPY_MIN_ROWS = 16
+    # строк на одну команду COPY (~12 КБ на строку при 3072 измерениях)
+    COPY_BATCH = 2000
+
+    @staticmethod
+    def _copy_cursor(s: Session) -> Any:
+        """DB-API курсор текущей транзакции сессии, если драйвер умеет COPY (psycopg2), иначе None."""
+        conn = s.connection()
+        if conn.dialect.name != "postgresql":
+            return None
+        cur = conn.connection.cursor()
+        if not hasattr(cur, "copy_expert"):
+            cur.close()
+            return None
+        return cur
+
+    _INSERT_CHUNK_SQL = """
+        INSERT INTO kb_chunks(document_id, chunk_order, text, embedding, content_hash, generation, simhash, dup_of)
+        VALUES (:document_id, :chunk_order, :text, CAST(:embedding AS vector), :content_hash, :generation, :simhash, :dup_of)
+    """
+
+    def _insert_chunks(self, s: Session, rows: Sequence[Tuple], generation: int) -> None:
+        """
+        rows: (document_id, chunk_order, text, embedding[, content_hash[, simhash[, dup_of]]]) — все в поколение
+        generation; simhash/dup_of — подпись почти-дубликатов и id оригинала (app.kb.dedup.ChunkDeduper).
+
+        На Postgres+psycopg2 пачки от COPY_MIN_ROWS строк идут бинарным COPY в той же транзакции,
+        иначе — executemany INSERT. С vector_store — INSERT ... RETURNING id по строке (id нужны
+        хранилищу), векторы уходят в хранилище после commit.
+        """
+        params = [
+            {
+                "document_id": int(r[0]),
+                "chunk_order": int(r[1]),
+                "text": r[2],
+                "embedding": self.EXTERNAL_EMBEDDING if self.vectors is not None else None,
+                "content_hash": r[4] if len(r) > 4 else None,
+                "generation": int(generation),
+                "simhash": r[5] if len(r) > 5 else None,
+                "dup_of": r[6] if len(r) > 6 else None,
+            }
+            for r in rows
+        ]
+        if self.vectors is not None:
+            stmt = sqltext(self._INSERT_CHUNK_SQL + " RETURNING id")
+            ids = [s.execute(stmt, p).scalar_one() for p in params]
+            self._vector_op(s, "add", int(generation), ids, [p["document_id"] for p in params], [r[3] for r in rows])
+            return
+        if len(rows) >= self.COPY_MIN_ROWS:
+            cur = self._copy_cursor(s)
+            if cur is not None:
+                try:
+                    for i in range(0, len(rows), self.COPY_BATCH):
+                        part = rows[i : i + self.COPY_BATCH]
+                        cur.copy_expert(_CHUNK_COPY_SQL, io.BytesIO(encode_chunk_copy(part, generation)))
+                finally:
+                    cur.close()
+                return
+        for p, r in zip(params, rows):
+            p["embedding"] = vector_literal(r[3])
+        s.execute(sqltext(self._INSERT_CHUNK_SQL), params)
+
+    def insert_chunks_bulk(self, rows: Sequence[Tuple], *, generation: int | None = None) -> None:
+        if not rows:
+            return
+        with self.sf() as s:
+            self._insert_chunks(s, rows, self._resolve_generation(s, generation))
+            s.commit()
+            self._apply_vector_ops(s)
+
+    def list_chunk_keys(
+        self, document_id: int, *, generation: int | None = None
+    ) -> List[Tuple[int, int, Optional[str], Optional[str]]]:
+        """
+        (id, chunk_order, content_hash, text) по документу в поколении (по умолчанию — активном).
+        text возвращается только для старых строк без content_hash (чтобы посчитать хэш на клиенте).
+        """
+        with self.sf() as s:
+            rows = s.execute(
+                sqltext(
+                    """
+                    SELECT id, chunk_order, content_hash,
+                           CASE WHEN content_hash IS NULL THEN text END
+                    FROM kb_chunks
+                    WHERE document_id=:id AND generation=:g
+                    ORDER BY chunk_order ASC, id ASC
+                    """
+                ),
+                {"id": int(document_id), "g": self._resolve_generation(s, generation)},
+            ).fetchall()
+        return [(int(r[0]), int(r[1]), r[2], r[3]) for r in rows]
+
+    @contextmanager
+    def chunk_writer(self, document_id: int, *, generation: int | None = None) -> Iterator["ChunkWriter"]:
+        """
+        Одна транзакция на все изменения чанков документа (commit на выходе,
+        rollback при исключении). Позволяет писать документ окнами по мере нарезки.
+        generation=None — активное поколение.
+        """
+        with self.sf() as s:
+            yield ChunkWriter(self, s, int(document_id), self._resolve_generation(s, generation))
+            s.commit()
+            self._apply_vector_ops(s)
+
+    def apply_chunk_diff(
+        self,
+        document_id: int,
+        *,
+        insert_rows: Sequence[Tuple],
+        delete_ids: Sequence[int],
+        renumber: Sequence[Tuple[int, int]],
+        set_hashes: Sequence[Tuple[int, str]] = (),
+        generation: int | None = None,
+    ) -> None:
+        """
+        Инкрементальное обновление чанков документа в ОДНОЙ транзакции:
+        - delete_ids: исчезнувшие чанки;
+        - renumber: (chunk_id, new_order) для сдвинувшихся чанков;
+        - set_hashes: (chunk_id, content_hash) для старых строк без хэша;
+        - insert_rows: новые чанки.
+        """
+        with self.chunk_writer(document_id, generation=generation) as w:
+            w.apply(insert_rows=insert_rows, delete_ids=delete_ids, renumber=renumber, set_hashes=set_hashes)
+
+    # ----------------------------
+    # Generations (kb_generations)
+    # ----------------------------
+    @staticmethod
+    def _resolve_generation(s: Session, generation: int | None) -> int:
+        if generation is not None:
+            return int(generation)
+        row = s.execute(sqltext(f"SELECT {ACTIVE_GENERATION_SQL}")).first()
+        return int(row[0]) if row and row[0] is not None else 1
+
+    def active_generation(self) -> int:
+        with self.sf() as s:
+            return self._resolve_generation(s, None)
+
+    def list_generations(self) -> List[Dict[str, Any]]:
+        with self.sf() as s:
+            rows = s.execute(
+                sqltext(
+                    """
+                    SELECT g.id, g.status, g.chunk_size, g.chunk_overlap, g.embedding_model,
+                           g.created_at, g.activated_at, g.retired_at,
+                           (SELECT COUNT(*) FROM kb_chunks c WHERE c.generation = g.id) AS chunks,
+                           g.embedding_dims, g.metric, g.chunker
+                    FROM kb_generations g
+                    ORDER BY g.id
+                    """
+                )
+            ).fetchall()
+        return [
+            {
+                "id": int(r[0]),
+                "status": r[1],
+                "chunk_size": r[2],
+                "chunk_overlap": r[3],
+                "embedding_model": r[4],
+                "created_at": r[5],
+                "activated_at": r[6],
+                "retired_at": r[7],
+                "chunks": int(r[8]),
+                "embedding_dims": r[9],
+                "metric": r[10],
+                "chunker": r[11] or "chars",
+            }
+            for r in rows
+        ]
+
+    def generation_profile(self, generation: int | None = None) -> Optional[Dict[str, Any]]:
+        """Профиль индекса поколения (по умолчанию активного): модель, размерность, метрика."""
+        with self.sf() as s:
+            g = self._resolve_generation(s, generation)
+            row = s.execute(
+                sqltext("SELECT embedding_model, embedding_dims, metric FROM kb_generations WHERE id=:g"),
+                {"g": g},
+            ).first()
+        if not row:
+            return None
+        return {"generation": g, "embedding_model": row[0], "embedding_dims": row[1], "metric": row[2]}
+
+    def create_generation(
+        self,
+        *,
+        chunker: str | None = None,
+        chunk_size: int | None = None,
+        chunk_overlap: int | None = None,
+        embedding_model: str | None = None,
+        embedding_dims: int | None = None,
+        metric: str | None = None,
+        note: str | None = None,
+    ) -> int:
+        """Новое поколение в статусе building: в него пишет перестройка, поиск его не видит."""
+        with self.sf() as s:
+            row = s.execute(
+                sqltext(
+                    """
+                    INSERT INTO kb_generations (status, chunker, chunk_size, chunk_overlap, embedding_model, embedding_dims, metric, note)
+                    VALUES ('building', :chunker, :cs, :co, :m, :dims, :metric, :note)
+                    RETURNING id
+                    """
+                ),
+                {
+                    "chunker": chunker,
+                    "cs": chunk_size,
+                    "co": chunk_overlap,
+                    "m": embedding_model,
+                    "dims": embedding_dims,
+                    "metric": metric,
+                    "note": note,
+                },
+            ).first()
+            s.commit()
+        return int(row[0])
+
+    def adopt_generation_profile(
+        self,
+        generation: int,
+        *,
+        chunker: str | None = None,
+        chunk_size: int | None = None,
+        chunk_overlap: int | None = None,
+        embedding_model: str | None = None,
+        embedding_dims: int | None = None,
+        metric: str | None = None,
+    ) -> bool:
+        """
+        Записывает профиль в поколение, только если в нём ещё нет чанков (свежая БД: поколение 1 создано
+        миграцией без профиля). True — профиль записан.
+        """
+        with self.sf() as s:
+            res = s.execute(
+                sqltext(
+                    """
+                    UPDATE kb_generations
+                    SET chunker=:chunker, chunk_size=:cs, chunk_overlap=:co,
+                        embedding_model=:m, embedding_dims=:dims, metric=:metric
+                    WHERE id=:g AND NOT EXISTS (SELECT 1 FROM kb_chunks c WHERE c.generation = :g)
+                    """
+                ),
+                {
+                    "g": int(generation),
+                    "chunker": chunker,
+                    "cs": chunk_size,
+                    "co": chunk_overlap,
+                    "m": embedding_model,
+                    "dims": embedding_dims,
+                    "metric": metric,
+                },
+            )
+            s.commit()
+        return bool(res.rowcount)
+
+    def set_generation_status(self, generation: int, status: str) -> None:
         with self.sf() as s:
             s.execute(
                 sqltext(
                     """
-                    INSERT INTO kb_chunks(document_id, chunk_order, text, embedding)
-                    VALUES (:document_id, :chunk_order, :text, :embedding)
+                    UPDATE kb_generations
+                    SET status=:st, retired_at = CASE WHEN :st IN ('retired', 'failed') THEN CURRENT_TIMESTAMP ELSE retired_at END
+                    WHERE id=:g AND status <> 'active'
                     """
                 ),
-                [
-                    {
-                        "document_id": int(did),
-                        "chunk_order": int(order),
-                        "text": text,
-                        "embedding": emb,
-                    }
-                    for (did, order, text, emb) in rows
-                ],
+                {"g": int(generation), "st": status},
             )
             s.commit()
 
-    def search_by_embedding(self, query_vector: list[float], *, limit: int = 6, document_ids: Sequence[int] | None = None):
+    def activate_generation(self, generation: int) -> Optional[int]:
+        """
+        Атомарное переключение: одно UPDATE делает generation активным, а прежнее активное — retired.
+        Читатели видят либо старое, либо новое поколение целиком. Возвращает id прежнего активного.
+        """
+        g = int(generation)
+        with self.sf() as s:
+            lock = " FOR UPDATE" if s.get_bind().dialect.name == "postgresql" else ""
+            row = s.execute(sqltext(f"SELECT status FROM kb_generations WHERE id=:g{lock}"), {"g": g}).first()
+            if not row or row[0] != "building":
+                raise ValueError(f"generation {g} is not building (status={row[0] if row else None})")
+            prev = s.execute(sqltext(f"SELECT {ACTIVE_GENERATION_SQL}")).scalar()
+            s.execute(
+                sqltext(
+                    """
+                    UPDATE kb_generations
+                    SET status       = CASE WHEN id = :g THEN 'active' ELSE 'retired' END,
+                        activated_at = CASE WHEN id = :g THEN CURRENT_TIMESTAMP ELSE activated_at END,
+                        retired_at   = CASE WHEN id = :g THEN NULL ELSE CURRENT_TIMESTAMP END
+                    WHERE id = :g OR status = 'active'
+                    """
+                ),
+                {"g": g},
+            )
+            s.commit()
+        self.generation_epoch += 1
+        return int(prev) if prev is not None else None
+
+    def copy_generation_chunks(self, src: int, dst: int, document_ids: Sequence[int]) -> int:
+        """Переносит чанки документов из поколения src в dst как есть (для документов, не собранных в dst)."""
+        ids = [int(x) for x in document_ids]
+        if not ids:
+            return 0
+        with self.sf() as s:
+            s.execute(
+                _ids_sql(s, "DELETE FROM kb_chunks WHERE generation=:dst AND document_id = ANY(:ids)"),
+                {"dst": int(dst), "ids": ids},
+            )
+            res = s.execute(
+                _ids_sql(
+                    s,
+                    """
+                    INSERT INTO kb_chunks (document_id, chunk_order, text, embedding, content_hash, generation, simhash)
+                    SELECT document_id, chunk_order, text, embedding, content_hash, :dst, simhash
+                    FROM kb_chunks
+                    WHERE generation=:src AND document_id = ANY(:ids)
+                    """,
+                ),
+                {"src": int(src), "dst": int(dst), "ids": ids},
+            )
+            # dup_of указывает на id поколения src: оригинал ищется в dst по (document_id, chunk_order)
+            # с тем же content_hash; если его там нет (документ перенарезан) — копия становится оригиналом
+            s.execute(
+                _ids_sql(
+                    s,
+                    """
+                    UPDATE kb_chunks SET dup_of = (
+                        SELECT MIN(n.id)
+                        FROM kb_chunks p
+                        JOIN kb_chunks o ON o.id = p.dup_of
+                        JOIN kb_chunks n ON n.generation = :dst AND n.document_id = o.document_id
+                             AND n.chunk_order = o.chunk_order
+                             AND COALESCE(n.content_hash, '') = COALESCE(o.content_hash, '')
+                             AND n.dup_of IS NULL
+                        WHERE p.generation = :src AND p.document_id = kb_chunks.document_id
+                          AND p.chunk_order = kb_chunks.chunk_order
+                    )
+                    WHERE generation = :dst AND document_id = ANY(:ids)
+                    """,
+                ),
+                {"src": int(src), "dst": int(dst), "ids": ids},
+            )
+            if self.vectors is not None:
+                self._copy_vectors(s, int(src), int(dst), ids)
+            s.execute(
+                _ids_sql(s, "DELETE FROM kb_document_vectors WHERE generation=:dst AND document_id = ANY(:ids)"),
+                {"dst": int(dst), "ids": ids},
+            )
+            s.execute(
+                _ids_sql(
+                    s,
+                    """
+                    INSERT INTO kb_document_vectors (generation, document_id, chunks, embedding)
+                    SELECT :dst, document_id, chunks, embedding
+                    FROM kb_document_vectors
+                    WHERE generation=:src AND document_id = ANY(:ids)
+                    """,
+                ),
+                {"src": int(src), "dst": int(dst), "ids": ids},
+            )
+            s.commit()
+            self._apply_vector_ops(s)
+            return int(res.rowcount or 0)
+
+    def _copy_vectors(self, s: Session, src: int, dst: int, document_ids: List[int]) -> None:
+        """Векторы скопированных чанков: старый и новый id сопоставляются по (document_id, chunk_order, id)."""
+        sql = "SELECT id, document_id, chunk_order FROM kb_chunks WHERE generation=:g AND document_id = ANY(:ids)"
+        pairs: Dict[Tuple[int, int], List[int]] = {}
+        for g in (src, dst):
+            for r in s.execute(_ids_sql(s, sql + " ORDER BY document_id, chunk_order, id"), {"g": g, "ids": document_ids}):
+                pairs.setdefault((int(r[1]), int(r[2])), []).append(int(r[0]))
+        old_ids = [i for v in pairs.values() for i in v[: len(v) // 2]]
+        vecs = self.vectors.get(src, old_ids)
+        new_ids, docs, rows = [], [], []
+        for (did, _), ids in pairs.items():
+            half = len(ids) // 2
+            for old, new in zip(ids[:half], ids[half:]):
+                if old in vecs:
+                    new_ids.append(new)
+                    docs.append(did)
+                    rows.append(vecs[old])
+        self._vector_op(s, "add", dst, new_ids, docs, rows)
+
+    def gc_generation(self, generation: int, *, batch: int = 5000, pause_sec: float = 0.0) -> int:
+        """
+        Удаляет чанки неактивного поколения пачками по batch строк (отдельная транзакция на пачку,
+        с паузой между ними), чтобы не держать длинных блокировок и не раздувать WAL одним DELETE.
+        Вместе с ним — припаркованные в -generation чанки неактивных документов (_park_chunks): у таких
+        документов сбрасывается indexed_at, вернувшись на Диск, они индексируются в активное поколение заново.
+        """
+        g = int(generation)
+        batch = max(1, int(batch))
+        if g == self.active_generation():
+            raise ValueError(f"generation {g} is active")
+        # индекс поколения больше не нужен, а без него DELETE не обновляет граф
+        self.drop_ann_index(g)
+        if self.vectors is not None:
+            self.vectors.drop_generation(g)
+            self.vectors.drop_generation(-g)
+        with self.sf() as s:
+            s.execute(sqltext("DELETE FROM kb_document_vectors WHERE generation=:g"), {"g": g})
+            s.execute(
+                sqltext(
+                    "UPDATE kb_documents SET indexed_at=NULL "
+                    "WHERE id IN (SELECT DISTINCT document_id FROM kb_chunks WHERE generation=:pg)"
+                ),
+                {"pg": -g},
+            )
+            s.commit()
+        deleted = 0
+        while True:
+            with self.sf() as s:
+                res = s.execute(
+                    sqltext(
+                        """
+                        DELETE FROM kb_chunks
+                        WHERE id IN (SELECT id FROM kb_chunks WHERE generation IN (:g, :pg) LIMIT :n)
+                        """
+                    ),
+                    {"g": g, "pg": -g, "n": batch},
+                )
+                s.commit()
+            n = int(res.rowcount or 0)
+            deleted += n
+            if n == 0 or n < batch:
+                return deleted
+            if pause_sec > 0:
+                time.sleep(pause_sec)
+
+    def gc_documents(
+        self, *, grace_sec: int = 86400, batch: int = 5000, pause_sec: float = 0.0, vacuum: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Сборка мусора по документам: чанки (во всех поколениях) документов, которые дольше grace_sec
+        неактивны (удалены с Диска, чанки припаркованы) или в статусе error (текст версии файла, которой
+        на Диске уже нет). Пачками по batch строк с паузой, как gc_generation. У документов сбрасывается
+        indexed_at и удаляются центроиды и кэш текста: вернувшийся на Диск или починенный документ
+        индексируется заново.
+
+        vacuum — в конце VACUUM (ANALYZE) kb_chunks (Postgres), чтобы место сразу пошло под новые строки;
+        без него освобождённое подберёт autovacuum (короткие транзакции ему не мешают).
+        Возвращает {documents, chunks, bytes, vacuum}; bytes — объём удалённых строк (text, embedding,
+        text_tsv по pg_column_size; вне Postgres — длина text, векторы vector_store не учтены).
+        """
+        out: Dict[str, Any] = {"documents": 0, "chunks": 0, "bytes": 0, "vacuum": False}
+        with self.sf() as s:
+            pg = s.get_bind().dialect.name == "postgresql"
+            cutoff = _age_cutoff(s, "grace")
+            ids = s.execute(
+                sqltext(
+                    f"""
+                    SELECT d.id FROM kb_documents d
+                    WHERE (d.is_active = FALSE OR d.status = 'error') AND d.updated_at <= {cutoff}
+                      AND EXISTS (SELECT 1 FROM kb_chunks c WHERE c.document_id = d.id)
+                    ORDER BY d.id
+                    """
+                ),
+                {"grace": max(0, int(grace_sec))},
+            ).scalars().all()
+        if not ids:
+            return out
+        ids = [int(x) for x in ids]
+        size = (
+            "pg_column_size(text) + pg_column_size(embedding) + COALESCE(pg_column_size(text_tsv), 0)"
+            if pg
+            else "length(text)"
+        )
+        n = max(1, int(batch))
+        while True:
+            with self.sf() as s:
+                rows = s.execute(
+                    _ids_sql(
+                        s,
+                        f"""
+                        DELETE FROM kb_chunks
+                        WHERE id IN (SELECT id FROM kb_chunks WHERE document_id = ANY(:ids) LIMIT :n)
+                        RETURNING id, {size}
+                        """,
+                    ),
+                    {"ids": ids, "n": n},
+                ).fetchall()
+                self._vector_op(s, "delete", chunk_ids=[int(r[0]) for r in rows])
+                s.commit()
+                self._apply_vector_ops(s)
+            out["chunks"] += len(rows)
+            out["bytes"] += sum(int(r[1] or 0) for r in rows)
+            if len(rows) < n:
+                break
+            if pause_sec > 0:
+                time.sleep(pause_sec)
+
+        with self.sf() as s:
+            s.execute(_ids_sql(s, "DELETE FROM kb_document_vectors WHERE document_id = ANY(:ids)"), {"ids": ids})
+            s.execute(_ids_sql(s, "DELETE FROM kb_document_texts WHERE document_id = ANY(:ids)"), {"ids": ids})
+            s.execute(_ids_sql(s, "UPDATE kb_documents SET indexed_at=NULL WHERE id = ANY(:ids)"), {"ids": ids})
+            s.commit()
+        out["documents"] = len(ids)
+        if vacuum and pg and out["chunks"]:
+            with self.sf() as s:
+                s.connection(execution_options={"isolation_level": "AUTOCOMMIT"}).execute(
+                    sqltext("VACUUM (ANALYZE) kb_chunks")
+                )
+            out["vacuum"] = True
+        return out
+
+    # ----------------------------
+    # Почти-дубликаты чанков (kb_chunks.simhash / dup_of, app.kb.dedup)
+    # ----------------------------
+    SIMHASH_BAND_SQL = ("(simhash & 65535)", "((simhash >> 16) & 65535)", "((simhash >> 32) & 65535)", "((simhash >> 48) & 65535)")
+
+    def find_near_duplicates(
+        self, generation: int, signatures: Sequence[int], *, exclude_document_id: int, max_distance: int = 3
+    ) -> Dict[int, List[Tuple[int, int]]]:
+        """
+        {индекс подписи: [(id чанка, расстояние Хэмминга), ...] по возрастанию расстояния} — оригиналы (dup_of IS NULL)
+        поколения в других документах на расстоянии <= max_distance. Кандидаты — по совпадению любой из 4 полос
+        по 16 бит (индексы ix_kb_chunks_simhash_b0..b3), расстояние считается здесь.
+        """
+        if not signatures:
+            return {}
+        bands: List[Dict[int, List[int]]] = [{} for _ in self.SIMHASH_BAND_SQL]
+        for i, sig in enumerate(signatures):
+            for j in range(len(bands)):
+                bands[j].setdefault((int(sig) >> (16 * j)) & 0xFFFF, []).append(i)
+        mask = (1 << 64) - 1
+        out: Dict[int, List[Tuple[int, int]]] = {}
+        with self.sf() as s:
+            pg = s.get_bind().dialect.name == "postgresql"
+            cond = " OR ".join(
+                f"{expr} = ANY(:b{j})" if pg else f"{expr} IN :b{j}" for j, expr in enumerate(self.SIMHASH_BAND_SQL)
+            )
+            stmt = sqltext(
+                f"""
+                SELECT id, simhash FROM kb_chunks
+                WHERE generation = :g AND dup_of IS NULL AND simhash IS NOT NULL AND document_id <> :did
+                  AND ({cond})
+                """
+            )
+            if not pg:
+                stmt = stmt.bindparams(*[bindparam(f"b{j}", expanding=True) for j in range(len(bands))])
+            params: Dict[str, Any] = {"g": int(generation), "did": int(exclude_document_id)}
+            params.update({f"b{j}": sorted(b) for j, b in enumerate(bands)})
+            for cid, sig in s.execute(stmt, params):
+                sig = int(sig)
+                near = {i for j, b in enumerate(bands) for i in b.get((sig >> (16 * j)) & 0xFFFF, ())}
+                for i in near:
+                    d = bin((sig ^ int(signatures[i])) & mask).count("1")
+                    if d <= max_distance:
+                        out.setdefault(i, []).append((int(cid), d))
+        for cands in out.values():
+            cands.sort(key=lambda x: (x[1], x[0]))
+        return out
+
+    def duplicate_sources(self, generation: int, chunk_ids: Sequence[int]) -> Dict[int, Tuple[str, Any]]:
+        """{id: (text, вектор)} чанков-оригиналов: копия пишется с тем же вектором, без вызова embeddings."""
+        ids = [int(x) for x in chunk_ids]
+        if not ids:
+            return {}
+        with self.sf() as s:
+            if self.vectors is not None:
+                texts = {
+                    int(r[0]): r[1]
+                    for r in s.execute(_ids_sql(s, "SELECT id, text FROM kb_chunks WHERE id = ANY(:ids)"), {"ids": ids})
+                }
+                vecs = self.vectors.get(int(generation), list(texts))
+                return {cid: (t, vecs[cid]) for cid, t in texts.items() if cid in vecs}
+            rows = s.execute(_ids_sql(s, "SELECT id, text, embedding FROM kb_chunks WHERE id = ANY(:ids)"), {"ids": ids})
+            return {int(r[0]): (r[1], self._vector_from_db(r[2])) for r in rows}
+
+    def chunk_signatures(self, generation: int, document_id: int) -> List[Tuple[int, int]]:
+        """[(id, simhash)] чанков-оригиналов документа в поколении (повторная сверка почти-дубликатов после sync)."""
+        with self.sf() as s:
+            rows = s.execute(
+                sqltext(
+                    """
+                    SELECT id, simhash FROM kb_chunks
+                    WHERE generation=:g AND document_id=:d AND dup_of IS NULL AND simhash IS NOT NULL
+                    ORDER BY chunk_order
+                    """
+                ),
+                {"g": int(generation), "d": int(document_id)},
+            ).fetchall()
+        return [(int(r[0]), int(r[1])) for r in rows]
+
+    def link_duplicates(self, links: Sequence[Tuple[int, int]]) -> int:
+        """
+        Помечает чанки почти-дубликатами: [(id копии, id оригинала)]. Вектор копии остаётся своим.
+        Копии, ссылавшиеся на ставший копией чанк, перевешиваются на его оригинал — цепочек dup_of нет.
+        """
+        if not links:
+            return 0
+        n = 0
+        with self.sf() as s:
+            for cid, orig in links:
+                params = {"c": int(cid), "o": int(orig)}
+                s.execute(sqltext("UPDATE kb_chunks SET dup_of=:o WHERE dup_of=:c"), params)
+                res = s.execute(sqltext("UPDATE kb_chunks SET dup_of=:o WHERE id=:c AND dup_of IS NULL"), params)
+                n += int(res.rowcount or 0)
+            s.commit()
+        return n
+
+    # ----------------------------
+    # Векторы документов (kb_document_vectors): двухуровневый поиск
+    # ----------------------------
+    def update_document_vectors(self, document_ids: Sequence[int], *, generation: int | None = None) -> int:
+        """
+        Пересчитывает центроиды документов в поколении (по умолчанию активном) — среднее embeddings их чанков.
+        У документа без чанков строка удаляется. Возвращает число записанных центроидов.
+        """
+        ids = sorted({int(x) for x in document_ids})
+        if not ids:
+            return 0
+        with self.sf() as s:
+            g = self._resolve_generation(s, generation)
+            params = {"g": g, "ids": ids}
+            s.execute(_ids_sql(s, "DELETE FROM kb_document_vectors WHERE generation=:g AND document_id = ANY(:ids)"), params)
+            if self.vectors is None and s.get_bind().dialect.name == "postgresql":
+                # avg(vector) — агрегат pgvector: центроид считается в БД, векторы чанков не покидают её
+                res = s.execute(
+                    sqltext(
+                        """
+                        INSERT INTO kb_document_vectors (generation, document_id, chunks, embedding)
+                        SELECT generation, document_id, COUNT(*), AVG(embedding)
+                        FROM kb_chunks
+                        WHERE generation=:g AND document_id = ANY(:ids)
+                        GROUP BY generation, document_id
+                        """
+                    ),
+                    params,
+                )
+                n = int(res.rowcount or 0)
+            else:
+                rows = [
+                    {"g": g, "d": did, "n": cnt, "e": vector_literal(c)}
+                    for did, (cnt, c) in self._centroids(s, g, ids).items()
+                ]
+                if rows:
+                    s.execute(
+                        sqltext(
+                            "INSERT INTO kb_document_vectors (generation, document_id, chunks, embedding) "
+                            "VALUES (:g, :d, :n, :e)"
+                        ),
+                        rows,
+                    )
+                n = len(rows)
+            s.commit()
+        return n
+
+    def _centroids(self, s: Session, generation: int, document_ids: List[int]) -> Dict[int, Tuple[int, Any]]:
+        """
+        Центроиды в Python: векторы чанков из vector_store (или из kb_chunks.embedding вне Postgres).
+        Без numpy — пусто: центроиды не считаются, _route_documents такие документы не отсекает.
+        """
+        if np is None:
+            return {}
+        if self.vectors is not None:
+            rows = s.execute(
+                _ids_sql(s, "SELECT id, document_id FROM kb_chunks WHERE generation=:g AND document_id = ANY(:ids)"),
+                {"g": generation, "ids": document_ids},
+            ).fetchall()
+            vecs = self.vectors.get(generation, [int(r[0]) for r in rows])
+            pairs = [(int(r[1]), vecs[int(r[0])]) for r in rows if int(r[0]) in vecs]
+        else:
+            rows = s.execute(
+                _ids_sql(s, "SELECT document_id, embedding FROM kb_chunks WHERE generation=:g AND document_id = ANY(:ids)"),
+                {"g": generation, "ids": document_ids},
+            ).fetchall()
+            pairs = [(int(r[0]), self._vector_from_db(r[1])) for r in rows]
+        by_doc: Dict[int, List[Any]] = {}
+        for did, v in pairs:
+            by_doc.setdefault(did, []).append(v)
+        return {did: (len(vs), np.mean(np.asarray(vs, dtype=np.float32), axis=0)) for did, vs in by_doc.items()}
+
+    def backfill_document_vectors(
+        self, generation: int | None = None, *, batch: int = 500, pause_sec: float = 0.0
+    ) -> int:
+        """
+        Центроиды документов поколения, у которых их ещё нет (индекс построен до kb_document_vectors),
+        пачками по batch документов с паузой между ними, как backfill_fts.
+        """
+        with self.sf() as s:
+            g = self._resolve_generation(s, generation)
+            missing = s.execute(
+                sqltext(
+                    """
+                    SELECT DISTINCT c.document_id
+                    FROM kb_chunks c
+                    WHERE c.generation=:g AND NOT EXISTS (
+                        SELECT 1 FROM kb_document_vectors v WHERE v.generation=:g AND v.document_id = c.document_id
+                    )
+                    ORDER BY c.document_id
+                    """
+                ),
+                {"g": g},
+            ).scalars().all()
+        done = 0
+        for lo in range(0, len(missing), max(1, int(batch))):
+            if lo and pause_sec > 0:
+                time.sleep(pause_sec)
+            done += self.update_document_vectors(missing[lo : lo + max(1, int(batch))], generation=g)
+        return done
+
+    def _route_documents(
+        self, s: Session, generation: int, query_vector: Any, document_ids: Sequence[int] | None, top: int
+    ) -> Optional[List[int]]:
+        """
+        Первая ступень двухуровневого поиска: top активных документов из document_ids с ближайшими к запросу
+        центроидами, плюс документы без центроида (ещё не посчитан) — их маршрутизация не отсекает.
+        None — маршрутизировать нечего: фильтра нет или в нём не больше top документов. Поиск по всей БЗ
+        не маршрутизируется: ANN-индекс по чанкам быстрее перебора центроидов и точнее (bench/doc_routing.py).
+        """
+        top = int(top)
+        scope = sorted({int(x) for x in document_ids or []})
+        if top <= 0 or len(scope) <= top:
+            return None
+
+        where = "v.generation = :g AND v.document_id = ANY(:ids)"
+        params: Dict[str, Any] = {"g": int(generation), "ids": scope}
+        if s.get_bind().dialect.name == "postgresql":
+            params["q"] = vector_literal(query_vector)
+            sql = f"""
+                SELECT v.document_id, d.is_active, v.embedding <=> (:q)::vector AS dist
+                FROM kb_document_vectors v
+                JOIN kb_documents d ON d.id = v.document_id
+                WHERE {where}
+            """
+            rows = [(int(r[0]), bool(r[1]), float(r[2])) for r in s.execute(sqltext(sql), params)]
+        elif np is None:
+            return None  # расстояния до центроидов вне Postgres считаются в numpy
+        else:
+            sql = f"""
+                SELECT v.document_id, d.is_active, v.embedding
+                FROM kb_document_vectors v
+                JOIN kb_documents d ON d.id = v.document_id
+                WHERE {where}
+            """
+            raw = s.execute(_ids_sql(s, sql), params).fetchall()
+            rows = []
+            if raw:
+                m = np.asarray([self._vector_from_db(r[2]) for r in raw], dtype=np.float32)
+                q = np.asarray(query_vector, dtype=np.float32)
+                sim = (m @ q) / (np.linalg.norm(m, axis=1) * float(np.linalg.norm(q)) + 1e-12)
+                rows = [(int(r[0]), bool(r[1]), 1.0 - float(x)) for r, x in zip(raw, sim)]
+
+        have = {r[0] for r in rows}
+        ranked = sorted((r for r in rows if r[1]), key=lambda r: (r[2], r[0]))[:top]
+        routed = [r[0] for r in ranked] + [d for d in scope if d not in have]
+        with self._plan_lock:
+            self.plan_stats["route"] = self.plan_stats.get("route", 0) + 1
+        log.debug("KB route: %s of %s documents (%s without centroid)", len(routed), len(scope), len(routed) - len(ranked))
+        return routed or None
+
+    # ----------------------------
+    # ANN index (pgvector hnsw / ivfflat)
+    # ----------------------------
+    def ann_index_info(self, generation: int | None = None) -> Optional[Dict[str, Any]]:
+        """Валидный ANN-индекс поколения (по умолчанию активного) или None."""
+        if self.vectors is not None:
+            return None
+        with self.sf() as s:
+            g = self._resolve_generation(s, generation)
+            row = s.execute(
+                sqltext(
+                    """
+                    SELECT am.amname, pg_get_indexdef(c.oid), pg_relation_size(c.oid)
+                    FROM pg_class c
+                    JOIN pg_index i ON i.indexrelid = c.oid AND i.indisvalid
+                    JOIN pg_am am ON am.oid = c.relam
+                    WHERE c.relname = :name
+                    """
+                ),
+                {"name": ann_index_name(g)},
+            ).first()
+        if not row:
+            return None
+        return {
+            "generation": g,
+            "index": ann_index_name(g),
+            "kind": row[0],
+            "precision": _index_precision(row[1]),
+            "size_mb": round(int(row[2] or 0) / 1024 / 1024, 1),
+        }
+
+    @staticmethod
+    def _pgvector_version(s: Session) -> Tuple[int, ...]:
+        v = s.execute(sqltext("SELECT extversion FROM pg_extension WHERE extname='vector'")).scalar() or "0"
+        return tuple(int(x) for x in str(v).split(".") if x.isdigit())
+
+    def ensure_ann_index(
+        self,
+        generation: int | None = None,
+        *,
+        kind: str = "hnsw",
+        m: int = 16,
+        ef_construction: int = 64,
+        lists: int = 0,
+        build_mem_mb: int = 0,
+    ) -> Dict[str, Any]:
+        """
+        Строит частичный ANN-индекс по чанкам поколения, если его ещё нет (CREATE INDEX CONCURRENTLY,
+        запись в kb_chunks не блокируется). Вызывать после массовой загрузки: сборка по готовым
+        данным в разы быстрее, чем поддержка графа на каждом INSERT/COPY.
+
+        Векторы индексируются как halfvec (pgvector >= 0.7): индекс вдвое меньше, а 3072 измерения
+        укладываются в лимит. На старом pgvector — vector, если размерность <= 2000, иначе индекс
+        не строится и поиск остаётся точным.
+
+        kind="bit" — hnsw по binary_quantize(embedding)::bit(dims) (bit_hamming_ops, pgvector >= 0.7):
+        грубый проход по расстоянию Хэмминга, точный косинус — только для кандидатов (см. _vector_leg).
+        """
+        if kind not in ANN_INDEX_KINDS:
+            raise ValueError(f"unknown ANN index kind: {kind}")
+        if self.vectors is not None:
+            return {"generation": generation, "created": False, "skipped": f"vector store {self.vectors.name}"}
+        with self.sf() as s:
+            g = self._resolve_generation(s, generation)
+            name = ann_index_name(g)
+            state = s.execute(
+                sqltext("SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname=:n"),
+                {"n": name},
+            ).first()
+            dims = s.execute(
+                sqltext("SELECT vector_dims(embedding) FROM kb_chunks WHERE generation=:g LIMIT 1"), {"g": g}
+            ).scalar()
+            rows = s.execute(sqltext("SELECT COUNT(*) FROM kb_chunks WHERE generation=:g"), {"g": g}).scalar()
+            half = self._pgvector_version(s) >= (0, 7)
+
+        res: Dict[str, Any] = {"generation": g, "index": name, "kind": kind, "rows": int(rows or 0), "created": False}
+        if state and state[0]:
+            return res
+        if not dims:
+            res["skipped"] = "no chunks"
+            return res
+        dims = int(dims)
+        # выражение с явной размерностью: индексу нужен тип с размерностью, а запрос должен повторить его дословно
+        if kind == "bit":
+            if not half:
+                res["skipped"] = "bit index needs pgvector >= 0.7 (binary_quantize)"
+                return res
+            expr, ops, res["precision"] = f"(binary_quantize(embedding)::bit({dims}))", "bit_hamming_ops", "binary"
+        elif half and dims <= ANN_MAX_DIM_HALFVEC:
+            expr, ops, res["precision"] = f"(embedding::halfvec({dims}))", "halfvec_cosine_ops", "half"
+        elif dims <= ANN_MAX_DIM_VECTOR:
+            expr, ops, res["precision"] = f"(embedding::vector({dims}))", "vector_cosine_ops", "full"
+        else:
+            res["skipped"] = f"{dims} dims need pgvector >= 0.7 (halfvec)"
+            return res
+
+        if kind in ("hnsw", "bit"):
+            params = f"m = {max(2, int(m))}, ef_construction = {max(4, int(ef_construction))}"
+        else:
+            n_lists = int(lists) if lists and int(lists) > 0 else max(10, int(rows) // 1000)
+            params = f"lists = {n_lists}"
+        method = "hnsw" if kind == "bit" else kind
+        ddl = (
+            f"CREATE INDEX CONCURRENTLY {name} ON kb_chunks "
+            f"USING {method} ({expr} {ops}) WITH ({params}) WHERE generation = {g}"
+        )
+
+        t0 = time.monotonic()
+        with self.sf() as s:
+            conn = s.connection(execution_options={"isolation_level": "AUTOCOMMIT"})
+            if state is not None:
+                # остаток упавшего CONCURRENTLY — невалидный индекс, планировщик его не использует
+                conn.execute(sqltext(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            if build_mem_mb and int(build_mem_mb) > 0:
+                conn.execute(sqltext(f"SET maintenance_work_mem = '{int(build_mem_mb)}MB'"))
+            try:
+                conn.execute(sqltext(ddl))
+            finally:
+                if build_mem_mb and int(build_mem_mb) > 0:
+                    conn.execute(sqltext("RESET maintenance_work_mem"))
+        res.update({"created": True, "dims": dims, "params": params, "elapsed_sec": round(time.monotonic() - t0, 2)})
+        return res
+
+    def drop_ann_index(self, generation: int) -> None:
+        if self.vectors is not None:
+            return
+        with self.sf() as s:
+            conn = s.connection(execution_options={"isolation_level": "AUTOCOMMIT"})
+            conn.execute(sqltext(f"DROP INDEX CONCURRENTLY IF EXISTS {ann_index_name(generation)}"))
+
+    # ----------------------------
+    # Full-text (kb_chunks.text_tsv, GIN)
+    # ----------------------------
+    def backfill_fts(self, *, batch: int = 5000, pause_sec: float = 0.0) -> int:
+        """
+        Заполняет text_tsv у чанков, загруженных до появления триггера, пачками по batch строк
+        (отдельная транзакция на пачку). Проход по первичному ключу: каждая пачка продолжает с места
+        предыдущей, а не сканирует таблицу заново.
+        """
+        if self.vectors is not None:
+            return 0
+        done, last = 0, 0
+        while True:
+            with self.sf() as s:
+                ids = s.execute(
+                    sqltext(
+                        f"""
+                        UPDATE kb_chunks SET text_tsv = to_tsvector('{FTS_CONFIG}', text)
+                        WHERE id IN (
+                            SELECT id FROM kb_chunks WHERE id > :last AND text_tsv IS NULL ORDER BY id LIMIT :n
+                        )
+                        RETURNING id
+                        """
+                    ),
+                    {"last": last, "n": max(1, int(batch))},
+                ).scalars().all()
+                s.commit()
+            if not ids:
+                return done
+            done += len(ids)
+            last = max(ids)
+            if len(ids) < batch:
+                return done
+            if pause_sec > 0:
+                time.sleep(pause_sec)
+
+    def ensure_fts_index(self) -> Dict[str, Any]:
+        """
+        GIN-индекс по text_tsv (CREATE INDEX CONCURRENTLY). Индекс общий для всех поколений: фильтр
+        generation накладывается поверх него. До его появления search_hybrid работает как векторный поиск.
+        """
+        if self.vectors is not None:
+            return {"index": FTS_INDEX, "created": False, "skipped": f"vector store {self.vectors.name}"}
+        with self.sf() as s:
+            state = s.execute(
+                sqltext("SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname=:n"),
+                {"n": FTS_INDEX},
+            ).first()
+        res: Dict[str, Any] = {"index": FTS_INDEX, "created": False}
+        if state and state[0]:
+            return res
+        t0 = time.monotonic()
+        with self.sf() as s:
+            conn = s.connection(execution_options={"isolation_level": "AUTOCOMMIT"})
+            if state is not None:
+                conn.execute(sqltext(f"DROP INDEX CONCURRENTLY IF EXISTS {FTS_INDEX}"))
+            conn.execute(sqltext(f"CREATE INDEX CONCURRENTLY {FTS_INDEX} ON kb_chunks USING gin (text_tsv)"))
+        res.update({"created": True, "elapsed_sec": round(time.monotonic() - t0, 2)})
+        return res
+
+    # ----------------------------
+    # Embedding cache (kb_embedding_cache)
+    # ----------------------------
+    @staticmethod
+    def _vector_from_db(v: Any) -> Any:
+        """
+        Вектор из БД как numpy float32 (тот же вид, что у OpenAIClient.embeddings), без numpy — list[float].
+        С register_vector приходит numpy.ndarray (pgvector < 0.4) или pgvector.Vector, без него — строка '[1,2,3]'.
+        """
+        if np is not None:
+            if hasattr(v, "to_numpy"):
+                return v.to_numpy()
+            if isinstance(v, str):
+                return np.array(v.strip("[]").split(","), dtype=np.float32)
+            return np.asarray(v, dtype=np.float32)
+        if hasattr(v, "to_list"):
+            return v.to_list()
+        if hasattr(v, "tolist"):
+            return v.tolist()
+        if isinstance(v, str):
+            return [float(x) for x in v.strip("[]").split(",") if x]
+        return [float(x) for x in v]
+
+    def get_cached_embeddings(
+        self, model: str, text_hashes: Sequence[str], *, max_age_sec: int | None = None
+    ) -> Dict[str, Any]:
+        """max_age_sec — только записи не старше (кэш запросов с TTL); у кэша чанков срока нет."""
+        hashes = list(dict.fromkeys(text_hashes))
+        if not hashes:
+            return {}
+        params: Dict[str, Any] = {"m": model, "ids": hashes}
+        with self.sf() as s:
+            where = "model=:m AND text_hash = ANY(:ids)"
+            if max_age_sec:
+                params["age"] = int(max_age_sec)
+                where += f" AND created_at > {_age_cutoff(s, 'age')}"
+            rows = s.execute(
+                _ids_sql(
+                    s,
+                    f"""
+                    SELECT text_hash, embedding
+                    FROM kb_embedding_cache
+                    WHERE {where}
+                    """,
+                ),
+                params,
+            ).fetchall()
+        return {r[0]: self._vector_from_db(r[1]) for r in rows}
+
+    def put_cached_embeddings(self, model: str, items: Sequence[Tuple[str, Any]], *, refresh: bool = False) -> None:
+        """refresh=True — существующая запись получает новый вектор и created_at (продление TTL)."""
+        if not items:
+            return
+        conflict = "DO UPDATE SET embedding = EXCLUDED.embedding, created_at = CURRENT_TIMESTAMP" if refresh else "DO NOTHING"
+        with self.sf() as s:
+            # вне Postgres колонка embedding — текст '[...]' (CAST AS vector в SQLite превратил бы его в 0)
+            emb_sql = "CAST(:e AS vector)" if s.get_bind().dialect.name == "postgresql" else ":e"
+            s.execute(
+                sqltext(
+                    f"""
+                    INSERT INTO kb_embedding_cache(model, text_hash, embedding)
+                    VALUES (:m, :h, {emb_sql})
+                    ON CONFLICT (model, text_hash) {conflict}
+                    """
+                ),
+                [{"m": model, "h": h, "e": vector_literal(emb)} for (h, emb) in items],
+            )
+            s.commit()
+
+    def prune_cached_embeddings(self, model_prefix: str, max_age_sec: int) -> int:
+        """Удаляет записи кэша с моделью model_prefix* старше max_age_sec (истёкшие запросы)."""
+        with self.sf() as s:
+            res = s.execute(
+                sqltext(
+                    f"""
+                    DELETE FROM kb_embedding_cache
+                    WHERE model LIKE :p ESCAPE '\\' AND created_at < {_age_cutoff(s, 'age')}
+                    """
+                ),
+                {"p": model_prefix.replace("%", r"\%").replace("_", r"\_") + "%", "age": int(max_age_sec)},
+            )
+            s.commit()
+            return int(res.rowcount or 0)
+
+    def embedding_cache_size(self) -> int:
+        with self.sf() as s:
+            # без записей кэша запросов (app/kb/query_cache.py)
+            row = s.execute(sqltext("SELECT COUNT(*) FROM kb_embedding_cache WHERE model NOT LIKE 'query:%'")).first()
+        return int(row[0]) if row else 0
+
+    # ----------------------------
+    # Кэш извлечённого текста (kb_document_texts, app.kb.text_cache)
+    # ----------------------------
+    def put_document_text(self, document_id: int, md5: str, codec: str, text_bytes: int, data: bytes) -> None:
+        """Сжатый текст версии md5 документа; записи прежних версий документа удаляются."""
+        with self.sf() as s:
+            s.execute(
+                sqltext("DELETE FROM kb_document_texts WHERE document_id=:d AND md5 <> :m"),
+                {"d": int(document_id), "m": md5},
+            )
+            s.execute(
+                sqltext(
+                    """
+                    INSERT INTO kb_document_texts(document_id, md5, codec, text_bytes, data)
+                    VALUES (:d, :m, :c, :n, :data)
+                    ON CONFLICT (document_id, md5) DO UPDATE SET
+                        codec = EXCLUDED.codec,
+                        text_bytes = EXCLUDED.text_bytes,
+                        data = EXCLUDED.data,
+                        created_at = CURRENT_TIMESTAMP
+                    """
+                ),
+                {"d": int(document_id), "m": md5, "c": codec, "n": int(text_bytes), "data": data},
+            )
+            s.commit()
+
+    def get_document_text(self, document_id: int, md5: str) -> Optional[Tuple[str, bytes]]:
+        """(codec, сжатые байты) или None, если текста этой версии в кэше нет."""
+        with self.sf() as s:
+            row = s.execute(
+                sqltext("SELECT codec, data FROM kb_document_texts WHERE document_id=:d AND md5=:m"),
+                {"d": int(document_id), "m": md5},
+            ).first()
+        if not row:
+            return None
+        return row[0], bytes(row[1])
+
+    def cached_text_versions(self) -> Dict[int, str]:
+        """{document_id: md5} — для каких версий документов есть текст в кэше."""
+        with self.sf() as s:
+            rows = s.execute(sqltext("SELECT document_id, md5 FROM kb_document_texts")).fetchall()
+        return {int(r[0]): r[1] for r in rows}
+
+    def text_cache_size(self) -> Dict[str, int]:
+        with self.sf() as s:
+            pg = s.get_bind().dialect.name == "postgresql"
+            size = "octet_length(data)" if pg else "length(data)"
+            row = s.execute(
+                sqltext(f"SELECT COUNT(*), COALESCE(SUM(text_bytes), 0), COALESCE(SUM({size}), 0) FROM kb_document_texts")
+            ).first()
+        return {"documents": int(row[0] or 0), "text_bytes": int(row[1] or 0), "stored_bytes": int(row[2] or 0)}
+
+    def _doc_chunk_counts(self, s: Session, generation: int) -> Dict[int, int]:
+        """
+        Число чанков по документам поколения — для выбора плана поиска. Кэшируется на doc_counts_ttl_sec:
+        устаревшие числа влияют только на выбор плана, не на результат.
+        """
+        now = time.monotonic()
+        with self._plan_lock:
+            hit = self._doc_counts.get(generation)
+            if hit and now - hit[0] < self.doc_counts_ttl_sec:
+                return hit[1]
+        rows = s.execute(
+            sqltext(f"SELECT document_id, COUNT(*) FROM kb_chunks WHERE generation = {int(generation)} GROUP BY document_id")
+        ).fetchall()
+        counts = {int(r[0]): int(r[1]) for r in rows}
+        with self._plan_lock:
+            self._doc_counts = {generation: (now, counts)}
+        return counts
+
+    def _iterative_scan(self, s: Session) -> bool:
+        """pgvector >= 0.8: hnsw/ivfflat.iterative_scan — индекс продолжает обход, пока фильтр не наберёт LIMIT."""
+        if self._pgvector is None:
+            self._pgvector = self._pgvector_version(s)
+        return self._pgvector >= (0, 8)
+
+    def _plan_search(
+        self, s: Session, target: Any, *, limit: int, document_ids: Sequence[int] | None, exact: bool
+    ) -> Dict[str, Any]:
+        """
+        План векторного поиска:
+          ann           — без фильтра по документам: ANN-индекс поколения, limit * ann_candidates кандидатов;
+          exact         — без фильтра, индекса нет (или exact=True): полный перебор поколения;
+          exact_scoped  — фильтр по документам, чанков в них <= ann_exact_max_rows (или индекса нет):
+                          точный перебор только этих чанков по btree (generation, document_id, chunk_order);
+          ann_iterative — большой фильтр, pgvector >= 0.8: индекс с iterative_scan дочитывает до LIMIT;
+          ann_filtered  — большой фильтр: индекс отдаёт limit * ann_candidates / доля_чанков_в_фильтре
+                          кандидатов, фильтр и точная пересортировка — поверх; если кандидатов нужно больше
+                          ann_max_candidates (фильтр слишком узкий для ANN) — exact_scoped.
+        Число чанков берётся из кэша по документам (_doc_chunk_counts). У бинарного индекса (kind "bit")
+        вместо ann_candidates — ann_binary_candidates: биты грубее, кандидатов нужно больше.
+        """
+        g = int(target[0]) if target and target[0] is not None else 1
+        kind = target[1] if target else None
+        if kind == "hnsw" and "binary_quantize" in (target[2] or ""):
+            kind = "bit"
+        per = self.ann_binary_candidates if kind == "bit" else self.ann_candidates
+        if not document_ids:
+            if kind and not exact:
+                return {"plan": "ann", "generation": g, "kind": kind, "candidates": int(limit) * per}
+            return {"plan": "exact", "generation": g, "kind": kind}
+
+        counts = self._doc_chunk_counts(s, g)
+        ids = {int(x) for x in document_ids}
+        scoped = sum(counts.get(d, 0) for d in ids)
+        total = sum(counts.values())
+        plan: Dict[str, Any] = {"generation": g, "kind": kind, "scoped_rows": scoped, "total_rows": total}
+        if exact or not kind or scoped <= self.ann_exact_max_rows or not total:
+            plan["plan"] = "exact_scoped"
+            return plan
+        selectivity = scoped / total
+        plan["selectivity"] = round(selectivity, 4)
+        if self._iterative_scan(s):
+            plan.update({"plan": "ann_iterative", "candidates": int(limit) * per})
+            return plan
+        cand = int(math.ceil(int(limit) * per / selectivity))
+        if cand > self.ann_max_candidates:
+            plan["plan"] = "exact_scoped"
+        else:
+            plan.update({"plan": "ann_filtered", "candidates": cand})
+        return plan
+
+    def _vector_leg(
+        self,
+        s: Session,
+        target: Any,
+        query_vector: Any,
+        *,
+        limit: int,
+        document_ids: Sequence[int] | None,
+        exact: bool,
+        ef_search: int | None,
+    ) -> Tuple[str, Dict[str, Any], Dict[str, Any]]:
+        """
+        SELECT ближайших чанков поколения (id, document_id, chunk_order, text, dup_of, score) по убыванию score,
+        его параметры и выбранный план (_plan_search); настройки ANN (SET LOCAL) выставляются в транзакции s.
+        """
+        plan = self._plan_search(s, target, limit=limit, document_ids=document_ids, exact=exact)
+        g, kind, name = plan["generation"], plan["kind"], plan["plan"]
+
         # IMPORTANT:
         # psycopg2 адаптирует list[float] как numeric[], а pgvector operator <=> ожидает vector.
         # Поэтому передаем строковый литерал вида '[1,2,3,...]' и явно кастим к ::vector.
-        vec_literal = "[" + ",".join(f"{float(x):.10g}" for x in query_vector) + "]"
-
-        params: Dict[str, Any] = {"q": vec_literal, "lim": int(limit)}
-        where = ""
+        params: Dict[str, Any] = {"q": vector_literal(query_vector), "lim": int(limit)}
         if document_ids:
             params["ids"] = [int(x) for x in document_ids]
-            where = "WHERE document_id = ANY(:ids)"
 
+        if name.startswith("ann"):
+            cand = int(plan["candidates"])
+            if kind in ("hnsw", "bit"):
+                # hnsw отдаёт не больше ef_search строк
+                s.execute(sqltext(f"SET LOCAL hnsw.ef_search = {min(1000, max(int(ef_search or self.ann_ef_search), cand))}"))
+            else:
+                probes = int(ef_search or self.ann_probes)
+                if name == "ann_filtered":
+                    # в списках, которые просматриваются, должно найтись достаточно строк из фильтра
+                    lists = re.search(r"lists\W+(\d+)", target[2] or "")
+                    probes = int(math.ceil(probes / plan["selectivity"]))
+                    probes = min(probes, int(lists.group(1))) if lists else probes
+                s.execute(sqltext(f"SET LOCAL ivfflat.probes = {probes}"))
+            inner_where = f"generation = {g}"
+            if name == "ann":
+                inner_where += " AND dup_of IS NULL"  # почти-дубликаты — только в поиске по документам диалога
+            if name == "ann_iterative":
+                s.execute(sqltext(f"SET LOCAL {'ivfflat' if kind == 'ivfflat' else 'hnsw'}.iterative_scan = relaxed_order"))
+                inner_where += " AND document_id = ANY(:ids)"
+            outer_where = "WHERE document_id = ANY(:ids)" if name == "ann_filtered" else ""
+            if kind == "bit":
+                # Хэмминг по знаковым битам — только отбор кандидатов, score ниже — точный косинус
+                order = f"binary_quantize(embedding)::bit({len(query_vector)}) <~> binary_quantize((:q)::vector)"
+            else:
+                vtype = f"{'halfvec' if 'halfvec' in (target[2] or '') else 'vector'}({len(query_vector)})"
+                order = f"embedding::{vtype} <=> (:q)::{vtype}"
+            params["cand"] = cand
+            # generation литералом: иначе планировщик не сопоставит запрос с частичным индексом
+            sql = f"""
+                SELECT id, document_id, chunk_order, text, dup_of,
+                       1 - (embedding <=> (:q)::vector) AS score
+                FROM (
+                    SELECT id, document_id, chunk_order, text, dup_of, embedding
+                    FROM kb_chunks
+                    WHERE {inner_where}
+                    ORDER BY {order}
+                    LIMIT :cand
+                ) c
+                {outer_where}
+                ORDER BY score DESC
+                LIMIT :lim
+            """
+        else:
+            where = f"WHERE generation = {g}"
+            where += " AND document_id = ANY(:ids)" if document_ids else " AND dup_of IS NULL"
+            # ORDER BY score, а не по оператору <=>: так точный перебор не уходит в ANN-индекс
+            sql = f"""
+                SELECT id, document_id, chunk_order, text, dup_of,
+                       1 - (embedding <=> (:q)::vector) AS score
+                FROM kb_chunks
+                {where}
+                ORDER BY score DESC
+                LIMIT :lim
+            """
+        with self._plan_lock:
+            self.plan_stats[name] = self.plan_stats.get(name, 0) + 1
+        return sql, params, plan
+
+    @staticmethod
+    def _with_documents(
+        hits_sql: str, order: str, generation: int, params: Dict[str, Any], *, window: int = 0, window_hits: int = 0
+    ) -> str:
+        """
+        Оборачивает выдачу (SELECT id, document_id, chunk_order, text, score, ...) в запрос, который
+        в том же round trip добавляет документ (title, path, is_active) и для первых window_hits
+        результатов — соседние чанки того же документа и поколения (chunk_order ± window).
+        """
+        ctx_cols, ctx_join = "NULL::int[] AS ctx_orders, NULL::text[] AS ctx_texts", ""
+        if window > 0 and window_hits > 0:
+            params.update({"win": int(window), "win_hits": int(window_hits)})
+            ctx_cols = "ctx.orders AS ctx_orders, ctx.texts AS ctx_texts"
+            # индекс (generation, document_id, chunk_order): на каждый результат — короткий range scan
+            ctx_join = f"""
+                LEFT JOIN LATERAL (
+                    SELECT array_agg(n.chunk_order ORDER BY n.chunk_order) AS orders,
+                           array_agg(n.text ORDER BY n.chunk_order) AS texts
+                    FROM kb_chunks n
+                    WHERE h.pos <= :win_hits AND n.generation = {int(generation)} AND n.document_id = h.document_id
+                      AND n.chunk_order BETWEEN h.chunk_order - :win AND h.chunk_order + :win
+                      AND n.id <> h.id
+                ) ctx ON TRUE
+            """
+        return f"""
+            WITH hits AS MATERIALIZED ({hits_sql}),
+            h AS (SELECT hits.*, row_number() OVER (ORDER BY {order}) AS pos FROM hits)
+            SELECT h.*, d.title, d.path, d.is_active, {ctx_cols}
+            FROM h
+            JOIN kb_documents d ON d.id = h.document_id
+            {ctx_join}
+            ORDER BY h.pos
+        """
+
+    @staticmethod
+    def _hit_from_row(r: Any) -> Dict[str, Any]:
+        m = r._mapping
+        orders, texts = m["ctx_orders"], m["ctx_texts"]
+        out = {
+            "chunk_id": int(m["id"]),
+            "document_id": int(m["document_id"]),
+            "chunk_order": int(m["chunk_order"]),
+            "text": m["text"],
+            "score": float(m["score"]),
+            "title": m["title"],
+            "path": m["path"],
+            "is_active": bool(m["is_active"]),
+            "dup_of": int(m["dup_of"]) if m["dup_of"] is not None else None,
+            "context": list(zip(orders, texts)) if orders else [],
+        }
+        if "rrf" in m:
+            out["vector_rank"] = int(m["vrank"]) if m["vrank"] is not None else None
+            out["lexical_rank"] = int(m["lrank"]) if m["lrank"] is not None else None
+            out["rrf"] = float(m["rrf"])
+        return out
+
+    def _search_vector_store(
+        self,
+        query_vector: Any,
+        *,
+        limit: int,
+        document_ids: Sequence[int] | None,
+        window: int,
+        window_hits: int,
+        route_docs: int = 0,
+    ) -> List[Dict[str, Any]]:
+        """
+        search_by_embedding через vector_store: top-limit из хранилища, затем строки чанков и документов.
+        Хранилище с бинарным грубым проходом (binary) отбирает limit * ann_binary_candidates кандидатов.
+        По всей БЗ почти-дубликаты (dup_of) отбрасываются после хранилища, поэтому берётся вдвое больше.
+        """
+        plan = self.vectors.name + ("_binary" if getattr(self.vectors, "binary", False) else "")
         with self.sf() as s:
+            g = self._resolve_generation(s, None)
+            routed = self._route_documents(s, g, query_vector, document_ids, route_docs)
+            if routed is not None:
+                plan, document_ids = "route+" + plan, routed
+            plan += "_scoped" if document_ids else ""
+            k = int(limit) if document_ids else 2 * int(limit)
+            found = self.vectors.search(
+                g, query_vector, limit=k, document_ids=document_ids, candidates=k * self.ann_binary_candidates
+            )
+            if not found:
+                return []
             rows = s.execute(
-                sqltext(
+                _ids_sql(
+                    s,
                     f"""
-                    SELECT id, document_id, chunk_order, text,
-                           1 - (embedding <=> (:q)::vector) AS score
-                    FROM kb_chunks
-                    {where}
-                    ORDER BY embedding <=> (:q)::vector
-                    LIMIT :lim
-                    """
+                    SELECT c.id, c.document_id, c.chunk_order, c.text, d.title, d.path, d.is_active, c.dup_of
+                    FROM kb_chunks c
+                    JOIN kb_documents d ON d.id = c.document_id
+                    WHERE c.id = ANY(:ids){"" if document_ids else " AND c.dup_of IS NULL"}
+                    """,
                 ),
-                params,
+                {"ids": [f[0] for f in found]},
             ).fetchall()
-
-        out = []
-        for r in rows:
-            out.append(
-                {
-                    "chunk_id": int(r[0]),
+            by_id = {int(r[0]): r for r in rows}
+            hits: List[Dict[str, Any]] = []
+            for cid, _, score in found:
+                r = by_id.get(cid)
+                if r is None:  # почти-дубликат или вектор удалённого чанка (до сверки reconcile_vector_store)
+                    continue
+                if len(hits) >= limit:
+                    break
+                hit = {
+                    "chunk_id": cid,
                     "document_id": int(r[1]),
                     "chunk_order": int(r[2]),
                     "text": r[3],
-                    "score": float(r[4]),
+                    "score": score,
+                    "title": r[4],
+                    "path": r[5],
+                    "is_active": bool(r[6]),
+                    "dup_of": int(r[7]) if r[7] is not None else None,
+                    "context": [],
+                    "plan": plan,
                 }
+                hits.append(hit)
+            if window > 0:
+                self._attach_context(s, g, hits[: max(0, int(window_hits))], int(window))
+        with self._plan_lock:
+            self.plan_stats[plan] = self.plan_stats.get(plan, 0) + 1
+        return hits
+
+    @staticmethod
+    def _attach_context(s: Session, generation: int, hits: List[Dict[str, Any]], window: int) -> None:
+        """
+        Соседи (chunk_order ± window) для hits одним запросом — диапазоны всех попаданий через OR,
+        как окно в _with_documents, без запроса на каждое попадание.
+        """
+        if not hits:
+            return
+        conds: List[str] = []
+        params: Dict[str, Any] = {"g": int(generation)}
+        for i, h in enumerate(hits):
+            conds.append(f"(document_id = :d{i} AND chunk_order BETWEEN :lo{i} AND :hi{i})")
+            params.update({f"d{i}": h["document_id"], f"lo{i}": h["chunk_order"] - window, f"hi{i}": h["chunk_order"] + window})
+        rows = s.execute(
+            sqltext(
+                f"""
+                SELECT id, document_id, chunk_order, text FROM kb_chunks
+                WHERE generation = :g AND ({" OR ".join(conds)})
+                ORDER BY document_id, chunk_order
+                """
+            ),
+            params,
+        ).fetchall()
+        for h in hits:
+            h["context"] = [
+                (int(r[2]), r[3])
+                for r in rows
+                if int(r[1]) == h["document_id"]
+                and int(r[0]) != h["chunk_id"]
+                and abs(int(r[2]) - h["chunk_order"]) <= window
+            ]
+
+    def search_by_embedding(
+        self,
+        query_vector: Any,
+        *,
+        limit: int = 6,
+        document_ids: Sequence[int] | None = None,
+        exact: bool = False,
+        ef_search: int | None = None,
+        window: int = 0,
+        window_hits: int = 0,
+        route_docs: int = 0,
+    ) -> List[Dict[str, Any]]:
+        """
+        Поиск ближайших чанков активного поколения; score — косинусная близость по исходным векторам.
+
+        Без фильтра по документам и при наличии ANN-индекса поколения: индекс отдаёт limit * ann_candidates
+        кандидатов (бинарный — limit * ann_binary_candidates; ef_search / probes — SET LOCAL, только на эту
+        транзакцию), они пересортировываются точным расстоянием. С фильтром по документам — план
+        _plan_search, exact=True — точный перебор.
+
+        Каждый результат — с title / path / is_active документа, dup_of (чанк-оригинал почти-дубликата,
+        в поиске по документам диалога; см. retriever.collapse_copies) и context: [(chunk_order, text)]
+        соседей (window > 0, первые window_hits результатов), всё одним запросом.
+
+        С vector_store — точный поиск в хранилище (план numpy / numpy_scoped), строки и документы — из БД.
+
+        route_docs > 0 — двухуровневый поиск: если в document_ids документов больше route_docs, чанки ищутся
+        только в route_docs документах с ближайшими центроидами (_route_documents, план с префиксом route+).
+        Быстрее на диалогах с сотнями документов ценой recall: нужный чанк может оказаться в документе,
+        который в целом о другом.
+        """
+        if self.vectors is not None:
+            return self._search_vector_store(
+                query_vector,
+                limit=limit,
+                document_ids=document_ids,
+                window=window,
+                window_hits=window_hits,
+                route_docs=route_docs,
             )
-        return out
+        with self.sf() as s:
+            target = s.execute(sqltext(_SEARCH_TARGET_SQL)).first()
+            g = int(target[0]) if target and target[0] is not None else 1
+            routed = self._route_documents(s, g, query_vector, document_ids, route_docs)
+            if routed is not None:
+                document_ids = routed
+            sql, params, plan = self._vector_leg(
+                s, target, query_vector, limit=limit, document_ids=document_ids, exact=exact, ef_search=ef_search
+            )
+            sql = self._with_documents(sql, "score DESC", g, params, window=window, window_hits=window_hits)
+            rows = s.execute(sqltext(sql), params).fetchall()
+            if len(rows) < int(limit) and plan["plan"] in ("ann_filtered", "ann_iterative"):
+                # индекс не добрал строк из фильтра — дочитываем точным перебором в той же сессии
+                s.rollback()
+                sql, params, _ = self._vector_leg(
+                    s, target, query_vector, limit=limit, document_ids=document_ids, exact=True, ef_search=None
+                )
+                sql = self._with_documents(sql, "score DESC", g, params, window=window, window_hits=window_hits)
+                rows = s.execute(sqltext(sql), params).fetchall()
+                plan["plan"] += "+exact_scoped"
+        if routed is not None:
+            plan["plan"] = "route+" + plan["plan"]
+        log.debug("KB search plan: %s", plan)
+        return [{**self._hit_from_row(r), "plan": plan["plan"]} for r in rows]
+
+    def search_hybrid(
+        self,
+        query_vector: Any,
+        query_text: str,
+        *,
+        limit: int = 6,
+        candidates: int = 24,
+        rrf_k: int = 60,
+        vector_weight: float = 1.0,
+        lexical_weight: float = 1.0,
+        document_ids: Sequence[int] | None = None,
+        exact: bool = False,
+        ef_search: int | None = None,
+        window: int = 0,
+        window_hits: int = 0,
+        route_docs: int = 0,
+    ) -> List[Dict[str, Any]]:
+        """
+        Векторная и полнотекстовая выдачи (до candidates кандидатов каждая) и их слияние Reciprocal Rank
+        Fusion одним запросом: rrf = vector_weight / (rrf_k + vector_rank) + lexical_weight / (rrf_k + lexical_rank),
+        отсутствующий ранг даёт 0. RRF работает по местам, поэтому несравнимые шкалы (косинус и ts_rank_cd)
+        нормировать не нужно. Возвращает limit лучших по rrf; score — косинусная близость (считается и для
+        найденных только по тексту), vector_rank / lexical_rank — место в своей выдаче или None.
+        Документ и соседние чанки — как в search_by_embedding.
+
+        Полнотекстовая часть: слова запроса через ИЛИ (plainto_tsquery, '&' -> '|'), ранжирование
+        ts_rank_cd по хранимому text_tsv (учитывает близость слов: «артикул 12-345» рядом выше, чем
+        те же слова порознь); равный ts_rank_cd — равный lexical_rank. Ранжируются все совпавшие чанки,
+        так что слово, встречающееся почти везде, делает эту часть дороже (см. bench/hybrid_search.py).
+        Пока GIN-индекс по text_tsv не построен (и с vector_store, где его нет) — только векторная.
+        route_docs — как в search_by_embedding: обе выдачи ищут только в отобранных по центроидам документах.
+        """
+        if self.vectors is not None:
+            return self.search_by_embedding(
+                query_vector,
+                limit=limit,
+                document_ids=document_ids,
+                window=window,
+                window_hits=window_hits,
+                route_docs=route_docs,
+            )
+        with self.sf() as s:
+            target = s.execute(sqltext(_SEARCH_TARGET_SQL)).first()
+            g = int(target[0]) if target and target[0] is not None else 1
+            routed = self._route_documents(s, g, query_vector, document_ids, route_docs)
+            if routed is not None:
+                document_ids = routed
+            vec_sql, params, plan = self._vector_leg(
+                s, target, query_vector, limit=candidates, document_ids=document_ids, exact=exact, ef_search=ef_search
+            )
+            lexical = bool(target and target[3]) and bool((query_text or "").strip())
+
+            if lexical:
+                params.update({"qt": query_text, "lex_lim": int(candidates)})
+                lex_where = f"c.generation = {g} AND c.text_tsv @@ q.tsq"
+                if document_ids:
+                    params["ids"] = [int(x) for x in document_ids]
+                    lex_where += " AND c.document_id = ANY(:ids)"
+                else:
+                    lex_where += " AND c.dup_of IS NULL"
+                # группа равных ts_rank_cd, разрезанная LIMIT, порядка не несёт (слово есть почти везде):
+                # она отбрасывается целиком, иначе в выдачу попадали бы случайные её представители
+                lex_cte = f"""
+                    lex_top AS (
+                        SELECT c.id, ts_rank_cd(c.text_tsv, q.tsq) AS r
+                        FROM kb_chunks c,
+                             (SELECT replace(plainto_tsquery('{FTS_CONFIG}', :qt)::text, '&', '|')::tsquery AS tsq) q
+                        WHERE {lex_where}
+                        ORDER BY r DESC, c.id
+                        LIMIT :lex_lim + 1
+                    ),
+                    lex AS (
+                        SELECT id, rank() OVER (ORDER BY r DESC) AS lrank
+                        FROM lex_top
+                        WHERE (SELECT COUNT(*) FROM lex_top) <= :lex_lim OR r > (SELECT MIN(r) FROM lex_top)
+                    )
+                """
+            else:
+                lex_cte = "lex AS (SELECT NULL::int AS id, NULL::bigint AS lrank WHERE FALSE)"
+
+            params.update(
+                {"top": int(limit), "rk": max(1, int(rrf_k)), "wv": float(vector_weight), "wl": float(lexical_weight)}
+            )
+            fused = f"""
+                WITH vec AS MATERIALIZED ({vec_sql}),
+                vec_r AS (SELECT id, score, row_number() OVER (ORDER BY score DESC, id) AS vrank FROM vec),
+                {lex_cte},
+                fused AS (
+                    SELECT c.id, c.document_id, c.chunk_order, c.text, c.dup_of,
+                           COALESCE(v.score, 1 - (c.embedding <=> (:q)::vector)) AS score,
+                           v.vrank, l.lrank,
+                           COALESCE(CAST(:wv AS float8) / (:rk + v.vrank), 0)
+                             + COALESCE(CAST(:wl AS float8) / (:rk + l.lrank), 0) AS rrf
+                    FROM (SELECT id FROM vec UNION SELECT id FROM lex) u
+                    JOIN kb_chunks c ON c.id = u.id
+                    LEFT JOIN vec_r v ON v.id = u.id
+                    LEFT JOIN lex l ON l.id = u.id
+                )
+                SELECT * FROM fused ORDER BY rrf DESC, score DESC LIMIT :top
+            """
+            sql = self._with_documents(fused, "rrf DESC, score DESC", g, params, window=window, window_hits=window_hits)
+            rows = s.execute(sqltext(sql), params).fetchall()
+        if routed is not None:
+            plan["plan"] = "route+" + plan["plan"]
+        log.debug("KB hybrid search plan: %s", plan)
+        return [{**self._hit_from_row(r), "plan": plan["plan"]} for r in rows]
@@ -6,6 +6,7 @@ import logging
 from sqlalchemy import create_engine, event, text
 from sqlalchemy.engine import Engine
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
+from sqlalchemy.pool import StaticPool
 
 try:
     from pgvector.psycopg2 import register_vector  # type: ignore
@@ -39,7 +40,11 @@ def make_session_factory(database_url: str | None):
     Возвращает (session_factory, engine).
     """
     url = _normalize_db_url(database_url)
-    engine = create_engine(url, pool_pre_ping=True, future=True)
+    if url.startswith("sqlite") and ":memory:" in url:
+        # одна in-memory БД на процесс: у каждого соединения пула (потоки sync/бота) была бы своя пустая
+        engine = create_engine(url, future=True, poolclass=StaticPool, connect_args={"check_same_thread": False})
+    else:
+        engine = create_engine(url, pool_pre_ping=True, future=True)
 
     if register_vector is not None:
 
@@ -76,6 +81,71 @@ def reset_schema(engine: Engine) -> None:
     log.warning("DB RESET: done.")
 
 
+# индексы почти-дубликатов kb_chunks: полосы SimHash (KBRepo.SIMHASH_BAND_SQL) — только по оригиналам;
+# dup_of — для ON DELETE SET NULL (удаление чанка ищет его копии)
+_DEDUP_INDEXES = [
+    *(
+        f"CREATE INDEX IF NOT EXISTS ix_kb_chunks_simhash_b{j} ON kb_chunks (generation, {expr}) "
+        "WHERE dup_of IS NULL AND simhash IS NOT NULL"
+        for j, expr in enumerate(
+            ("(simhash & 65535)", "((simhash >> 16) & 65535)", "((simhash >> 32) & 65535)", "((simhash >> 48) & 65535)")
+        )
+    ),
+    "CREATE INDEX IF NOT EXISTS ix_kb_chunks_dup_of ON kb_chunks (dup_of) WHERE dup_of IS NOT NULL",
+]
+
+
+# Идемпотентные доработки существующих таблиц (create_all не добавляет колонки в старые таблицы).
+_PG_SCHEMA_PATCHES = [
+    "ALTER TABLE kb_chunks ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    # поколения индекса: существующие чанки — поколение 1, оно же активное
+    "ALTER TABLE kb_chunks ADD COLUMN IF NOT EXISTS generation INTEGER NOT NULL DEFAULT 1",
+    "CREATE INDEX IF NOT EXISTS ix_kb_chunks_generation_document_order ON kb_chunks (generation, document_id, chunk_order)",
+    "INSERT INTO kb_generations (id, status, activated_at) "
+    "SELECT 1, 'active', NOW() WHERE NOT EXISTS (SELECT 1 FROM kb_generations)",
+    "SELECT setval(pg_get_serial_sequence('kb_generations', 'id'), (SELECT MAX(id) FROM kb_generations))",
+    # профиль индекса: размерность векторов задаёт поколение, колонка — без фиксированной размерности
+    "ALTER TABLE kb_generations ADD COLUMN IF NOT EXISTS embedding_dims INTEGER",
+    "ALTER TABLE kb_generations ADD COLUMN IF NOT EXISTS metric VARCHAR",
+    "DO $$ BEGIN "
+    "IF EXISTS (SELECT 1 FROM pg_attribute WHERE attrelid = 'kb_chunks'::regclass "
+    "AND attname = 'embedding' AND atttypmod <> -1) THEN "
+    "ALTER TABLE kb_chunks ALTER COLUMN embedding TYPE vector; "
+    "END IF; END $$",
+    # полнотекстовый поиск: tsvector хранится (ранжирование не разбирает текст заново), заполняет триггер —
+    # он срабатывает и на COPY. Старые строки дозаполняет KBRepo.backfill_fts, GIN-индекс — KBRepo.ensure_fts_index
+    "ALTER TABLE kb_chunks ADD COLUMN IF NOT EXISTS text_tsv tsvector",
+    "CREATE OR REPLACE FUNCTION kb_chunks_tsv() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+    "IF NEW.text_tsv IS NULL OR (TG_OP = 'UPDATE' AND NEW.text IS DISTINCT FROM OLD.text) THEN "
+    "NEW.text_tsv := to_tsvector('russian', COALESCE(NEW.text, '')); "
+    "END IF; RETURN NEW; END $$",
+    "DO $$ BEGIN "
+    "IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'kb_chunks_tsv' AND tgrelid = 'kb_chunks'::regclass) THEN "
+    "CREATE TRIGGER kb_chunks_tsv BEFORE INSERT OR UPDATE OF text ON kb_chunks "
+    "FOR EACH ROW EXECUTE FUNCTION kb_chunks_tsv(); "
+    "END IF; END $$",
+    # соседние чанки для контекстного окна (KBRepo._with_documents) — по тому же индексу; старый (generation, document_id)
+    # покрывается его префиксом
+    "DROP INDEX IF EXISTS ix_kb_chunks_generation_document",
+    "ALTER TABLE kb_generations ADD COLUMN IF NOT EXISTS chunker VARCHAR",
+    # почти-дубликаты (app.kb.dedup): подпись, ссылка на оригинал, индексы полос подписи для поиска кандидатов
+    "ALTER TABLE kb_chunks ADD COLUMN IF NOT EXISTS simhash BIGINT",
+    "ALTER TABLE kb_chunks ADD COLUMN IF NOT EXISTS dup_of INTEGER REFERENCES kb_chunks(id) ON DELETE SET NULL",
+    *_DEDUP_INDEXES,
+]
+
+
+# то же для SQLite (dev-режим без DATABASE_URL): таблицы свежие, нужно только активное поколение 1
+_SQLITE_SCHEMA_PATCHES = [
+    "INSERT INTO kb_generations (id, status, activated_at) "
+    "SELECT 1, 'active', CURRENT_TIMESTAMP WHERE NOT EXISTS (SELECT 1 FROM kb_generations)",
+    *_DEDUP_INDEXES,
+    # внешние ключи SQLite не проверяет (PRAGMA foreign_keys выключен) — ON DELETE SET NULL триггером
+    "CREATE TRIGGER IF NOT EXISTS kb_chunks_dup_release AFTER DELETE ON kb_chunks "
+    "BEGIN UPDATE kb_chunks SET dup_of = NULL WHERE dup_of = OLD.id; END",
+]
+
+
 def ensure_schema(engine: Engine) -> None:
     """
     Мягкая инициализация: создаёт таблицы, если их нет. Данные не трогает.
@@ -89,3 +159,16 @@ def ensure_schema(engine: Engine) -> None:
         log.info("pgvector extension not ensured (ok): %s", e)
 
     ModelsBase.metadata.create_all(bind=engine)
+
+    if engine.dialect.name == "postgresql":
+        patches = _PG_SCHEMA_PATCHES
+    elif engine.dialect.name == "sqlite":
+        patches = _SQLITE_SCHEMA_PATCHES
+    else:
+        return
+    for stmt in patches:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(stmt))
+        except Exception as e:
+            log.warning("schema patch failed: %s (%s)", stmt, e)
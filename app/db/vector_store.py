@@ -0,0 +1,463 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+import struct
+import threading
+from typing import Any, Dict, List, Optional, Protocol, Sequence, Tuple
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class VectorStore(Protocol):
+    """
+    Внешнее хранилище векторов чанков для KBRepo (вместо колонки kb_chunks.embedding и pgvector).
+
+    Тексты, документы и поколения остаются в БД; хранилище знает только (поколение, chunk_id, document_id,
+    вектор). KBRepo пишет в него после commit транзакции с чанками, поиск возвращает
+    (chunk_id, document_id, score) — score, как у pgvector, косинусная близость.
+    """
+
+    name: str
+
+    def add(self, generation: int, chunk_ids: Sequence[int], document_ids: Sequence[int], vectors: Sequence[Any]) -> None: ...
+
+    def get(self, generation: int, chunk_ids: Sequence[int]) -> Dict[int, Any]: ...
+
+    def delete(
+        self,
+        *,
+        generation: int | None = None,
+        chunk_ids: Sequence[int] | None = None,
+        document_ids: Sequence[int] | None = None,
+    ) -> int: ...
+
+    def retain(self, generation: int, chunk_ids: Sequence[int]) -> int: ...
+
+    def generations(self) -> List[int]: ...
+
+    def drop_generation(self, generation: int) -> None: ...
+
+    def search(
+        self,
+        generation: int,
+        query_vector: Any,
+        *,
+        limit: int,
+        document_ids: Sequence[int] | None = None,
+        candidates: int = 0,
+    ) -> List[Tuple[int, int, float]]: ...
+
+    def stats(self) -> Dict[str, Any]: ...
+
+
+_DIMS_HEADER = struct.Struct("<i")
+
+
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def sign_bits(vectors: np.ndarray) -> np.ndarray:
+    """
+    Бинарное квантование (как binary_quantize в pgvector): бит 1 там, где координата > 0, упакованные
+    в uint64 (rows, ceil(dims / 64)); хвост последнего слова — нули и у строк, и у запроса.
+    """
+    v = np.asarray(vectors)
+    packed = np.packbits(v > 0, axis=1)
+    pad = -packed.shape[1] % 8
+    if pad:
+        packed = np.pad(packed, ((0, 0), (0, pad)))
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+
+def hamming(bits: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """Расстояние Хэмминга от каждой строки bits до q (popcount XOR; numpy >= 2 — bitwise_count)."""
+    x = bits ^ q
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT8[x.view(np.uint8)].sum(axis=1, dtype=np.int32)
+
+
+def _unit_rows(vectors: Any) -> np.ndarray:
+    v = np.asarray(vectors, dtype=np.float32)
+    if v.ndim == 1:
+        v = v.reshape(1, -1)
+    norms = np.linalg.norm(v, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(v / norms, dtype=np.float32)
+
+
+class _Generation:
+    """
+    Векторы одного поколения в каталоге хранилища, «эпоха» e — номер последнего уплотнения:
+      g<N>-<e>.npy        — float32 (rows, dims), единичные векторы, memmap только на чтение;
+      g<N>-<e>.ids.npy    — int64 (rows, 2): chunk_id, document_id; удалённая строка — document_id = -1;
+      g<N>-<e>.bits.npy   — знаковые биты векторов (sign_bits), читаются в память целиком: 1/32 от .npy;
+      g<N>-<e>.tail.f32   — добавленные после уплотнения: int32 dims, затем строки float32 подряд;
+      g<N>-<e>.tail.ids   — их (chunk_id, document_id) int64.
+    Уплотнение пишет эпоху e+1 целиком (через .tmp и rename) и только потом удаляет файлы эпохи e,
+    поэтому после сбоя на диске всегда есть полная эпоха: при открытии берётся старшая полная.
+    """
+
+    def __init__(self, root: str, generation: int):
+        self.root = root
+        self.generation = int(generation)
+        self.epoch = 0
+        self.dims = 0
+        self.vec: Optional[np.ndarray] = None
+        self.ids: Optional[np.ndarray] = None
+        self.tail_vec: Optional[np.ndarray] = None
+        self.tail_ids: Optional[np.ndarray] = None
+        self.bits: Optional[np.ndarray] = None
+        self.tail_bits: Optional[np.ndarray] = None
+        self.dead = 0
+        self._load()
+
+    # ---- файлы ----
+    def _path(self, suffix: str, epoch: int | None = None) -> str:
+        return os.path.join(self.root, f"g{self.generation}-{self.epoch if epoch is None else epoch}.{suffix}")
+
+    def files(self) -> List[str]:
+        pat = re.compile(rf"^g{self.generation}-\d+\.")
+        return [os.path.join(self.root, f) for f in os.listdir(self.root) if pat.match(f)]
+
+    def _load(self) -> None:
+        pat = re.compile(rf"^g{self.generation}-(\d+)\.(npy|ids\.npy|bits\.npy|tail\.f32|tail\.ids)$")
+        present: Dict[int, set] = {}
+        for f in os.listdir(self.root):
+            m = pat.match(f)
+            if m:
+                present.setdefault(int(m.group(1)), set()).add(m.group(2))
+        complete = [e for e, kinds in present.items() if e == 0 or {"npy", "ids.npy"} <= kinds]
+        self.epoch = max(complete, default=0)
+        for f in self.files():
+            if not os.path.basename(f).startswith(f"g{self.generation}-{self.epoch}."):
+                os.remove(f)  # прежние эпохи и недописанное уплотнение
+
+        if os.path.exists(self._path("npy")):
+            self.vec = np.load(self._path("npy"), mmap_mode="r")
+            self.ids = np.load(self._path("ids.npy"), mmap_mode="r+")
+            if self.vec.shape[0] != self.ids.shape[0]:
+                raise ValueError(f"vector store generation {self.generation}: vectors/ids size mismatch")
+            self.dims = int(self.vec.shape[1])
+        self._open_tail()
+        self.dead = sum(int((ids[:, 1] < 0).sum()) for _, ids in self.parts())
+
+    def _open_tail(self) -> None:
+        self.tail_vec = self.tail_ids = None
+        if self.tail_bits is not None and not os.path.exists(self._path("tail.f32")):
+            self.tail_bits = None
+        vpath, ipath = self._path("tail.f32"), self._path("tail.ids")
+        if not os.path.exists(vpath) or os.path.getsize(vpath) < _DIMS_HEADER.size:
+            return
+        with open(vpath, "rb") as f:
+            dims = _DIMS_HEADER.unpack(f.read(_DIMS_HEADER.size))[0]
+        if self.dims and dims != self.dims:
+            raise ValueError(f"vector store generation {self.generation}: tail has {dims} dims, expected {self.dims}")
+        self.dims = dims
+        ids_size = os.path.getsize(ipath) if os.path.exists(ipath) else 0
+        rows = min((os.path.getsize(vpath) - _DIMS_HEADER.size) // (4 * dims), ids_size // 16)
+        # оборванная дозапись (сбой между файлами) — обрезаем до общей длины
+        os.truncate(vpath, _DIMS_HEADER.size + rows * 4 * dims)
+        if os.path.exists(ipath):
+            os.truncate(ipath, rows * 16)
+        if rows:
+            self.tail_vec = np.memmap(vpath, dtype=np.float32, mode="r", offset=_DIMS_HEADER.size, shape=(rows, dims))
+            self.tail_ids = np.memmap(ipath, dtype=np.int64, mode="r+", shape=(rows, 2))
+
+    # ---- данные ----
+    def part_bits(self) -> List[np.ndarray]:
+        """Знаковые биты, параллельно parts(): основной файл — из .bits.npy (или считаются и сохраняются), хвост — дописываются."""
+        out = []
+        if self.vec is not None and self.vec.shape[0]:
+            if self.bits is None or self.bits.shape[0] != self.vec.shape[0]:
+                path = self._path("bits.npy")
+                bits = np.load(path) if os.path.exists(path) else None
+                if bits is None or bits.shape[0] != self.vec.shape[0]:
+                    bits = np.concatenate([sign_bits(self.vec[i : i + 16384]) for i in range(0, self.vec.shape[0], 16384)])
+                    np.save(path + ".tmp.npy", bits)
+                    os.replace(path + ".tmp.npy", path)
+                self.bits = bits
+            out.append(self.bits)
+        if self.tail_vec is not None:
+            have = 0 if self.tail_bits is None else self.tail_bits.shape[0]
+            if have < self.tail_vec.shape[0]:
+                new = sign_bits(self.tail_vec[have:])
+                self.tail_bits = new if self.tail_bits is None else np.concatenate([self.tail_bits, new])
+            out.append(self.tail_bits[: self.tail_vec.shape[0]])
+        return out
+
+    def parts(self) -> List[Tuple[np.ndarray, np.ndarray]]:
+        out = []
+        if self.vec is not None and self.vec.shape[0]:
+            out.append((self.vec, self.ids))
+        if self.tail_vec is not None:
+            out.append((self.tail_vec, self.tail_ids))
+        return out
+
+    @property
+    def main_rows(self) -> int:
+        return 0 if self.vec is None else int(self.vec.shape[0])
+
+    @property
+    def tail_rows(self) -> int:
+        return 0 if self.tail_vec is None else int(self.tail_vec.shape[0])
+
+    @property
+    def rows(self) -> int:
+        return self.main_rows + self.tail_rows - self.dead
+
+    def append(self, ids: np.ndarray, vec: np.ndarray) -> None:
+        if not self.dims:
+            self.dims = int(vec.shape[1])
+        if vec.shape[1] != self.dims:
+            raise ValueError(f"vector store generation {self.generation}: got {vec.shape[1]} dims, expected {self.dims}")
+        vpath = self._path("tail.f32")
+        new = not os.path.exists(vpath)
+        # сначала векторы, потом ids: при открытии хвост обрезается по более короткому
+        with open(vpath, "ab") as f:
+            if new:
+                f.write(_DIMS_HEADER.pack(self.dims))
+            f.write(vec.tobytes())
+        with open(self._path("tail.ids"), "ab") as f:
+            f.write(np.ascontiguousarray(ids, dtype=np.int64).tobytes())
+        self._open_tail()
+
+    def tombstone(self, mask_fn) -> int:
+        n = 0
+        for _, ids in self.parts():
+            mask = mask_fn(ids) & (ids[:, 1] >= 0)
+            k = int(mask.sum())
+            if k:
+                ids[mask, 1] = -1
+                ids.flush()
+                n += k
+        self.dead += n
+        return n
+
+    def compact(self) -> None:
+        """Новая эпоха: живые строки основного файла и хвоста в один .npy (блоками, без копии в памяти)."""
+        parts = self.parts()
+        alive = [np.flatnonzero(ids[:, 1] >= 0) for _, ids in parts]
+        total = sum(len(a) for a in alive)
+        e = self.epoch + 1
+        vtmp, itmp = self._path("npy.tmp", e), self._path("ids.npy.tmp", e)
+        vec = np.lib.format.open_memmap(vtmp, mode="w+", dtype=np.float32, shape=(total, self.dims))
+        ids = np.lib.format.open_memmap(itmp, mode="w+", dtype=np.int64, shape=(total, 2))
+        bits = np.zeros((total, (self.dims + 63) // 64), dtype=np.uint64)
+        pos, block = 0, 16384
+        for (pvec, pids), idx in zip(parts, alive):
+            for i in range(0, len(idx), block):
+                sel = idx[i : i + block]
+                rows = pvec[sel]
+                vec[pos : pos + len(sel)] = rows
+                ids[pos : pos + len(sel)] = pids[sel]
+                bits[pos : pos + len(sel)] = sign_bits(rows)
+                pos += len(sel)
+        vec.flush()
+        ids.flush()
+        del vec, ids
+        # биты — до .npy: эпоха считается полной по .npy + .ids.npy, и тогда её биты уже на месте
+        np.save(self._path("bits.npy.tmp.npy", e), bits)
+        os.replace(self._path("bits.npy.tmp.npy", e), self._path("bits.npy", e))
+        os.replace(vtmp, self._path("npy", e))
+        os.replace(itmp, self._path("ids.npy", e))
+        old = [f for f in self.files() if os.path.basename(f).startswith(f"g{self.generation}-{self.epoch}.")]
+        self.epoch = e
+        self.vec = np.load(self._path("npy"), mmap_mode="r")
+        self.ids = np.load(self._path("ids.npy"), mmap_mode="r+")
+        self.tail_vec = self.tail_ids = self.tail_bits = None
+        self.bits = bits
+        self.dead = 0
+        for f in old:
+            os.remove(f)
+
+
+class NumpyVectorStore:
+    """
+    Векторы в memmap-файлах .npy (по поколению) и точный поиск перебором: матрица единичных float32
+    умножается на запрос (BLAS), top-k — argpartition. Фильтр по документам — маска по document_id,
+    скоринг только отобранных строк. Для SQLite/dev-режима и небольших баз без pgvector: 200k x 1024
+    перебираются за десятки миллисекунд (bench/vector_store.py).
+
+    binary=True — двухэтапный поиск: знаковые биты векторов (1/32 объёма) держатся в памяти, Хэмминг
+    отбирает кандидатов, точный косинус — только по ним (bench/binary_search.py).
+
+    Запись: дозапись в хвост (append-only файлы), удаление — пометка строки; когда хвост или удалённые
+    превышают compact_ratio от основного файла, поколение уплотняется в новый .npy.
+    Один процесс-писатель на каталог; чтение идёт параллельно записи (снимок массивов под lock).
+    """
+
+    name = "numpy"
+
+    def __init__(self, root: str, *, binary: bool = False, compact_ratio: float = 0.25, compact_min_rows: int = 4096):
+        self.root = root
+        self.binary = bool(binary)
+        self.compact_ratio = max(0.01, float(compact_ratio))
+        self.compact_min_rows = max(1, int(compact_min_rows))
+        self._lock = threading.RLock()
+        self._gens: Dict[int, _Generation] = {}
+        os.makedirs(root, exist_ok=True)
+        # отрицательные поколения — припаркованные векторы неактивных документов (KBRepo._park_chunks)
+        for g in sorted({int(m.group(1)) for m in (re.match(r"^g(-?\d+)-\d+\.", f) for f in os.listdir(root)) if m}):
+            self._gens[g] = _Generation(root, g)
+
+    def _gen(self, generation: int, *, create: bool = False) -> Optional[_Generation]:
+        g = int(generation)
+        seg = self._gens.get(g)
+        if seg is None and create:
+            seg = self._gens[g] = _Generation(self.root, g)
+        return seg
+
+    def _maybe_compact(self, seg: _Generation) -> None:
+        limit = max(self.compact_min_rows, self.compact_ratio * seg.main_rows)
+        if seg.tail_rows > limit or seg.dead > limit:
+            seg.compact()
+
+    def add(self, generation: int, chunk_ids: Sequence[int], document_ids: Sequence[int], vectors: Sequence[Any]) -> None:
+        """Повторно добавленный chunk_id заменяет прежний вектор."""
+        if not len(chunk_ids):
+            return
+        ids = np.column_stack([np.asarray(chunk_ids, dtype=np.int64), np.asarray(document_ids, dtype=np.int64)])
+        vec = _unit_rows(vectors)
+        if vec.shape[0] != ids.shape[0]:
+            raise ValueError("chunk_ids and vectors differ in length")
+        with self._lock:
+            seg = self._gen(generation, create=True)
+            if seg.rows:
+                seg.tombstone(lambda a: np.isin(a[:, 0], ids[:, 0]))
+            seg.append(ids, vec)
+            self._maybe_compact(seg)
+
+    def get(self, generation: int, chunk_ids: Sequence[int]) -> Dict[int, Any]:
+        with self._lock:
+            seg = self._gen(generation)
+            parts = seg.parts() if seg else []
+        want = np.asarray(list(chunk_ids), dtype=np.int64)
+        out: Dict[int, Any] = {}
+        for vec, ids in parts:
+            idx = np.flatnonzero(np.isin(ids[:, 0], want) & (ids[:, 1] >= 0))
+            for i in idx:
+                out[int(ids[i, 0])] = np.array(vec[i])
+        return out
+
+    def delete(
+        self,
+        *,
+        generation: int | None = None,
+        chunk_ids: Sequence[int] | None = None,
+        document_ids: Sequence[int] | None = None,
+    ) -> int:
+        """Помечает удалёнными строки с chunk_ids или document_ids (в поколении или во всех)."""
+        cids = np.asarray(list(chunk_ids or []), dtype=np.int64)
+        dids = np.asarray(list(document_ids or []), dtype=np.int64)
+        if not len(cids) and not len(dids):
+            return 0
+
+        def mask(ids: np.ndarray) -> np.ndarray:
+            m = np.isin(ids[:, 0], cids) if len(cids) else np.zeros(len(ids), dtype=bool)
+            return (m | np.isin(ids[:, 1], dids)) if len(dids) else m
+
+        n = 0
+        with self._lock:
+            gens = [self._gen(generation)] if generation is not None else list(self._gens.values())
+            for seg in gens:
+                if seg is not None:
+                    n += seg.tombstone(mask)
+                    self._maybe_compact(seg)
+        return n
+
+    def retain(self, generation: int, chunk_ids: Sequence[int]) -> int:
+        """Помечает удалёнными строки поколения, которых нет в chunk_ids (сверка с kb_chunks)."""
+        keep = np.asarray(list(chunk_ids), dtype=np.int64)
+        with self._lock:
+            seg = self._gen(generation)
+            if seg is None:
+                return 0
+            n = seg.tombstone(lambda a: ~np.isin(a[:, 0], keep))
+            self._maybe_compact(seg)
+        return n
+
+    def generations(self) -> List[int]:
+        with self._lock:
+            return sorted(self._gens)
+
+    def drop_generation(self, generation: int) -> None:
+        with self._lock:
+            seg = self._gens.pop(int(generation), None)
+            if seg is not None:
+                for f in seg.files():
+                    os.remove(f)
+
+    def search(
+        self,
+        generation: int,
+        query_vector: Any,
+        *,
+        limit: int,
+        document_ids: Sequence[int] | None = None,
+        candidates: int = 0,
+    ) -> List[Tuple[int, int, float]]:
+        """
+        (chunk_id, document_id, score) по убыванию score — top-limit по косинусной близости.
+
+        binary и candidates > limit — двухэтапный поиск: грубый проход по знаковым битам (Хэмминг, в 32 раза
+        меньше данных, без чтения .npy) отбирает candidates строк, точный косинус считается только для них.
+        Иначе (и если строк в фильтре не больше candidates) — точный перебор.
+        """
+        limit = max(1, int(limit))
+        coarse = self.binary and int(candidates) > limit
+        with self._lock:
+            seg = self._gen(generation)
+            if seg is None:
+                return []
+            parts, dead, dims = seg.parts(), seg.dead, seg.dims
+            bits = seg.part_bits() if coarse else [None] * len(parts)
+        q = _unit_rows(query_vector)[0]
+        if q.shape[0] != dims:
+            raise ValueError(f"query has {q.shape[0]} dims, generation {int(generation)} has {dims}")
+        qbits = sign_bits(q.reshape(1, -1))[0] if coarse else None
+        scope = np.asarray(sorted({int(x) for x in document_ids}), dtype=np.int64) if document_ids else None
+
+        found_s, found_ids = [], []
+        for (vec, ids), pbits in zip(parts, bits):
+            idx = np.flatnonzero(np.isin(ids[:, 1], scope)) if scope is not None else None
+            n = ids.shape[0] if idx is None else len(idx)
+            if not n:
+                continue
+            if coarse and n > int(candidates):
+                dist = hamming(pbits if idx is None else pbits[idx], qbits)
+                if idx is None and dead:
+                    dist[ids[:, 1] < 0] = np.iinfo(np.int32).max
+                top = np.argpartition(dist, int(candidates) - 1)[: int(candidates)]
+                # по возрастанию номера строки: чтение memmap идёт вперёд, а не вразброс
+                idx = np.sort(top if idx is None else idx[top])
+            if idx is None:
+                scores = vec @ q
+                if dead:
+                    scores[ids[:, 1] < 0] = -np.inf
+            else:
+                scores = vec[idx] @ q
+                scores[ids[idx, 1] < 0] = -np.inf
+            k = min(limit, scores.shape[0])
+            top = np.argpartition(-scores, k - 1)[:k] if scores.shape[0] > k else np.arange(scores.shape[0])
+            found_s.append(scores[top])
+            found_ids.append(np.asarray(ids[top if idx is None else idx[top]]))
+        if not found_s:
+            return []
+        scores, ids = np.concatenate(found_s), np.concatenate(found_ids)
+        order = np.argsort(-scores, kind="stable")[:limit]
+        return [(int(ids[i, 0]), int(ids[i, 1]), float(scores[i])) for i in order if np.isfinite(scores[i])]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            gens = list(self._gens.values())
+        size = sum(os.path.getsize(f) for seg in gens for f in seg.files())
+        return {
+            "vector_store": self.name,
+            "vector_store_rows": {seg.generation: seg.rows for seg in gens},
+            "vector_store_mb": round(size / 1024 / 1024, 1),
+        }
@@ -35,6 +35,9 @@ HELP = """База знаний (встроена в диалоги)
 
 Админ (если настроен syncer):
 /kb scan | /kb sync | /kb status
+/kb rebuild         — полная переиндексация в новом поколении (поиск работает по старому до переключения)
+/kb rechunk         — то же из кэша извлечённого текста, без скачивания с Диска (после смены нарезки/модели)
+/kb gc              — удалить чанки документов, удалённых с Диска или с ошибкой индексации (дольше KB_GC_GRACE_SEC)
 """
 
 
@@ -202,7 +205,7 @@ async def kb_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         return
 
     # --- admin: scan/sync/status (if syncer exists) ---
-    if sub in ("scan", "sync", "status"):
+    if sub in ("scan", "sync", "rebuild", "rechunk", "status", "gc"):
         if az and not az.is_admin(update.effective_user.id):
             await update.effective_message.reply_text("⛔ Только для админов.")
             return
@@ -226,9 +229,19 @@ async def kb_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
                 )
                 return
 
-            if sub == "sync":
+            if sub == "gc":
+                loop = asyncio.get_running_loop()
+                res = await loop.run_in_executor(None, syncer.gc_documents)
+                await update.effective_message.reply_text(
+                    f"KB gc: документов={res.get('documents', 0)} чанков={res.get('chunks', 0)} "
+                    f"освобождено≈{res.get('bytes', 0) / 2**20:.1f} MB VACUUM={'да' if res.get('vacuum') else 'нет'}"
+                )
+                return
+
+            if sub in ("sync", "rebuild", "rechunk"):
+                op = f"KB {sub}"
                 # 1) Сразу отвечаем + прогресс будем редактировать это сообщение
-                msg = await update.effective_message.reply_text("KB sync: стартовал… (это может занять несколько минут)")
+                msg = await update.effective_message.reply_text(f"{op}: стартовал… (это может занять несколько минут)")
 
                 loop = asyncio.get_running_loop()
                 start_ts = time.time()
@@ -248,13 +261,30 @@ async def kb_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
                 def progress_cb(processed: int, total: int, path: str, ok: int, fail: int) -> None:
                     elapsed = int(time.time() - start_ts)
                     name = _short_name(path) if path and path != "<done>" else ""
-                    line = f"KB sync: {processed}/{total} | ok={ok} fail={fail} | {elapsed}s"
+                    line = f"{op}: {processed}/{total} | ok={ok} fail={fail} | {elapsed}s"
                     if name:
                         line += f"\n{ name }"
                     # вызываем edit из thread-safe контекста
                     asyncio.run_coroutine_threadsafe(_safe_edit(line), loop)
 
                 # 2) НЕ блокируем обработку апдейтов: запускаем sync в executor
+                if sub in ("rebuild", "rechunk"):
+                    run = syncer.rebuild if sub == "rebuild" else syncer.rechunk
+                    res = await loop.run_in_executor(None, lambda: run(progress_cb=progress_cb))
+                    elapsed = int(time.time() - start_ts)
+                    final = (
+                        f"{op}: ✅ готово за {elapsed}s\n"
+                        f"- generation: {res.get('previous')} → {res.get('generation')}\n"
+                        f"- ok: {res.get('ok')}\n"
+                        f"- fail: {res.get('fail')} (перенесено чанков из старого поколения: {res.get('carried_over_chunks')})\n"
+                        f"- удалено чанков старого поколения: {res.get('gc_deleted_chunks')}\n"
+                        f"- ANN-индекс: {res.get('ann_index') or 'нет (точный поиск)'}"
+                    )
+                    if sub == "rechunk":
+                        final += f"\n- из кэша текста: {res.get('from_text_cache')}, скачано с Диска: {res.get('downloaded')}"
+                    await _safe_edit(final)
+                    return
+
                 def _run_sync():
                     return syncer.sync(progress_cb=progress_cb)
 
@@ -269,6 +299,15 @@ async def kb_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
                     f"- new: {len(rep.new)}\n"
                     f"- outdated: {len(rep.outdated)}"
                 )
+                stats = getattr(syncer, "last_sync_stats", None) or {}
+                if stats:
+                    final += f"\n- speed: {stats.get('docs_per_sec')} docs/s ({stats.get('mode')})"
+                    saved = stats.get("dup_tokens_saved", 0) + stats.get("boilerplate_tokens", 0)
+                    if saved or stats.get("dup_chunks"):
+                        final += (
+                            f"\n- dedup: {stats.get('dup_chunks', 0)} чанков-копий, "
+                            f"{stats.get('boilerplate_lines', 0)} строк колонтитулов, −{saved} токенов embeddings"
+                        )
                 await _safe_edit(final)
                 return
 
@@ -65,11 +65,13 @@ async def _handle_web_search(update: Update, context: ContextTypes.DEFAULT_TYPE,
 def _format_kb_context(results: List[RetrievedChunk]) -> str:
     parts: List[str] = []
     for r in results:
-        title = r.get("title") or r.get("source") or "Документ"
-        path = r.get("path") or ""
-        score = r.get("score")
-        text = r.get("text") or ""
+        title = r.document_title or "Документ"
+        path = r.document_path or ""
+        score = r.score
+        text = r.text or ""
         hdr = f"- [{title}] {path}"
+        if r.span and r.span[1] > r.span[0]:
+            hdr += f" #{r.span[0] + 1}-{r.span[1] + 1}"
         if score is not None:
             try:
                 hdr += f" (score={float(score):.3f})"
@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+try:
+    import numpy as np  # зависимость pgvector
+except Exception:
+    np = None
+
+from app.core.utils import count_tokens_batch
+from app.db.repo_kb import KBRepo
+from app.kb.embedding_cache import normalize_chunk_text
+
+log = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_NUM_RE = re.compile(r"\d+")
+
+SIMHASH_BITS = 64
+# 64 бита = 4 полосы по 16: у подписей на расстоянии Хэмминга <= 3 хотя бы одна полоса совпадает целиком,
+# поэтому кандидаты ищутся равенством полос по индексам (KBRepo.find_near_duplicates)
+SIMHASH_BANDS = 4
+MAX_DISTANCE = SIMHASH_BANDS - 1
+
+
+# -----------------------------
+# Колонтитулы: строки, повторяющиеся на большинстве страниц документа
+# -----------------------------
+def _line_key(line: str) -> str:
+    # номера страниц и даты в колонтитулах меняются от страницы к странице
+    return _NUM_RE.sub("#", " ".join(line.lower().split()))
+
+
+def strip_boilerplate(
+    pages: Iterable[str],
+    *,
+    sample: int = 12,
+    min_pages: int = 3,
+    min_share: float = 0.6,
+    max_line: int = 200,
+    stats: Optional[Dict[str, int]] = None,
+) -> Iterator[str]:
+    """
+    Постранично (PDF) убирает колонтитулы и повторяющийся юридический текст: строки (до max_line символов,
+    цифры не различаются — «Стр. 3 из 10»), которые встречаются на доле страниц >= min_share из первых
+    sample страниц. В памяти — только эти sample страниц; документ короче min_pages страниц не трогается.
+    stats (если передан) получает documents / lines / tokens — сколько убрано.
+    """
+    it = iter(pages)
+    head: List[str] = []
+    for p in it:
+        head.append(p)
+        if len(head) >= sample:
+            break
+
+    drop: set[str] = set()
+    if len(head) >= min_pages:
+        seen: Counter[str] = Counter()
+        for p in head:
+            seen.update({_line_key(ln) for ln in p.splitlines() if ln.strip() and len(ln.strip()) <= max_line})
+        need = max(2, int(len(head) * min_share + 0.999))
+        drop = {k for k, n in seen.items() if n >= need}
+
+    def clean(page: str) -> str:
+        if not drop:
+            return page
+        kept: List[str] = []
+        dropped: List[str] = []
+        for ln in page.splitlines():
+            if ln.strip() and len(ln.strip()) <= max_line and _line_key(ln) in drop:
+                dropped.append(ln)
+                continue
+            kept.append(ln)
+        if stats is not None and dropped:
+            stats["lines"] = stats.get("lines", 0) + len(dropped)
+            stats["tokens"] = stats.get("tokens", 0) + count_tokens_batch(["\n".join(dropped)])[0][0]
+        return "\n".join(kept).strip()
+
+    for p in head:
+        yield clean(p)
+    for p in it:
+        yield clean(p)
+    if stats is not None and drop:
+        stats["documents"] = stats.get("documents", 0) + 1
+
+
+# -----------------------------
+# SimHash чанков
+# -----------------------------
+def simhash(text: str) -> int:
+    """
+    64-битный SimHash нормализованного текста по словным биграммам (порядок слов учитывается, мелкие правки
+    меняют несколько бит). Знаковое int64 — как в kb_chunks.simhash (BIGINT).
+    """
+    words = _WORD_RE.findall(normalize_chunk_text(text).lower())
+    feats = Counter(zip(words, words[1:])) if len(words) > 1 else Counter((w, "") for w in words)
+    if not feats:
+        return 0
+    hashes = [hashlib.blake2b(f"{a} {b}".encode("utf-8"), digest_size=8).digest() for a, b in feats]
+    if np is not None:
+        bits = np.unpackbits(np.frombuffer(b"".join(hashes), dtype=np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+        acc = np.asarray(list(feats.values()), dtype=np.int64) @ (bits.astype(np.int64) * 2 - 1)
+        v = int(np.packbits(acc > 0, bitorder="little").view("<u8")[0])
+    else:
+        acc = [0] * SIMHASH_BITS
+        for h, n in zip(hashes, feats.values()):
+            x = int.from_bytes(h, "little")
+            for i in range(SIMHASH_BITS):
+                acc[i] += n if (x >> i) & 1 else -n
+        v = sum(1 << i for i in range(SIMHASH_BITS) if acc[i] > 0)
+    return v - (1 << 64) if v >= 1 << 63 else v
+
+
+def hamming(a: int, b: int) -> int:
+    return bin((a ^ b) & ((1 << 64) - 1)).count("1")
+
+
+def simhash_bands(sig: int) -> List[int]:
+    """Полосы подписи по 16 бит, младшая первая — те же выражения, что в индексах ix_kb_chunks_simhash_b*."""
+    return [(sig >> (16 * i)) & 0xFFFF for i in range(SIMHASH_BANDS)]
+
+
+def same_numbers(a: str, b: str) -> bool:
+    # версии шаблона с другими суммами/датами/номерами — разные документы, а не копии
+    return _NUM_RE.findall(a) == _NUM_RE.findall(b)
+
+
+class ChunkDeduper:
+    """
+    Индекс почти-дубликатов чанков по всей БЗ: SimHash каждого нового чанка (kb_chunks.simhash) сравнивается
+    с подписями уже сохранённых чанков поколения в других документах. Найденная копия (расстояние Хэмминга
+    <= max_distance и те же числа в тексте) не отправляется в embeddings: строка пишется с вектором
+    оригинала и ссылкой dup_of на него. Поиск по всей БЗ такие строки пропускает (копии не занимают top-k),
+    поиск по документам диалога видит их как обычные чанки своего документа.
+
+    match видит только закоммиченные чанки: копии, которые индексировались одновременно (конвейер sync
+    с несколькими index-воркерами), друг друга не находят — их связывает relink после sync.
+
+    Счётчики — in-process, сбрасываются на каждый sync (reset) и попадают в /kb status.
+    """
+
+    def __init__(self, kb_repo: KBRepo, *, max_distance: int = MAX_DISTANCE):
+        self._repo = kb_repo
+        self.max_distance = max(0, min(int(max_distance), MAX_DISTANCE))
+        self._lock = threading.Lock()
+        self.chunks = 0
+        self.duplicates = 0
+        self.tokens_saved = 0
+        self.relinked = 0
+        self._seen: Dict[int, Set[int]] = {}  # поколение -> документы, прошедшие match с последнего reset
+
+    def match(
+        self, generation: int, document_id: int, texts: Sequence[str]
+    ) -> Tuple[List[int], Dict[int, Tuple[int, Any]]]:
+        """
+        (подписи texts, {индекс текста: (id оригинала, его вектор)}) — для текстов, у которых нашёлся
+        почти-дубликат в другом документе поколения.
+        """
+        sigs = [simhash(t) for t in texts]
+        found: Dict[int, Tuple[int, Any]] = {}
+        try:
+            cands = self._repo.find_near_duplicates(
+                generation, sigs, exclude_document_id=document_id, max_distance=self.max_distance
+            )
+            if cands:
+                sources = self._repo.duplicate_sources(generation, sorted({c for cs in cands.values() for c, _ in cs}))
+                for i, cs in cands.items():
+                    for cid, _ in cs:
+                        src = sources.get(cid)
+                        if src is not None and same_numbers(texts[i], src[0]):
+                            found[i] = (cid, src[1])
+                            break
+        except Exception as e:
+            log.warning("KB dedup lookup failed (continue without dedup): %s", e)
+            found = {}
+
+        saved = count_tokens_batch([texts[i] for i in found])[0] if found else []
+        with self._lock:
+            self.chunks += len(texts)
+            self.duplicates += len(found)
+            self.tokens_saved += sum(saved)
+            self._seen.setdefault(int(generation), set()).add(int(document_id))
+        return sigs, found
+
+    def relink(self) -> int:
+        """
+        Повторная сверка чанков документов, прошедших match, когда их транзакции уже закоммичены.
+        Документы идут от нового к старому, поэтому оригиналом остаётся чанк более старого документа.
+        Найденная копия получает dup_of (embeddings для неё уже посчитаны — экономии токенов нет,
+        но в поиске она больше не занимает место оригинала). Возвращает число связанных чанков.
+        """
+        with self._lock:
+            seen, self._seen = self._seen, {}
+        linked = 0
+        for generation, docs in seen.items():
+            for did in sorted(docs, reverse=True):
+                try:
+                    rows = self._repo.chunk_signatures(generation, did)
+                    cands = self._repo.find_near_duplicates(
+                        generation, [sig for _, sig in rows], exclude_document_id=did, max_distance=self.max_distance
+                    )
+                    if not cands:
+                        continue
+                    ids = sorted({c for cs in cands.values() for c, _ in cs} | {rows[i][0] for i in cands})
+                    texts = {cid: src[0] for cid, src in self._repo.duplicate_sources(generation, ids).items()}
+                    links = []
+                    for i, cs in cands.items():
+                        own = texts.get(rows[i][0])
+                        orig = next((c for c, _ in cs if own is not None and c in texts and same_numbers(own, texts[c])), None)
+                        if orig is not None:
+                            links.append((rows[i][0], orig))
+                    linked += self._repo.link_duplicates(links)
+                except Exception as e:
+                    log.warning("KB dedup relink failed for document_id=%s (ignored): %s", did, e)
+        if linked:
+            log.info("KB dedup: linked %s near-duplicate chunks of concurrently indexed documents", linked)
+        with self._lock:
+            self.duplicates += linked
+            self.relinked += linked
+        return linked
+
+    def reset(self) -> None:
+        with self._lock:
+            self.chunks = self.duplicates = self.tokens_saved = self.relinked = 0
+            self._seen = {}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "dedup_chunks": self.chunks,
+                "dedup_duplicates": self.duplicates,
+                "dedup_tokens_saved": self.tokens_saved,
+                "dedup_relinked": self.relinked,
+            }
@@ -1,16 +1,41 @@
 from __future__ import annotations
 
-from typing import List, Sequence
+from typing import Any, List, Optional, Sequence
 
 from ..clients.openai_client import OpenAIClient
+from .profile import IndexProfile
 
 
 class Embedder:
-    def __init__(self, openai_client: OpenAIClient, model: str):
+    def __init__(self, openai_client: OpenAIClient, model: str, dimensions: Optional[int] = None):
         self._cli = openai_client
-        self._model = model
+        self._profile = IndexProfile(model, dimensions)
 
-    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+    @property
+    def model(self) -> str:
+        return self._profile.model
+
+    @property
+    def dimensions(self) -> Optional[int]:
+        return self._profile.dimensions
+
+    @property
+    def profile(self) -> IndexProfile:
+        return self._profile
+
+    def is_enabled(self) -> bool:
+        # не у всех клиентов есть is_enabled()
+        check = getattr(self._cli, "is_enabled", None)
+        return bool(self._cli) and (not callable(check) or bool(check()))
+
+    def for_profile(self, profile: IndexProfile) -> "Embedder":
+        """Embedder того же клиента под профиль конкретного поколения индекса."""
+        if profile == self._profile:
+            return self
+        return Embedder(self._cli, profile.model, profile.dimensions)
+
+    def embed(self, texts: Sequence[str]) -> List[Any]:
+        """Векторы float32 (numpy.ndarray) — в таком виде они идут в COPY и в поиск без конвертации."""
         if not texts:
             return []
-        return self._cli.embeddings(texts, model=self._model)
+        return self._cli.embeddings(texts, model=self._profile.model, dimensions=self._profile.dimensions)
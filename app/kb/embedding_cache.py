@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import re
+import threading
+import unicodedata
+from typing import Any, Dict, Sequence, Tuple
+
+from app.db.repo_kb import KBRepo
+
+log = logging.getLogger(__name__)
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_chunk_text(text: str) -> str:
+    """Нормализация перед хэшированием: NFC + схлопывание пробелов."""
+    t = unicodedata.normalize("NFC", text or "")
+    return _WS_RE.sub(" ", t).strip()
+
+
+def chunk_text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_chunk_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Персистентный кэш embeddings по содержимому чанка (таблица kb_embedding_cache).
+
+    Ключ: (модель embeddings, sha256 нормализованного текста).
+    Счётчики hits/misses — in-process, для /kb status.
+    """
+
+    def __init__(self, kb_repo: KBRepo):
+        self._repo = kb_repo
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.dedup = 0  # одинаковые тексты внутри одного вызова
+
+    def lookup(self, model: str, hashes: Sequence[str]) -> Dict[str, list[float]]:
+        try:
+            return self._repo.get_cached_embeddings(model, hashes)
+        except Exception as e:
+            log.warning("embedding cache lookup failed (continue without cache): %s", e)
+            return {}
+
+    def store(self, model: str, items: Sequence[Tuple[str, list[float]]]) -> None:
+        try:
+            self._repo.put_cached_embeddings(model, items)
+        except Exception as e:
+            log.warning("embedding cache store failed (ignored): %s", e)
+
+    def count(self, *, hits: int, misses: int, dedup: int) -> None:
+        with self._lock:
+            self.hits += int(hits)
+            self.misses += int(misses)
+            self.dedup += int(dedup)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits, misses, dedup = self.hits, self.misses, self.dedup
+        total = hits + misses
+        out: Dict[str, Any] = {
+            "embed_cache_hits": hits,
+            "embed_cache_misses": misses,
+            "embed_cache_dedup": dedup,
+            "embed_cache_hit_rate": f"{(100.0 * hits / total):.1f}%" if total else "n/a",
+        }
+        try:
+            out["embed_cache_rows"] = self._repo.embedding_cache_size()
+        except Exception:
+            pass
+        return out
@@ -1,41 +1,318 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import List, Tuple
+import copy
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
+from app.core.utils import count_tokens_batch, split_by_tokens
 from app.db.repo_kb import KBRepo
+from app.kb.dedup import ChunkDeduper
+from app.kb.embedding_cache import EmbeddingCache, chunk_text_hash
+
+log = logging.getLogger(__name__)
 
 
 @dataclass(frozen=True)
 class Chunk:
     order: int
     text: str
+    heading: str = ""  # путь заголовков раздела (iter_structured_chunks), уже включён в text
 
 
-def split_text(text: str, chunk_size: int, overlap: int) -> List[Chunk]:
-    text = (text or "").strip()
-    if not text:
-        return []
+@dataclass
+class ChunkDiff:
+    """Что нужно сделать с kb_chunks документа (для одного окна чанков), чтобы привести его к новому тексту."""
+
+    document_id: int
+    # (document_id, chunk_order, text, embedding, content_hash, simhash, dup_of)
+    inserts: List[Tuple[int, int, str, list[float], str, int | None, int | None]] = field(default_factory=list)
+    renumber: List[Tuple[int, int]] = field(default_factory=list)
+    kept: int = 0
+    duplicates: int = 0  # из inserts — почти-копии чанков других документов (вектор оригинала, без embeddings)
 
+
+def iter_split_text(pieces: Iterable[str], chunk_size: int, overlap: int) -> Iterator[Chunk]:
+    """
+    Потоковая версия split_text: текст приходит фрагментами (страницы, строки, блоки),
+    в памяти держится только хвост размером ~chunk_size.
+    Результат совпадает с split_text("".join(pieces)).
+    """
     chunk_size = max(200, int(chunk_size))
     overlap = max(0, min(int(overlap), chunk_size - 1))
 
-    chunks: List[Chunk] = []
-    n = len(text)
-    start = 0
+    buf = ""
+    started = False
     order = 0
 
+    for piece in pieces:
+        if not piece:
+            continue
+        if not started:
+            piece = piece.lstrip()
+            if not piece:
+                continue
+            started = True
+        buf += piece
+
+        # чанк не последний, только если за ним гарантированно есть непробельный текст
+        while len(buf.rstrip()) > chunk_size:
+            t = buf[:chunk_size].strip()
+            if t:
+                yield Chunk(order=order, text=t)
+                order += 1
+            buf = buf[chunk_size - overlap :]
+
+    buf = buf.rstrip()
+    n = len(buf)
+    start = 0
     while start < n:
         end = min(start + chunk_size, n)
-        piece = text[start:end].strip()
-        if piece:
-            chunks.append(Chunk(order=order, text=piece))
+        t = buf[start:end].strip()
+        if t:
+            yield Chunk(order=order, text=t)
             order += 1
         if end >= n:
             break
         start = max(0, end - overlap)
 
-    return chunks
+
+def split_text(text: str, chunk_size: int, overlap: int) -> List[Chunk]:
+    return list(iter_split_text([text or ""], chunk_size, overlap))
+
+
+# ---------- нарезка по структуре документа (KB_CHUNKER=structured) ----------
+
+CHUNKERS = ("chars", "structured")
+
+_PAGE_RE = re.compile(r"^#{1,6}\s*(?:Page|Стр\.?|Страница)\s+(\d+)\s*$", re.IGNORECASE)
+_MD_HEADING_RE = re.compile(r"^(#{1,6})\s+(\S.*?)\s*#*$")
+_SHEET_RE = re.compile(r"^===\s*(.+?)\s*===$")  # лист XLSX (parsers.iter_xlsx_text)
+_NUM_HEADING_RE = re.compile(r"^(\d{1,2}(?:\.\d{1,2}){1,4}\.?|\d{1,2}\.)\s+([^\W\d][^\t]{0,60})$")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+")
+_HEADING_SEP = " › "
+
+# строка без перевода строки длиннее этого (в символах на токен бюджета) режется, не дожидаясь конца строки
+_LINE_CHARS_PER_TOKEN = 16
+
+
+def _heading(line: str) -> Optional[Tuple[int, str]]:
+    """(уровень, заголовок), если строка похожа на заголовок раздела."""
+    m = _MD_HEADING_RE.match(line)
+    if m:
+        return len(m.group(1)), m.group(2)
+    m = _SHEET_RE.match(line)
+    if m:
+        return 1, m.group(1)
+    if len(line) > 100 or line[-1] in ".,;:!?":
+        return None
+    m = _NUM_HEADING_RE.match(line)
+    if m and len(m.group(2).split()) <= 8:
+        return m.group(1).rstrip(".").count(".") + 1, line
+    letters = [ch for ch in line if ch.isalpha()]
+    if len(letters) >= 4 and all(ch.isupper() for ch in letters):
+        return 1, line
+    return None
+
+
+def _is_table_row(line: str) -> bool:
+    # строки CSV/XLSX (parsers склеивают ячейки табуляцией) и markdown-таблицы
+    return "\t" in line or (line.startswith("|") and line.endswith("|"))
+
+
+def _tokens(text: str) -> int:
+    return count_tokens_batch([text])[0][0]
+
+
+def _split_oversized(text: str, max_tokens: int) -> List[str]:
+    """Абзац больше бюджета: по строкам, затем по предложениям, в крайнем случае — по токенам."""
+    for parts, sep in ((text.split("\n"), "\n"), (_SENTENCE_END_RE.split(text), " ")):
+        parts = [p.strip() for p in parts if p.strip()]
+        if len(parts) > 1:
+            out: List[str] = []
+            for p in _pack([(p, _tokens(p)) for p in parts], max_tokens, sep):
+                out.extend(_split_oversized(p, max_tokens) if _tokens(p) > max_tokens else [p])
+            return out
+    return [p.strip() for p in split_by_tokens(text, max_tokens) if p.strip()]
+
+
+def _pack(units: List[Tuple[str, int]], max_tokens: int, sep: str) -> List[str]:
+    """Жадно склеивает подряд идущие куски в строки не больше max_tokens (кусок больше бюджета — отдельно)."""
+    out: List[str] = []
+    cur: List[str] = []
+    acc = 0
+    for t, n in units:
+        if cur and acc + n > max_tokens:
+            out.append(sep.join(cur))
+            cur, acc = [], 0
+        cur.append(t)
+        acc += n
+    if cur:
+        out.append(sep.join(cur))
+    return out
+
+
+def _iter_lines(pieces: Iterable[str], max_line_chars: int) -> Iterator[str]:
+    """Строки потока фрагментов (без \\n); строка без переводов длиннее max_line_chars режется по пробелу."""
+    buf = ""
+    for piece in pieces:
+        if not piece:
+            continue
+        buf += piece
+        *lines, buf = buf.split("\n")
+        yield from lines
+        while len(buf) > max_line_chars:
+            cut = buf.rfind(" ", 0, max_line_chars)
+            cut = cut if cut > 0 else max_line_chars
+            yield buf[:cut]
+            buf = buf[cut:]
+    if buf:
+        yield buf
+
+
+def iter_structured_chunks(pieces: Iterable[str], max_tokens: int) -> Iterator[Chunk]:
+    """
+    Нарезка по структуре: текст делится на блоки — абзацы (до пустой строки), заголовки,
+    строки таблиц, маркеры страниц «## Page N», — и блоки жадно упаковываются в чанк до max_tokens.
+    Границы чанков — только между блоками (абзац больше бюджета режется по строкам/предложениям),
+    перекрытия нет. Новый раздел начинает новый чанк, если текущий заполнен хотя бы на четверть,
+    иначе заголовок идёт в текст. Первая строка чанка — путь заголовков раздела («Глава › Пункт»),
+    с номером страницы, если он известен; чанк таблицы, начатый не с её начала, повторяет строку шапки.
+    Потоковая, как iter_split_text: в памяти — текущий чанк и незаконченная строка.
+    """
+    max_tokens = max(32, int(max_tokens))
+    min_fill = max_tokens // 4
+
+    headings: List[Tuple[int, str]] = []
+    page: Optional[str] = None
+    header = ""  # заголовок текущего чанка
+    body: List[str] = []  # блоки текущего чанка
+    used = 0
+    order = 0
+
+    in_table = False  # последний блок чанка — строки таблицы
+
+    para: List[str] = []  # строки незаконченного абзаца
+    table_head: Optional[str] = None  # шапка текущей таблицы
+
+    def tag() -> str:
+        parts = [h for _, h in headings]
+        if page:
+            parts.append(f"стр. {page}")
+        return _HEADING_SEP.join(parts)
+
+    def flush() -> Iterator[Chunk]:
+        nonlocal body, used, order, header, in_table
+        text = "\n\n".join(body).strip()
+        if text:
+            yield Chunk(order=order, text=f"{header}\n{text}" if header else text, heading=header)
+            order += 1
+        body, used, in_table = [], 0, False
+        header = tag()
+
+    def add(block: str, n: int, *, table: bool = False) -> Iterator[Chunk]:
+        nonlocal used, in_table
+        if body and used + n > max_tokens:
+            yield from flush()
+            if table and table_head and block != table_head:
+                body.append(table_head)
+                used = _tokens(header) if header else 0
+                used += _tokens(table_head)
+                in_table = True
+        if not body:
+            used = _tokens(header) if header else 0
+        if table and in_table:
+            body[-1] += "\n" + block  # строки таблицы — одним блоком, без пустых строк между ними
+        else:
+            body.append(block)
+        in_table = table
+        used += n
+
+    def end_para() -> Iterator[Chunk]:
+        if not para:
+            return
+        text = "\n".join(para)
+        para.clear()
+        n = _tokens(text)
+        room = max(min_fill, max_tokens - (_tokens(header) if header else 0))
+        if n <= room:
+            yield from add(text, n)
+            return
+        for part in _split_oversized(text, room):
+            yield from add(part, _tokens(part))
+
+    def section(level: int, title: str, line: str) -> Iterator[Chunk]:
+        nonlocal header
+        while headings and headings[-1][0] >= level:
+            headings.pop()
+        headings.append((level, title))
+        if used >= min_fill:
+            yield from flush()
+        elif body:
+            yield from add(line, _tokens(line))  # короткий раздел — заголовок остаётся в тексте чанка
+        else:
+            header = tag()
+
+    for raw in _iter_lines(pieces, max_tokens * _LINE_CHARS_PER_TOKEN):
+        line = raw.strip()
+        if not line:
+            yield from end_para()
+            table_head = None
+            continue
+
+        m = _PAGE_RE.match(line)
+        if m:
+            yield from end_para()
+            page = m.group(1)
+            if not body:
+                header = tag()
+            continue
+
+        h = _heading(line)
+        if h is not None:
+            yield from end_para()
+            table_head = None
+            yield from section(h[0], h[1], line)
+            continue
+
+        if _is_table_row(line):
+            yield from end_para()
+            if table_head is None:
+                table_head = line
+            n = _tokens(line)
+            if n > max_tokens:
+                for part in _split_oversized(line, max_tokens):
+                    yield from add(part, _tokens(part))
+            else:
+                yield from add(line, n, table=True)
+            continue
+
+        table_head = None
+        para.append(line)
+
+    yield from end_para()
+    yield from flush()
+
+
+def pack_by_tokens(counts: List[int], *, max_items: int, max_tokens: int) -> List[Tuple[int, int]]:
+    """
+    Жадная упаковка подряд идущих элементов в батчи [lo, hi) так, чтобы
+    в батче было <= max_items элементов и <= max_tokens токенов.
+    Элемент больше max_tokens уходит отдельным батчем.
+    """
+    out: List[Tuple[int, int]] = []
+    lo = 0
+    acc = 0
+    for i, n in enumerate(counts):
+        if i > lo and ((i - lo) >= max_items or (acc + n) > max_tokens):
+            out.append((lo, i))
+            lo = i
+            acc = 0
+        acc += n
+    if lo < len(counts):
+        out.append((lo, len(counts)))
+    return out
 
 
 class KbIndexer:
@@ -47,15 +324,85 @@ class KbIndexer:
     - защита от max_tokens_per_request
     """
 
-    # ---- safety limits ----
-    MAX_ITEMS_PER_BATCH = 32
-    MAX_CHARS_PER_BATCH = 80_000  # грубый, но безопасный суррогат токенов
+    # ---- лимиты OpenAI embeddings на один запрос ----
+    MAX_ITEMS_PER_BATCH = 2048
+    MAX_TOKENS_PER_BATCH = 300_000
+    TOKEN_SAFETY = 0.95  # запас на расхождение токенизатора и служебные токены
+
+    # сколько чанков нарезается/эмбеддится/пишется за один шаг при потоковой индексации
+    STREAM_WINDOW = 256
 
-    def __init__(self, kb_repo: KBRepo, embedder, chunk_size: int, overlap: int):
+    def __init__(
+        self,
+        kb_repo: KBRepo,
+        embedder,
+        chunk_size: int,
+        overlap: int,
+        *,
+        cache: EmbeddingCache | None = None,
+        dedup: ChunkDeduper | None = None,
+        max_items_per_batch: int | None = None,
+        max_tokens_per_batch: int | None = None,
+        chunker: str = "chars",
+        chunk_tokens: int = 700,
+    ):
         self._repo = kb_repo
         self._embedder = embedder
         self._chunk_size = int(chunk_size)
         self._overlap = int(overlap)
+        self._chunker = (chunker or "chars").strip().lower()
+        if self._chunker not in CHUNKERS:
+            raise ValueError(f"unsupported chunker: {chunker} (supported: {', '.join(CHUNKERS)})")
+        self._chunk_tokens = int(chunk_tokens)
+        self._cache = cache
+        self._dedup = dedup
+        self._max_items = int(max_items_per_batch or self.MAX_ITEMS_PER_BATCH)
+        self._max_tokens = int((max_tokens_per_batch or self.MAX_TOKENS_PER_BATCH) * self.TOKEN_SAFETY)
+
+    def cache_stats(self) -> dict:
+        return self._cache.stats() if self._cache else {}
+
+    def dedup_stats(self) -> dict:
+        return self._dedup.stats() if self._dedup else {}
+
+    def reset_dedup_stats(self) -> None:
+        if self._dedup:
+            self._dedup.reset()
+
+    def relink_duplicates(self) -> int:
+        """Почти-дубликаты среди документов, индексировавшихся одновременно (см. ChunkDeduper.relink)."""
+        return self._dedup.relink() if self._dedup else 0
+
+    def profile(self) -> dict:
+        """Настройки, с которыми строится поколение индекса (пишутся в kb_generations)."""
+        prof = getattr(self._embedder, "profile", None)
+        if self._chunker == "structured":
+            # размер чанка — бюджет в токенах, перекрытия нет
+            out = {"chunker": self._chunker, "chunk_size": self._chunk_tokens, "chunk_overlap": 0}
+        else:
+            out = {"chunker": self._chunker, "chunk_size": self._chunk_size, "chunk_overlap": self._overlap}
+        if prof is not None:
+            out.update(prof.as_generation())
+        else:
+            out["embedding_model"] = getattr(self._embedder, "model", None)
+        return out
+
+    def for_profile(self, profile) -> "KbIndexer":
+        """Тот же индексатор, но embeddings — профилем конкретного поколения (см. app.kb.profile)."""
+        if not hasattr(self._embedder, "for_profile"):
+            return self
+        emb = self._embedder.for_profile(profile)
+        if emb is self._embedder:
+            return self
+        clone = copy.copy(self)
+        clone._embedder = emb
+        return clone
+
+    def iter_chunks(self, pieces: Iterable[str]) -> Iterator[Chunk]:
+        """Нарезка текста документа выбранным чанкером (KB_CHUNKER)."""
+        if self._chunker == "structured":
+            return iter_structured_chunks(pieces, self._chunk_tokens)
+        return iter_split_text(pieces, self._chunk_size, self._overlap)
 
     # ---------- embeddings helpers ----------
 
@@ -72,16 +419,47 @@ class KbIndexer:
 
     def _embed_batched(self, texts: List[str]) -> List[list[float]]:
         """
-        Делит embeddings на безопасные батчи.
-        При ошибке — рекурсивно делит батч пополам.
+        embeddings с кэшем по содержимому:
+        - одинаковые тексты внутри вызова считаются один раз;
+        - тексты, уже лежащие в kb_embedding_cache для этой модели, не отправляются в API.
         """
         if not texts:
             return []
+        if self._cache is None:
+            return self._embed_uncached(texts)
+
+        # ключ кэша — модель + размерность: укороченные векторы той же модели — другие векторы
+        prof = getattr(self._embedder, "profile", None)
+        model = prof.key if prof is not None else str(getattr(self._embedder, "model", "") or "default")
+        hashes = [chunk_text_hash(t) for t in texts]
+        unique = dict(zip(hashes, texts))
+
+        known = self._cache.lookup(model, list(unique.keys()))
+        missing = [h for h in unique if h not in known]
+        if missing:
+            fresh = list(zip(missing, self._embed_uncached([unique[h] for h in missing])))
+            self._cache.store(model, fresh)
+            known.update(fresh)
+
+        self._cache.count(
+            hits=len(unique) - len(missing),
+            misses=len(missing),
+            dedup=len(texts) - len(unique),
+        )
+        return [known[h] for h in hashes]
 
-        results: List[list[float]] = []
+    def _embed_uncached(self, texts: List[str]) -> List[list[float]]:
+        """
+        Делит embeddings на батчи по числу токенов (считаются один раз на чанк).
+
+        Если tiktoken недоступен, токены оцениваются грубо — тогда при ошибке
+        батч, как и раньше, рекурсивно делится пополам.
+        """
+        if not texts:
+            return []
 
-        batch: List[str] = []
-        batch_chars = 0
+        texts = [t or "" for t in texts]
+        counts, exact = count_tokens_batch(texts)
 
         def flush_batch(b: List[str]) -> List[list[float]]:
             if not b:
@@ -89,35 +467,78 @@ class KbIndexer:
             try:
                 return self._embed_raw(b)
             except Exception:
-                # fallback: делим пополам
-                if len(b) == 1:
+                # fallback: делим пополам (только при неточном подсчёте токенов)
+                if exact or len(b) == 1:
                     raise
                 mid = len(b) // 2
                 return flush_batch(b[:mid]) + flush_batch(b[mid:])
 
-        for t in texts:
-            t = t or ""
-            t_len = len(t)
-
-            if (
-                batch
-                and (
-                    len(batch) >= self.MAX_ITEMS_PER_BATCH
-                    or (batch_chars + t_len) >= self.MAX_CHARS_PER_BATCH
-                )
-            ):
-                results.extend(flush_batch(batch))
-                batch = []
-                batch_chars = 0
-
-            batch.append(t)
-            batch_chars += t_len
-
-        if batch:
-            results.extend(flush_batch(batch))
-
+        results: List[list[float]] = []
+        for lo, hi in pack_by_tokens(counts, max_items=self._max_items, max_tokens=self._max_tokens):
+            results.extend(flush_batch(texts[lo:hi]))
         return results
 
+    # ---------- diff helpers ----------
+
+    def _existing_pool(
+        self, did: int, generation: int
+    ) -> Tuple[Dict[str, List[Tuple[int, int]]], List[Tuple[int, str]]]:
+        """Текущие чанки документа в поколении: hash -> [(id, order)] + хэши для старых строк без content_hash."""
+        pool: Dict[str, List[Tuple[int, int]]] = {}
+        set_hashes: List[Tuple[int, str]] = []
+        for cid, order, h, old_text in self._repo.list_chunk_keys(did, generation=generation):
+            if h is None:
+                h = chunk_text_hash(old_text or "")
+                set_hashes.append((cid, h))
+            pool.setdefault(h, []).append((cid, order))
+        return pool, set_hashes
+
+    def _diff_window(
+        self, did: int, window: List[Chunk], pool: Dict[str, List[Tuple[int, int]]], generation: int
+    ) -> ChunkDiff:
+        """
+        Сопоставление окна новых чанков с пулом существующих строк (пул расходуется):
+          1) тот же хэш и тот же chunk_order -> строка не трогается;
+          2) тот же хэш, другой chunk_order -> только перенумерация;
+          3) остальное -> insert (embeddings считаются только для них); с dedup — кроме почти-копий
+             чанков других документов: они пишутся с вектором оригинала и ссылкой dup_of.
+        """
+        diff = ChunkDiff(document_id=did)
+        unmatched: List[Tuple[int, str, str]] = []
+        for c in window:
+            h = chunk_text_hash(c.text)
+            cands = pool.get(h) or []
+            hit = next((i for i, (_, o) in enumerate(cands) if o == c.order), None)
+            if hit is None:
+                unmatched.append((int(c.order), c.text, h))
+                continue
+            cands.pop(hit)
+            diff.kept += 1
+
+        to_insert: List[Tuple[int, str, str]] = []
+        for order, t, h in unmatched:
+            cands = pool.get(h) or []
+            if cands:
+                cid, _ = cands.pop(0)
+                diff.renumber.append((cid, order))
+            else:
+                to_insert.append((order, t, h))
+
+        if to_insert:
+            texts = [t for (_, t, _) in to_insert]
+            sigs: List[int | None] = [None] * len(texts)
+            dups: Dict[int, Tuple[int, list[float]]] = {}
+            if self._dedup is not None:
+                sigs, dups = self._dedup.match(generation, did, texts)
+            fresh = [i for i in range(len(texts)) if i not in dups]
+            embedded = dict(zip(fresh, self._embed_batched([texts[i] for i in fresh])))
+            diff.inserts = [
+                (did, order, t, dups[i][1] if i in dups else embedded[i], h, sigs[i], dups[i][0] if i in dups else None)
+                for i, (order, t, h) in enumerate(to_insert)
+            ]
+            diff.duplicates = len(dups)
+        return diff
+
     # ---------- public API ----------
 
     def reindex_document(
@@ -127,25 +548,68 @@ class KbIndexer:
         *,
         doc_id: int | None = None,
         document_text: str | None = None,
+        pieces: Iterable[str] | None = None,
+        generation: int | None = None,
     ) -> int:
+        """
+        Инкрементальная переиндексация документа.
+
+        Текст можно передать строкой (text) или потоком фрагментов (pieces) — тогда
+        нарезка, embeddings и запись идут окнами по STREAM_WINDOW чанков, и память
+        не зависит от размера файла. Все изменения — в одной транзакции.
+
+        generation — поколение индекса, в которое пишем (по умолчанию активное);
+        при полной перестройке это новое, ещё невидимое для поиска поколение.
+        """
         did = int(document_id if document_id is not None else (doc_id or 0))
         if did <= 0:
             raise ValueError("reindex_document: document_id/doc_id is required")
 
-        txt = text if text is not None else (document_text or "")
-        txt = (txt or "").strip()
-
-        chunks = split_text(txt, self._chunk_size, self._overlap)
-        if not chunks:
-            self._repo.delete_chunks_by_document_id(did)
-            return 0
-
-        embeddings = self._embed_batched([c.text for c in chunks])
-
-        rows: List[Tuple[int, int, str, list[float]]] = []
-        for c, emb in zip(chunks, embeddings):
-            rows.append((did, int(c.order), c.text, emb))
-
-        self._repo.delete_chunks_by_document_id(did)
-        self._repo.insert_chunks_bulk(rows)
-        return len(rows)
+        if pieces is None:
+            txt = text if text is not None else (document_text or "")
+            pieces = [txt or ""]
+
+        if generation is None:
+            generation = self._repo.active_generation()
+        pool, set_hashes = self._existing_pool(did, generation)
+        kept = renumbered = inserted = duplicates = 0
+
+        with self._repo.chunk_writer(did, generation=generation) as w:
+            window: List[Chunk] = []
+
+            def flush() -> None:
+                nonlocal kept, renumbered, inserted, duplicates
+                d = self._diff_window(did, window, pool, generation)
+                w.apply(insert_rows=d.inserts, renumber=d.renumber)
+                kept += d.kept
+                renumbered += len(d.renumber)
+                inserted += len(d.inserts)
+                duplicates += d.duplicates
+                window.clear()
+
+            for c in self.iter_chunks(pieces):
+                window.append(c)
+                if len(window) >= self.STREAM_WINDOW:
+                    flush()
+            if window:
+                flush()
+
+            # остались в пуле -> исчезли из документа
+            deletes = [cid for cands in pool.values() for (cid, _) in cands]
+            gone = set(deletes)
+            w.apply(delete_ids=deletes, set_hashes=[(cid, h) for (cid, h) in set_hashes if cid not in gone])
+
+        # центроид документа для двухуровневого поиска — после commit: с vector_store векторы пишутся в нём
+        self._repo.update_document_vectors([did], generation=generation)
+
+        log.info(
+            "KB reindex doc=%s gen=%s: kept=%s renumbered=%s inserted=%s (duplicates=%s) deleted=%s",
+            did,
+            generation,
+            kept,
+            renumbered,
+            inserted,
+            duplicates,
+            len(deletes),
+        )
+        return kept + renumbered + inserted
@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import signal
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import IO, Any, Dict, Optional, Tuple
+
+try:
+    import resource  # только POSIX
+except Exception:
+    resource = None
+
+from app.kb.parsers import Source, detect_ext, iter_file_text
+
+log = logging.getLogger(__name__)
+
+# Форматы, разбор которых упирается в CPU (pypdf, python-docx, openpyxl). txt/csv/картинки дешевле
+# переслать не получится — их разбирает поток sync, как раньше.
+CPU_BOUND_EXTS = frozenset({"pdf", "docx", "xlsx", "xls"})
+
+_START_TIMEOUT_SEC = 60
+_COPY_BLOCK = 1024 * 1024
+
+
+# -----------------------------
+# Процесс-воркер
+# -----------------------------
+def _vm_size() -> int:
+    """Виртуальная память процесса (байт) из /proc; 0 — неизвестно."""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmSize:"):
+                    return int(line.split()[1]) * 1024
+    except Exception:
+        pass
+    return 0
+
+
+def _peak_rss_mb() -> int:
+    if resource is None:
+        return 0
+    return int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss) // 1024  # Linux: КБ
+
+
+def _init_worker(memory_mb: int) -> None:
+    # парсеры импортируются до замера: лимит — это память сверх уже загруженного процесса
+    import app.kb.dedup  # noqa: F401
+
+    # Ctrl+C в боте не должен ронять воркеры раньше, чем пул их остановит
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if memory_mb <= 0 or resource is None:
+        return
+    base = _vm_size()
+    if not base:
+        return
+    cap = base + int(memory_mb) * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (cap, cap))
+    except Exception as e:
+        log.warning("KB parse worker: memory limit not set: %s", e)
+
+
+def _parse_file(filename: str, in_path: str, out_path: str, pdf_max_pages: Optional[int], strip: bool) -> Dict[str, Any]:
+    """Разбор в процессе-воркере: файл in_path -> текст в out_path (utf-8)."""
+    from app.kb.dedup import strip_boilerplate
+
+    stats: Dict[str, int] = {}
+    pdf_pages = (lambda pages: strip_boilerplate(pages, stats=stats)) if strip else None
+    has_text = False
+    with open(in_path, "rb") as src, open(out_path, "w", encoding="utf-8") as out:
+        for piece in iter_file_text(filename, src, pdf_max_pages=pdf_max_pages, pdf_pages=pdf_pages):
+            if piece:
+                out.write(piece)
+                has_text = has_text or bool(piece.strip())
+    return {"has_text": has_text, "boilerplate": stats, "peak_rss_mb": _peak_rss_mb()}
+
+
+# -----------------------------
+# Пул (в процессе бота)
+# -----------------------------
+class _Worker:
+    """Один процесс: ProcessPoolExecutor на одного воркера, чтобы зависший разбор можно было убить отдельно."""
+
+    def __init__(self, ctx: Any, memory_mb: int):
+        self.ex = ProcessPoolExecutor(max_workers=1, mp_context=ctx, initializer=_init_worker, initargs=(memory_mb,))
+        self.files = 0
+        try:
+            self.pid = int(self.ex.submit(os.getpid).result(timeout=_START_TIMEOUT_SEC))
+            self.base_rss_mb = int(self.ex.submit(_peak_rss_mb).result(timeout=_START_TIMEOUT_SEC))
+        except BaseException:
+            self.ex.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    def kill(self) -> None:
+        try:
+            os.kill(self.pid, getattr(signal, "SIGKILL", signal.SIGTERM))
+        except Exception:
+            pass
+        self.ex.shutdown(wait=False, cancel_futures=True)
+
+    def close(self) -> None:
+        self.ex.shutdown(wait=True, cancel_futures=True)
+
+
+class ParsePool:
+    """
+    Разбор PDF/DOCX/XLSX в отдельных процессах: GIL не сводит парсинг всего sync к одному ядру,
+    а патологический файл не останавливает sync.
+
+      - processes процессов, каждый берёт один файл за раз (поток стадии parse ждёт свой результат);
+      - timeout_sec на файл: зависший разбор — процесс убивается (SIGKILL), файл — ошибка (status=error);
+      - memory_mb: лимит адресного пространства процесса сверх базового (RLIMIT_AS, Linux) — огромный файл
+        падает с MemoryError вместо того, чтобы съесть память бота; после файла с пиком памяти больше
+        половины лимита процесс перезапускается;
+      - max_files_per_worker: после стольких файлов процесс перезапускается (утечки pypdf/lxml не копятся;
+        у ProcessPoolExecutor в Python 3.10 ещё нет max_tasks_per_child).
+
+    Файл передаётся процессу через временный каталог пула (копия spool), текст возвращается
+    таким же файлом: по pipe не гоняются мегабайты, память бота не зависит от размера документа.
+    Процессы стартуют лениво (forkserver: не наследуют потоки и соединения бота).
+    """
+
+    def __init__(
+        self,
+        processes: int,
+        *,
+        timeout_sec: float = 120,
+        max_files_per_worker: int = 50,
+        memory_mb: int = 1024,
+        pdf_max_pages: Optional[int] = None,
+        strip_boilerplate: bool = True,
+    ):
+        self.processes = max(1, int(processes))
+        self.timeout_sec = float(timeout_sec) if timeout_sec and timeout_sec > 0 else None
+        self.max_files_per_worker = max(0, int(max_files_per_worker))
+        self.memory_mb = max(0, int(memory_mb))
+        self._pdf_max_pages = pdf_max_pages or None
+        self._strip = bool(strip_boilerplate)
+
+        methods = multiprocessing.get_all_start_methods()
+        self._ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self._tmp = tempfile.mkdtemp(prefix="kb_parse_")
+        self._idle: "queue.LifoQueue[Optional[_Worker]]" = queue.LifoQueue()
+        for _ in range(self.processes):
+            self._idle.put(None)
+
+        self._lock = threading.Lock()
+        self._closed = False
+        self.files = 0
+        self.timeouts = 0
+        self.crashes = 0
+        self.restarts = 0
+
+    def __enter__(self) -> "ParsePool":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    @staticmethod
+    def handles(filename: str) -> bool:
+        return detect_ext(filename) in CPU_BOUND_EXTS
+
+    def _write_input(self, src: Source, path: str) -> None:
+        with open(path, "wb") as f:
+            if isinstance(src, (bytes, bytearray, memoryview)):
+                f.write(src)
+                return
+            try:
+                src.seek(0)
+            except Exception:
+                pass
+            shutil.copyfileobj(src, f, _COPY_BLOCK)
+
+    def parse(self, filename: str, src: Source) -> Tuple[Optional[IO[str]], Dict[str, int]]:
+        """
+        (текст файла — открытый на чтение файл или None, если непробельного текста нет; статистика колонтитулов).
+        Таймаут, падение процесса и ошибки разбора — RuntimeError с причиной (документ уходит в error).
+        """
+        if self._closed:
+            raise RuntimeError("parse pool is closed")
+        name = uuid.uuid4().hex
+        in_path = os.path.join(self._tmp, name + ".in")
+        out_path = os.path.join(self._tmp, name + ".txt")
+        w = self._idle.get()
+        try:
+            self._write_input(src, in_path)
+            if w is None:
+                w = _Worker(self._ctx, self.memory_mb)
+            fut = w.ex.submit(_parse_file, filename, in_path, out_path, self._pdf_max_pages, self._strip)
+            try:
+                res = fut.result(timeout=self.timeout_sec)
+            except FutureTimeout:
+                w.kill()
+                w = None
+                with self._lock:
+                    self.timeouts += 1
+                raise RuntimeError(f"parse timeout after {self.timeout_sec:g}s (worker killed)") from None
+            except BrokenProcessPool:
+                w.kill()
+                w = None
+                with self._lock:
+                    self.crashes += 1
+                raise RuntimeError("parse worker died (out of memory or crash in parser)") from None
+            except MemoryError:
+                w.kill()
+                w = None
+                with self._lock:
+                    self.crashes += 1
+                raise RuntimeError(f"parse memory limit exceeded ({self.memory_mb} MB)") from None
+
+            w.files += 1
+            with self._lock:
+                self.files += 1
+            grown = int(res.get("peak_rss_mb") or 0) - w.base_rss_mb
+            if (self.max_files_per_worker and w.files >= self.max_files_per_worker) or (
+                self.memory_mb and grown > self.memory_mb // 2
+            ):
+                w.close()
+                w = None
+                with self._lock:
+                    self.restarts += 1
+
+            if not res.get("has_text"):
+                return None, res.get("boilerplate") or {}
+            text = open(out_path, "r", encoding="utf-8")
+            try:
+                os.unlink(out_path)  # POSIX: файл живёт, пока открыт
+            except OSError:
+                pass
+            return text, res.get("boilerplate") or {}
+        finally:
+            if self._closed and w is not None:
+                w.close()
+                w = None
+            self._idle.put(w)
+            for p in (in_path, out_path):
+                try:
+                    os.unlink(p)
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "parse_processes": self.processes,
+                "parse_files": self.files,
+                "parse_timeouts": self.timeouts,
+                "parse_crashes": self.crashes,
+                "parse_restarts": self.restarts,
+            }
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        while True:
+            try:
+                w = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if w is not None:
+                try:
+                    w.close()
+                except Exception:
+                    pass
+        shutil.rmtree(self._tmp, ignore_errors=True)
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
+import codecs
 import csv
 import io
 import os
+from typing import BinaryIO, Callable, Iterable, Iterator, Union
+
 from PIL import Image
 
 try:
@@ -29,6 +32,45 @@ def is_image_ext(ext: str) -> bool:
     return ext in {"png", "jpg", "jpeg", "webp"}
 
 
+# Источник для парсеров: байты целиком или бинарный file-like (например, SpooledTemporaryFile)
+Source = Union[bytes, BinaryIO]
+
+_TEXT_BLOCK = 64 * 1024
+
+
+def _as_stream(src: Source) -> BinaryIO:
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        return io.BytesIO(bytes(src))
+    try:
+        src.seek(0)
+    except Exception:
+        pass
+    return src
+
+
+def _sniff_encoding(stream: BinaryIO) -> str:
+    """Та же цепочка, что и в parse_text_bytes (utf-8 -> utf-8-sig -> cp1251), но по первым 64 КБ."""
+    head = stream.read(_TEXT_BLOCK)
+    try:
+        stream.seek(0)
+    except Exception:
+        pass
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        # final=False: многобайтовый символ может быть разрезан границей выборки
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "cp1251"
+
+
+def _text_stream(src: Source) -> io.TextIOWrapper:
+    stream = _as_stream(src)
+    enc = _sniff_encoding(stream)
+    return io.TextIOWrapper(stream, encoding=enc, errors="ignore", newline="")
+
+
 def parse_text_bytes(data: bytes) -> str:
     for enc in ("utf-8", "utf-8-sig", "cp1251"):
         try:
@@ -43,64 +85,137 @@ def parse_txt_bytes(data: bytes) -> str:
     return parse_text_bytes(data)
 
 
-def parse_pdf_bytes(data: bytes) -> str:
+# -----------------------------
+# Потоковые парсеры (генераторы фрагментов текста)
+# -----------------------------
+def iter_txt_text(src: Source) -> Iterator[str]:
+    """Текстовый файл блоками по 64 КБ."""
+    f = _text_stream(src)
+    try:
+        while True:
+            block = f.read(_TEXT_BLOCK)
+            if not block:
+                break
+            yield block
+    finally:
+        f.detach()
+
+
+def iter_pdf_text(src: Source, *, max_pages: int | None = None) -> Iterator[str]:
+    """PDF постранично (pypdf читает страницы лениво)."""
     if PdfReader is None:
-        return ""
-    bio = io.BytesIO(data)
-    reader = PdfReader(bio)
-    parts = []
-    for p in reader.pages:
-        t = p.extract_text() or ""
-        t = t.strip()
+        return
+    reader = PdfReader(_as_stream(src))
+    for i, p in enumerate(reader.pages):
+        if max_pages and i >= int(max_pages):
+            break
+        t = (p.extract_text() or "").strip()
         if t:
-            parts.append(t)
-    return "\n\n".join(parts)
+            yield t
 
 
-def parse_docx_bytes(data: bytes) -> str:
+def iter_docx_text(src: Source) -> Iterator[str]:
     if Document is None:
-        return ""
-    bio = io.BytesIO(data)
-    doc = Document(bio)
-    parts = []
+        return
+    doc = Document(_as_stream(src))
     for p in doc.paragraphs:
         t = (p.text or "").strip()
         if t:
-            parts.append(t)
-    return "\n".join(parts)
+            yield t
 
 
-def parse_xlsx_bytes(data: bytes) -> str:
+def iter_xlsx_text(src: Source) -> Iterator[str]:
+    """XLSX построчно: openpyxl в read_only режиме не держит лист целиком в памяти."""
     if openpyxl is None:
-        return ""
-    bio = io.BytesIO(data)
-    wb = openpyxl.load_workbook(bio, data_only=True)
-    parts = []
-    for ws in wb.worksheets:
-        parts.append(f"=== {ws.title} ===")
-        for row in ws.iter_rows(values_only=True):
-            cells = []
-            for v in row:
-                if v is None:
-                    cells.append("")
-                else:
-                    cells.append(str(v))
-            line = "\t".join(cells).strip()
+        return
+    wb = openpyxl.load_workbook(_as_stream(src), read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            yield f"=== {ws.title} ==="
+            for row in ws.iter_rows(values_only=True):
+                line = "\t".join("" if v is None else str(v) for v in row).strip()
+                if line:
+                    yield line
+    finally:
+        wb.close()
+
+
+def iter_csv_text(src: Source) -> Iterator[str]:
+    f = _text_stream(src)
+    try:
+        for row in csv.reader(f):
+            line = "\t".join([c.strip() for c in row]).strip()
             if line:
-                parts.append(line)
-    return "\n".join(parts).strip()
+                yield line
+    finally:
+        f.detach()
+
+
+def join_pieces(pieces: Iterable[str], sep: str) -> Iterator[str]:
+    """Ленивый аналог sep.join(pieces)."""
+    first = True
+    for p in pieces:
+        if not first:
+            yield sep
+        first = False
+        yield p
+
+
+def iter_file_text(
+    filename: str,
+    src: Source,
+    *,
+    pdf_max_pages: int | None = None,
+    pdf_pages: Callable[[Iterator[str]], Iterator[str]] | None = None,
+) -> Iterator[str]:
+    """
+    Текст файла потоком фрагментов (вместе с разделителями) по расширению имени.
+    pdf_pages — обработка страниц PDF до склейки (например, удаление колонтитулов).
+    """
+    ext = detect_ext(filename)
+
+    if ext in ("txt", "md", "log"):
+        return iter_txt_text(src)
+
+    if ext == "pdf":
+        pages = iter_pdf_text(src, max_pages=pdf_max_pages)
+        if pdf_pages is not None:
+            pages = pdf_pages(pages)
+        return join_pieces(pages, "\n\n")
+
+    if ext == "docx":
+        return join_pieces(iter_docx_text(src), "\n")
+
+    if ext in ("xlsx", "xls"):
+        return join_pieces(iter_xlsx_text(src), "\n")
+
+    if ext == "csv":
+        return join_pieces(iter_csv_text(src), "\n")
+
+    if is_image_ext(ext):
+        data = src if isinstance(src, bytes) else src.read()
+        return iter([parse_image_bytes_best_effort(data)])
+
+    return iter(())
+
+
+# -----------------------------
+# Совместимые обёртки: весь текст строкой
+# -----------------------------
+def parse_pdf_bytes(data: bytes, *, max_pages: int | None = None) -> str:
+    return "".join(join_pieces(iter_pdf_text(data, max_pages=max_pages), "\n\n"))
+
+
+def parse_docx_bytes(data: bytes) -> str:
+    return "\n".join(iter_docx_text(data))
+
+
+def parse_xlsx_bytes(data: bytes) -> str:
+    return "\n".join(iter_xlsx_text(data)).strip()
 
 
 def parse_csv_bytes(data: bytes) -> str:
-    text = parse_text_bytes(data)
-    buf = io.StringIO(text)
-    reader = csv.reader(buf)
-    lines = []
-    for row in reader:
-        line = "\t".join([c.strip() for c in row]).strip()
-        if line:
-            lines.append(line)
-    return "\n".join(lines).strip()
+    return "\n".join(iter_csv_text(data)).strip()
 
 
 def parse_image_bytes_best_effort(data: bytes) -> str:
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, List, Optional
+
+log = logging.getLogger(__name__)
+
+# Маркер окончания потока для воркеров стадии
+_STOP = object()
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    Стадия конвейера.
+
+    fn(item) -> item | None
+      - возвращает item (или новый объект) для следующей стадии;
+      - None — элемент обработан досрочно (например, skipped) и дальше не идёт.
+    """
+
+    name: str
+    fn: Callable[[Any], Any]
+    workers: int = 1
+
+
+class StagedPipeline:
+    """
+    Простой потоковый конвейер: N стадий, у каждой свой пул потоков,
+    между стадиями — ограниченные очереди (backpressure).
+
+    Результаты (успех/ошибка/досрочное завершение) приходят в вызывающий поток
+    через колбэки — поэтому progress_cb и счётчики не требуют блокировок.
+    Ошибка в одном элементе не останавливает конвейер.
+    """
+
+    def __init__(self, stages: List[Stage], *, queue_size: int = 8):
+        if not stages:
+            raise ValueError("StagedPipeline: at least one stage is required")
+        self._stages = stages
+        self._queue_size = max(1, int(queue_size))
+
+    def run(
+        self,
+        items: Iterable[Any],
+        *,
+        on_done: Callable[[Any, Any], None],
+        on_error: Callable[[Any, Exception], None],
+    ) -> None:
+        """
+        on_done(item, result)  — элемент прошёл все стадии (result) или завершён досрочно (result=None);
+        on_error(item, exc)    — исключение на любой стадии.
+
+        item в колбэках — исходный элемент из items.
+        """
+        n = len(self._stages)
+        queues: List[queue.Queue] = [queue.Queue(maxsize=self._queue_size) for _ in range(n)]
+        results: queue.Queue = queue.Queue()
+
+        alive = [int(max(1, st.workers)) for st in self._stages]
+        alive_lock = threading.Lock()
+
+        def worker(idx: int) -> None:
+            st = self._stages[idx]
+            q_in = queues[idx]
+            try:
+                while True:
+                    msg = q_in.get()
+                    if msg is _STOP:
+                        break
+                    origin, payload = msg
+                    try:
+                        out = st.fn(payload)
+                    except Exception as e:
+                        results.put(("error", origin, e))
+                        continue
+                    if out is None:
+                        results.put(("done", origin, None))
+                    elif idx + 1 < n:
+                        queues[idx + 1].put((origin, out))
+                    else:
+                        results.put(("done", origin, out))
+            finally:
+                with alive_lock:
+                    alive[idx] -= 1
+                    last = alive[idx] == 0
+                # последний воркер стадии закрывает следующую стадию
+                if last:
+                    if idx + 1 < n:
+                        for _ in range(alive[idx + 1]):
+                            queues[idx + 1].put(_STOP)
+                    else:
+                        results.put(("finished", None, None))
+
+        def feeder() -> None:
+            try:
+                for it in items:
+                    queues[0].put((it, it))
+            except Exception as e:
+                log.exception("pipeline feeder failed: %s", e)
+            finally:
+                for _ in range(alive[0]):
+                    queues[0].put(_STOP)
+
+        threads: List[threading.Thread] = []
+        for idx, st in enumerate(self._stages):
+            for k in range(alive[idx]):
+                t = threading.Thread(target=worker, args=(idx,), name=f"kb-{st.name}-{k}", daemon=True)
+                threads.append(t)
+
+        t_feed = threading.Thread(target=feeder, name="kb-feeder", daemon=True)
+        for t in threads:
+            t.start()
+        t_feed.start()
+
+        while True:
+            kind, origin, payload = results.get()
+            if kind == "finished":
+                break
+            try:
+                if kind == "error":
+                    on_error(origin, payload)
+                else:
+                    on_done(origin, payload)
+            except Exception as e:
+                log.warning("pipeline callback failed: %s", e)
+
+        t_feed.join()
+        for t in threads:
+            t.join()
+
+
+def run_serial(
+    items: Iterable[Any],
+    stages: List[Stage],
+    *,
+    on_done: Callable[[Any, Any], None],
+    on_error: Callable[[Any, Exception], None],
+) -> None:
+    """Тот же контракт, что и StagedPipeline.run, но без потоков (режим по умолчанию)."""
+    for it in items:
+        payload: Optional[Any] = it
+        try:
+            for st in stages:
+                payload = st.fn(payload)
+                if payload is None:
+                    break
+        except Exception as e:
+            on_error(it, e)
+            continue
+        on_done(it, payload)
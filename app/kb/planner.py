@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+
+def naive_utc(value: Union[datetime, str, None]) -> Optional[datetime]:
+    """
+    Диск отдаёт modified с таймзоной, а kb_documents.modified_at — timestamp без неё.
+    Сравниваем и пишем всегда в naive UTC, иначе aware != naive и каждый файл «изменён».
+    Строки ISO 8601 (SQLite отдаёт timestamp сырых запросов строкой) разбираются; нечитаемая — None.
+    """
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+# статусы, при которых документ индексируется заново, даже если метаданные не менялись
+RETRY_STATUSES = frozenset({"new", "outdated", "error"})
+
+
+def needs_reindex(disk: Dict[str, Any], db: Dict[str, Any]) -> bool:
+    """Те же правила, что KBRepo.document_needs_reindex, но без похода в БД."""
+    if db.get("indexed_at") is None or db.get("status") in RETRY_STATUSES:
+        return True
+
+    md5, old_md5 = disk.get("md5"), db.get("md5")
+    size, old_size = disk.get("size"), db.get("size")
+    modified, old_modified = naive_utc(disk.get("modified_at")), naive_utc(db.get("modified_at"))
+
+    if md5 and old_md5 and md5 != old_md5:
+        return True
+    if size is not None and old_size is not None and int(size) != int(old_size):
+        return True
+    if modified is not None and old_modified is not None and modified != old_modified:
+        return True
+
+    if old_md5 is None and md5 is not None:
+        return True
+    if old_size is None and size is not None:
+        return True
+    if old_modified is None and modified is not None:
+        return True
+    return False
+
+
+@dataclass
+class SyncPlan:
+    """
+    Результат сравнения снимка Диска с kb_documents.
+
+    new / outdated — файлы Диска (dict из KbSyncer._disk_files) к индексации;
+    reactivated — неактивные в БД документы, вернувшиеся на Диск без изменений;
+    unchanged — активные и актуальные; deleted — активные документы, которых нет на Диске.
+    """
+
+    new: List[Dict[str, Any]] = field(default_factory=list)
+    outdated: List[Dict[str, Any]] = field(default_factory=list)
+    reactivated: List[Dict[str, Any]] = field(default_factory=list)
+    unchanged: List[Dict[str, Any]] = field(default_factory=list)
+    deleted: List[Dict[str, Any]] = field(default_factory=list)
+    doc_ids: Dict[str, int] = field(default_factory=dict)  # path -> kb_documents.id (для уже известных)
+    upsert_status: Dict[str, str] = field(default_factory=dict)  # path -> status для upsert (to_upsert)
+
+    @property
+    def to_index(self) -> List[Dict[str, Any]]:
+        return self.new + self.outdated
+
+    @property
+    def to_upsert(self) -> List[Dict[str, Any]]:
+        return self.new + self.outdated + self.reactivated
+
+
+def plan_sync(disk_files: Iterable[Dict[str, Any]], db_docs: Iterable[Dict[str, Any]]) -> SyncPlan:
+    """
+    Один проход по снимку Диска и list_documents_brief(active_only=False), без запросов к БД.
+    """
+    plan = SyncPlan()
+    db_by_path = {d["path"]: d for d in db_docs}
+    seen = set()
+
+    for f in disk_files:
+        p = f["path"]
+        if p in seen:
+            continue
+        seen.add(p)
+        db = db_by_path.get(p)
+        if db is None:
+            plan.new.append(f)
+            plan.upsert_status[p] = "new"
+            continue
+        plan.doc_ids[p] = int(db["id"])
+        if needs_reindex(f, db):
+            plan.outdated.append(f)
+            # до конца индексации документ остаётся «outdated» — упавший sync повторит его; «error» не сбрасываем:
+            # от первой ошибки (updated_at) KBRepo.gc_documents отсчитывает срок до удаления чанков
+            if db.get("status") == "error":
+                plan.upsert_status[p] = "error"
+            else:
+                plan.upsert_status[p] = "new" if db.get("indexed_at") is None else "outdated"
+        elif not db.get("is_active", True):
+            plan.reactivated.append(f)
+            plan.upsert_status[p] = db.get("status") or "indexed"
+        else:
+            plan.unchanged.append(f)
+
+    for p, d in db_by_path.items():
+        if p not in seen and d.get("is_active", True):
+            plan.deleted.append({"id": int(d["id"]), "path": p})
+    return plan
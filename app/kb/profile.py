@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+# метрики, которые умеет поиск (KBRepo.search_by_embedding, ANN-индексы — *_cosine_ops)
+METRICS = ("cosine",)
+
+# параметр dimensions (Matryoshka-укорочение) поддерживают только text-embedding-3-*
+_DIMENSIONS_MODELS = ("text-embedding-3-",)
+
+
+def supports_dimensions(model: str) -> bool:
+    m = (model or "").lower()
+    return any(m.startswith(p) for p in _DIMENSIONS_MODELS)
+
+
+@dataclass(frozen=True)
+class IndexProfile:
+    """
+    Профиль индекса: чем построены векторы поколения kb_chunks.
+    Индексация и поиск по поколению обязаны использовать один и тот же профиль.
+
+    dimensions=None — родная размерность модели (запрос без параметра dimensions).
+    """
+
+    model: str
+    dimensions: Optional[int] = None
+    metric: str = "cosine"
+
+    def __post_init__(self) -> None:
+        if self.metric not in METRICS:
+            raise ValueError(f"unsupported metric: {self.metric} (supported: {', '.join(METRICS)})")
+        if self.dimensions is not None:
+            if int(self.dimensions) <= 0:
+                object.__setattr__(self, "dimensions", None)
+            elif not supports_dimensions(self.model):
+                raise ValueError(f"model {self.model} does not support the dimensions parameter")
+
+    @property
+    def key(self) -> str:
+        """Ключ для кэша embeddings: векторы разных размерностей одной модели не взаимозаменяемы."""
+        return f"{self.model}@{self.dimensions}" if self.dimensions else self.model
+
+    def as_generation(self) -> Dict[str, Any]:
+        """Поля kb_generations."""
+        return {"embedding_model": self.model, "embedding_dims": self.dimensions, "metric": self.metric}
+
+    @classmethod
+    def from_generation(cls, row: Optional[Dict[str, Any]], fallback: "IndexProfile") -> "IndexProfile":
+        """
+        Профиль поколения из kb_generations. Поколения, построенные до появления профиля
+        (embedding_model пуст), индексировались настроенной моделью в родной размерности.
+        """
+        if not row or not row.get("embedding_model"):
+            return cls(fallback.model)
+        return cls(str(row["embedding_model"]), row.get("embedding_dims") or None, row.get("metric") or "cosine")
+
+    def __str__(self) -> str:
+        return f"{self.model}/{self.dimensions or 'native'}/{self.metric}"
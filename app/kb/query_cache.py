@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.db.repo_kb import KBRepo
+from .embedding_cache import chunk_text_hash, normalize_chunk_text
+
+log = logging.getLogger(__name__)
+
+# префикс ключа модели в kb_embedding_cache: запросы живут рядом с чанками, но отдельно от них
+SHARED_PREFIX = "query:"
+
+
+def normalize_query(text: str) -> str:
+    """Как у чанков (NFC + пробелы) плюс регистр: «Что такое КПЭ?» и «что такое кпэ?» — один запрос."""
+    return normalize_chunk_text(text).casefold()
+
+
+class QueryEmbeddingCache:
+    """
+    Кэш embeddings пользовательских запросов: одинаковый вопрос не ходит в OpenAI повторно.
+
+    Ключ: (профиль индекса — модель@размерность, нормализованный запрос).
+    Первый уровень — in-process LRU на max_items записей с TTL; второй (если передан kb_repo) —
+    общая для всех экземпляров бота таблица kb_embedding_cache, записи с моделью 'query:<профиль>'
+    и тем же TTL по created_at. Ошибки общего уровня не мешают поиску.
+    """
+
+    def __init__(self, *, max_items: int = 1024, ttl_sec: int = 3600, kb_repo: Optional[KBRepo] = None):
+        self.max_items = max(1, int(max_items))
+        self.ttl_sec = max(1, int(ttl_sec))
+        self._repo = kb_repo
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, profile_key: str, query: str) -> Any:
+        key = (profile_key, normalize_query(query))
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                if now - item[0] < self.ttl_sec:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                del self._items[key]
+
+        vec = self._shared_get(key)
+        with self._lock:
+            if vec is None:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+        self._remember(key, vec)
+        return vec
+
+    def put(self, profile_key: str, query: str, vector: Any) -> None:
+        key = (profile_key, normalize_query(query))
+        self._remember(key, vector)
+        if self._repo is not None:
+            try:
+                self._repo.put_cached_embeddings(SHARED_PREFIX + key[0], [(chunk_text_hash(key[1]), vector)], refresh=True)
+            except Exception as e:
+                log.warning("query embedding cache store failed (ignored): %s", e)
+
+    def _remember(self, key: Tuple[str, str], vector: Any) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic(), vector)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def _shared_get(self, key: Tuple[str, str]) -> Any:
+        if self._repo is None:
+            return None
+        h = chunk_text_hash(key[1])
+        try:
+            return self._repo.get_cached_embeddings(SHARED_PREFIX + key[0], [h], max_age_sec=self.ttl_sec).get(h)
+        except Exception as e:
+            log.warning("query embedding cache lookup failed (continue without cache): %s", e)
+            return None
+
+    def prune_shared(self) -> int:
+        """Удаляет из общего уровня истёкшие записи (вызывается после sync)."""
+        if self._repo is None:
+            return 0
+        return self._repo.prune_cached_embeddings(SHARED_PREFIX, self.ttl_sec)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits, shared, misses, size, ev = self.hits, self.shared_hits, self.misses, len(self._items), self.evictions
+        total = hits + shared + misses
+        return {
+            "query_cache_hits": hits,
+            "query_cache_shared_hits": shared,
+            "query_cache_misses": misses,
+            "query_cache_hit_rate": f"{(100.0 * (hits + shared) / total):.1f}%" if total else "n/a",
+            "query_cache_size": f"{size}/{self.max_items}",
+            "query_cache_evictions": ev,
+        }
@@ -1,18 +1,185 @@
 # app/kb/retriever.py
 from __future__ import annotations
 
-from typing import Optional, List
+import threading
+import time
+from typing import Any, Dict, Optional, List, Tuple
 
 from ..db.repo_kb import KBRepo
-from ..clients.openai_client import OpenAIClient
 from ..core.types import RetrievedChunk
+from .embedder import Embedder
+from .profile import IndexProfile
+from .query_cache import QueryEmbeddingCache
+
+
+RETRIEVAL_MODES = ("vector", "hybrid")
+
+# совпадение хвоста одного чанка с началом следующего короче этого считается случайным
+MIN_OVERLAP = 16
+
+
+def overlap_len(a: str, b: str) -> int:
+    """
+    Длина самого длинного суффикса a, который является префиксом b: так split_text повторяет
+    chunk_overlap символов на стыке соседних чанков (с точностью до strip краёв).
+    """
+    if not a or not b:
+        return 0
+    start = max(0, len(a) - len(b))
+    i = a.find(b[0], start)
+    while i != -1:
+        if b.startswith(a[i:]):
+            k = len(a) - i
+            return k if k >= MIN_OVERLAP or k == len(b) else 0
+        i = a.find(b[0], i + 1)
+    return 0
+
+
+def join_chunks(texts: List[str]) -> str:
+    """Склейка подряд идущих чанков документа без повторов на стыках."""
+    out = ""
+    for t in texts:
+        t = t or ""
+        k = overlap_len(out, t)
+        # без перекрытия соседние чанки идут в тексте подряд, на стыке strip срезал пробел
+        out = out + t[k:] if k else (out + " " + t if out else t)
+    return out
+
+
+def collapse_copies(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Почти-дубликаты в выдаче по документам диалога: копия чанка (dup_of) хранит вектор оригинала и
+    получает тот же score, поэтому копии одного текста из разных файлов заняли бы подряд несколько мест.
+    Из группы COALESCE(dup_of, chunk_id) остаётся результат с лучшим местом.
+    """
+    seen = set()
+    out: List[Dict[str, Any]] = []
+    for r in rows:
+        key = int(r.get("dup_of") or r["chunk_id"])
+        if key not in seen:
+            seen.add(key)
+            out.append(r)
+    return out
+
+
+def merge_spans(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Результаты (с соседями из context, если запрошены) -> непересекающиеся фрагменты документов.
+
+    Фрагменты одного документа, чьи диапазоны chunk_order пересекаются или примыкают, сливаются:
+    место в выдаче и chunk_id — у лучшего из них, score — максимальный, текст — склейка по chunk_order
+    без повторов на стыках (join_chunks). Итоговый диапазон — в span (первый, последний chunk_order).
+    """
+    by_doc: Dict[int, List[Dict[str, Any]]] = {}
+    for pos, r in enumerate(rows):
+        parts = {int(r["chunk_order"]): r.get("text") or ""}
+        for o, t in r.get("context") or []:
+            parts.setdefault(int(o), t or "")
+        by_doc.setdefault(int(r["document_id"]), []).append(
+            {**r, "pos": pos, "parts": parts, "span": (min(parts), max(parts))}
+        )
+
+    merged: List[Dict[str, Any]] = []
+    for spans in by_doc.values():
+        spans.sort(key=lambda x: x["span"])
+        cur: Optional[Dict[str, Any]] = None
+        for sp in spans:
+            if cur is None or sp["span"][0] > cur["span"][1] + 1:
+                cur = sp
+                merged.append(cur)
+                continue
+            best, other = (cur, sp) if cur["pos"] <= sp["pos"] else (sp, cur)
+            lr = [x["lexical_rank"] for x in (cur, sp) if x.get("lexical_rank") is not None]
+            joined = {
+                **best,
+                "parts": {**other["parts"], **best["parts"]},
+                "span": (cur["span"][0], max(cur["span"][1], sp["span"][1])),
+                "score": max(float(cur.get("score") or 0.0), float(sp.get("score") or 0.0)),
+                "lexical_rank": min(lr) if lr else None,
+            }
+            merged[merged.index(cur)] = joined
+            cur = joined
+
+    merged.sort(key=lambda x: x["pos"])
+    for sp in merged:
+        sp["text"] = join_chunks([sp["parts"][o] for o in sorted(sp["parts"])])
+    return merged
 
 
 class Retriever:
-    def __init__(self, kb_repo: KBRepo, openai: OpenAIClient, dim: int):
+    def __init__(
+        self,
+        kb_repo: KBRepo,
+        embedder: Embedder,
+        *,
+        mode: str = "vector",
+        rrf_k: int = 60,
+        vector_weight: float = 1.0,
+        lexical_weight: float = 1.0,
+        candidates: int = 4,
+        query_cache: Optional[QueryEmbeddingCache] = None,
+        context_window: int = 0,
+        context_hits: int = 3,
+        route_docs: int = 0,
+        profile_ttl_sec: int = 30,
+    ):
+        """
+        mode="hybrid": векторная и полнотекстовая выдачи (по top_k * candidates кандидатов) приходят
+        и сливаются RRF с весами vector_weight / lexical_weight одним запросом (KBRepo.search_hybrid).
+        query_cache — embeddings повторяющихся запросов без обращения к OpenAI.
+        context_window > 0: к первым context_hits результатам тем же запросом подтягиваются по
+        context_window соседних чанков с каждой стороны (см. merge_spans).
+        route_docs > 0: двухуровневый поиск — если у диалога документов больше, чанки ищутся только
+        в route_docs из них, чьи центроиды ближе к запросу (KBRepo._route_documents).
+        profile_ttl_sec — сколько держать в памяти профиль активного поколения (query_embedder).
+        """
         self._repo = kb_repo
-        self._openai = openai
-        self._dim = dim  # dim сейчас не используется, но оставляем для совместимости
+        self._embedder = embedder
+        self.mode = mode if mode in RETRIEVAL_MODES else "vector"
+        self.rrf_k = max(1, int(rrf_k))
+        self.vector_weight = float(vector_weight)
+        self.lexical_weight = float(lexical_weight)
+        self.candidates = max(1, int(candidates))
+        self._query_cache = query_cache
+        self.context_window = max(0, int(context_window))
+        self.context_hits = max(0, int(context_hits))
+        self.route_docs = max(0, int(route_docs))
+        self.profile_ttl_sec = max(0, int(profile_ttl_sec))
+        self._profile_lock = threading.Lock()
+        self._profile: Optional[Tuple[int, float, Optional[Dict[str, Any]]]] = None  # (epoch, время, строка)
+
+    def query_embedder(self) -> Embedder:
+        """
+        Запрос эмбеддится профилем АКТИВНОГО поколения, а не настройками: после смены модели/размерности
+        и до /kb rebuild поиск идёт по старым векторам и должен оставаться в их пространстве.
+        Профиль кэшируется: сброс при activate_generation в этом процессе (KBRepo.generation_epoch),
+        переключение поколения другим экземпляром бота видно через profile_ttl_sec.
+        """
+        row = self._active_profile()
+        return self._embedder.for_profile(IndexProfile.from_generation(row, self._embedder.profile))
+
+    def _active_profile(self) -> Optional[Dict[str, Any]]:
+        epoch = self._repo.generation_epoch
+        now = time.monotonic()
+        with self._profile_lock:
+            hit = self._profile
+            if hit and hit[0] == epoch and now - hit[1] < self.profile_ttl_sec:
+                return hit[2]
+        row = self._repo.generation_profile()
+        with self._profile_lock:
+            self._profile = (epoch, now, row)
+        return row
+
+    def embed_query(self, query: str) -> Any:
+        embedder = self.query_embedder()
+        if self._query_cache is None:
+            return embedder.embed([query])[0]
+        key = embedder.profile.key
+        emb = self._query_cache.get(key, query)
+        if emb is None:
+            emb = embedder.embed([query])[0]
+            self._query_cache.put(key, query, emb)
+        return emb
 
     def retrieve(
         self,
@@ -21,55 +188,62 @@ class Retriever:
         top_k: int = 6,
         allowed_document_ids: Optional[List[int]] = None,
     ) -> list[RetrievedChunk]:
-        # Backward compatible: some code expects is_enabled(); some not.
-        if not self._openai:
+        if not self._embedder or not self._embedder.is_enabled():
             return []
-        if hasattr(self._openai, "is_enabled") and callable(getattr(self._openai, "is_enabled")):
-            if not self._openai.is_enabled():
-                return []
 
         query = (query or "").strip()
         if not query:
             return []
 
         # 1) embed query
-        emb = self._openai.embeddings([query], model="text-embedding-3-large")[0]
-
-        # 2) vector search in DB
-        # repo_kb.search_by_embedding returns list[dict] with keys:
-        # chunk_id, document_id, chunk_order, text, score
-        rows = self._repo.search_by_embedding(
-            emb,
-            limit=int(top_k),
-            document_ids=allowed_document_ids,
-        )
+        emb = self.embed_query(query)
 
+        # 2) search in DB: один запрос — чанки, документ (title/path/is_active) и соседи для контекстного окна
+        # repo_kb.search_* returns list[dict] with keys:
+        # chunk_id, document_id, chunk_order, text, score, title, path, is_active, context
+        # (+ vector_rank, lexical_rank, rrf для search_hybrid)
+        opts = {"window": self.context_window, "window_hits": self.context_hits, "route_docs": self.route_docs}
+        # по документам диалога почти-дубликаты не отсекаются в БД — берём с запасом под collapse_copies
+        limit = int(top_k) * (2 if allowed_document_ids else 1)
+        if self.mode == "hybrid":
+            rows = self._repo.search_hybrid(
+                emb,
+                query,
+                limit=limit,
+                candidates=int(top_k) * self.candidates,
+                rrf_k=self.rrf_k,
+                vector_weight=self.vector_weight,
+                lexical_weight=self.lexical_weight,
+                document_ids=allowed_document_ids,
+                **opts,
+            )
+        else:
+            rows = self._repo.search_by_embedding(
+                emb,
+                limit=limit,
+                document_ids=allowed_document_ids,
+                **opts,
+            )
+
+        # документ могли выключить после индексации (is_active=False) — его чанки в ответ не идут
+        rows = [r for r in rows if r.get("is_active", True)]
+        rows = collapse_copies(rows)[: int(top_k)]
         if not rows:
             return []
 
-        # 3) enrich with doc brief (title/path)
+        # 3) соседние/перекрывающиеся чанки одного документа -> один фрагмент без повторов
         out: List[RetrievedChunk] = []
-        doc_cache: dict[int, dict] = {}
-
-        for r in rows:
-            chunk_id = int(r.get("chunk_id"))
-            doc_id = int(r.get("document_id"))
-            text = str(r.get("text") or "")
-            score = float(r.get("score") or 0.0)
-
-            if doc_id not in doc_cache:
-                doc_cache[doc_id] = self._repo.get_document_brief(doc_id) or {"title": None, "path": None}
-
-            brief = doc_cache[doc_id]
-
+        for r in merge_spans(rows):
             out.append(
                 RetrievedChunk(
-                    id=chunk_id,
-                    text=text,
-                    score=score,
-                    document_id=doc_id,
-                    document_title=brief.get("title"),
-                    document_path=brief.get("path"),
+                    id=int(r["chunk_id"]),
+                    text=str(r.get("text") or ""),
+                    score=float(r.get("score") or 0.0),
+                    document_id=int(r["document_id"]),
+                    document_title=r.get("title"),
+                    document_path=r.get("path"),
+                    lexical_rank=r.get("lexical_rank"),
+                    span=r.get("span"),
                 )
             )
 
@@ -1,25 +1,22 @@
 from __future__ import annotations
 
 import logging
+import tempfile
 import time
 import threading
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Any, Callable, Dict, List, Optional, Tuple
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 from app.settings import Settings
-from app.db.repo_kb import KBRepo
+from app.db.repo_kb import ANN_INDEX_KINDS, KBRepo
+from app.kb.dedup import strip_boilerplate
 from app.kb.indexer import KbIndexer
-from app.kb.parsers import (
-    detect_ext,
-    is_image_ext,
-    parse_csv_bytes,
-    parse_docx_bytes,
-    parse_image_bytes_best_effort,
-    parse_pdf_bytes,
-    parse_txt_bytes,
-    parse_xlsx_bytes,
-)
+from app.kb.parse_pool import ParsePool
+from app.kb.pipeline import Stage, StagedPipeline, run_serial
+from app.kb.planner import SyncPlan, naive_utc, plan_sync
+from app.kb.profile import IndexProfile
+from app.kb.parsers import Source, iter_file_text
 
 log = logging.getLogger(__name__)
 
@@ -34,6 +31,41 @@ class ScanReport:
     new: List[Dict[str, Any]]
     outdated: List[Dict[str, Any]]
     deleted: List[Dict[str, Any]]
+    unchanged: int = 0
+
+
+@dataclass
+class _SyncJob:
+    """Состояние одного файла Диска, проходящего через стадии sync."""
+
+    file: Dict[str, Any]
+    document_id: Optional[int] = None
+    data: Optional[Source] = None  # скачанный файл (spool или bytes)
+    text: Optional[IO[str]] = None  # spool с извлечённым текстом
+    chunks: int = 0
+    indexed: bool = False
+    cached: bool = False  # текст из кэша извлечённого текста (/kb rechunk): без скачивания и парсинга
+
+    @property
+    def path(self) -> str:
+        return self.file["path"]
+
+    @property
+    def title(self) -> str:
+        return self.file.get("title") or self.path.split("/")[-1]
+
+
+@dataclass
+class _RunResult:
+    """Итог прогона _SyncJob через стадии (общий для sync и rebuild)."""
+
+    ok: int = 0
+    fail: int = 0
+    processed: int = 0
+    elapsed: float = 0.0
+    mode: str = "serial"
+    failed_ids: List[int] = field(default_factory=list)
+    parse: Dict[str, Any] = field(default_factory=dict)  # счётчики ParsePool (процессы, таймауты, перезапуски)
 
 
 @dataclass
@@ -51,18 +83,43 @@ class KbSyncer:
     Публичный API соответствует handlers/kb.py:
       - scan() -> ScanReport (new/outdated/deleted)
       - sync() -> (ScanReport, ok, fail, deleted_count)
+      - rebuild() -> Dict[str, Any] (полная перестройка в новом поколении индекса)
+      - rechunk() -> Dict[str, Any] (то же из кэша извлечённого текста, без Диска)
+      - gc_documents() -> Dict[str, Any] (чанки удалённых с Диска и error-документов)
       - status_summary() -> Dict[str, Any]
     """
 
-    def __init__(self, settings: Settings, repo: KBRepo, indexer: KbIndexer, yandex_client: Any):
+    def __init__(
+        self,
+        settings: Settings,
+        repo: KBRepo,
+        indexer: KbIndexer,
+        yandex_client: Any,
+        *,
+        downloader: Any = None,
+        query_cache: Any = None,
+        text_cache: Any = None,
+    ):
         self._cfg = settings
         self._repo = repo
         self._indexer = indexer
         self._y = yandex_client
+        # чем качать файлы в sync (например, BlockingAsyncDownloader); по умолчанию — сам клиент Диска
+        self._dl = downloader or yandex_client
+        # кэш embeddings запросов (QueryEmbeddingCache): счётчики в /kb status, чистка общего уровня после sync
+        self._query_cache = query_cache
+        # кэш извлечённого текста (TextCache): sync кладёт текст разобранных файлов, /kb rechunk читает
+        self._text_cache = text_cache
 
         # Защита от одновременных /kb sync
         self._sync_lock = threading.Lock()
 
+        # Статистика последнего sync (режим, время, docs/sec) — для /kb status
+        self.last_sync_stats: Dict[str, Any] = {}
+        # сколько колонтитулов убрано за текущий sync (парсинг идёт в нескольких потоках)
+        self._boilerplate: Dict[str, int] = {}
+        self._boilerplate_lock = threading.Lock()
+
     # -----------------------------
     # helpers
     # -----------------------------
@@ -77,28 +134,98 @@ class KbSyncer:
                 return None
         return None
 
-    def _parse_to_text(self, filename: str, data: bytes) -> str:
-        ext = detect_ext(filename)
-
-        if ext in ("txt", "md", "log"):
-            return parse_txt_bytes(data)
-
-        if ext == "pdf":
-            return parse_pdf_bytes(data)
-
-        if ext == "docx":
-            return parse_docx_bytes(data)
+    def _iter_text(self, filename: str, src: Source) -> Iterator[str]:
+        """Текст файла потоком фрагментов (вместе с разделителями), без сборки в одну строку."""
+        strip = bool(getattr(self._cfg, "kb_strip_boilerplate", True))
+        return iter_file_text(
+            filename,
+            src,
+            pdf_max_pages=int(getattr(self._cfg, "kb_pdf_max_pages", 0)) or None,
+            pdf_pages=self._strip_boilerplate if strip else None,
+        )
 
-        if ext in ("xlsx", "xls"):
-            return parse_xlsx_bytes(data)
+    def _strip_boilerplate(self, pages: Iterator[str]) -> Iterator[str]:
+        st: Dict[str, int] = {}
+        try:
+            yield from strip_boilerplate(pages, stats=st)
+        finally:
+            self._add_boilerplate(st)
+
+    def _add_boilerplate(self, st: Dict[str, int]) -> None:
+        with self._boilerplate_lock:
+            for k, v in st.items():
+                self._boilerplate[k] = self._boilerplate.get(k, 0) + v
+
+    def _reset_savings(self) -> None:
+        with self._boilerplate_lock:
+            self._boilerplate = {}
+        self._indexer.reset_dedup_stats()
+
+    def _savings(self) -> Dict[str, Any]:
+        """Что не ушло в embeddings за sync: убранные колонтитулы PDF и почти-дубликаты чанков (app.kb.dedup)."""
+        with self._boilerplate_lock:
+            bp = dict(self._boilerplate)
+        dd = self._indexer.dedup_stats()
+        return {
+            "boilerplate_docs": bp.get("documents", 0),
+            "boilerplate_lines": bp.get("lines", 0),
+            "boilerplate_tokens": bp.get("tokens", 0),
+            "dup_chunks": dd.get("dedup_duplicates", 0),
+            "dup_tokens_saved": dd.get("dedup_tokens_saved", 0),
+            "dup_relinked": dd.get("dedup_relinked", 0),
+        }
 
-        if ext == "csv":
-            return parse_csv_bytes(data)
+    def _parse_to_text(self, filename: str, data: bytes) -> str:
+        return "".join(self._iter_text(filename, data))
+
+    def _new_parse_pool(self) -> Optional[ParsePool]:
+        """Процессы для разбора PDF/DOCX/XLSX на время одного sync/rebuild (KB_PARSE_PROCESSES > 0)."""
+        n = int(getattr(self._cfg, "kb_parse_processes", 0) or 0)
+        if n <= 0:
+            return None
+        return ParsePool(
+            n,
+            timeout_sec=float(getattr(self._cfg, "kb_parse_timeout_sec", 120)),
+            max_files_per_worker=int(getattr(self._cfg, "kb_parse_max_files_per_worker", 50)),
+            memory_mb=int(getattr(self._cfg, "kb_parse_memory_mb", 1024)),
+            pdf_max_pages=int(getattr(self._cfg, "kb_pdf_max_pages", 0)) or None,
+            strip_boilerplate=bool(getattr(self._cfg, "kb_strip_boilerplate", True)),
+        )
 
-        if is_image_ext(ext):
-            return parse_image_bytes_best_effort(data)
+    def _spool_text(self, filename: str, src: Source, pool: Optional[ParsePool] = None) -> Optional[IO[str]]:
+        """
+        Парсит файл во временный текстовый spool (в памяти до KB_TEXT_SPOOL_MB, дальше — на диске).
+        PDF/DOCX/XLSX при заданном pool разбираются в отдельном процессе (текст — во временном файле пула).
+        Возвращает None, если непробельного текста нет.
+        """
+        if pool is not None and pool.handles(filename):
+            text, bp = pool.parse(filename, src)
+            self._add_boilerplate(bp)
+            return text
+        max_mem = int(getattr(self._cfg, "kb_text_spool_mb", 4)) * 1024 * 1024
+        spool = tempfile.SpooledTemporaryFile(max_size=max_mem, mode="w+", encoding="utf-8")
+        has_text = False
+        try:
+            for piece in self._iter_text(filename, src):
+                if piece:
+                    spool.write(piece)
+                    has_text = has_text or bool(piece.strip())
+        except Exception:
+            spool.close()
+            raise
+        if not has_text:
+            spool.close()
+            return None
+        spool.seek(0)
+        return spool
 
-        return ""
+    @staticmethod
+    def _iter_spool(spool: IO[str], block: int = 64 * 1024) -> Iterator[str]:
+        while True:
+            t = spool.read(block)
+            if not t:
+                break
+            yield t
 
     def _disk_files(self) -> List[Dict[str, Any]]:
         raw: List[Dict[str, Any]] = self._y.list_kb_files_metadata() or []
@@ -133,162 +260,544 @@ class KbSyncer:
     # -----------------------------
     # public API
     # -----------------------------
+    def _plan(self) -> SyncPlan:
+        """Снимок Диска и kb_documents — по одному запросу, сравнение в памяти."""
+        return plan_sync(self._disk_files(), self._repo.list_documents_brief(active_only=False))
+
+    @staticmethod
+    def _report(plan: SyncPlan) -> ScanReport:
+        return ScanReport(
+            new=[{"path": f["path"], "title": f.get("title")} for f in plan.new],
+            outdated=[{"id": plan.doc_ids[f["path"]], "path": f["path"], "title": f.get("title")} for f in plan.outdated],
+            deleted=list(plan.deleted),
+            unchanged=len(plan.unchanged) + len(plan.reactivated),
+        )
+
     def scan(self) -> ScanReport:
-        disk = self._disk_files()
-        disk_by_path = {x["path"]: x for x in disk}
+        return self._report(self._plan())
 
-        db_docs = self._repo.list_documents_brief(active_only=True)
-        db_by_path = {x["path"]: x for x in db_docs}
+    def _apply_plan(self, plan: SyncPlan) -> Tuple[Dict[str, int], int]:
+        """
+        Метаданные new/outdated/reactivated — пакетным upsert, исчезнувшие с Диска —
+        одним UPDATE по id. Неизменённые документы не трогаем вовсе.
+        Возвращает ({path: document_id}, deleted_count).
+        """
+        rows = [
+            {
+                "path": f["path"],
+                "title": f.get("title"),
+                "resource_id": f.get("resource_id"),
+                "md5": f.get("md5"),
+                "size": f.get("size"),
+                "modified_at": naive_utc(f.get("modified_at")),
+                "status": plan.upsert_status.get(f["path"]),
+            }
+            for f in plan.to_upsert
+        ]
+        ids = dict(plan.doc_ids)
+        ids.update(self._repo.upsert_documents_bulk(rows))
 
-        new: List[Dict[str, Any]] = []
-        outdated: List[Dict[str, Any]] = []
-        deleted: List[Dict[str, Any]] = []
+        deleted = 0
+        try:
+            deleted = self._repo.deactivate_documents([d["id"] for d in plan.deleted])
+        except Exception as e:
+            log.warning("deactivate_documents failed (continue): %s", e)
+        return ids, deleted
+
+    def _pipeline_stages(
+        self,
+        generation: Optional[int] = None,
+        indexer: Optional[KbIndexer] = None,
+        parse_pool: Optional[ParsePool] = None,
+    ) -> List[Stage]:
+        """
+        download -> parse -> index; каждая стадия работает с одним _SyncJob
+        (document_id уже известен из пакетного upsert, см. _apply_plan).
 
-        for p, d in db_by_path.items():
-            if p not in disk_by_path:
-                deleted.append({"id": d["id"], "path": p})
+        parse пишет текст во временный spool, index читает его потоком и
+        режет/эмбеддит/пишет окнами — память не зависит от размера файла.
+        parse_pool — PDF/DOCX/XLSX разбираются в процессах (потоков parse не меньше, чем процессов).
+        indexer — с профилем embeddings того поколения, в которое идёт запись.
+        """
+        indexer = indexer or self._indexer
+
+        def download(job: _SyncJob) -> _SyncJob:
+            if job.cached:
+                return job
+            if hasattr(self._dl, "download_to_spool"):
+                job.data = self._dl.download_to_spool(job.path, size=job.file.get("size"))
+            else:
+                job.data = self._dl.download(job.path)
+            return job
+
+        def parse(job: _SyncJob) -> Optional[_SyncJob]:
+            did = int(job.document_id or 0)
+            if job.cached:
+                job.text = self._text_cache.load(did, job.file.get("md5"))
+                if job.text is not None:
+                    return job
+                # запись пропала или не читается — обычный путь
+                job.cached = False
+                download(job)
+            try:
+                job.text = self._spool_text(job.title, job.data if job.data is not None else b"", parse_pool)
+            finally:
+                if hasattr(job.data, "close"):
+                    job.data.close()
+                job.data = None
+            if job.text is not None and self._text_cache is not None:
+                self._text_cache.store(did, job.file.get("md5"), job.text)
+            if job.text is None:
+                self._repo.set_document_status(
+                    document_id=did,
+                    status="skipped",
+                    last_error="Empty text after parsing (possibly encrypted PDF or unsupported format).",
+                )
+                return None
+            return job
 
-        for p, f in disk_by_path.items():
-            db = db_by_path.get(p)
-            if not db:
-                new.append({"path": p, "title": f.get("title")})
-                continue
+        def index(job: _SyncJob) -> _SyncJob:
+            did = int(job.document_id or 0)
+            try:
+                job.chunks = indexer.reindex_document(did, pieces=self._iter_spool(job.text), generation=generation)
+            finally:
+                job.text.close()
+                job.text = None
+            self._repo.set_document_indexed(document_id=did)
+            job.indexed = True
+            return job
+
+        cfg = self._cfg
+        parse_workers = int(getattr(cfg, "kb_sync_parse_workers", 2))
+        if parse_pool is not None:
+            parse_workers = max(parse_workers, parse_pool.processes)
+        return [
+            Stage("download", download, workers=int(getattr(cfg, "kb_sync_download_workers", 4))),
+            Stage("parse", parse, workers=parse_workers),
+            Stage("index", index, workers=int(getattr(cfg, "kb_sync_index_workers", 2))),
+        ]
+
+    def _run_jobs(
+        self,
+        jobs: List[_SyncJob],
+        *,
+        progress_cb: Optional[ProgressCB],
+        pipeline: Optional[bool],
+        generation: Optional[int] = None,
+        indexer: Optional[KbIndexer] = None,
+    ) -> _RunResult:
+        """Прогоняет jobs через download -> parse -> index (конвейером или последовательно)."""
+        res = _RunResult()
+        total = len(jobs)
+        last_emit = 0.0
+
+        def emit(path: str) -> None:
+            nonlocal last_emit
+            if not progress_cb:
+                return
+            now = time.time()
+            # не спамим телегу: раз в ~1.5 сек или на финале
+            if (now - last_emit) < 1.5 and res.processed < total:
+                return
+            last_emit = now
+            try:
+                progress_cb(res.processed, total, path, res.ok, res.fail)
+            except Exception:
+                pass
 
-            needs = self._repo.document_needs_reindex(
-                document_id=int(db["id"]),
-                md5=f.get("md5"),
-                modified_at=f.get("modified_at"),
-                size=f.get("size"),
-            )
-            if needs:
-                outdated.append({"id": int(db["id"]), "path": p, "title": f.get("title")})
+        def on_done(job: _SyncJob, result: Optional[_SyncJob]) -> None:
+            if result is not None and result.indexed:
+                log.info("KB indexed %s chunks for %s", result.chunks, job.path)
+                res.ok += 1
+            res.processed += 1
+            emit(job.path)
 
-        return ScanReport(new=new, outdated=outdated, deleted=deleted)
+        def on_error(job: _SyncJob, e: Exception) -> None:
+            log.error("KB sync failed for path=%s: %s", job.path, e, exc_info=e)
+            try:
+                if job.document_id:
+                    self._repo.set_document_status(document_id=job.document_id, status="error", last_error=str(e))
+            except Exception:
+                pass
+            if job.document_id:
+                res.failed_ids.append(int(job.document_id))
+            res.fail += 1
+            res.processed += 1
+            emit(job.path)
+
+        use_pipeline = bool(getattr(self._cfg, "kb_sync_pipeline", False)) if pipeline is None else bool(pipeline)
+        res.mode = "pipeline" if use_pipeline else "serial"
+        pool = self._new_parse_pool() if jobs else None
+        stages = self._pipeline_stages(generation, indexer, pool)
+
+        t0 = time.monotonic()
+        try:
+            if use_pipeline:
+                StagedPipeline(stages, queue_size=int(getattr(self._cfg, "kb_sync_queue_size", 8))).run(
+                    jobs, on_done=on_done, on_error=on_error
+                )
+                # index-воркеры пишут параллельно: одинаковые файлы друг друга в match не видели
+                if int(getattr(self._cfg, "kb_sync_index_workers", 2)) > 1:
+                    (indexer or self._indexer).relink_duplicates()
+            else:
+                run_serial(jobs, stages, on_done=on_done, on_error=on_error)
+        finally:
+            if pool is not None:
+                res.parse = pool.stats()
+                pool.close()
+        res.elapsed = max(1e-6, time.monotonic() - t0)
 
-    def sync(self, *, progress_cb: Optional[ProgressCB] = None) -> Tuple[ScanReport, int, int, int]:
+        # финальный emit
+        if progress_cb:
+            try:
+                progress_cb(total, total, "<done>", res.ok, res.fail)
+            except Exception:
+                pass
+        return res
+
+    def sync(
+        self,
+        *,
+        progress_cb: Optional[ProgressCB] = None,
+        pipeline: Optional[bool] = None,
+    ) -> Tuple[ScanReport, int, int, int]:
         """
         Возвращает:
           (report, ok, fail, deleted_count)
 
         progress_cb(processed, total, current_path, ok, fail) — опционально.
+        pipeline — конвейерный режим (по умолчанию из settings.kb_sync_pipeline).
         """
         if not self._sync_lock.acquire(blocking=False):
             raise RuntimeError("KB sync is already running")
 
         try:
-            report = self.scan()
+            t_plan = time.monotonic()
+            plan = self._plan()
+            report = self._report(plan)
+            ids, deleted_count = self._apply_plan(plan)
+            plan_sec = time.monotonic() - t_plan
+
+            jobs = [_SyncJob(file=f, document_id=ids.get(f["path"])) for f in plan.to_index]
+            scanned = len(plan.to_index) + len(plan.unchanged) + len(plan.reactivated)
+
+            # sync дописывает в активное поколение — его векторами, даже если в настройках уже другой профиль
+            active, configured = self._active_profile()
+            if active != configured and self._repo.adopt_generation_profile(
+                self._repo.active_generation(), **self._indexer.profile()
+            ):
+                # пустое поколение (первый sync): перестраивать нечего — сразу профиль из настроек
+                log.info("KB sync: active generation is empty, using profile from settings %s", configured)
+                active = configured
+            if active != configured:
+                log.warning(
+                    "KB sync: active generation uses profile %s, settings say %s — indexing with %s; "
+                    "run /kb rebuild to switch",
+                    active,
+                    configured,
+                    active,
+                )
+            indexer = self._indexer.for_profile(active)
+
+            self._reset_savings()
+            run = self._run_jobs(jobs, progress_cb=progress_cb, pipeline=pipeline, indexer=indexer)
+            # первый sync (или индекс потерян) — строим; дальше индекс обновляется на вставках
+            self._ensure_ann_index()
+            self._ensure_fts_index()
+            self._ensure_document_vectors()
+            self._prune_query_cache()
+            gc = self._gc_documents()
+
+            self.last_sync_stats = {
+                "mode": run.mode,
+                "elapsed_sec": round(run.elapsed, 2),
+                "docs_per_sec": round(run.processed / run.elapsed, 2),
+                "indexed_per_sec": round(run.ok / run.elapsed, 2),
+                "plan_sec": round(plan_sec, 2),
+                "unchanged": report.unchanged,
+                "gc_chunks": gc.get("chunks", 0),
+                "gc_mb": round(gc.get("bytes", 0) / 2**20, 1),
+                **self._savings(),
+                **run.parse,
+            }
 
-            ok = 0
-            fail = 0
+            log.info(
+                "KB sync finished: scanned=%s to_index=%s unchanged=%s ok=%s fail=%s deleted=%s plan=%.1fs "
+                "mode=%s elapsed=%.1fs docs/s=%.2f duplicates=%s tokens_saved=%s",
+                scanned,
+                len(jobs),
+                report.unchanged,
+                run.ok,
+                run.fail,
+                deleted_count,
+                plan_sec,
+                run.mode,
+                run.elapsed,
+                self.last_sync_stats["docs_per_sec"],
+                self.last_sync_stats["dup_chunks"],
+                self.last_sync_stats["dup_tokens_saved"] + self.last_sync_stats["boilerplate_tokens"],
+            )
+            return report, run.ok, run.fail, deleted_count
+        finally:
+            try:
+                self._sync_lock.release()
+            except Exception:
+                pass
 
-            disk_files = self._disk_files()
-            total = len(disk_files)
-            scanned = total
+    def _configured_profile(self) -> IndexProfile:
+        p = self._indexer.profile()
+        return IndexProfile(p.get("embedding_model") or "", p.get("embedding_dims"), p.get("metric") or "cosine")
 
-            # delete-propagation
+    def _active_profile(self) -> Tuple[IndexProfile, IndexProfile]:
+        """(профиль активного поколения, профиль из настроек)."""
+        configured = self._configured_profile()
+        return IndexProfile.from_generation(self._repo.generation_profile(), configured), configured
+
+    def _ensure_ann_index(self, generation: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """ANN-индекс поколения после загрузки; ошибка сборки не роняет sync — поиск останется точным."""
+        kind = str(getattr(self._cfg, "kb_ann_index", "hnsw") or "off").lower()
+        if kind not in ANN_INDEX_KINDS:
+            return None
+        try:
+            res = self._repo.ensure_ann_index(
+                generation,
+                kind=kind,
+                m=int(getattr(self._cfg, "kb_ann_m", 16)),
+                ef_construction=int(getattr(self._cfg, "kb_ann_ef_construction", 64)),
+                lists=int(getattr(self._cfg, "kb_ann_lists", 0)),
+                build_mem_mb=int(getattr(self._cfg, "kb_ann_build_mem_mb", 0)),
+            )
+        except Exception as e:
+            log.warning("KB ANN index for generation %s not built (search stays exact): %s", generation, e)
+            return None
+        if res.get("created"):
+            log.info("KB ANN index built: %s", res)
+        elif res.get("skipped"):
+            log.info("KB ANN index skipped: %s", res)
+        return res
+
+    def _ensure_fts_index(self) -> None:
+        """
+        Для KB_RETRIEVAL_MODE=hybrid: дозаполнить text_tsv у старых чанков (пачками, как GC) и построить
+        GIN-индекс. Ошибка не роняет sync — гибридный поиск без индекса работает как векторный.
+        """
+        if str(getattr(self._cfg, "kb_retrieval_mode", "vector") or "").lower() != "hybrid":
+            return
+        try:
+            filled = self._repo.backfill_fts(
+                batch=int(getattr(self._cfg, "kb_gc_batch", 5000)),
+                pause_sec=int(getattr(self._cfg, "kb_gc_pause_ms", 50)) / 1000.0,
+            )
+            res = self._repo.ensure_fts_index()
+        except Exception as e:
+            log.warning("KB full-text index not built (hybrid search stays vector-only): %s", e)
+            return
+        if filled or res.get("created"):
+            log.info("KB full-text index: backfilled=%s %s", filled, res)
+
+    def _ensure_document_vectors(self, generation: Optional[int] = None) -> None:
+        """
+        Для KB_ROUTE_DOCS > 0: центроиды документов, проиндексированных до kb_document_vectors (пачками, как GC).
+        Ошибка не роняет sync — документы без центроида двухуровневый поиск не отсекает.
+        """
+        if int(getattr(self._cfg, "kb_route_docs", 0) or 0) <= 0:
+            return
+        try:
+            n = self._repo.backfill_document_vectors(
+                generation, pause_sec=int(getattr(self._cfg, "kb_gc_pause_ms", 50)) / 1000.0
+            )
+        except Exception as e:
+            log.warning("KB document vectors not backfilled (routing keeps those documents): %s", e)
+            return
+        if n:
+            log.info("KB document vectors: backfilled=%s", n)
+
+    def _gc_documents(self, *, vacuum: bool = False) -> Dict[str, Any]:
+        """Чанки документов, удалённых с Диска или в error дольше KB_GC_GRACE_SEC; ошибка не роняет sync."""
+        try:
+            res = self._repo.gc_documents(
+                grace_sec=int(getattr(self._cfg, "kb_gc_grace_sec", 86400)),
+                batch=int(getattr(self._cfg, "kb_gc_batch", 5000)),
+                pause_sec=int(getattr(self._cfg, "kb_gc_pause_ms", 50)) / 1000.0,
+                vacuum=vacuum,
+            )
+        except Exception as e:
+            log.warning("KB gc of inactive documents failed (will retry on next sync): %s", e)
+            return {}
+        if res.get("chunks"):
+            log.info("KB gc: %s", res)
+        return res
+
+    def gc_documents(self) -> Dict[str, Any]:
+        """
+        /kb gc: то же, что в конце sync, и VACUUM (ANALYZE) kb_chunks после удаления.
+        Держит тот же lock, что и sync: документ не вернётся на Диск посреди удаления его чанков.
+        """
+        if not self._sync_lock.acquire(blocking=False):
+            raise RuntimeError("KB sync is already running")
+        try:
+            return self._gc_documents(vacuum=True)
+        finally:
+            self._sync_lock.release()
+
+    def _prune_query_cache(self) -> None:
+        if self._query_cache is None:
+            return
+        try:
+            n = self._query_cache.prune_shared()
+        except Exception as e:
+            log.warning("KB query cache prune failed (ignored): %s", e)
+            return
+        if n:
+            log.info("KB query cache: pruned %s expired shared entries", n)
+
+    def _gc_generation(self, generation: int) -> int:
+        try:
+            return self._repo.gc_generation(
+                generation,
+                batch=int(getattr(self._cfg, "kb_gc_batch", 5000)),
+                pause_sec=int(getattr(self._cfg, "kb_gc_pause_ms", 50)) / 1000.0,
+            )
+        except Exception as e:
+            log.warning("KB gc of generation %s failed (will retry on next rebuild): %s", generation, e)
+            return 0
+
+    def rebuild(
+        self,
+        *,
+        progress_cb: Optional[ProgressCB] = None,
+        pipeline: Optional[bool] = None,
+    ) -> Dict[str, Any]:
+        """
+        Полная перестройка индекса (после смены chunk size / модели embeddings) без простоя:
+        все документы Диска индексируются в новое поколение kb_chunks, пока поиск читает
+        старое; затем одно UPDATE переключает активное поколение, а старое удаляется пачками.
+
+        Документы, которые не удалось проиндексировать, переносятся из старого поколения
+        как есть (если профиль embeddings тот же), чтобы после переключения они не пропали из поиска.
+        Держит тот же lock, что и sync.
+        """
+        if not self._sync_lock.acquire(blocking=False):
+            raise RuntimeError("KB sync is already running")
+        try:
+            return self._rebuild(progress_cb=progress_cb, pipeline=pipeline, from_cache=False)
+        finally:
             try:
-                self._repo.mark_all_documents_inactive()
-            except Exception as e:
-                log.warning("mark_all_documents_inactive failed (continue): %s", e)
-
-            last_emit = 0.0
-
-            def emit(processed: int, path: str) -> None:
-                nonlocal last_emit
-                if not progress_cb:
-                    return
-                now = time.time()
-                # не спамим телегу: раз в ~1.5 сек или на финале
-                if (now - last_emit) < 1.5 and processed < total:
-                    return
-                last_emit = now
-                try:
-                    progress_cb(processed, total, path, ok, fail)
-                except Exception:
-                    pass
-
-            processed = 0
-            for f in disk_files:
-                path = f["path"]
-                title = f.get("title") or path.split("/")[-1]
-                resource_id = f.get("resource_id")
-                md5 = f.get("md5")
-                size = f.get("size")
-                modified_at = f.get("modified_at")
-
-                document_id: Optional[int] = None
-                try:
-                    document_id = self._repo.upsert_document(
-                        path=path,
-                        title=title,
-                        resource_id=resource_id,
-                        md5=md5,
-                        size=size,
-                        modified_at=modified_at,
-                        is_active=True,
-                        status=None,
-                        last_error=None,
-                    )
-
-                    needs = self._repo.document_needs_reindex(
-                        document_id=document_id,
-                        md5=md5,
-                        modified_at=modified_at,
-                        size=size,
-                    )
-                    if not needs:
-                        processed += 1
-                        emit(processed, path)
-                        continue
-
-                    data: bytes = self._y.download(path)
-                    text = self._parse_to_text(title, data).strip()
-
-                    if not text:
-                        self._repo.set_document_status(
-                            document_id=document_id,
-                            status="skipped",
-                            last_error="Empty text after parsing (possibly encrypted PDF or unsupported format).",
-                        )
-                        processed += 1
-                        emit(processed, path)
-                        continue
-
-                    n = self._indexer.reindex_document(document_id=document_id, text=text)
-                    self._repo.set_document_indexed(document_id=document_id)
-
-                    log.info("KB indexed %s chunks for %s", n, path)
-                    ok += 1
-
-                except Exception as e:
-                    log.exception("KB sync failed for path=%s: %s", path, e)
-                    try:
-                        if document_id:
-                            self._repo.set_document_status(document_id=document_id, status="error", last_error=str(e))
-                    except Exception:
-                        pass
-                    fail += 1
-
-                processed += 1
-                emit(processed, path)
-
-            deleted_count = len(report.deleted)
-            log.info("KB sync finished: scanned=%s ok=%s fail=%s deleted=%s", scanned, ok, fail, deleted_count)
-
-            # финальный emit
-            if progress_cb:
-                try:
-                    progress_cb(total, total, "<done>", ok, fail)
-                except Exception:
-                    pass
-
-            return report, ok, fail, deleted_count
+                self._sync_lock.release()
+            except Exception:
+                pass
+
+    def rechunk(
+        self,
+        *,
+        progress_cb: Optional[ProgressCB] = None,
+        pipeline: Optional[bool] = None,
+    ) -> Dict[str, Any]:
+        """
+        /kb rechunk: перестройка в новом поколении, как rebuild, но без Диска — текст активных документов
+        берётся из кэша извлечённого текста (KB_TEXT_CACHE), поэтому смена CHUNK_SIZE / KB_CHUNKER / модели
+        embeddings упирается в embeddings, а не в скачивание и парсинг. Проиндексированные документы, текста
+        которых в кэше нет (до включения кэша), скачиваются и разбираются как при rebuild — и попадают в кэш.
+        Список документов — из kb_documents (новые и изменённые на Диске файлы подберёт следующий sync).
+        """
+        if self._text_cache is None:
+            raise RuntimeError("KB text cache is disabled (KB_TEXT_CACHE=false): use /kb rebuild")
+        if not self._sync_lock.acquire(blocking=False):
+            raise RuntimeError("KB sync is already running")
+        try:
+            return self._rebuild(progress_cb=progress_cb, pipeline=pipeline, from_cache=True)
         finally:
             try:
                 self._sync_lock.release()
             except Exception:
                 pass
 
+    def _cached_jobs(self) -> List[_SyncJob]:
+        """Задания /kb rechunk: активные документы с текстом в кэше и проиндексированные без него."""
+        versions = self._text_cache.versions()
+        jobs: List[_SyncJob] = []
+        for d in self._repo.list_documents_brief(active_only=True):
+            cached = bool(d["md5"]) and versions.get(d["id"]) == d["md5"]
+            if not cached and d["status"] != "indexed":
+                continue
+            f = {"path": d["path"], "title": d["path"].split("/")[-1], "md5": d["md5"], "size": d["size"]}
+            jobs.append(_SyncJob(file=f, document_id=d["id"], cached=cached))
+        return jobs
+
+    def _rebuild(self, *, progress_cb: Optional[ProgressCB], pipeline: Optional[bool], from_cache: bool) -> Dict[str, Any]:
+        op = "rechunk" if from_cache else "rebuild"
+        gc_deleted = 0
+        # брошенные (упавшие) прошлые перестройки
+        for g in self._repo.list_generations():
+            if g["status"] in ("building", "failed", "retired") and g["chunks"]:
+                if g["status"] == "building":
+                    self._repo.set_generation_status(g["id"], "failed")
+                gc_deleted += self._gc_generation(g["id"])
+
+        prev = self._repo.active_generation()
+        prev_profile, configured = self._active_profile()
+        prof = self._indexer.profile()
+        gen = self._repo.create_generation(note=op, **prof)
+        log.info("KB %s: building generation %s (active=%s, profile=%s)", op, gen, prev, prof)
+
+        if from_cache:
+            jobs, deleted_count = self._cached_jobs(), 0
+        else:
+            plan = self._plan()
+            ids, deleted_count = self._apply_plan(plan)
+            files = plan.to_index + plan.unchanged + plan.reactivated
+            jobs = [_SyncJob(file=f, document_id=ids.get(f["path"])) for f in files]
+        queued_from_cache = sum(1 for j in jobs if j.cached)
+
+        try:
+            self._reset_savings()
+            run = self._run_jobs(jobs, progress_cb=progress_cb, pipeline=pipeline, generation=gen)
+            carried = 0
+            # чужие векторы переносить нельзя: другая модель/размерность — другое пространство embeddings
+            if run.failed_ids and prev_profile == configured:
+                carried = self._repo.copy_generation_chunks(prev, gen, run.failed_ids)
+            # индекс по уже загруженному поколению — до переключения, чтобы поиск сразу шёл по нему
+            ann = self._ensure_ann_index(gen)
+            self._ensure_fts_index()
+            self._ensure_document_vectors(gen)
+            self._repo.activate_generation(gen)
+        except Exception:
+            self._repo.set_generation_status(gen, "failed")
+            raise
+
+        gc_deleted += self._gc_generation(prev)
+
+        # job.cached сбрасывается, если запись кэша не прочиталась и файл пришлось скачать
+        from_text_cache = sum(1 for j in jobs if j.cached)
+        result = {
+            "generation": gen,
+            "previous": prev,
+            "documents": len(jobs),
+            "ok": run.ok,
+            "fail": run.fail,
+            "carried_over_chunks": carried,
+            "ann_index": (ann or {}).get("kind") if (ann or {}).get("created") else None,
+            "deleted_documents": deleted_count,
+            "gc_deleted_chunks": gc_deleted,
+            "elapsed_sec": round(run.elapsed, 2),
+            "mode": run.mode,
+        }
+        if from_cache:
+            result["from_text_cache"] = from_text_cache
+            result["downloaded"] = len(jobs) - from_text_cache
+            if from_text_cache < queued_from_cache:
+                log.warning("KB rechunk: %s cached texts were unreadable, downloaded instead", queued_from_cache - from_text_cache)
+        self.last_sync_stats = {
+            "mode": f"{op}/{run.mode}",
+            "elapsed_sec": round(run.elapsed, 2),
+            "docs_per_sec": round(run.processed / run.elapsed, 2),
+            "indexed_per_sec": round(run.ok / run.elapsed, 2),
+            **self._savings(),
+            **run.parse,
+        }
+        log.info("KB %s finished: %s", op, result)
+        return result
+
     def status_summary(self) -> Dict[str, Any]:
         st = self._repo.status_summary()
         rep = self.scan()
@@ -299,6 +808,22 @@ class KbSyncer:
                 "disk_deleted": len(rep.deleted),
             }
         )
+        st.update(self._indexer.cache_stats())
+        if self._query_cache is not None:
+            st.update(self._query_cache.stats())
+        if self._text_cache is not None:
+            st.update(self._text_cache.stats())
+        active, configured = self._active_profile()
+        st["index_profile"] = str(active)
+        if active != configured:
+            st["index_profile_pending"] = f"{configured} (нужен /kb rebuild)"
+        try:
+            ann = self._repo.ann_index_info()
+        except Exception:
+            ann = None
+        st["ann_index"] = f"{ann['kind']}/{ann['precision']} {ann['size_mb']} MB" if ann else "none (exact scan)"
+        if self.last_sync_stats:
+            st.update({f"last_sync_{k}": v for k, v in self.last_sync_stats.items()})
         return st
 
 
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import codecs
+import logging
+import tempfile
+import threading
+import zlib
+from typing import IO, Any, Dict, Iterator, Optional, Tuple
+
+try:
+    import zstandard  # необязательная зависимость: без неё — gzip
+except Exception:
+    zstandard = None
+
+from app.db.repo_kb import KBRepo
+
+log = logging.getLogger(__name__)
+
+CODECS = ("zstd", "gzip")
+_BLOCK = 64 * 1024
+
+
+def default_codec() -> str:
+    return "zstd" if zstandard is not None else "gzip"
+
+
+def _compressor(codec: str) -> Any:
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd codec requires the zstandard package")
+        return zstandard.ZstdCompressor(level=6).compressobj()
+    if codec == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 — формат gzip
+    raise ValueError(f"unsupported text cache codec: {codec} (supported: {', '.join(CODECS)})")
+
+
+def _decompressor(codec: str) -> Any:
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd codec requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompressobj()
+    if codec == "gzip":
+        return zlib.decompressobj(31)
+    raise ValueError(f"unsupported text cache codec: {codec} (supported: {', '.join(CODECS)})")
+
+
+def compress_text(text: IO[str], codec: str) -> Tuple[bytes, int]:
+    """(сжатые байты, размер текста в UTF-8) — поток читается блоками, целиком в памяти только результат."""
+    c = _compressor(codec)
+    out = []
+    n = 0
+    while True:
+        t = text.read(_BLOCK)
+        if not t:
+            break
+        b = t.encode("utf-8")
+        n += len(b)
+        out.append(c.compress(b))
+    out.append(c.flush())
+    return b"".join(out), n
+
+
+def iter_decompressed_text(codec: str, data: bytes) -> Iterator[str]:
+    """Текст из сжатых байтов блоками (UTF-8 декодируется инкрементально, символы не режутся)."""
+    d = _decompressor(codec)
+    dec = codecs.getincrementaldecoder("utf-8")()
+    for i in range(0, len(data), _BLOCK):
+        t = dec.decode(d.decompress(data[i : i + _BLOCK]))
+        if t:
+            yield t
+    tail = getattr(d, "flush", None)
+    t = dec.decode(tail() if tail is not None else b"", final=True)
+    if t:
+        yield t
+
+
+class TextCache:
+    """
+    Кэш извлечённого текста документов (таблица kb_document_texts): ключ — (document_id, md5 файла
+    на Диске), значение — текст после парсинга, сжатый zstd (если установлен zstandard) или gzip.
+    Sync кладёт текст при разборе файла, /kb rechunk читает его вместо скачивания и парсинга.
+
+    Ошибки кэша не роняют sync: запись пропускается, чтение считается промахом.
+    Счётчики — in-process, для /kb status.
+    """
+
+    def __init__(self, kb_repo: KBRepo, *, codec: Optional[str] = None, spool_mb: int = 4):
+        self._repo = kb_repo
+        self.codec = (codec or default_codec()).strip().lower()
+        _compressor(self.codec)  # неизвестный кодек — ошибка сразу, а не на первом sync
+        self._spool_max = max(0, int(spool_mb)) * 1024 * 1024
+        self._lock = threading.Lock()
+        self.stored = 0
+        self.hits = 0
+        self.misses = 0
+
+    def store(self, document_id: int, md5: Optional[str], text: IO[str]) -> None:
+        """Сохраняет текст (читает text с начала и возвращает позицию в начало)."""
+        if not md5:
+            return
+        try:
+            text.seek(0)
+            data, n = compress_text(text, self.codec)
+            self._repo.put_document_text(document_id, md5, self.codec, n, data)
+        except Exception as e:
+            log.warning("KB text cache store failed for document_id=%s (ignored): %s", document_id, e)
+            return
+        finally:
+            text.seek(0)
+        with self._lock:
+            self.stored += 1
+
+    def load(self, document_id: int, md5: Optional[str]) -> Optional[IO[str]]:
+        """Текст версии md5 во временном spool (как после парсинга) или None — промах."""
+        row = None
+        if md5:
+            try:
+                row = self._repo.get_document_text(document_id, md5)
+            except Exception as e:
+                log.warning("KB text cache lookup failed for document_id=%s: %s", document_id, e)
+        if row is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        codec, data = row
+        spool = tempfile.SpooledTemporaryFile(max_size=self._spool_max, mode="w+", encoding="utf-8")
+        try:
+            for piece in iter_decompressed_text(codec, data):
+                spool.write(piece)
+        except Exception as e:
+            spool.close()
+            log.warning("KB text cache entry for document_id=%s is unreadable (%s): %s", document_id, codec, e)
+            with self._lock:
+                self.misses += 1
+            return None
+        spool.seek(0)
+        with self._lock:
+            self.hits += 1
+        return spool
+
+    def versions(self) -> Dict[int, str]:
+        try:
+            return self._repo.cached_text_versions()
+        except Exception as e:
+            log.warning("KB text cache listing failed: %s", e)
+            return {}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = {
+                "text_cache_codec": self.codec,
+                "text_cache_stored": self.stored,
+                "text_cache_hits": self.hits,
+                "text_cache_misses": self.misses,
+            }
+        try:
+            size = self._repo.text_cache_size()
+        except Exception:
+            return out
+        out["text_cache_documents"] = size["documents"]
+        out["text_cache_mb"] = round(size["stored_bytes"] / 2**20, 1)
+        if size["stored_bytes"]:
+            out["text_cache_ratio"] = round(size["text_bytes"] / size["stored_bytes"], 1)
+        return out
@@ -8,6 +8,7 @@ from .settings import load_settings
 
 from .clients.openai_client import OpenAIClient
 from .clients.yandex_disk_client import YandexDiskClient
+from .clients.yandex_disk_async import BlockingAsyncDownloader
 from .clients.web_search_client import WebSearchClient
 
 from .db.session import make_session_factory, reset_schema, ensure_schema
@@ -17,9 +18,13 @@ from .db.repo_kb import KBRepo
 from .db.repo_access import AccessRepo
 
 from .kb.embedder import Embedder
+from .kb.dedup import ChunkDeduper
+from .kb.embedding_cache import EmbeddingCache
+from .kb.query_cache import QueryEmbeddingCache
 from .kb.retriever import Retriever
 from .kb.indexer import KbIndexer
 from .kb.syncer import KBSyncer
+from .kb.text_cache import TextCache
 
 from .services.dialog_service import DialogService
 from .services.dialog_kb_service import DialogKBService
@@ -51,8 +56,6 @@ from .handlers import (
 
 log = logging.getLogger(__name__)
 
-EMBEDDING_DIM = 1536
-
 
 async def _post_init(app: Application) -> None:
     try:
@@ -110,7 +113,32 @@ def build_application() -> Application:
 
     # --- clients ---
     openai = OpenAIClient(cfg.openai_api_key)
-    yandex = YandexDiskClient(cfg.yandex_disk_token, cfg.yandex_root_path)
+    yandex = YandexDiskClient(
+        cfg.yandex_disk_token,
+        cfg.yandex_root_path,
+        pool_size=cfg.yandex_pool_size,
+        connect_timeout=cfg.yandex_connect_timeout,
+        read_timeout=cfg.yandex_read_timeout,
+        spool_max_mb=cfg.yandex_spool_mb,
+        segment_threshold_mb=cfg.yandex_segment_threshold_mb,
+        segments=cfg.yandex_segments,
+        list_mode=cfg.yandex_list_mode,
+        list_workers=cfg.yandex_list_workers,
+        list_page_size=cfg.yandex_list_page_size,
+    )
+    yandex_downloader = None
+    if cfg.yandex_async:
+        try:
+            yandex_downloader = BlockingAsyncDownloader(
+                token=cfg.yandex_disk_token,
+                root=cfg.yandex_root_path,
+                max_connections=cfg.yandex_pool_size,
+                connect_timeout=cfg.yandex_connect_timeout,
+                read_timeout=cfg.yandex_read_timeout,
+                spool_max_mb=cfg.yandex_spool_mb,
+            )
+        except Exception as e:
+            log.warning("Async Disk downloader disabled: %s", e)
 
     web_client = WebSearchClient(
         cfg.web_search_provider,
@@ -119,16 +147,81 @@ def build_application() -> Application:
     )
 
     # --- repos ---
+    # векторы чанков: pgvector в kb_chunks или .npy-файлы (SQLite/dev-режим, базы без pgvector)
+    vector_store = None
+    if cfg.kb_vector_store == "numpy" or (cfg.kb_vector_store == "auto" and engine.dialect.name != "postgresql"):
+        try:
+            from .db.vector_store import NumpyVectorStore
+        except ImportError as e:
+            raise RuntimeError(
+                f"KB_VECTOR_STORE={cfg.kb_vector_store} ({engine.dialect.name}) needs numpy: pip install numpy"
+            ) from e
+        vector_store = NumpyVectorStore(cfg.kb_vector_dir, binary=cfg.kb_ann_index == "bit")
+
     repo_dialogs = DialogsRepo(sf)
-    repo_kb = KBRepo(sf, dim=EMBEDDING_DIM)
+    repo_kb = KBRepo(
+        sf,
+        dim=cfg.embedding_dim,
+        ann_ef_search=cfg.kb_ann_ef_search,
+        ann_probes=cfg.kb_ann_probes,
+        ann_candidates=cfg.kb_ann_candidates,
+        ann_binary_candidates=cfg.kb_ann_binary_candidates,
+        ann_exact_max_rows=cfg.kb_ann_exact_max_rows,
+        ann_max_candidates=cfg.kb_ann_max_candidates,
+        vector_store=vector_store,
+    )
+    if vector_store is not None:
+        reconciled = repo_kb.reconcile_vector_store()
+        log.info("KB vector store: %s (%s), reconcile: %s", vector_store.name, cfg.kb_vector_dir, reconciled)
     repo_dialog_kb = DialogKBRepo(sf)
     repo_access = AccessRepo(sf)
 
     # --- KB / RAG ---
-    embedder = Embedder(cfg, openai)
-    retriever = Retriever(cfg, repo_kb, embedder)
-    indexer = KbIndexer(repo_kb, embedder, cfg.chunk_size, cfg.chunk_overlap)
-    syncer = KBSyncer(cfg, repo_kb, indexer, yandex)
+    # профиль новых поколений индекса; поиск берёт профиль активного поколения из kb_generations
+    embedder = Embedder(openai, cfg.openai_embedding_model, cfg.openai_embedding_dimensions or None)
+    query_cache = (
+        QueryEmbeddingCache(
+            max_items=cfg.kb_query_cache_size,
+            ttl_sec=cfg.kb_query_cache_ttl_sec,
+            kb_repo=repo_kb if cfg.kb_query_cache_shared else None,
+        )
+        if cfg.kb_query_cache_size > 0
+        else None
+    )
+    retriever = Retriever(
+        repo_kb,
+        embedder,
+        mode=cfg.kb_retrieval_mode,
+        rrf_k=cfg.kb_rrf_k,
+        vector_weight=cfg.kb_hybrid_vector_weight,
+        lexical_weight=cfg.kb_hybrid_lexical_weight,
+        candidates=cfg.kb_hybrid_candidates,
+        query_cache=query_cache,
+        context_window=cfg.kb_context_window,
+        context_hits=cfg.kb_context_hits,
+        route_docs=cfg.kb_route_docs,
+    )
+    indexer = KbIndexer(
+        repo_kb,
+        embedder,
+        cfg.chunk_size,
+        cfg.chunk_overlap,
+        cache=EmbeddingCache(repo_kb) if cfg.kb_embedding_cache else None,
+        dedup=ChunkDeduper(repo_kb, max_distance=cfg.kb_dedup_distance) if cfg.kb_dedup else None,
+        max_items_per_batch=cfg.kb_embed_max_items,
+        max_tokens_per_batch=cfg.kb_embed_max_tokens,
+        chunker=cfg.kb_chunker,
+        chunk_tokens=cfg.kb_chunk_tokens,
+    )
+    syncer = KBSyncer(
+        cfg,
+        repo_kb,
+        indexer,
+        yandex,
+        downloader=yandex_downloader,
+        query_cache=query_cache,
+        text_cache=TextCache(repo_kb, spool_mb=cfg.kb_text_spool_mb) if cfg.kb_text_cache else None,
+    )
 
     dialog_service = DialogService(repo_dialogs, settings=cfg)
     dialog_kb_service = DialogKBService(repo_dialog_kb, repo_kb)
@@ -42,5 +42,10 @@ class RagService:
         except Exception:
             ms = 0.0
 
-        filtered = [r for r in results if (r.score is not None and float(r.score) >= ms)]
+        # точное совпадение слов (артикул, номер пункта) проходит и с низким косинусом — ради него и гибридный поиск
+        filtered = [
+            r
+            for r in results
+            if (r.score is not None and float(r.score) >= ms) or (r.lexical_rank is not None and r.lexical_rank <= top_k)
+        ]
         return filtered
@@ -85,6 +85,7 @@ class Settings:
     openai_text_model: str = "gpt-5"
     openai_image_model: str = "gpt-image-1"
     openai_embedding_model: str = "text-embedding-3-large"
+    openai_embedding_dimensions: int = 0  # 0 = родная размерность; иначе параметр dimensions (text-embedding-3-*)
     openai_transcribe_model: str = "whisper-1"
     openai_temperature: float = 0.2
     max_context_tokens: int = 8000
@@ -98,11 +99,60 @@ class Settings:
     # KB / RAG
     chunk_size: int = 900
     chunk_overlap: int = 150
+    kb_chunker: str = "chars"  # chars | structured — нарезка по абзацам/заголовкам/таблицам в бюджет токенов
+    kb_chunk_tokens: int = 700  # structured: бюджет чанка в токенах
     max_kb_chunks: int = 6
     kb_debug: bool = False
     kb_sync_entrypoint: str = ""
     kb_sync_interval: int = 0  # seconds
 
+    # KB sync pipeline (download -> parse -> embed -> write)
+    kb_sync_pipeline: bool = False
+    kb_sync_queue_size: int = 8
+    kb_sync_download_workers: int = 4
+    kb_sync_parse_workers: int = 2
+    kb_sync_index_workers: int = 2  # chunk + embed + write (потоково)
+    kb_pdf_max_pages: int = 0  # 0 = без ограничения
+    kb_text_spool_mb: int = 4  # извлечённый текст держим в памяти до N МБ, дальше — temp-файл
+    kb_parse_processes: int = 0  # PDF/DOCX/XLSX разбираются в N процессах; 0 = в потоках sync
+    kb_parse_timeout_sec: int = 120  # дольше — процесс убивается, документ в error
+    kb_parse_max_files_per_worker: int = 50  # перезапуск процесса разбора после N файлов
+    kb_parse_memory_mb: int = 1024  # лимит памяти процесса разбора сверх базовой
+    kb_embedding_cache: bool = True
+    kb_text_cache: bool = True  # сжатый текст разобранных файлов в kb_document_texts — для /kb rechunk
+    kb_strip_boilerplate: bool = True  # PDF: строки, повторяющиеся на большинстве страниц (колонтитулы), не индексируются
+    kb_dedup: bool = True  # почти-дубликаты чанков других документов — без embeddings и вне поиска по всей БЗ
+    kb_dedup_distance: int = 3  # SimHash: максимум различающихся бит (0..3)
+    kb_embed_max_items: int = 2048  # лимиты одного запроса embeddings
+    kb_embed_max_tokens: int = 300_000
+    kb_gc_batch: int = 5000  # строк kb_chunks на один DELETE при сборке мусора
+    kb_gc_pause_ms: int = 50  # пауза между пачками DELETE
+    kb_gc_grace_sec: int = 86400  # чанки удалённых с Диска / error-документов удаляются через столько секунд
+    kb_ann_index: str = "hnsw"  # hnsw | ivfflat | bit | off — ANN-индекс поколения kb_chunks
+    kb_ann_m: int = 16
+    kb_ann_ef_construction: int = 64
+    kb_ann_lists: int = 0  # ivfflat: 0 = авто (строк / 1000)
+    kb_ann_build_mem_mb: int = 0  # maintenance_work_mem на время сборки индекса, 0 = как на сервере
+    kb_ann_ef_search: int = 100  # hnsw.ef_search на запрос
+    kb_ann_probes: int = 10  # ivfflat.probes на запрос
+    kb_ann_candidates: int = 4  # ANN отдаёт limit * N кандидатов, они пересортировываются точно
+    kb_ann_binary_candidates: int = 10  # то же для бинарного грубого прохода (KB_ANN_INDEX=bit)
+    kb_ann_exact_max_rows: int = 10_000  # поиск по документам диалога: до N чанков — точный перебор без ANN
+    kb_ann_max_candidates: int = 1000  # предел кандидатов ANN при фильтре по документам (hnsw: ef_search <= 1000)
+    kb_retrieval_mode: str = "vector"  # vector | hybrid (вектор + полнотекстовый russian, слияние RRF)
+    kb_rrf_k: int = 60
+    kb_hybrid_vector_weight: float = 1.0
+    kb_hybrid_lexical_weight: float = 1.0
+    kb_hybrid_candidates: int = 4  # каждая выдача гибридного поиска — top_k * N кандидатов
+    kb_query_cache_size: int = 1024  # embeddings запросов в памяти (LRU), 0 = без кэша
+    kb_query_cache_ttl_sec: int = 3600
+    kb_query_cache_shared: bool = False  # второй уровень в Postgres (kb_embedding_cache), общий для экземпляров
+    kb_context_window: int = 0  # соседних чанков с каждой стороны к лучшим результатам, 0 = без окна
+    kb_context_hits: int = 3  # к скольким первым результатам добавлять окно
+    kb_route_docs: int = 0  # двухуровневый поиск: чанки только в N документах с ближайшими центроидами, 0 = выкл.
+    kb_vector_store: str = "auto"  # auto | pgvector | numpy (auto: numpy, если БД не Postgres)
+    kb_vector_dir: str = "data/kb_vectors"  # каталог .npy-файлов для KB_VECTOR_STORE=numpy
+
     # Security / webhook (optional)
     webhook_domain: str = ""
     webhook_secret: str = ""
@@ -110,6 +160,16 @@ class Settings:
     # Yandex.Disk
     yandex_disk_token: str = ""
     yandex_root_path: str = ""
+    yandex_pool_size: int = 16
+    yandex_connect_timeout: float = 10.0
+    yandex_read_timeout: float = 120.0
+    yandex_spool_mb: int = 8  # скачанный файл в памяти до N МБ, дальше — temp-файл
+    yandex_segment_threshold_mb: int = 64  # с какого размера качать параллельными сегментами
+    yandex_segments: int = 4
+    yandex_async: bool = False  # httpx-загрузчик для sync (нужен пакет httpx)
+    yandex_list_mode: str = "walk"  # walk | flat
+    yandex_list_workers: int = 8
+    yandex_list_page_size: int = 1000
 
     # Misc
     rate_limit_per_min: int = 60
@@ -144,6 +204,9 @@ class Settings:
 
     @property
     def embedding_dim(self) -> int:
+        if self.openai_embedding_dimensions > 0:
+            return self.openai_embedding_dimensions
+
         # OpenAI embedding model dims (stable defaults)
         m = (self.openai_embedding_model or "").lower()
 
@@ -192,6 +255,7 @@ def load_settings() -> Settings:
     openai_embedding_model = (
         _getenv("OPENAI_EMBEDDING_MODEL") or _getenv("EMBEDDING_MODEL") or "text-embedding-3-large"
     )
+    openai_embedding_dimensions = _getenv_int("OPENAI_EMBEDDING_DIMENSIONS", _getenv_int("EMBEDDING_DIMENSIONS", 0))
     openai_transcribe_model = (
         _getenv("OPENAI_TRANSCRIBE_MODEL") or _getenv("TRANSCRIBE_MODEL") or "whisper-1"
     )
@@ -208,11 +272,59 @@ def load_settings() -> Settings:
     # KB / RAG params
     chunk_size = _getenv_int("CHUNK_SIZE", 900)
     chunk_overlap = _getenv_int("CHUNK_OVERLAP", 150)
+    kb_chunker = (_getenv("KB_CHUNKER", "chars") or "chars").strip().lower()
+    kb_chunk_tokens = _getenv_int("KB_CHUNK_TOKENS", 700)
     max_kb_chunks = _getenv_int("MAX_KB_CHUNKS", 6)
     kb_debug = _getenv_bool("KB_DEBUG", False)
     kb_sync_entrypoint = _getenv("KB_SYNC_ENTRYPOINT", "") or ""
     kb_sync_interval = _getenv_int("KB_SYNC_INTERVAL", 0)
 
+    kb_sync_pipeline = _getenv_bool("KB_SYNC_PIPELINE", False)
+    kb_sync_queue_size = _getenv_int("KB_SYNC_QUEUE_SIZE", 8)
+    kb_sync_download_workers = _getenv_int("KB_SYNC_DOWNLOAD_WORKERS", 4)
+    kb_sync_parse_workers = _getenv_int("KB_SYNC_PARSE_WORKERS", 2)
+    kb_sync_index_workers = _getenv_int("KB_SYNC_INDEX_WORKERS", _getenv_int("KB_SYNC_EMBED_WORKERS", 2))
+    kb_pdf_max_pages = _getenv_int("KB_PDF_MAX_PAGES", 0)
+    kb_text_spool_mb = _getenv_int("KB_TEXT_SPOOL_MB", 4)
+    kb_parse_processes = _getenv_int("KB_PARSE_PROCESSES", 0)
+    kb_parse_timeout_sec = _getenv_int("KB_PARSE_TIMEOUT_SEC", 120)
+    kb_parse_max_files_per_worker = _getenv_int("KB_PARSE_MAX_FILES_PER_WORKER", 50)
+    kb_parse_memory_mb = _getenv_int("KB_PARSE_MEMORY_MB", 1024)
+    kb_embedding_cache = _getenv_bool("KB_EMBEDDING_CACHE", True)
+    kb_text_cache = _getenv_bool("KB_TEXT_CACHE", True)
+    kb_strip_boilerplate = _getenv_bool("KB_STRIP_BOILERPLATE", True)
+    kb_dedup = _getenv_bool("KB_DEDUP", True)
+    kb_dedup_distance = _getenv_int("KB_DEDUP_DISTANCE", 3)
+    kb_embed_max_items = _getenv_int("KB_EMBED_MAX_ITEMS", 2048)
+    kb_embed_max_tokens = _getenv_int("KB_EMBED_MAX_TOKENS", 300_000)
+    kb_gc_batch = _getenv_int("KB_GC_BATCH", 5000)
+    kb_gc_pause_ms = _getenv_int("KB_GC_PAUSE_MS", 50)
+    kb_gc_grace_sec = _getenv_int("KB_GC_GRACE_SEC", 86400)
+    kb_ann_index = (_getenv("KB_ANN_INDEX", "hnsw") or "hnsw").strip().lower()
+    kb_ann_m = _getenv_int("KB_ANN_M", 16)
+    kb_ann_ef_construction = _getenv_int("KB_ANN_EF_CONSTRUCTION", 64)
+    kb_ann_lists = _getenv_int("KB_ANN_LISTS", 0)
+    kb_ann_build_mem_mb = _getenv_int("KB_ANN_BUILD_MEM_MB", 0)
+    kb_ann_ef_search = _getenv_int("KB_ANN_EF_SEARCH", 100)
+    kb_ann_probes = _getenv_int("KB_ANN_PROBES", 10)
+    kb_ann_candidates = _getenv_int("KB_ANN_CANDIDATES", 4)
+    kb_ann_binary_candidates = _getenv_int("KB_ANN_BINARY_CANDIDATES", 10)
+    kb_ann_exact_max_rows = _getenv_int("KB_ANN_EXACT_MAX_ROWS", 10_000)
+    kb_ann_max_candidates = _getenv_int("KB_ANN_MAX_CANDIDATES", 1000)
+    kb_retrieval_mode = (_getenv("KB_RETRIEVAL_MODE", "vector") or "vector").strip().lower()
+    kb_rrf_k = _getenv_int("KB_RRF_K", 60)
+    kb_hybrid_vector_weight = _getenv_float("KB_HYBRID_VECTOR_WEIGHT", 1.0)
+    kb_hybrid_lexical_weight = _getenv_float("KB_HYBRID_LEXICAL_WEIGHT", 1.0)
+    kb_hybrid_candidates = _getenv_int("KB_HYBRID_CANDIDATES", 4)
+    kb_query_cache_size = _getenv_int("KB_QUERY_CACHE_SIZE", 1024)
+    kb_query_cache_ttl_sec = _getenv_int("KB_QUERY_CACHE_TTL_SEC", 3600)
+    kb_query_cache_shared = _getenv_bool("KB_QUERY_CACHE_SHARED", False)
+    kb_context_window = _getenv_int("KB_CONTEXT_WINDOW", 0)
+    kb_context_hits = _getenv_int("KB_CONTEXT_HITS", 3)
+    kb_route_docs = _getenv_int("KB_ROUTE_DOCS", 0)
+    kb_vector_store = (_getenv("KB_VECTOR_STORE", "auto") or "auto").strip().lower()
+    kb_vector_dir = (_getenv("KB_VECTOR_DIR", "data/kb_vectors") or "data/kb_vectors").strip()
+
     # Webhook optional
     webhook_domain = _getenv("WEBHOOK_DOMAIN", "") or ""
     webhook_secret = _getenv("WEBHOOK_SECRET", "") or ""
@@ -220,6 +332,16 @@ def load_settings() -> Settings:
     # Yandex.Disk
     yandex_disk_token = _getenv("YANDEX_DISK_TOKEN", "") or ""
     yandex_root_path = _getenv("YANDEX_ROOT_PATH", "") or ""
+    yandex_pool_size = _getenv_int("YANDEX_POOL_SIZE", 16)
+    yandex_connect_timeout = _getenv_float("YANDEX_CONNECT_TIMEOUT", 10.0)
+    yandex_read_timeout = _getenv_float("YANDEX_READ_TIMEOUT", 120.0)
+    yandex_spool_mb = _getenv_int("YANDEX_SPOOL_MB", 8)
+    yandex_segment_threshold_mb = _getenv_int("YANDEX_SEGMENT_THRESHOLD_MB", 64)
+    yandex_segments = _getenv_int("YANDEX_SEGMENTS", 4)
+    yandex_async = _getenv_bool("YANDEX_ASYNC", False)
+    yandex_list_mode = (_getenv("YANDEX_LIST_MODE", "walk") or "walk").strip().lower()
+    yandex_list_workers = _getenv_int("YANDEX_LIST_WORKERS", 8)
+    yandex_list_page_size = _getenv_int("YANDEX_LIST_PAGE_SIZE", 1000)
 
     # Misc
     rate_limit_per_min = _getenv_int("RATE_LIMIT_PER_MIN", 60)
@@ -237,6 +359,7 @@ def load_settings() -> Settings:
         openai_text_model=openai_text_model,
         openai_image_model=openai_image_model,
         openai_embedding_model=openai_embedding_model,
+        openai_embedding_dimensions=openai_embedding_dimensions,
         openai_transcribe_model=openai_transcribe_model,
         openai_temperature=openai_temperature,
         max_context_tokens=max_context_tokens,
@@ -246,14 +369,71 @@ def load_settings() -> Settings:
         tavily_api_key=tavily_api_key,
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
+        kb_chunker=kb_chunker,
+        kb_chunk_tokens=kb_chunk_tokens,
         max_kb_chunks=max_kb_chunks,
         kb_debug=kb_debug,
         kb_sync_entrypoint=kb_sync_entrypoint,
         kb_sync_interval=kb_sync_interval,
+        kb_sync_pipeline=kb_sync_pipeline,
+        kb_sync_queue_size=kb_sync_queue_size,
+        kb_sync_download_workers=kb_sync_download_workers,
+        kb_sync_parse_workers=kb_sync_parse_workers,
+        kb_sync_index_workers=kb_sync_index_workers,
+        kb_pdf_max_pages=kb_pdf_max_pages,
+        kb_text_spool_mb=kb_text_spool_mb,
+        kb_parse_processes=kb_parse_processes,
+        kb_parse_timeout_sec=kb_parse_timeout_sec,
+        kb_parse_max_files_per_worker=kb_parse_max_files_per_worker,
+        kb_parse_memory_mb=kb_parse_memory_mb,
+        kb_embedding_cache=kb_embedding_cache,
+        kb_text_cache=kb_text_cache,
+        kb_strip_boilerplate=kb_strip_boilerplate,
+        kb_dedup=kb_dedup,
+        kb_dedup_distance=kb_dedup_distance,
+        kb_embed_max_items=kb_embed_max_items,
+        kb_embed_max_tokens=kb_embed_max_tokens,
+        kb_gc_batch=kb_gc_batch,
+        kb_gc_pause_ms=kb_gc_pause_ms,
+        kb_gc_grace_sec=kb_gc_grace_sec,
+        kb_ann_index=kb_ann_index,
+        kb_ann_m=kb_ann_m,
+        kb_ann_ef_construction=kb_ann_ef_construction,
+        kb_ann_lists=kb_ann_lists,
+        kb_ann_build_mem_mb=kb_ann_build_mem_mb,
+        kb_ann_ef_search=kb_ann_ef_search,
+        kb_ann_probes=kb_ann_probes,
+        kb_ann_candidates=kb_ann_candidates,
+        kb_ann_binary_candidates=kb_ann_binary_candidates,
+        kb_ann_exact_max_rows=kb_ann_exact_max_rows,
+        kb_ann_max_candidates=kb_ann_max_candidates,
+        kb_retrieval_mode=kb_retrieval_mode,
+        kb_rrf_k=kb_rrf_k,
+        kb_hybrid_vector_weight=kb_hybrid_vector_weight,
+        kb_hybrid_lexical_weight=kb_hybrid_lexical_weight,
+        kb_hybrid_candidates=kb_hybrid_candidates,
+        kb_query_cache_size=kb_query_cache_size,
+        kb_query_cache_ttl_sec=kb_query_cache_ttl_sec,
+        kb_query_cache_shared=kb_query_cache_shared,
+        kb_context_window=kb_context_window,
+        kb_context_hits=kb_context_hits,
+        kb_route_docs=kb_route_docs,
+        kb_vector_store=kb_vector_store,
+        kb_vector_dir=kb_vector_dir,
         webhook_domain=webhook_domain,
         webhook_secret=webhook_secret,
         yandex_disk_token=yandex_disk_token,
         yandex_root_path=yandex_root_path,
+        yandex_pool_size=yandex_pool_size,
+        yandex_connect_timeout=yandex_connect_timeout,
+        yandex_read_timeout=yandex_read_timeout,
+        yandex_spool_mb=yandex_spool_mb,
+        yandex_segment_threshold_mb=yandex_segment_threshold_mb,
+        yandex_segments=yandex_segments,
+        yandex_async=yandex_async,
+        yandex_list_mode=yandex_list_mode,
+        yandex_list_workers=yandex_list_workers,
+        yandex_list_page_size=yandex_list_page_size,
         rate_limit_per_min=rate_limit_per_min,
         log_level=log_level,
         denylist_models=denylist_models,
@@ -0,0 +1,79 @@
+import random
+
+import app.kb.dedup as dedup
+from app.kb.dedup import MAX_DISTANCE, hamming, same_numbers, simhash, simhash_bands, strip_boilerplate
+from app.kb.retriever import collapse_copies
+
+TEXT = " ".join(
+    f"Пункт {i}. Поставщик обязуется передать товар покупателю в срок согласно спецификации." for i in range(20)
+)
+
+
+def test_simhash_bands_low_band_first():
+    assert simhash_bands(0x0001000200030004) == [4, 3, 2, 1]
+    assert simhash_bands(0) == [0, 0, 0, 0]
+    # подпись хранится знаковым int64: полосы те же, что у беззнакового значения
+    assert simhash_bands(-1) == [0xFFFF] * 4
+    assert simhash_bands(-(1 << 63)) == [0, 0, 0, 0x8000]
+
+
+def test_near_signatures_share_a_band():
+    rnd = random.Random(23)
+    for _ in range(200):
+        sig = rnd.getrandbits(64)
+        near = sig
+        for bit in rnd.sample(range(64), MAX_DISTANCE):
+            near ^= 1 << bit
+        assert hamming(sig, near) == MAX_DISTANCE
+        assert any(a == b for a, b in zip(simhash_bands(sig), simhash_bands(near)))
+
+
+def test_hamming_handles_signed_values():
+    assert hamming(0, 0) == 0
+    assert hamming(-1, 0) == 64
+    assert hamming(-1, -2) == 1
+
+
+def test_simhash_is_signed_int64_and_ignores_formatting():
+    sig = simhash(TEXT)
+    assert -(1 << 63) <= sig < (1 << 63)
+    assert simhash("  " + TEXT.upper().replace(" ", "\n  ") + "  ") == sig
+    assert simhash("") == 0
+
+
+def test_simhash_small_edit_is_closer_than_other_text():
+    edited = simhash(TEXT.replace("в срок", "в установленный срок", 1))
+    other = simhash("Табель учёта рабочего времени сотрудников отдела за отчётный месяц. " * 10)
+    assert hamming(simhash(TEXT), edited) < hamming(simhash(TEXT), other)
+
+
+def test_simhash_without_numpy_matches(monkeypatch):
+    expected = simhash(TEXT)
+    monkeypatch.setattr(dedup, "np", None)
+    assert simhash(TEXT) == expected
+
+
+def test_same_numbers():
+    assert same_numbers("Договор 12 от 01.02", "договор  12 от 01.02")
+    assert not same_numbers("Сумма 100 руб.", "Сумма 200 руб.")
+
+
+def test_strip_boilerplate_removes_repeated_lines():
+    body = ["Предмет договора", "Цена и порядок расчётов", "Сроки поставки", "Приёмка товара", "Ответственность"]
+    pages = [f"ООО Ромашка — стр. {i} из 5\n{b}\nКонфиденциально" for i, b in enumerate(body, 1)]
+    stats = {}
+    out = list(strip_boilerplate(pages, stats=stats))
+    assert out == body
+    assert stats["documents"] == 1 and stats["lines"] == 10
+    # короткий документ не трогается
+    assert list(strip_boilerplate(pages[:2])) == pages[:2]
+
+
+def test_collapse_copies_keeps_best_hit_per_original():
+    rows = [
+        {"chunk_id": 30, "dup_of": 10},
+        {"chunk_id": 10, "dup_of": None},
+        {"chunk_id": 21},
+        {"chunk_id": 40, "dup_of": 10},
+    ]
+    assert [r["chunk_id"] for r in collapse_copies(rows)] == [30, 21]
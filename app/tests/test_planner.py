@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta, timezone
+
+from app.kb.planner import RETRY_STATUSES, naive_utc, needs_reindex, plan_sync
+
+MSK = timezone(timedelta(hours=3))
+MODIFIED = datetime(2026, 1, 1, 10, 0, tzinfo=MSK)
+
+
+def _db(**kw):
+    row = {
+        "id": 1,
+        "path": "/kb/a.pdf",
+        "md5": "m1",
+        "size": 100,
+        "modified_at": datetime(2026, 1, 1, 7, 0),
+        "indexed_at": datetime(2026, 1, 2),
+        "status": "indexed",
+        "is_active": True,
+    }
+    row.update(kw)
+    return row
+
+
+def _disk(**kw):
+    f = {"path": "/kb/a.pdf", "md5": "m1", "size": 100, "modified_at": MODIFIED}
+    f.update(kw)
+    return f
+
+
+def test_naive_utc_converts_aware_to_naive_utc():
+    assert naive_utc(MODIFIED) == datetime(2026, 1, 1, 7, 0)
+    assert naive_utc(datetime(2026, 1, 1, 7, 0)) == datetime(2026, 1, 1, 7, 0)
+    assert naive_utc(None) is None
+
+
+def test_naive_utc_parses_strings():
+    # SQLite: timestamp сырого запроса приходит строкой
+    assert naive_utc("2026-01-01 07:00:00.000000") == datetime(2026, 1, 1, 7, 0)
+    assert naive_utc("2026-01-01T10:00:00+03:00") == datetime(2026, 1, 1, 7, 0)
+    assert naive_utc("2026-01-01T07:00:00Z") == datetime(2026, 1, 1, 7, 0)
+    assert naive_utc("not a date") is None
+
+
+def test_unchanged_document_is_not_reindexed():
+    assert not needs_reindex(_disk(), _db())
+
+
+def test_modified_at_string_from_db():
+    assert not needs_reindex(_disk(), _db(modified_at="2026-01-01 07:00:00"))
+    assert needs_reindex(_disk(), _db(modified_at="2025-12-31 07:00:00"))
+
+
+def test_changed_md5_size_or_mtime():
+    assert needs_reindex(_disk(md5="m2"), _db())
+    assert needs_reindex(_disk(size=101), _db())
+    assert needs_reindex(_disk(modified_at=MODIFIED + timedelta(seconds=1)), _db())
+
+
+def test_missing_old_metadata_triggers_reindex():
+    assert needs_reindex(_disk(), _db(md5=None))
+    assert needs_reindex(_disk(), _db(size=None))
+    assert needs_reindex(_disk(), _db(modified_at=None))
+    # Диск не отдал поле — сравнивать нечего
+    assert not needs_reindex(_disk(md5=None, size=None, modified_at=None), _db())
+
+
+def test_retry_statuses_and_never_indexed():
+    for status in RETRY_STATUSES:
+        assert needs_reindex(_disk(), _db(status=status))
+    assert needs_reindex(_disk(), _db(indexed_at=None))
+
+
+def test_plan_sync_buckets():
+    db = [
+        _db(id=1, path="/kb/same.pdf"),
+        _db(id=2, path="/kb/changed.pdf"),
+        _db(id=3, path="/kb/back.pdf", is_active=False),
+        _db(id=4, path="/kb/gone.pdf"),
+        _db(id=5, path="/kb/gone-inactive.pdf", is_active=False),
+        _db(id=6, path="/kb/broken.pdf", status="error"),
+        _db(id=7, path="/kb/never.pdf", indexed_at=None, status="new"),
+    ]
+    disk = [
+        _disk(path="/kb/same.pdf"),
+        _disk(path="/kb/same.pdf", md5="dup"),  # повтор пути — берётся первый
+        _disk(path="/kb/changed.pdf", md5="m2"),
+        _disk(path="/kb/back.pdf"),
+        _disk(path="/kb/broken.pdf"),
+        _disk(path="/kb/never.pdf"),
+        _disk(path="/kb/new.pdf"),
+    ]
+    plan = plan_sync(disk, db)
+
+    assert [f["path"] for f in plan.unchanged] == ["/kb/same.pdf"]
+    assert [f["path"] for f in plan.new] == ["/kb/new.pdf"]
+    assert [f["path"] for f in plan.outdated] == ["/kb/changed.pdf", "/kb/broken.pdf", "/kb/never.pdf"]
+    assert [f["path"] for f in plan.reactivated] == ["/kb/back.pdf"]
+    assert plan.deleted == [{"id": 4, "path": "/kb/gone.pdf"}]
+    assert plan.upsert_status == {
+        "/kb/new.pdf": "new",
+        "/kb/changed.pdf": "outdated",
+        "/kb/broken.pdf": "error",
+        "/kb/never.pdf": "new",
+        "/kb/back.pdf": "indexed",
+    }
+    assert plan.doc_ids == {
+        "/kb/same.pdf": 1,
+        "/kb/changed.pdf": 2,
+        "/kb/back.pdf": 3,
+        "/kb/broken.pdf": 6,
+        "/kb/never.pdf": 7,
+    }
+    assert [f["path"] for f in plan.to_index] == ["/kb/new.pdf", "/kb/changed.pdf", "/kb/broken.pdf", "/kb/never.pdf"]
@@ -0,0 +1,54 @@
+from app.kb.retriever import join_chunks, merge_spans, overlap_len
+
+TAIL = "поставщик обязуется передать"  # длиннее MIN_OVERLAP
+
+
+def _hit(doc, order, text, score, **kw):
+    return {"chunk_id": doc * 100 + order, "document_id": doc, "chunk_order": order, "text": text, "score": score, **kw}
+
+
+def test_overlap_len():
+    assert overlap_len("начало. " + TAIL, TAIL + " товар") == len(TAIL)
+    assert overlap_len("abc", "") == 0
+    assert overlap_len("", "abc") == 0
+    # короткое случайное совпадение на стыке — не перекрытие
+    assert overlap_len("конец слова", "слова дальше") == 0
+    # b целиком внутри хвоста a — перекрытие любой длины
+    assert overlap_len("много текста abc", "abc") == 3
+
+
+def test_join_chunks_drops_overlap():
+    assert join_chunks(["начало. " + TAIL, TAIL + " товар."]) == "начало. " + TAIL + " товар."
+    assert join_chunks(["первый.", "второй."]) == "первый. второй."
+    assert join_chunks([]) == ""
+
+
+def test_merge_spans_joins_adjacent_chunks_of_one_document():
+    rows = [
+        _hit(1, 3, "три", 0.7),
+        _hit(2, 0, "другой", 0.6),
+        _hit(1, 2, "два", 0.9),
+        _hit(1, 7, "семь", 0.5),
+    ]
+    out = merge_spans(rows)
+
+    assert [(r["document_id"], r["span"]) for r in out] == [(1, (2, 3)), (2, (0, 0)), (1, (7, 7))]
+    first = out[0]
+    # место и chunk_id — у лучшего (первого в выдаче), score — максимальный
+    assert first["chunk_id"] == 103
+    assert first["score"] == 0.9
+    assert first["text"] == "два три"
+
+
+def test_merge_spans_uses_context_and_lexical_rank():
+    rows = [
+        _hit(1, 5, "пять", 0.8, lexical_rank=4, context=[(4, "четыре"), (6, "шесть")]),
+        _hit(1, 7, "семь", 0.6, lexical_rank=2),
+    ]
+    out = merge_spans(rows)
+
+    assert len(out) == 1
+    assert out[0]["span"] == (4, 7)
+    assert out[0]["text"] == "четыре пять шесть семь"
+    assert out[0]["lexical_rank"] == 2
+
@@ -0,0 +1,5 @@
+"""
+Offline-бенчмарки KB/RAG.
+
+Запуск из корня репозитория:  python -m bench.<module> [--help]
+"""
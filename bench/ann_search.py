@@ -0,0 +1,127 @@
+"""
+Поиск по kb_chunks: точный перебор против ANN-индекса (hnsw / ivfflat / bit) с разными ef_search / probes.
+Меряет p50/p95 латентности search_by_embedding и recall@k относительно точного результата.
+
+Векторы синтетические: малая внутренняя размерность (64 латентных измерения, темы + шум),
+спроецированная в dims, — как у реальных embeddings; на изотропном шуме ближайшие соседи почти
+равноудалены и recall любого ANN бессмысленно низкий.
+
+Нужен Postgres с pgvector (DATABASE_URL) и ПУСТОЙ kb_chunks: бенч пишет в активное поколение,
+а в конце удаляет свои документы и индекс. 3072 измерения индексируются только как halfvec
+(pgvector >= 0.7); --dims меньше 3072 — если колонка embedding без фиксированной размерности.
+
+    DATABASE_URL=postgresql://... python -m bench.ann_search [--rows 50000] [--queries 200] [--kind hnsw]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import time
+from typing import List
+
+import numpy as np
+
+from sqlalchemy import text as sqltext
+
+from app.db.repo_kb import KBRepo
+from app.db.session import ensure_schema, make_session_factory
+
+PREFIX = "bench/ann/"
+
+
+def make_vectors(n: int, dims: int, topics: int, rng: "np.random.Generator", basis: "np.ndarray") -> List[List[float]]:
+    """Точки малой внутренней размерности (латентные темы + шум), спроецированные в dims — как у embeddings."""
+    latent = basis.shape[0]
+    centers = np.random.default_rng(5).normal(size=(topics, latent))
+    z = centers[rng.integers(0, topics, n)] + rng.normal(scale=1.0, size=(n, latent))
+    v = z @ basis + rng.normal(scale=0.1, size=(n, dims))
+    v /= np.linalg.norm(v, axis=1, keepdims=True)
+    return v.astype(np.float32).tolist()
+
+
+def pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=50_000)
+    ap.add_argument("--dims", type=int, default=3072)
+    ap.add_argument("--topics", type=int, default=200)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--kind", choices=("hnsw", "ivfflat", "bit"), default="hnsw")
+    ap.add_argument("--ef", default="40,100,200", help="ef_search (hnsw) или probes (ivfflat) через запятую")
+    ap.add_argument("--build-mem-mb", type=int, default=0)
+    ap.add_argument("--binary-candidates", type=int, default=10, help="--kind bit: кандидатов на limit")
+    args = ap.parse_args()
+
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        raise SystemExit("DATABASE_URL is required")
+    sf, engine = make_session_factory(url)
+    ensure_schema(engine)
+    repo = KBRepo(sf, dim=args.dims, ann_binary_candidates=args.binary_candidates)
+
+    with sf() as s:
+        if s.execute(sqltext("SELECT COUNT(*) FROM kb_chunks")).scalar():
+            raise SystemExit("kb_chunks is not empty: run on an empty database")
+
+    rng = np.random.default_rng(11)
+    basis = np.random.default_rng(3).normal(size=(64, args.dims)) / 8.0
+    gen = repo.active_generation()
+    docs = repo.upsert_documents_bulk(
+        [{"path": f"{PREFIX}{i:03d}", "title": "bench", "status": "indexed"} for i in range(100)]
+    )
+    doc_ids = list(docs.values())
+    try:
+        t0 = time.perf_counter()
+        done = 0
+        while done < args.rows:
+            n = min(2000, args.rows - done)
+            vecs = make_vectors(n, args.dims, args.topics, rng, basis)
+            repo.insert_chunks_bulk(
+                [(doc_ids[(done + i) % len(doc_ids)], done + i, f"chunk {done + i}", v, None) for i, v in enumerate(vecs)]
+            )
+            done += n
+        print(f"loaded {args.rows} x {args.dims} in {time.perf_counter() - t0:.1f} s")
+        with sf() as s:
+            s.execute(sqltext("ANALYZE kb_chunks"))
+            s.commit()
+
+        queries = make_vectors(args.queries, args.dims, args.topics, rng, basis)
+
+        def run(label: str, **kw) -> List[List[int]]:
+            lat, results = [], []
+            for q in queries:
+                t = time.perf_counter()
+                hits = repo.search_by_embedding(q, limit=args.k, **kw)
+                lat.append((time.perf_counter() - t) * 1000)
+                results.append([h["chunk_id"] for h in hits])
+            recall = ""
+            if truth is not None:
+                r = statistics.mean(len(set(a) & set(b)) / max(1, len(b)) for a, b in zip(results, truth))
+                recall = f"  recall@{args.k}={r:.3f}"
+            print(f"{label:<22} p50={pct(lat, 0.5):7.1f} ms  p95={pct(lat, 0.95):7.1f} ms{recall}")
+            return results
+
+        truth = None
+        truth = run("exact scan", exact=True)
+
+        res = repo.ensure_ann_index(gen, kind=args.kind, build_mem_mb=args.build_mem_mb)
+        print(f"ANN index: {res}")
+        if not res.get("created"):
+            return
+        for ef in [int(x) for x in args.ef.split(",") if x.strip()]:
+            run(f"{args.kind} ef/probes={ef}", ef_search=ef)
+    finally:
+        repo.drop_ann_index(gen)
+        with sf() as s:
+            s.execute(sqltext("DELETE FROM kb_documents WHERE path LIKE :p"), {"p": PREFIX + "%"})
+            s.commit()
+
+
+if __name__ == "__main__":
+    main()
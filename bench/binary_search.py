@@ -0,0 +1,90 @@
+"""
+Двухэтапный поиск NumpyVectorStore (binary=True): Хэмминг по знаковым битам отбирает limit * N кандидатов,
+точный косинус — только по ним. Сравнение с точным перебором: p50/p95 и recall@k для нескольких N.
+
+Векторы синтетические, как в bench.ann_search: 64 латентных измерения (темы + шум), спроецированные в dims.
+Postgres-вариант (hnsw по binary_quantize, pgvector >= 0.7) — python -m bench.ann_search --kind bit.
+
+    python -m bench.binary_search [--rows 200000] [--dims 1024] [--candidates 4,10,20,40]
+"""
+from __future__ import annotations
+
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+
+from app.db.vector_store import NumpyVectorStore
+
+
+def pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=200_000)
+    ap.add_argument("--dims", type=int, default=1024)
+    ap.add_argument("--topics", type=int, default=200)
+    ap.add_argument("--queries", type=int, default=100)
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--candidates", default="4,10,20,40", help="кандидатов грубого прохода на limit")
+    args = ap.parse_args()
+
+    root = tempfile.mkdtemp(prefix="kb_binary_bench_")
+    rng = np.random.default_rng(11)
+    basis = np.random.default_rng(3).normal(size=(64, args.dims)) / 8.0
+    centers = np.random.default_rng(5).normal(size=(args.topics, 64))
+
+    def vectors(n: int) -> np.ndarray:
+        z = centers[rng.integers(0, args.topics, n)] + rng.normal(scale=1.0, size=(n, 64))
+        return (z @ basis + rng.normal(scale=0.1, size=(n, args.dims))).astype(np.float32)
+
+    try:
+        writer = NumpyVectorStore(root)
+        t0 = time.perf_counter()
+        for lo in range(0, args.rows, 5000):
+            hi = min(args.rows, lo + 5000)
+            writer.add(1, np.arange(lo, hi), np.arange(lo, hi) % 1000, vectors(hi - lo))
+        exact = NumpyVectorStore(root)
+        binary = NumpyVectorStore(root, binary=True)
+        t1 = time.perf_counter()
+        bits = binary._gen(1).part_bits()
+        print(
+            f"{args.rows} x {args.dims} written in {t1 - t0:.1f} s; sign bits {sum(b.nbytes for b in bits) / 2**20:.1f} MB "
+            f"in memory vs {args.rows * args.dims * 4 / 2**20:.0f} MB float32 (loaded in {(time.perf_counter() - t1) * 1000:.0f} ms)"
+        )
+
+        queries = vectors(args.queries)
+        k = args.k
+        exact.search(1, queries[0], limit=k)  # прогрев page cache
+
+        def run(label: str, store: NumpyVectorStore, cand: int) -> List[List[int]]:
+            lat, out = [], []
+            for q in queries:
+                t = time.perf_counter()
+                hits = store.search(1, q, limit=k, candidates=cand)
+                lat.append((time.perf_counter() - t) * 1000)
+                out.append([h[0] for h in hits])
+            rec = ""
+            if truth:
+                r = statistics.mean(len(set(a) & set(b)) / len(b) for a, b in zip(out, truth))
+                rec = f"  recall@{k}={r:.3f}"
+            print(f"{label:<20} p50={pct(lat, 0.5):6.1f} ms  p95={pct(lat, 0.95):6.1f} ms{rec}")
+            return out
+
+        truth: List[List[int]] = []
+        truth = run("exact", exact, 0)
+        for n in [int(x) for x in args.candidates.split(",") if x.strip()]:
+            run(f"binary x{n} ({n * k})", binary, n * k)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
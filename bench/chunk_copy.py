@@ -0,0 +1,101 @@
+"""
+Запись чанков в kb_chunks: прежний executemany INSERT (эмбеддинг — list[float],
+psycopg2 превращает его в текстовый литерал) против бинарного COPY из KBRepo.insert_chunks_bulk.
+
+Нужен Postgres с pgvector (DATABASE_URL). Бенч создаёт документ bench/chunk_copy
+и удаляет его (вместе с чанками) в конце.
+
+    DATABASE_URL=postgresql://... python -m bench.chunk_copy [--rows 100000] [--batch 1000]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import time
+from typing import List, Tuple
+
+from sqlalchemy import text as sqltext
+
+from app.db.repo_kb import KBRepo
+from app.db.session import ensure_schema, make_session_factory
+
+DIM = 3072
+BENCH_PATH = "bench/chunk_copy"
+
+
+def make_rows(document_id: int, start: int, n: int, rnd: random.Random) -> List[Tuple]:
+    return [
+        (
+            document_id,
+            start + i,
+            f"Синтетический чанк {start + i}: " + "текст регламента " * 50,
+            [rnd.uniform(-0.05, 0.05) for _ in range(DIM)],
+            f"{start + i:064x}",
+        )
+        for i in range(n)
+    ]
+
+
+def legacy_insert(repo: KBRepo, rows: List[Tuple]) -> None:
+    """Прежний KBRepo.insert_chunks_bulk: executemany INSERT."""
+    with repo.sf() as s:
+        s.execute(
+            sqltext(
+                """
+                INSERT INTO kb_chunks(document_id, chunk_order, text, embedding, content_hash)
+                VALUES (:document_id, :chunk_order, :text, :embedding, :content_hash)
+                """
+            ),
+            [{"document_id": r[0], "chunk_order": r[1], "text": r[2], "embedding": r[3], "content_hash": r[4]} for r in rows],
+        )
+        s.commit()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--batch", type=int, default=1000, help="строк на один insert_chunks_bulk")
+    ap.add_argument("--skip-legacy", action="store_true")
+    args = ap.parse_args()
+
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        raise SystemExit("DATABASE_URL is required")
+    sf, engine = make_session_factory(url)
+    ensure_schema(engine)
+    repo = KBRepo(sf, dim=DIM)
+    did = repo.upsert_documents_bulk([{"path": BENCH_PATH, "title": "bench", "status": "new"}])[BENCH_PATH]
+
+    # пул заранее сгенерированных строк: генерация эмбеддингов не должна попадать в замер
+    rnd = random.Random(7)
+    pool = make_rows(did, 0, min(args.batch, args.rows), rnd)
+
+    def run(label: str, insert) -> None:
+        with sf() as s:
+            s.execute(sqltext("DELETE FROM kb_chunks WHERE document_id=:d"), {"d": did})
+            s.commit()
+        t0 = time.perf_counter()
+        done = 0
+        while done < args.rows:
+            n = min(args.batch, args.rows - done)
+            insert([(r[0], done + j, r[2], r[3], r[4]) for j, r in enumerate(pool[:n])])
+            done += n
+        dt = time.perf_counter() - t0
+        with sf() as s:
+            cnt = s.execute(sqltext("SELECT COUNT(*) FROM kb_chunks WHERE document_id=:d"), {"d": did}).scalar()
+        assert cnt == args.rows, (cnt, args.rows)
+        print(f"{label:<26} rows={args.rows}  {dt:8.2f} s  {args.rows / dt:10.0f} rows/s")
+
+    try:
+        if not args.skip_legacy:
+            run("executemany INSERT", lambda rows: legacy_insert(repo, rows))
+        run("binary COPY", repo.insert_chunks_bulk)
+    finally:
+        with sf() as s:
+            s.execute(sqltext("DELETE FROM kb_documents WHERE id=:d"), {"d": did})
+            s.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Нарезка чанков: символьная (split_text, CHUNK_SIZE/CHUNK_OVERLAP) против структурной
+(iter_structured_chunks, KB_CHUNKER=structured, бюджет KB_CHUNK_TOKENS).
+
+На корпусе печатает для каждого чанкера: число чанков, токены, отправленные в embeddings,
+оценку размера индекса (float32-вектор --dims + текст + служебное на строку), сколько предложений
+разрезано границей чанка, и hit@k: запрос — часть слов случайного предложения корпуса, попадание —
+предложение целиком лежит в одном из k найденных чанков (то, что увидит модель).
+API не вызывается: embedding — хэшированный мешок слов (детерминированный), поиск — точный косинус.
+
+Корпус — синтетический (документы с разделами, нумерованными заголовками, таблицами, маркерами
+страниц) или свои файлы: --corpus DIR (.txt/.md/.pdf/.docx/.csv/.xlsx — те же парсеры, что у /kb sync).
+
+    python -m bench.chunking [--docs 200] [--corpus DIR] [--chunk-size 900] [--overlap 150] [--tokens 500,700,900]
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import random
+import re
+from typing import Callable, Dict, Iterable, List
+
+import numpy as np
+
+from app.core.utils import count_tokens_batch
+from app.kb.indexer import iter_structured_chunks, split_text
+from app.kb.parsers import (
+    detect_ext,
+    iter_csv_text,
+    iter_docx_text,
+    iter_pdf_text,
+    iter_txt_text,
+    iter_xlsx_text,
+    join_pieces,
+)
+
+ROW_OVERHEAD = 64  # заголовок строки, id/document_id/generation/chunk_order/hash, указатель индекса
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_SENT_RE = re.compile(r"(?<=[.!?])\s+")
+
+_TOPICS = {
+    "закупки": "заявка поставщик тендер лот спецификация согласование договор аванс",
+    "персонал": "сотрудник отпуск больничный табель премия оклад квартал аттестация",
+    "финансы": "бюджет платёж счёт проводка сверка дебиторка лимит казначейство",
+    "склад": "остаток приёмка отгрузка накладная инвентаризация ячейка партия брак",
+    "безопасность": "пропуск доступ инцидент журнал пароль учётная запись проверка",
+    "ит": "сервер резервная копия релиз тикет мониторинг обновление база",
+}
+_COMMON = "порядок срок ответственный пункт согласно требование документ отдел решение случай".split()
+
+
+def make_corpus(n_docs: int, rnd: random.Random) -> List[str]:
+    topics = list(_TOPICS)
+    docs: List[str] = []
+    for d in range(n_docs):
+        topic = topics[d % len(topics)]
+        vocab = _TOPICS[topic].split()
+        lines = [f"# {topic.capitalize()}: регламент {d}", ""]
+        page = 1
+        for sec in range(1, rnd.randint(3, 7)):
+            lines += [f"{sec}. {rnd.choice(vocab).capitalize()} и {rnd.choice(vocab)}", ""]
+            for sub in range(1, rnd.randint(2, 4)):
+                lines += [f"{sec}.{sub} {rnd.choice(vocab).capitalize()} {rnd.choice(_COMMON)}", ""]
+                for _ in range(rnd.randint(1, 4)):
+                    sents = []
+                    for _ in range(rnd.randint(2, 7)):
+                        words = [rnd.choice(vocab if rnd.random() < 0.6 else _COMMON) for _ in range(rnd.randint(10, 30))]
+                        # уникальные «факты»: номера и коды, по которым предложение можно найти
+                        words.insert(rnd.randrange(len(words)), f"№{d}-{sec}{sub}-{rnd.randint(100, 999)}")
+                        sents.append(" ".join(words).capitalize() + ".")
+                    lines += [" ".join(sents), ""]
+                if rnd.random() < 0.3:
+                    lines.append("Код\tНаименование\tСрок\tОтветственный")
+                    for r in range(rnd.randint(5, 40)):
+                        lines.append(f"{d}{sec}{sub}{r:02d}\t{rnd.choice(vocab)} {rnd.choice(vocab)}\t{rnd.randint(1, 30)} дн\t{rnd.choice(_COMMON)}")
+                    lines.append("")
+                if rnd.random() < 0.2:
+                    page += 1
+                    lines += [f"## Page {page}", ""]
+        docs.append("\n".join(lines))
+    return docs
+
+
+def load_corpus(path: str) -> List[str]:
+    readers: Dict[str, Callable[[bytes], Iterable[str]]] = {
+        "txt": iter_txt_text,
+        "md": iter_txt_text,
+        "pdf": lambda b: join_pieces(iter_pdf_text(b), "\n\n"),
+        "docx": lambda b: join_pieces(iter_docx_text(b), "\n"),
+        "xlsx": lambda b: join_pieces(iter_xlsx_text(b), "\n"),
+        "csv": lambda b: join_pieces(iter_csv_text(b), "\n"),
+    }
+    docs: List[str] = []
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            reader = readers.get(detect_ext(name))
+            if reader is None:
+                continue
+            with open(os.path.join(root, name), "rb") as f:
+                text = "".join(reader(f.read()))
+            if text.strip():
+                docs.append(text)
+    return docs
+
+
+def embed(texts: List[str], dims: int = 1024) -> np.ndarray:
+    """Хэшированный мешок слов (основа — первые 6 букв), tf сублинейно, L2-нормировка."""
+    out = np.zeros((len(texts), dims), dtype=np.float32)
+    for i, t in enumerate(texts):
+        for w in _WORD_RE.findall(t.lower()):
+            h = int.from_bytes(hashlib.blake2b(w[:6].encode("utf-8"), digest_size=4).digest(), "little")
+            out[i, h % dims] += 1.0
+    np.log1p(out, out=out)
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    return out / np.maximum(norms, 1e-9)
+
+
+def norm_ws(s: str) -> str:
+    return " ".join(s.split())
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=200, help="документов в синтетическом корпусе")
+    ap.add_argument("--corpus", default="", help="каталог со своими файлами вместо синтетики")
+    ap.add_argument("--chunk-size", type=int, default=900)
+    ap.add_argument("--overlap", type=int, default=150)
+    ap.add_argument("--tokens", default="500,700,900", help="KB_CHUNK_TOKENS, через запятую")
+    ap.add_argument("--dims", type=int, default=3072, help="размерность векторов для оценки размера индекса")
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("--k", type=int, default=6)
+    args = ap.parse_args()
+
+    rnd = random.Random(22)
+    docs = load_corpus(args.corpus) if args.corpus else make_corpus(args.docs, rnd)
+    if not docs:
+        raise SystemExit("empty corpus")
+
+    # вопросы — по предложениям обычного текста (не заголовки и не строки таблиц), хотя бы из 8 слов
+    doc_sentences = [
+        [
+            norm_ws(s)
+            for para in d.split("\n")
+            if "\t" not in para and not para.lstrip().startswith("#")
+            for s in _SENT_RE.split(para)
+            if len(_WORD_RE.findall(s)) >= 8
+        ]
+        for d in docs
+    ]
+    sentences = [s for ss in doc_sentences for s in ss]
+    answers = rnd.sample(sentences, min(args.queries, len(sentences)))
+    queries = []
+    for s in answers:
+        words = _WORD_RE.findall(s)
+        queries.append(" ".join(rnd.sample(words, max(4, len(words) // 2))))
+    qv = embed(queries)
+
+    chunkers = {
+        f"chars {args.chunk_size}/{args.overlap}": lambda d: split_text(d, args.chunk_size, args.overlap),
+    }
+    for n in [int(x) for x in args.tokens.split(",") if x.strip()]:
+        chunkers[f"structured {n} tok"] = lambda d, n=n: list(iter_structured_chunks([d], n))
+    print(f"corpus: {len(docs)} documents, {sum(len(d) for d in docs) / 2**20:.1f} MB of text, {len(sentences)} sentences")
+    for name, chunk in chunkers.items():
+        per_doc = [[c.text for c in chunk(d)] for d in docs]
+        texts = [t for ts in per_doc for t in ts]
+        counts, exact = count_tokens_batch(texts)
+        text_bytes = sum(len(t.encode("utf-8")) for t in texts)
+        index_mb = (len(texts) * (args.dims * 4 + 8 + ROW_OVERHEAD) + text_bytes) / 2**20
+        flat = [norm_ws(t) for t in texts]
+        # предложение разрезано, если целиком не лежит ни в одном чанке своего документа
+        cut = 0
+        for ts, ss in zip(per_doc, doc_sentences):
+            joined = [norm_ws(t) for t in ts]
+            cut += sum(1 for s in ss if not any(s in t for t in joined))
+
+        cv = embed(texts)
+        top = np.argsort(-(qv @ cv.T), axis=1)[:, : args.k]
+        hits = sum(1 for ans, row in zip(answers, top) if any(ans in flat[j] for j in row))
+        print(
+            f"  {name:<22} chunks={len(texts):<6} tokens={sum(counts):<8} ({'tiktoken' if exact else 'estimate'}) "
+            f"avg={sum(counts) / len(texts):.0f}  index≈{index_mb:.1f} MB  "
+            f"sentences cut={cut / len(sentences):.1%}  hit@{args.k}={hits / len(answers):.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Колонтитулы и почти-дубликаты чанков (KB_STRIP_BOILERPLATE, KB_DEDUP): сколько чанков и токенов уходит
+в embeddings без них и с ними, и сколько почти-копий уже найденного текста попадает в top-k поиска по всей БЗ.
+
+Корпус синтетический, «как PDF»: семейства договоров по одному шаблону (версии отличаются парой слов,
+часть версий — суммами и сроками: такие копиями не считаются), уникальные регламенты, на каждой странице
+шапка с названием организации, «Стр. N из M» и юридическая оговорка в подвале.
+API не вызывается: embedding — хэшированный мешок слов (как в bench.chunking), БД — временный SQLite
+с NumpyVectorStore, индексация — тот же KbIndexer, что у /kb sync.
+
+    python -m bench.dedup [--families 40] [--versions 5] [--unique 100] [--distance 3]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from app.core.utils import count_tokens_batch
+from app.db.repo_kb import KBRepo
+from app.db.session import ensure_schema, make_session_factory
+from app.db.vector_store import NumpyVectorStore
+from app.kb.dedup import ChunkDeduper, hamming, simhash, strip_boilerplate
+from app.kb.indexer import KbIndexer
+
+from bench.chunking import embed
+
+_VOCAB = (
+    "поставщик покупатель товар поставка оплата срок приёмка претензия спецификация гарантия "
+    "неустойка расторжение уведомление сторона обязательство качество упаковка доставка счёт акт"
+).split()
+_HEADER = "ООО «Северная логистика» · Договорной отдел"
+_FOOTER = "Настоящий документ является собственностью ООО «Северная логистика». Копирование запрещено."
+
+
+class CountingEmbedder:
+    def __init__(self):
+        self.texts = 0
+        self.tokens = 0
+
+    def embed(self, texts: List[str]):
+        self.texts += len(texts)
+        self.tokens += sum(count_tokens_batch(texts)[0])
+        return list(embed(texts, 256))
+
+
+def clause(rnd: random.Random) -> str:
+    words = [rnd.choice(_VOCAB) for _ in range(rnd.randint(25, 45))]
+    return " ".join(words).capitalize() + "."
+
+
+def paginate(paras: List[str], per_page: int) -> List[str]:
+    chunks = [paras[i : i + per_page] for i in range(0, len(paras), per_page)]
+    return [
+        "\n".join([_HEADER, f"Стр. {n} из {len(chunks)}", ""] + p + ["", _FOOTER])
+        for n, p in enumerate(chunks, 1)
+    ]
+
+
+def make_corpus(args, rnd: random.Random) -> Dict[str, List[str]]:
+    docs: Dict[str, List[str]] = {}
+    for f in range(args.families):
+        template = [f"{i + 1}. {clause(rnd)} {clause(rnd)}" for i in range(rnd.randint(20, 40))]
+        for v in range(args.versions):
+            paras = list(template)
+            # правки версии: пара слов в нескольких пунктах
+            for i in rnd.sample(range(len(paras)), max(1, len(paras) // 10)):
+                words = paras[i].split()
+                words[rnd.randrange(1, len(words))] = rnd.choice(_VOCAB)
+                paras[i] = " ".join(words)
+            if rnd.random() < 0.3:
+                # другая сумма — уже не копия
+                i = rnd.randrange(len(paras))
+                paras[i] += f" Сумма договора {rnd.randint(10, 999)} {rnd.randint(100, 999)} руб."
+            docs[f"contracts/{f:03d}/v{v}.pdf"] = paginate(paras, 6)
+    for u in range(args.unique):
+        paras = [clause(rnd) for _ in range(rnd.randint(15, 40))]
+        docs[f"regulations/{u:03d}.pdf"] = paginate(paras, 6)
+    return docs
+
+
+def run(name: str, docs: Dict[str, List[str]], args, *, strip: bool, dedup: bool) -> None:
+    tmp = tempfile.mkdtemp(prefix="bench_dedup_")
+    try:
+        sf, engine = make_session_factory("sqlite:///" + os.path.join(tmp, "kb.sqlite3"))
+        ensure_schema(engine)
+        repo = KBRepo(sf, vector_store=NumpyVectorStore(os.path.join(tmp, "vectors")))
+        emb = CountingEmbedder()
+        deduper = ChunkDeduper(repo, max_distance=args.distance) if dedup else None
+        indexer = KbIndexer(repo, emb, args.chunk_size, args.overlap, dedup=deduper)
+        ids = repo.upsert_documents_bulk([{"path": p, "title": p, "status": "new"} for p in docs])
+
+        boiler: Dict[str, int] = {}
+        t0 = time.perf_counter()
+        for path, pages in docs.items():
+            it = strip_boilerplate(pages, stats=boiler) if strip else iter(pages)
+            indexer.reindex_document(ids[path], "\n\n".join(p for p in it if p))
+        elapsed = time.perf_counter() - t0
+
+        status = repo.status_summary()
+        rnd = random.Random(7)
+        all_pages = [p for ps in docs.values() for p in ps]
+        queries = [clause(random.Random(rnd.random())) for _ in range(args.queries)]
+        queries += [rnd.choice(rnd.choice(all_pages).splitlines()[3:-2] or [""]) for _ in range(args.queries)]
+        copies = []
+        for q in queries:
+            hits = repo.search_by_embedding(embed([q], 256)[0], limit=args.k)
+            # хит — копия, если выше него уже есть почти такой же текст: место в контексте модели потрачено зря
+            sigs = [simhash(h["text"]) for h in hits]
+            copies.append(sum(1 for i, a in enumerate(sigs) if any(hamming(a, b) <= 3 for b in sigs[:i])))
+
+        print(
+            f"  {name:<24} rows={status.get('chunks_total', 0):<6} embedded={emb.texts:<6} "
+            f"tokens={emb.tokens:<8} duplicates={status.get('chunks_duplicate', 0):<5} "
+            f"boilerplate lines={boiler.get('lines', 0)} tokens={boiler.get('tokens', 0)}  "
+            f"copies in top-{args.k}={np.mean(copies):.2f}  index {elapsed:.1f} s"
+        )
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--families", type=int, default=40, help="шаблонов договоров")
+    ap.add_argument("--versions", type=int, default=5, help="версий каждого шаблона")
+    ap.add_argument("--unique", type=int, default=100, help="уникальных документов")
+    ap.add_argument("--distance", type=int, default=3, help="KB_DEDUP_DISTANCE")
+    ap.add_argument("--chunk-size", type=int, default=900)
+    ap.add_argument("--overlap", type=int, default=150)
+    ap.add_argument("--queries", type=int, default=100)
+    ap.add_argument("--k", type=int, default=6)
+    args = ap.parse_args()
+
+    rnd = random.Random(23)
+    docs = make_corpus(args, rnd)
+    n_pages = sum(len(p) for p in docs.values())
+    print(f"corpus: {len(docs)} documents, {n_pages} pages")
+
+    sample = [p for ps in docs.values() for p in ps][:2000]
+    t0 = time.perf_counter()
+    for p in sample:
+        simhash(p)
+    print(f"simhash: {(time.perf_counter() - t0) / len(sample) * 1000:.2f} ms per page")
+
+    run("baseline", docs, args, strip=False, dedup=False)
+    run("strip boilerplate", docs, args, strip=True, dedup=False)
+    run("strip + dedup", docs, args, strip=True, dedup=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Скачивание файлов с локального HTTP-двойника Яндекс.Диска: прежний клиент
+(requests.get без Session, файл целиком в память) против пула keep-alive
+соединений с разной конкурентностью и (если есть httpx) асинхронного клиента.
+
+Стоимость установки соединения (TLS handshake) имитируется задержкой на каждое
+новое TCP-соединение, сетевая задержка — паузой на каждый запрос.
+
+    python -m bench.disk_download [--files 200] [--size-kb 256] [--handshake-ms 40] [--rtt-ms 10]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from app.clients.yandex_disk_client import YandexDiskClient
+
+
+def start_fake_disk(size: int, handshake: float, rtt: float) -> ThreadingHTTPServer:
+    payload = os.urandom(size)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # иначе keep-alive ловит 40 мс delayed ACK на каждом ответе
+
+        def setup(self) -> None:
+            super().setup()
+            time.sleep(handshake)  # "TLS handshake" на каждое новое соединение
+
+        def log_message(self, *args) -> None:  # noqa: D401
+            pass
+
+        def _send(self, code: int, body: bytes, ctype: str, extra: dict | None = None) -> None:
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (extra or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            time.sleep(rtt)
+            u = urlparse(self.path)
+            if u.path.endswith("/resources/download"):
+                name = parse_qs(u.query).get("path", ["x"])[0].strip("/").replace("/", "_")
+                href = f"http://127.0.0.1:{self.server.server_port}/files/{name}"
+                self._send(200, json.dumps({"href": href}).encode(), "application/json")
+                return
+            if u.path.startswith("/files/"):
+                rng = self.headers.get("Range")
+                if rng:
+                    lo_s, hi_s = rng.split("=", 1)[1].split("-", 1)
+                    lo = int(lo_s)
+                    hi = int(hi_s) if hi_s else len(payload) - 1
+                    self._send(206, payload[lo : hi + 1], "application/octet-stream",
+                               {"Content-Range": f"bytes {lo}-{hi}/{len(payload)}", "Accept-Ranges": "bytes"})
+                else:
+                    self._send(200, payload, "application/octet-stream", {"Accept-Ranges": "bytes"})
+                return
+            self._send(404, b"{}", "application/json")
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def legacy_download(base: str, path: str) -> bytes:
+    """Прежний YandexDiskClient.download: два requests.get без Session."""
+    r = requests.get(f"{base}/resources/download", headers={"Authorization": "OAuth x"}, params={"path": path})
+    r.raise_for_status()
+    f = requests.get(r.json()["href"])
+    f.raise_for_status()
+    return f.content
+
+
+def run(label: str, fn: Callable[[str], int], paths: List[str], concurrency: int, total_bytes: int) -> None:
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        got = sum(ex.map(fn, paths))
+    dt = time.perf_counter() - t0
+    assert got == total_bytes, (got, total_bytes)
+    print(f"{label:<34} c={concurrency:<3} {len(paths) / dt:8.1f} files/s  {total_bytes / dt / 1e6:8.1f} MB/s")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=200)
+    ap.add_argument("--size-kb", type=int, default=256)
+    ap.add_argument("--handshake-ms", type=float, default=40.0)
+    ap.add_argument("--rtt-ms", type=float, default=10.0)
+    args = ap.parse_args()
+
+    size = args.size_kb * 1024
+    srv = start_fake_disk(size, args.handshake_ms / 1000.0, args.rtt_ms / 1000.0)
+    base = f"http://127.0.0.1:{srv.server_port}/v1/disk"
+    paths = [f"/kb/doc_{i}.pdf" for i in range(args.files)]
+    total = size * len(paths)
+
+    run("legacy requests.get", lambda p: len(legacy_download(base, p)), paths, 1, total)
+
+    for c in (1, 4, 16, 32):
+        cli = YandexDiskClient("x", "/kb", base_url=base, pool_size=max(4, c))
+
+        def pooled(p: str, cli: YandexDiskClient = cli) -> int:
+            with cli.download_to_spool(p) as f:
+                return len(f.read())
+
+        run("pooled session + spool", pooled, paths, c, total)
+        cli.close()
+
+    try:
+        from app.clients.yandex_disk_async import AsyncYandexDiskClient, httpx
+
+        if httpx is None:
+            raise ImportError("httpx")
+
+        async def go(c: int) -> None:
+            cli = AsyncYandexDiskClient("x", "/kb", base_url=base, max_connections=c)
+            t0 = time.perf_counter()
+            res = await cli.download_many(paths, concurrency=c)
+            dt = time.perf_counter() - t0
+            got = 0
+            for f in res.values():
+                if isinstance(f, Exception):
+                    raise f
+                got += len(f.read())
+                f.close()
+            await cli.aclose()
+            assert got == total
+            print(f"{'async httpx download_many':<34} c={c:<3} {len(paths) / dt:8.1f} files/s  {total / dt / 1e6:8.1f} MB/s")
+
+        for c in (4, 16, 32):
+            asyncio.run(go(c))
+    except ImportError:
+        print("async httpx: skipped (httpx is not installed)")
+
+    srv.shutdown()
+
+
+if __name__ == "__main__":
+    main()
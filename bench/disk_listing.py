@@ -0,0 +1,178 @@
+"""
+Листинг БЗ на локальном HTTP-двойнике Яндекс.Диска: прежний рекурсивный обход
+(limit=1000 без offset, последовательно, requests.get без Session) против режимов
+walk (параллельный обход с постраничным offset) и flat (/resources/files).
+
+Дерево: 2000 папок (40 верхнего уровня x 49 вложенных), 50 000 файлов, из них
+3000 в одной папке — больше страницы, прежний обход её обрезает. Ещё 5000 файлов
+лежат вне корня БЗ (их должен отбросить flat-режим). Сетевая задержка — пауза
+на каждый запрос.
+
+    python -m bench.disk_listing [--files 50000] [--folders 2000] [--rtt-ms 5] [--workers 8]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from app.clients.yandex_disk_client import YandexDiskClient
+
+ROOT = "disk:/kb"
+
+
+def build_tree(n_files: int, n_folders: int, big: int = 3000) -> Dict[str, List[Dict[str, Any]]]:
+    """{папка: [элементы]} — папки идут первыми, как у Диска."""
+    top = max(1, n_folders // 50)
+    per_top = max(0, (n_folders - top) // top)
+    tree: Dict[str, List[Dict[str, Any]]] = {ROOT: []}
+    folders: List[str] = []
+    for i in range(top):
+        t = f"{ROOT}/dept_{i:03d}"
+        tree[ROOT].append({"type": "dir", "path": t})
+        tree[t] = []
+        folders.append(t)
+        for j in range(per_top):
+            sub = f"{t}/sub_{j:03d}"
+            tree[t].append({"type": "dir", "path": sub})
+            tree[sub] = []
+            folders.append(sub)
+
+    def add(folder: str, k: int) -> None:
+        tree[folder].append(
+            {"type": "file", "path": f"{folder}/doc_{k:06d}.pdf", "resource_id": f"r{k}",
+             "modified": "2026-01-01T00:00:00+00:00", "md5": f"{k:032x}", "size": 1000 + k}
+        )
+
+    big = min(big, n_files)
+    for k in range(big):
+        add(folders[0], k)
+    rest = folders[1:] or folders
+    for k in range(big, n_files):
+        add(rest[k % len(rest)], k)
+    return tree
+
+
+def start_fake_disk(tree: Dict[str, List[Dict[str, Any]]], outside: int, rtt: float) -> ThreadingHTTPServer:
+    flat = [it for items in tree.values() for it in items if it["type"] == "file"]
+    flat += [{"type": "file", "path": f"disk:/Photos/img_{k}.jpg", "size": 1} for k in range(outside)]
+    flat.sort(key=lambda it: it["path"])
+    counter = {"requests": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # иначе keep-alive ловит 40 мс delayed ACK на каждом ответе
+
+        def log_message(self, *args) -> None:  # noqa: D401
+            pass
+
+        def _json(self, code: int, obj: Any) -> None:
+            body = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            time.sleep(rtt)
+            with lock:
+                counter["requests"] += 1
+            u = urlparse(self.path)
+            q = {k: v[0] for k, v in parse_qs(u.query).items()}
+            limit = int(q.get("limit", 20))
+            offset = int(q.get("offset", 0))
+            if u.path.endswith("/resources/files"):
+                self._json(200, {"items": flat[offset : offset + limit], "limit": limit, "offset": offset})
+                return
+            if u.path.endswith("/resources"):
+                path = q.get("path", "")
+                if not path.startswith("disk:"):
+                    path = "disk:" + path
+                items = tree.get(path.rstrip("/"))
+                if items is None:
+                    self._json(404, {"error": "DiskNotFoundError"})
+                    return
+                self._json(200, {"type": "dir", "path": path, "_embedded": {
+                    "items": items[offset : offset + limit], "total": len(items), "limit": limit, "offset": offset}})
+                return
+            self._json(404, {})
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    srv.daemon_threads = True
+    srv.counter = counter  # type: ignore[attr-defined]
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def legacy_list(base: str, root: str) -> List[Dict[str, Any]]:
+    """Копия прежнего YandexDiskClient.list_kb_files_metadata (requests.get, limit=1000, без offset)."""
+    out: List[Dict[str, Any]] = []
+
+    def full(path: str) -> str:
+        if not path:
+            return root
+        if path.startswith("/"):
+            return path
+        return f"{root}/{path}".rstrip("/")
+
+    def walk(rel: str) -> None:
+        r = requests.get(f"{base}/resources", headers={"Authorization": "OAuth x"},
+                         params={"path": full(rel), "limit": 1000, "offset": 0})
+        r.raise_for_status()
+        for it in (r.json().get("_embedded") or {}).get("items") or []:
+            p = it.get("path")
+            if it.get("type") == "dir":
+                walk(p[len(root):].lstrip("/") if p.startswith(root) else p)
+            else:
+                out.append({"path": p[len(root):].lstrip("/") if p.startswith(root) else p})
+
+    walk("")
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=50_000)
+    ap.add_argument("--folders", type=int, default=2000)
+    ap.add_argument("--outside", type=int, default=5000, help="файлов вне корня БЗ")
+    ap.add_argument("--rtt-ms", type=float, default=5.0)
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--skip-legacy", action="store_true")
+    args = ap.parse_args()
+
+    tree = build_tree(args.files, args.folders)
+    srv = start_fake_disk(tree, args.outside, args.rtt_ms / 1000.0)
+    base = f"http://127.0.0.1:{srv.server_port}/v1/disk"
+    n_folders = len(tree) - 1
+    print(f"tree: {n_folders} folders, {args.files} files under {ROOT}, {args.outside} outside")
+
+    def report(label: str, fn) -> List[str]:
+        before = srv.counter["requests"]  # type: ignore[attr-defined]
+        t0 = time.perf_counter()
+        res = fn()
+        dt = time.perf_counter() - t0
+        reqs = srv.counter["requests"] - before  # type: ignore[attr-defined]
+        print(f"{label:<28} files={len(res):>6}  requests={reqs:>5}  {dt:7.2f} s")
+        return sorted(str(x["path"]) for x in res)
+
+    if not args.skip_legacy:
+        report("legacy recursive walk", lambda: legacy_list(base, ROOT))
+
+    cli = YandexDiskClient("x", ROOT, base_url=base, pool_size=max(4, args.workers), list_workers=args.workers)
+    walk_keys = report(f"walk, {args.workers} workers", lambda: cli.list_kb_files_metadata(mode="walk"))
+    flat_keys = report(f"flat, {args.workers} workers", lambda: cli.list_kb_files_metadata(mode="flat"))
+    print(f"walk == flat keys: {walk_keys == flat_keys}")
+    cli.close()
+    srv.shutdown()
+
+
+if __name__ == "__main__":
+    main()
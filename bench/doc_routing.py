@@ -0,0 +1,139 @@
+"""
+Двухуровневый поиск (KB_ROUTE_DOCS): сначала M документов с ближайшими к запросу центроидами
+(kb_document_vectors), затем чанки только в них — против обычного поиска по всем документам диалога.
+
+Для диалогов с --scopes документов и M из --route печатает p50/p95, recall@k относительно точного поиска
+по всей области и сколько чанков остаётся кандидатами (во сколько раз меньше). route=0 — без маршрутизации.
+Векторы синтетические (как в bench.ann_search), но у документа несколько тем (--doc-topics): чанк — одна
+из тем документа + шум, так что центроид документа — смесь тем, как у настоящих многотемных файлов.
+
+Нужен Postgres с pgvector (DATABASE_URL) и ПУСТОЙ kb_chunks; бенч строит ANN-индекс поколения,
+в конце удаляет его и свои документы.
+
+    DATABASE_URL=postgresql://... python -m bench.doc_routing [--docs 2000] [--route 0,5,10,25,50]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import time
+from typing import List
+
+import numpy as np
+
+from sqlalchemy import text as sqltext
+
+from app.db.repo_kb import KBRepo
+from app.db.session import ensure_schema, make_session_factory
+
+PREFIX = "bench/routing/"
+
+
+def pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=2000)
+    ap.add_argument("--chunks-per-doc", type=int, default=30)
+    ap.add_argument("--dims", type=int, default=1024)
+    ap.add_argument("--topics", type=int, default=200)
+    ap.add_argument("--doc-topics", type=int, default=3, help="тем в одном документе")
+    ap.add_argument("--scopes", default="100,400,1000", help="сколько документов у диалога")
+    ap.add_argument("--route", default="0,5,10,25,50", help="KB_ROUTE_DOCS")
+    ap.add_argument("--queries", type=int, default=50)
+    ap.add_argument("--k", type=int, default=6)
+    args = ap.parse_args()
+
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        raise SystemExit("DATABASE_URL is required")
+    sf, engine = make_session_factory(url)
+    ensure_schema(engine)
+    repo = KBRepo(sf)
+
+    with sf() as s:
+        if s.execute(sqltext("SELECT COUNT(*) FROM kb_chunks")).scalar():
+            raise SystemExit("kb_chunks is not empty: run on an empty database")
+
+    rng = np.random.default_rng(29)
+    latent = 64
+    basis = rng.normal(size=(latent, args.dims)) / 8.0
+    centers = rng.normal(size=(args.topics, latent))
+
+    def vectors(topic_ids: np.ndarray) -> np.ndarray:
+        z = centers[topic_ids] + rng.normal(scale=1.0, size=(len(topic_ids), latent))
+        v = z @ basis + rng.normal(scale=0.1, size=(len(topic_ids), args.dims))
+        return (v / np.linalg.norm(v, axis=1, keepdims=True)).astype(np.float32)
+
+    gen = repo.active_generation()
+    repo.drop_ann_index(gen)
+    docs = repo.upsert_documents_bulk(
+        [{"path": f"{PREFIX}{i:05d}", "title": "bench", "status": "indexed"} for i in range(args.docs)]
+    )
+    doc_ids = [docs[f"{PREFIX}{i:05d}"] for i in range(args.docs)]
+    doc_topics = rng.integers(0, args.topics, (args.docs, args.doc_topics))
+    try:
+        t0 = time.perf_counter()
+        per_batch = max(1, 2000 // args.chunks_per_doc)
+        for lo in range(0, args.docs, per_batch):
+            batch = list(range(lo, min(args.docs, lo + per_batch)))
+            topics = np.concatenate([rng.choice(doc_topics[d], args.chunks_per_doc) for d in batch])
+            vecs = vectors(topics)
+            rows = []
+            for j, d in enumerate(batch):
+                for o in range(args.chunks_per_doc):
+                    rows.append((doc_ids[d], o, f"chunk {d}/{o}", vecs[j * args.chunks_per_doc + o], None))
+            repo.insert_chunks_bulk(rows)
+        t1 = time.perf_counter()
+        centroids = repo.backfill_document_vectors(gen)
+        t2 = time.perf_counter()
+        with sf() as s:
+            s.execute(sqltext("ANALYZE kb_chunks"))
+            s.commit()
+        res = repo.ensure_ann_index(gen)
+        print(
+            f"loaded {args.docs * args.chunks_per_doc} chunks in {t1 - t0:.1f} s; "
+            f"{centroids} document centroids in {t2 - t1:.1f} s; ANN index: {res.get('kind')} created={res.get('created')}"
+        )
+
+        k = args.k
+        routes = [int(x) for x in args.route.split(",") if x.strip()]
+        for n_docs in [int(x) for x in args.scopes.split(",") if x.strip()]:
+            n_docs = min(n_docs, args.docs)
+            scopes = [rng.choice(args.docs, n_docs, replace=False) for _ in range(args.queries)]
+            # запрос — про одну из тем одного из документов диалога
+            queries = [vectors(np.array([rng.choice(doc_topics[int(sc[0])])]))[0] for sc in scopes]
+            scope_ids = [[doc_ids[int(i)] for i in sc] for sc in scopes]
+            truth = [
+                {h["chunk_id"] for h in repo.search_by_embedding(q, limit=k, document_ids=ids, exact=True)}
+                for q, ids in zip(queries, scope_ids)
+            ]
+            print(f"dialog with {n_docs} documents ({n_docs * args.chunks_per_doc} chunks):")
+            for m in routes:
+                lat, rec, plans = [], [], {}
+                for q, ids, t in zip(queries, scope_ids, truth):
+                    t1 = time.perf_counter()
+                    hits = repo.search_by_embedding(q, limit=k, document_ids=ids, route_docs=m)
+                    lat.append((time.perf_counter() - t1) * 1000)
+                    rec.append(len(t & {h["chunk_id"] for h in hits}) / max(1, len(t)))
+                    plan = hits[0].get("plan", "-") if hits else "-"
+                    plans[plan] = plans.get(plan, 0) + 1
+                cand = (min(m, n_docs) if m else n_docs) * args.chunks_per_doc
+                print(
+                    f"  route={m:<4} p50={pct(lat, 0.5):7.1f} ms  p95={pct(lat, 0.95):7.1f} ms  "
+                    f"recall@{k}={statistics.mean(rec):.3f}  candidates={cand} "
+                    f"(x{n_docs * args.chunks_per_doc / cand:.0f} fewer)  plan={max(plans, key=plans.get)}"
+                )
+    finally:
+        repo.drop_ann_index(gen)
+        with sf() as s:
+            s.execute(sqltext("DELETE FROM kb_documents WHERE path LIKE :p"), {"p": PREFIX + "%"})
+            s.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Сколько запросов к embeddings API уходит на 1000 чанков: старая упаковка
+(32 элемента / 80k символов + деление пополам при ошибке) против упаковки по токенам.
+
+API не вызывается: фейковый embedder отклоняет запросы сверх лимитов OpenAI
+(2048 элементов, 300k токенов) и считает все попытки, включая неудачные.
+
+    python -m bench.embed_batching [--chunks 1000] [--chunk-size 900]
+"""
+from __future__ import annotations
+
+import argparse
+import random
+from typing import List
+
+from app.core.utils import count_tokens_batch
+from app.kb.indexer import KbIndexer
+
+API_MAX_ITEMS = 2048
+API_MAX_TOKENS = 300_000
+
+_RU = "договор поставка штраф пени согласно пункту регламента сотрудник отдела КПЭ премия квартал".split()
+_EN = "contract article clause invoice payment schedule penalty".split()
+
+
+def make_chunks(n: int, size: int, seed: int = 42) -> List[str]:
+    rnd = random.Random(seed)
+    out: List[str] = []
+    for _ in range(n):
+        words: List[str] = []
+        while sum(len(w) + 1 for w in words) < size:
+            words.append(rnd.choice(_RU) if rnd.random() < 0.85 else rnd.choice(_EN))
+            if rnd.random() < 0.05:
+                words.append(f"ст.{rnd.randint(1, 999)}.{rnd.randint(1, 9)}")
+        out.append(" ".join(words)[:size])
+    return out
+
+
+class FakeEmbedder:
+    model = "bench-fake"
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.rejected = 0
+
+    def embed(self, texts: List[str]) -> List[list[float]]:
+        self.requests += 1
+        counts, _ = count_tokens_batch(texts)
+        if len(texts) > API_MAX_ITEMS or sum(counts) > API_MAX_TOKENS:
+            self.rejected += 1
+            raise RuntimeError("max_tokens_per_request exceeded")
+        return [[0.0] for _ in texts]
+
+
+def legacy_embed_batched(emb: FakeEmbedder, texts: List[str], max_items: int = 32, max_chars: int = 80_000) -> int:
+    """Копия прежнего KbIndexer._embed_batched (до упаковки по токенам)."""
+
+    def flush(b: List[str]) -> List[list[float]]:
+        if not b:
+            return []
+        try:
+            return emb.embed(b)
+        except Exception:
+            if len(b) == 1:
+                raise
+            mid = len(b) // 2
+            return flush(b[:mid]) + flush(b[mid:])
+
+    out: List[list[float]] = []
+    batch: List[str] = []
+    chars = 0
+    for t in texts:
+        if batch and (len(batch) >= max_items or chars + len(t) >= max_chars):
+            out.extend(flush(batch))
+            batch, chars = [], 0
+        batch.append(t)
+        chars += len(t)
+    out.extend(flush(batch))
+    return len(out)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chunks", type=int, default=1000)
+    ap.add_argument("--chunk-size", type=int, default=900, help="символов на чанк")
+    ap.add_argument("--legacy-max-chars", type=int, default=80_000)
+    args = ap.parse_args()
+
+    texts = make_chunks(args.chunks, args.chunk_size)
+    counts, exact = count_tokens_batch(texts)
+    print(f"chunks={len(texts)} tokens={sum(counts)} ({'tiktoken' if exact else 'estimated'})")
+
+    old = FakeEmbedder()
+    legacy_embed_batched(old, texts, max_chars=args.legacy_max_chars)
+
+    new = FakeEmbedder()
+    ix = KbIndexer(None, new, 900, 150)  # type: ignore[arg-type]
+    ix._embed_uncached(texts)
+
+    per_k = 1000.0 / max(1, len(texts))
+    print(f"legacy (32 items / {args.legacy_max_chars} chars): requests={old.requests} rejected={old.rejected} "
+          f"-> {old.requests * per_k:.1f} per 1000 chunks")
+    print(f"token packer ({API_MAX_ITEMS} items / {API_MAX_TOKENS} tokens): requests={new.requests} rejected={new.rejected} "
+          f"-> {new.requests * per_k:.1f} per 1000 chunks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Путь embedding от ответа OpenAI до Postgres: списки Python float против float32 (numpy).
+
+1) Ответ embeddings (по умолчанию 32 x 3072) от фейкового сервера через настоящий SDK openai:
+   - float JSON          — encoding_format="float", числа парсятся из JSON и валидируются pydantic;
+   - SDK base64 -> list  — прежний OpenAIClient.embeddings: SDK сам качает base64, но делает .tolist();
+   - base64 -> float32   — OpenAIClient.embeddings: строка base64 декодируется сразу в numpy float32.
+   Меряется время на батч и память, которую занимает результат (tracemalloc).
+2) Дальше по пути: кодирование батча в бинарный COPY (encode_chunk_copy) и литерал запроса
+   для search_by_embedding — из list[float] против float32.
+
+Сеть и ключ не нужны.
+
+    python -m bench.embed_decode [--batch 32] [--dims 3072] [--rounds 30]
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, List
+
+import numpy as np
+from openai import OpenAI
+
+from app.clients.openai_client import OpenAIClient
+from app.db.repo_kb import encode_chunk_copy, vector_literal
+
+
+def start_fake_openai(batch: int, dims: int) -> ThreadingHTTPServer:
+    rng = np.random.default_rng(1)
+    vecs = rng.normal(size=(batch, dims)).astype("<f4")
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+
+    def body(fmt: str) -> bytes:
+        data = [
+            {
+                "object": "embedding",
+                "index": i,
+                "embedding": base64.b64encode(v.tobytes()).decode() if fmt == "base64" else v.tolist(),
+            }
+            for i, v in enumerate(vecs)
+        ]
+        usage = {"prompt_tokens": batch * 200, "total_tokens": batch * 200}
+        return json.dumps({"object": "list", "data": data, "model": "bench", "usage": usage}).encode()
+
+    bodies = {"float": body("float"), "base64": body("base64")}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # иначе keep-alive ловит 40 мс delayed ACK на каждом ответе
+
+        def log_message(self, *args) -> None:  # noqa: D401
+            pass
+
+        def do_POST(self) -> None:
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            out = bodies["base64" if req.get("encoding_format") == "base64" else "float"]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def measure(label: str, fn: Callable[[], Any], rounds: int) -> Any:
+    fn()  # прогрев соединения
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        res = fn()
+    ms = (time.perf_counter() - t0) * 1000 / rounds
+    del res
+    tracemalloc.start()
+    res = fn()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{label:<24} {ms:8.2f} ms/batch   result {retained / 1024 / 1024:6.2f} MB")
+    return res
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--batch", type=int, default=32)
+    ap.add_argument("--dims", type=int, default=3072)
+    ap.add_argument("--rounds", type=int, default=30)
+    args = ap.parse_args()
+
+    srv = start_fake_openai(args.batch, args.dims)
+    sdk = OpenAI(api_key="bench", base_url=f"http://127.0.0.1:{srv.server_port}/v1", max_retries=0)
+    cli = OpenAIClient("bench")
+    cli.client = sdk
+    texts = [f"chunk {i}" for i in range(args.batch)]
+
+    print(f"embeddings response: {args.batch} x {args.dims}")
+    measure(
+        "float JSON",
+        lambda: [d.embedding for d in sdk.embeddings.create(model="bench", input=texts, encoding_format="float").data],
+        args.rounds,
+    )
+    as_list: List[List[float]] = measure(
+        "SDK base64 -> list",
+        lambda: [d.embedding for d in sdk.embeddings.create(model="bench", input=texts).data],
+        args.rounds,
+    )
+    as_f32 = measure("base64 -> float32", lambda: cli.embeddings(texts, model="bench"), args.rounds)
+    srv.shutdown()
+
+    def per_call(label: str, fn: Callable[[], Any], n: int) -> None:
+        t0 = time.perf_counter()
+        for _ in range(n):
+            fn()
+        print(f"{label:<34} {(time.perf_counter() - t0) * 1000 / n:8.3f} ms")
+
+    print("\ndownstream:")
+    rows_list = [(1, i, "t", v, None) for i, v in enumerate(as_list)]
+    rows_f32 = [(1, i, "t", v, None) for i, v in enumerate(as_f32)]
+    per_call("COPY encode, list[float] batch", lambda: encode_chunk_copy(rows_list, 1), 50)
+    per_call("COPY encode, float32 batch", lambda: encode_chunk_copy(rows_f32, 1), 50)
+    q_list, q_f32 = as_list[0], as_f32[0]
+    per_call("query literal, old (.10g per float)", lambda: "[" + ",".join(f"{float(x):.10g}" for x in q_list) + "]", 300)
+    per_call("query literal, float32", lambda: vector_literal(q_f32), 300)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Recall@k укороченных embeddings (параметр dimensions у text-embedding-3-*) против полных 3072.
+
+Укорочение через API эквивалентно обрезке полного вектора до первых D координат с повторной
+нормировкой (Matryoshka-обучение), поэтому бенчу не нужны повторные запросы embeddings:
+берутся уже сохранённые полные векторы активного поколения kb_chunks, запросами служат
+сами чанки (без учёта совпадения с собой) или тексты из --queries-file (нужен OPENAI_API_KEY).
+
+Для каждой размерности печатает recall@k относительно полного поиска, размер вектора
+и время точного поиска по корпусу в NumPy (≈ стоимость расчёта расстояний).
+
+    DATABASE_URL=postgresql://... python -m bench.embed_dims [--limit 50000] [--dims 1536,1024,512,256]
+    python -m bench.embed_dims --synthetic 20000   # без БД: синтетика с убывающей по координатам дисперсией
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from sqlalchemy import text as sqltext
+
+
+def load_db(limit: int) -> Tuple[np.ndarray, List[str]]:
+    from app.db.repo_kb import ACTIVE_GENERATION_SQL, KBRepo
+    from app.db.session import make_session_factory
+
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        raise SystemExit("DATABASE_URL is required (or use --synthetic)")
+    sf, _ = make_session_factory(url)
+    with sf() as s:
+        rows = s.execute(
+            sqltext(
+                f"SELECT embedding, text FROM kb_chunks WHERE generation = {ACTIVE_GENERATION_SQL} "
+                "ORDER BY random() LIMIT :n"
+            ),
+            {"n": int(limit)},
+        ).fetchall()
+    if not rows:
+        raise SystemExit("no chunks in the active generation")
+    vecs = np.array([KBRepo._vector_from_db(r[0]) for r in rows], dtype=np.float32)
+    return vecs, [r[1] for r in rows]
+
+
+def synthetic(n: int, dims: int, rng: np.random.Generator) -> np.ndarray:
+    """Дисперсия убывает по номеру координаты — информация сосредоточена в начале, как у Matryoshka."""
+    scale = 1.0 / np.sqrt(np.arange(1, dims + 1, dtype=np.float32))
+    centers = rng.normal(size=(max(2, n // 100), dims)).astype(np.float32) * scale
+    v = centers[rng.integers(0, len(centers), n)] + rng.normal(scale=0.7, size=(n, dims)).astype(np.float32) * scale
+    return v
+
+
+def shorten(v: np.ndarray, d: int) -> np.ndarray:
+    out = v[:, :d].copy()
+    out /= np.linalg.norm(out, axis=1, keepdims=True) + 1e-12
+    return out
+
+
+def topk(corpus: np.ndarray, queries: np.ndarray, k: int, exclude_self: bool) -> Tuple[np.ndarray, float]:
+    t0 = time.perf_counter()
+    sims = queries @ corpus.T
+    if exclude_self:
+        np.fill_diagonal(sims[:, : len(queries)], -np.inf)
+    idx = np.argpartition(-sims, k, axis=1)[:, :k]
+    ms = (time.perf_counter() - t0) * 1000 / len(queries)
+    return idx, ms
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--limit", type=int, default=50_000, help="сколько чанков взять из БД")
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("--queries-file", help="тексты запросов, по одному в строке (эмбеддятся полной моделью)")
+    ap.add_argument("--model", default=os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-large"))
+    ap.add_argument("--dims", default="1536,1024,512,256")
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--synthetic", type=int, default=0, help="N синтетических векторов 3072 вместо БД")
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(7)
+    if args.synthetic:
+        full = synthetic(args.synthetic, 3072, rng)
+    else:
+        full, _ = load_db(args.limit)
+    full /= np.linalg.norm(full, axis=1, keepdims=True) + 1e-12
+    n, native = full.shape
+
+    if args.queries_file:
+        from app.clients.openai_client import OpenAIClient
+
+        with open(args.queries_file, encoding="utf-8") as f:
+            texts = [t.strip() for t in f if t.strip()]
+        q_full = np.array(OpenAIClient(os.getenv("OPENAI_API_KEY", "")).embeddings(texts, model=args.model), dtype=np.float32)
+        exclude_self = False
+    else:
+        # запросы — первые чанки корпуса (порядок уже случайный)
+        q_full = full[: min(args.queries, n)]
+        exclude_self = True
+
+    truth, base_ms = topk(full, q_full, args.k, exclude_self)
+    print(f"corpus={n} x {native}  queries={len(q_full)}  k={args.k}")
+    print(f"{native:>5} dims  {native * 4:>6} B/vec  search {base_ms:6.2f} ms/query  recall@{args.k}=1.000")
+
+    for d in [int(x) for x in args.dims.split(",") if x.strip()]:
+        if d >= native:
+            continue
+        idx, ms = topk(shorten(full, d), shorten(q_full, d), args.k, exclude_self)
+        recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(idx.tolist(), truth.tolist())])
+        print(f"{d:>5} dims  {d * 4:>6} B/vec  search {ms:6.2f} ms/query  recall@{args.k}={recall:.3f}")
+
+
+if __name__ == "__main__":
+    main()
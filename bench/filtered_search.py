@@ -0,0 +1,143 @@
+"""
+Поиск с фильтром по документам диалога (document_ids): планировщик KBRepo против двух крайних вариантов.
+
+  planner      — search_by_embedding(document_ids=...): exact_scoped / ann_filtered / ann_iterative по размеру фильтра;
+  exact        — exact=True: точный перебор чанков фильтра (прежнее поведение при любом фильтре);
+  ann+filter   — ANN без фильтра на limit * ann_candidates кандидатов, фильтр поверх: быстро, но на узком
+                 фильтре почти ничего не находит.
+
+Для диалогов с 2 ... 2000 документов печатает план, p50/p95 и recall@k относительно точного результата.
+Векторы синтетические (как в bench.ann_search): у документа своя тема, чанки — тема + шум.
+
+Нужен Postgres с pgvector (DATABASE_URL) и ПУСТОЙ kb_chunks; бенч строит ANN-индекс поколения,
+в конце удаляет его и свои документы.
+
+    DATABASE_URL=postgresql://... python -m bench.filtered_search [--docs 2000] [--chunks-per-doc 30] [--dims 1024]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import time
+from typing import Callable, List
+
+import numpy as np
+
+from sqlalchemy import text as sqltext
+
+from app.db.repo_kb import KBRepo
+from app.db.session import ensure_schema, make_session_factory
+
+PREFIX = "bench/filtered/"
+
+
+def pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=2000)
+    ap.add_argument("--chunks-per-doc", type=int, default=30)
+    ap.add_argument("--dims", type=int, default=1024)
+    ap.add_argument("--topics", type=int, default=200)
+    ap.add_argument("--scopes", default="2,20,200,1000,2000", help="сколько документов у диалога")
+    ap.add_argument("--queries", type=int, default=50)
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--exact-max-rows", type=int, default=10_000)
+    args = ap.parse_args()
+
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        raise SystemExit("DATABASE_URL is required")
+    sf, engine = make_session_factory(url)
+    ensure_schema(engine)
+    repo = KBRepo(sf, ann_exact_max_rows=args.exact_max_rows)
+
+    with sf() as s:
+        if s.execute(sqltext("SELECT COUNT(*) FROM kb_chunks")).scalar():
+            raise SystemExit("kb_chunks is not empty: run on an empty database")
+
+    rng = np.random.default_rng(23)
+    latent = 64
+    basis = rng.normal(size=(latent, args.dims)) / 8.0
+    centers = rng.normal(size=(args.topics, latent))
+
+    def vectors(topic_ids: np.ndarray) -> np.ndarray:
+        z = centers[topic_ids] + rng.normal(scale=1.0, size=(len(topic_ids), latent))
+        v = z @ basis + rng.normal(scale=0.1, size=(len(topic_ids), args.dims))
+        return (v / np.linalg.norm(v, axis=1, keepdims=True)).astype(np.float32)
+
+    gen = repo.active_generation()
+    repo.drop_ann_index(gen)
+    docs = repo.upsert_documents_bulk(
+        [{"path": f"{PREFIX}{i:05d}", "title": "bench", "status": "indexed"} for i in range(args.docs)]
+    )
+    doc_ids = [docs[f"{PREFIX}{i:05d}"] for i in range(args.docs)]
+    doc_topic = rng.integers(0, args.topics, args.docs)
+    try:
+        t0 = time.perf_counter()
+        per_batch = max(1, 2000 // args.chunks_per_doc)
+        for lo in range(0, args.docs, per_batch):
+            batch = range(lo, min(args.docs, lo + per_batch))
+            topics = np.repeat(doc_topic[list(batch)], args.chunks_per_doc)
+            vecs = vectors(topics)
+            rows = []
+            for j, d in enumerate(batch):
+                for o in range(args.chunks_per_doc):
+                    rows.append((doc_ids[d], o, f"chunk {d}/{o}", vecs[j * args.chunks_per_doc + o], None))
+            repo.insert_chunks_bulk(rows)
+        with sf() as s:
+            s.execute(sqltext("ANALYZE kb_chunks"))
+            s.commit()
+        res = repo.ensure_ann_index(gen)
+        print(f"loaded {args.docs * args.chunks_per_doc} chunks in {time.perf_counter() - t0:.1f} s; ANN index: {res}")
+
+        k = args.k
+        for n_docs in [int(x) for x in args.scopes.split(",") if x.strip()]:
+            n_docs = min(n_docs, args.docs)
+            scopes = [rng.choice(args.docs, n_docs, replace=False) for _ in range(args.queries)]
+            # запрос — про тему одного из документов диалога
+            queries = [vectors(np.array([doc_topic[int(sc[0])]]))[0] for sc in scopes]
+            scope_ids = [[doc_ids[int(i)] for i in sc] for sc in scopes]
+            truth = [
+                {h["chunk_id"] for h in repo.search_by_embedding(q, limit=k, document_ids=ids, exact=True)}
+                for q, ids in zip(queries, scope_ids)
+            ]
+
+            def run(label: str, fn: Callable[[np.ndarray, List[int]], List[dict]]) -> None:
+                lat, rec, plans = [], [], {}
+                for q, ids, t in zip(queries, scope_ids, truth):
+                    t1 = time.perf_counter()
+                    hits = fn(q, ids)
+                    lat.append((time.perf_counter() - t1) * 1000)
+                    rec.append(len(t & {h["chunk_id"] for h in hits}) / max(1, len(t)))
+                    plan = hits[0].get("plan", "-") if hits else "-"
+                    plans[plan] = plans.get(plan, 0) + 1
+                top_plan = max(plans, key=plans.get)
+                print(
+                    f"  {label:<11} p50={pct(lat, 0.5):7.1f} ms  p95={pct(lat, 0.95):7.1f} ms  "
+                    f"recall@{k}={statistics.mean(rec):.3f}  plan={top_plan}"
+                )
+
+            print(f"dialog with {n_docs} documents ({n_docs * args.chunks_per_doc} chunks):")
+            run("planner", lambda q, ids: repo.search_by_embedding(q, limit=k, document_ids=ids))
+            run("exact", lambda q, ids: repo.search_by_embedding(q, limit=k, document_ids=ids, exact=True))
+
+            def post_filter(q: np.ndarray, ids: List[int]) -> List[dict]:
+                allowed = set(ids)
+                hits = repo.search_by_embedding(q, limit=k * repo.ann_candidates)
+                return [h for h in hits if h["document_id"] in allowed][:k]
+
+            run("ann+filter", post_filter)
+    finally:
+        repo.drop_ann_index(gen)
+        with sf() as s:
+            s.execute(sqltext("DELETE FROM kb_documents WHERE path LIKE :p"), {"p": PREFIX + "%"})
+            s.commit()
+
+
+if __name__ == "__main__":
+    main()
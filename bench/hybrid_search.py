@@ -0,0 +1,140 @@
+"""
+Гибридный поиск (вектор + полнотекстовый, RRF) против чисто векторного на запросах с идентификаторами.
+
+Корпус синтетический: у каждой темы — свой вектор-центр и свой словарь, у каждого чанка — уникальный
+артикул в тексте. Векторы чанков одной темы близки, поэтому запрос «артикул X ...» (его embedding —
+центр темы с шумом, как у реальной модели, которая артикулы не различает) векторный поиск находит
+только случайно. Два набора запросов:
+  - ident    — текст с артикулом, цель — чанк с этим артикулом (hit@k);
+  - semantic — только слова темы: hit@k — доля точного векторного top-k (равные по словам чанки
+               гибрид переставляет), topic@k — доля выдачи из нужной темы (гибрид не должен её портить).
+Плюс p50/p95 латентности search_by_embedding и search_hybrid (один запрос к БД).
+
+Нужен Postgres с pgvector (DATABASE_URL) и ПУСТОЙ kb_chunks; в конце бенч удаляет свои документы.
+
+    DATABASE_URL=postgresql://... python -m bench.hybrid_search [--rows 20000] [--dims 1024] [--k 6]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import time
+from typing import Callable, List
+
+import numpy as np
+
+from sqlalchemy import text as sqltext
+
+from app.db.repo_kb import KBRepo
+from app.db.session import ensure_schema, make_session_factory
+
+PREFIX = "bench/hybrid/"
+WORDS = (
+    "договор поставка оплата счет акт склад отгрузка претензия гарантия ремонт насос клапан фильтр "
+    "датчик кабель щит трансформатор проект смета монтаж наладка проверка инструкция регламент приказ "
+    "отпуск командировка премия график охрана пожар эвакуация доступ пропуск ключ сервер сеть почта"
+).split()
+
+
+def pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=20_000)
+    ap.add_argument("--dims", type=int, default=1024)
+    ap.add_argument("--topics", type=int, default=200)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--candidates", type=int, default=4)
+    ap.add_argument("--rrf-k", type=int, default=60)
+    ap.add_argument("--lexical-weight", type=float, default=1.0)
+    args = ap.parse_args()
+
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        raise SystemExit("DATABASE_URL is required")
+    sf, engine = make_session_factory(url)
+    ensure_schema(engine)
+    repo = KBRepo(sf)
+
+    with sf() as s:
+        if s.execute(sqltext("SELECT COUNT(*) FROM kb_chunks")).scalar():
+            raise SystemExit("kb_chunks is not empty: run on an empty database")
+
+    rng = np.random.default_rng(17)
+    centers = rng.normal(size=(args.topics, args.dims)).astype(np.float32)
+    topic_words = [rng.choice(WORDS, 4, replace=False).tolist() for _ in range(args.topics)]
+
+    def embed(topic: int, scale: float = 0.6) -> np.ndarray:
+        v = centers[topic] + rng.normal(scale=scale, size=args.dims).astype(np.float32)
+        return v / np.linalg.norm(v)
+
+    topics = rng.integers(0, args.topics, args.rows)
+    docs = repo.upsert_documents_bulk(
+        [{"path": f"{PREFIX}{i:03d}", "title": "bench", "status": "indexed"} for i in range(100)]
+    )
+    doc_ids = list(docs.values())
+    try:
+        t0 = time.perf_counter()
+        for start in range(0, args.rows, 2000):
+            rows = []
+            for i in range(start, min(args.rows, start + 2000)):
+                t = int(topics[i])
+                text = f"{' '.join(topic_words[t])} артикул SKU{100000 + i} раздел {i % 97}"
+                rows.append((doc_ids[i % len(doc_ids)], i, text, embed(t), None))
+            repo.insert_chunks_bulk(rows)
+        filled = repo.backfill_fts()
+        fts = repo.ensure_fts_index()
+        with sf() as s:
+            s.execute(sqltext("ANALYZE kb_chunks"))
+            s.commit()
+            order_to_id = dict(s.execute(sqltext("SELECT chunk_order, id FROM kb_chunks")).fetchall())
+        topic_of = {cid: int(topics[o]) for o, cid in order_to_id.items()}
+        print(f"loaded {args.rows} x {args.dims} in {time.perf_counter() - t0:.1f} s  (backfilled {filled}, {fts})")
+
+        k, lim = args.k, args.k * args.candidates
+        picks = rng.integers(0, args.rows, args.queries)
+        ident, semantic = [], []
+        for i in (int(x) for x in picks):
+            t = int(topics[i])
+            ident.append((f"артикул SKU{100000 + i} {topic_words[t][0]}", embed(t), {order_to_id[i]}, t))
+            q, qv = " ".join(topic_words[t][:2]), embed(t)
+            truth = {h["chunk_id"] for h in repo.search_by_embedding(qv, limit=k, exact=True)}
+            semantic.append((q, qv, truth, t))
+
+        def vector(q: str, qv: np.ndarray) -> List[int]:
+            return [h["chunk_id"] for h in repo.search_by_embedding(qv, limit=k)]
+
+        def hybrid(q: str, qv: np.ndarray) -> List[int]:
+            rows = repo.search_hybrid(qv, q, limit=k, candidates=lim, rrf_k=args.rrf_k, lexical_weight=args.lexical_weight)
+            return [h["chunk_id"] for h in rows]
+
+        def run(label: str, fn: Callable[[str, np.ndarray], List[int]], queries) -> None:
+            lat, hit, on_topic = [], [], []
+            for q, qv, truth, topic in queries:
+                t = time.perf_counter()
+                got = fn(q, qv)
+                lat.append((time.perf_counter() - t) * 1000)
+                hit.append(len(truth & set(got)) / len(truth))
+                on_topic.append(sum(topic_of[c] == topic for c in got) / max(1, len(got)))
+            print(
+                f"{label:<18} p50={pct(lat, 0.5):7.1f} ms  p95={pct(lat, 0.95):7.1f} ms  "
+                f"hit@{k}={statistics.mean(hit):.3f}  topic@{k}={statistics.mean(on_topic):.3f}"
+            )
+
+        run("ident / vector", vector, ident)
+        run("ident / hybrid", hybrid, ident)
+        run("semantic / vector", vector, semantic)
+        run("semantic / hybrid", hybrid, semantic)
+    finally:
+        with sf() as s:
+            s.execute(sqltext("DELETE FROM kb_documents WHERE path LIKE :p"), {"p": PREFIX + "%"})
+            s.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Разбор PDF/DOCX/XLSX: потоки sync (как при KB_PARSE_PROCESSES=0) против ParsePool с N процессами.
+
+На синтетическом корпусе (PDF — PyMuPDF, DOCX — python-docx, XLSX — openpyxl) или своих файлах
+(--corpus DIR) печатает для каждого режима файлы/с, МБ/с и ускорение относительно потоков; парсинг тот же,
+что у /kb sync (iter_file_text, колонтитулы PDF убираются). Потоков столько же, сколько процессов:
+в потоках GIL не даёт парсингу занять больше одного ядра, процессы масштабируются до числа ядер.
+В конце — проверка таймаута: самый большой файл с --timeout 0.05 с должен убить процесс и завершиться
+ошибкой, а пул — продолжить работу.
+
+    python -m bench.parse_pool [--files 120] [--pages 30] [--processes 1,2,4,8] [--corpus DIR]
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+
+from app.kb.parse_pool import ParsePool
+from app.kb.parsers import detect_ext, iter_file_text
+
+_WORDS = (
+    "supplier buyer goods delivery payment term acceptance claim specification warranty penalty "
+    "termination notice party obligation quality packaging shipping invoice act schedule"
+).split()
+
+
+def _sentence(rnd: random.Random) -> str:
+    return " ".join(rnd.choice(_WORDS) for _ in range(rnd.randint(8, 16))).capitalize() + "."
+
+
+def make_pdf(rnd: random.Random, pages: int) -> bytes:
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page()
+        page.insert_text((50, 40), f"Northern Logistics LLC - Contracts - page {n + 1} of {pages}", fontsize=8)
+        y = 70
+        while y < 780:
+            page.insert_text((50, y), _sentence(rnd)[:95], fontsize=9)
+            y += 12
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def make_docx(rnd: random.Random, pages: int) -> bytes:
+    from docx import Document
+
+    doc = Document()
+    for _ in range(pages * 12):
+        doc.add_paragraph(" ".join(_sentence(rnd) for _ in range(3)))
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+
+def make_xlsx(rnd: random.Random, pages: int) -> bytes:
+    import openpyxl
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["Code", "Name", "Term", "Owner", "Amount"])
+    for r in range(pages * 60):
+        ws.append([f"A{r:05d}", _sentence(rnd)[:40], rnd.randint(1, 30), rnd.choice(_WORDS), rnd.random() * 1e5])
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def make_corpus(n: int, pages: int, rnd: random.Random) -> List[Tuple[str, bytes]]:
+    makers: List[Tuple[str, Callable[[random.Random, int], bytes]]] = [
+        ("pdf", make_pdf),
+        ("docx", make_docx),
+        ("xlsx", make_xlsx),
+    ]
+    out = []
+    for i in range(n):
+        ext, make = makers[i % len(makers)]
+        out.append((f"doc{i:04d}.{ext}", make(rnd, max(1, int(pages * rnd.uniform(0.5, 1.5))))))
+    return out
+
+
+def load_corpus(path: str) -> List[Tuple[str, bytes]]:
+    out = []
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            if ParsePool.handles(name):
+                with open(os.path.join(root, name), "rb") as f:
+                    out.append((name, f.read()))
+    return out
+
+
+def parse_in_thread(name: str, data: bytes) -> int:
+    return sum(len(p) for p in iter_file_text(name, data))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=120)
+    ap.add_argument("--pages", type=int, default=30, help="страниц (у DOCX/XLSX — эквивалент) на файл, ±50%%")
+    ap.add_argument("--processes", default="1,2,4,8")
+    ap.add_argument("--corpus", default="", help="каталог со своими PDF/DOCX/XLSX вместо синтетики")
+    ap.add_argument("--timeout", type=float, default=0.05, help="таймаут для проверки убийства процесса")
+    args = ap.parse_args()
+
+    rnd = random.Random(24)
+    t0 = time.perf_counter()
+    files = load_corpus(args.corpus) if args.corpus else make_corpus(args.files, args.pages, rnd)
+    if not files:
+        raise SystemExit("empty corpus")
+    mb = sum(len(d) for _, d in files) / 2**20
+    kinds = sorted({detect_ext(n) for n, _ in files})
+    print(
+        f"corpus: {len(files)} files ({', '.join(kinds)}), {mb:.1f} MB, built in {time.perf_counter() - t0:.1f} s; "
+        f"cpu cores: {os.cpu_count()}"
+    )
+
+    base = None
+    for n in [int(x) for x in args.processes.split(",") if x.strip()]:
+        for mode in ("threads", "processes"):
+            pool = ParsePool(n) if mode == "processes" else None
+            try:
+                if pool is not None:
+                    # старт процессов (forkserver + импорт парсеров) — не в замере
+                    list(ThreadPoolExecutor(n).map(lambda f: pool.parse(*f)[0], files[:n]))
+
+                def one(f: Tuple[str, bytes]) -> int:
+                    if pool is None:
+                        return parse_in_thread(*f)
+                    text, _ = pool.parse(*f)
+                    if text is None:
+                        return 0
+                    with text:
+                        return len(text.read())
+
+                t1 = time.perf_counter()
+                with ThreadPoolExecutor(n) as ex:
+                    chars = sum(ex.map(one, files))
+                dt = time.perf_counter() - t1
+            finally:
+                if pool is not None:
+                    pool.close()
+            base = base or dt
+            print(
+                f"  {mode:<9} x{n:<3} {len(files) / dt:7.1f} files/s  {mb / dt:6.2f} MB/s  "
+                f"x{base / dt:.2f} vs 1 thread  ({chars / 2**20:.1f} MB of text)"
+            )
+
+    name, data = max(files, key=lambda f: len(f[1]))
+    with ParsePool(1, timeout_sec=args.timeout) as pool:
+        t1 = time.perf_counter()
+        try:
+            pool.parse(name, data)
+            verdict = "finished before the timeout (increase --pages)"
+        except RuntimeError as e:
+            verdict = f"error: {e}"
+        killed = time.perf_counter() - t1
+        small = min(files, key=lambda f: len(f[1]))
+        pool.timeout_sec = None
+        text, _ = pool.parse(*small)
+        if text is not None:
+            text.close()
+        print(f"timeout check: {name} ({len(data) / 2**20:.1f} MB) -> {verdict} in {killed:.2f} s; after: {pool.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+/kb rebuild (скачивание + парсинг + нарезка + embeddings) против /kb rechunk (текст из kb_document_texts).
+
+Диск фейковый, с задержкой на файл (--disk-latency-ms) и пропускной способностью (--disk-mbps); embedder
+фейковый, со скоростью --embed-tps токенов/с (как у API). После sync, который заполняет кэш текста,
+меняется CHUNK_SIZE и выполняются rebuild и rechunk. Печатает время, сколько файлов скачано и во сколько
+раз rechunk быстрее; время rechunk должно быть близко к времени embeddings / KB_SYNC_INDEX_WORKERS.
+Также печатает объём кэша и степень сжатия. БД — временный SQLite с NumpyVectorStore.
+
+    python -m bench.rechunk [--files 60] [--pages 20] [--disk-mbps 20] [--embed-tps 200000]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+import types
+from typing import Any, Dict, List
+
+import numpy as np
+
+from app.core.utils import count_tokens_batch
+from app.db.repo_kb import KBRepo
+from app.db.session import ensure_schema, make_session_factory
+from app.db.vector_store import NumpyVectorStore
+from app.kb.indexer import KbIndexer
+from app.kb.syncer import KbSyncer
+from app.kb.text_cache import TextCache
+
+from bench.parse_pool import make_corpus
+
+
+class FakeDisk:
+    def __init__(self, files: Dict[str, bytes], latency_ms: float, mbps: float):
+        self.files = files
+        self.latency = latency_ms / 1000.0
+        self.mbps = mbps
+        self.downloads = 0
+
+    def list_kb_files_metadata(self) -> List[Dict[str, Any]]:
+        return [
+            {"path": p, "name": p.rsplit("/", 1)[-1], "md5": f"{hash(d) & 0xFFFFFFFF:08x}", "size": len(d)}
+            for p, d in self.files.items()
+        ]
+
+    def download(self, path: str) -> bytes:
+        data = self.files[path]
+        self.downloads += 1
+        time.sleep(self.latency + len(data) / (self.mbps * 2**20))
+        return data
+
+
+class FakeEmbedder:
+    def __init__(self, tps: float, dims: int = 64):
+        self.tps = tps
+        self.dims = dims
+        self.tokens = 0
+
+    def embed(self, texts: List[str]):
+        n = sum(count_tokens_batch(texts)[0])
+        self.tokens += n
+        time.sleep(n / self.tps)
+        return [np.ones(self.dims, dtype=np.float32) / self.dims**0.5 for _ in texts]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=60)
+    ap.add_argument("--pages", type=int, default=20)
+    ap.add_argument("--disk-latency-ms", type=float, default=300)
+    ap.add_argument("--disk-mbps", type=float, default=20)
+    ap.add_argument("--embed-tps", type=float, default=200_000, help="токенов embeddings в секунду")
+    ap.add_argument("--chunk-size", default="900,600", help="CHUNK_SIZE до и после смены")
+    args = ap.parse_args()
+
+    before, after = [int(x) for x in args.chunk_size.split(",")]
+    files = {f"/kb/{name}": data for name, data in make_corpus(args.files, args.pages, random.Random(25))}
+    print(f"corpus: {len(files)} files, {sum(len(d) for d in files.values()) / 2**20:.1f} MB")
+
+    tmp = tempfile.mkdtemp(prefix="bench_rechunk_")
+    try:
+        sf, engine = make_session_factory("sqlite:///" + os.path.join(tmp, "kb.sqlite3"))
+        ensure_schema(engine)
+        repo = KBRepo(sf, vector_store=NumpyVectorStore(os.path.join(tmp, "vectors")))
+        disk = FakeDisk(files, args.disk_latency_ms, args.disk_mbps)
+        cfg = types.SimpleNamespace(kb_ann_index="off", kb_sync_pipeline=True)
+        cache = TextCache(repo)
+
+        emb = FakeEmbedder(args.embed_tps)
+        KbSyncer(cfg, repo, KbIndexer(repo, emb, before, 150), disk, text_cache=cache).sync()
+        size = repo.text_cache_size()
+        print(
+            f"text cache: {size['documents']} documents, {size['text_bytes'] / 2**20:.1f} MB of text -> "
+            f"{size['stored_bytes'] / 2**20:.2f} MB ({cache.codec}, x{size['text_bytes'] / max(1, size['stored_bytes']):.1f})"
+        )
+
+        times = {}
+        for op in ("rebuild", "rechunk"):
+            emb = FakeEmbedder(args.embed_tps)
+            syncer = KbSyncer(cfg, repo, KbIndexer(repo, emb, after, 150), disk, text_cache=cache)
+            disk.downloads = 0
+            t0 = time.perf_counter()
+            res = getattr(syncer, op)()
+            times[op] = time.perf_counter() - t0
+            print(
+                f"  {op:<8} {times[op]:6.1f} s  ok={res['ok']} fail={res['fail']} downloads={disk.downloads} "
+                f"embeddings {emb.tokens} tokens ≈{emb.tokens / args.embed_tps:.1f} s in total over index workers"
+            )
+        print(f"rechunk is x{times['rebuild'] / times['rechunk']:.1f} faster")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Sync без изменений на Диске: прежний путь (scan с document_needs_reindex на каждый файл,
+UPDATE всей kb_documents, затем upsert_document + document_needs_reindex на каждый файл)
+против планировщика (один SELECT, сравнение в памяти, пакетные upsert/деактивация).
+
+Нужен Postgres (DATABASE_URL) с ПУСТОЙ kb_documents — бенч создаёт документы bench/*
+и удаляет их в конце. Диск фейковый, ничего не скачивается и не эмбеддится.
+
+    DATABASE_URL=postgresql://... python -m bench.sync_plan [--docs 10000] [--changed 0]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+from sqlalchemy import event
+from sqlalchemy import text as sqltext
+
+from app.db.repo_kb import KBRepo
+from app.db.session import ensure_schema, make_session_factory
+from app.kb.syncer import KbSyncer
+
+PREFIX = "bench/"
+
+
+class FakeDisk:
+    def __init__(self, files: List[Dict[str, Any]]):
+        self.files = files
+
+    def list_kb_files_metadata(self) -> List[Dict[str, Any]]:
+        return [dict(f) for f in self.files]
+
+
+def make_files(n: int) -> List[Dict[str, Any]]:
+    base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "path": f"{PREFIX}dept_{i % 50:02d}/doc_{i:06d}.pdf",
+            "resource_id": f"bench-r{i}",
+            "md5": f"{i:032x}",
+            "size": 1000 + i,
+            "modified": (base + timedelta(minutes=i)).isoformat(),
+        }
+        for i in range(n)
+    ]
+
+
+def seed(repo: KBRepo, syncer: KbSyncer) -> None:
+    """Все файлы Диска уже проиндексированы."""
+    plan = syncer._plan()
+    syncer._apply_plan(plan)
+    with repo.sf() as s:
+        s.execute(sqltext("UPDATE kb_documents SET indexed_at=NOW(), status='indexed' WHERE path LIKE :p"), {"p": PREFIX + "%"})
+        s.commit()
+
+
+def legacy_sync_metadata(syncer: KbSyncer, repo: KBRepo) -> int:
+    """Копия метаданной части прежнего KbSyncer.sync (без скачивания/индексации)."""
+    disk = syncer._disk_files()
+    db_by_path = {d["path"]: d for d in repo.list_documents_brief(active_only=True)}
+    for f in disk:  # прежний scan()
+        db = db_by_path.get(f["path"])
+        if db:
+            repo.document_needs_reindex(int(db["id"]), md5=f.get("md5"), modified_at=f.get("modified_at"), size=f.get("size"))
+    disk = syncer._disk_files()
+    repo.mark_all_documents_inactive()
+    to_index = 0
+    for f in disk:  # прежняя стадия plan
+        did = repo.upsert_document(
+            path=f["path"], title=f.get("title"), resource_id=f.get("resource_id"), md5=f.get("md5"),
+            size=f.get("size"), modified_at=f.get("modified_at"), is_active=True,
+        )
+        if repo.document_needs_reindex(did, md5=f.get("md5"), modified_at=f.get("modified_at"), size=f.get("size")):
+            to_index += 1
+    return to_index
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=10_000)
+    ap.add_argument("--changed", type=int, default=0, help="сколько файлов изменить перед вторым sync")
+    ap.add_argument("--skip-legacy", action="store_true")
+    args = ap.parse_args()
+
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        raise SystemExit("DATABASE_URL is required")
+    sf, engine = make_session_factory(url)
+    ensure_schema(engine)
+    repo = KBRepo(sf, dim=3072)
+
+    with sf() as s:
+        foreign = s.execute(sqltext("SELECT COUNT(*) FROM kb_documents WHERE path NOT LIKE :p"), {"p": PREFIX + "%"}).scalar()
+    if foreign:
+        raise SystemExit(f"kb_documents has {foreign} non-bench rows: run on an empty database")
+
+    statements = {"n": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(*_a: Any, **_k: Any) -> None:
+        statements["n"] += 1
+
+    files = make_files(args.docs)
+    disk = FakeDisk(files)
+    cfg = SimpleNamespace(kb_sync_pipeline=False)
+    syncer = KbSyncer(cfg, repo, None, disk)  # type: ignore[arg-type]
+
+    try:
+        seed(repo, syncer)
+        for i in range(min(args.changed, len(files))):
+            files[i]["md5"] = f"changed{i:025x}"
+
+        def run(label: str, fn) -> None:
+            statements["n"] = 0
+            t0 = time.perf_counter()
+            res = fn()
+            dt = time.perf_counter() - t0
+            print(f"{label:<22} docs={args.docs}  to_index={res:>6}  statements={statements['n']:>6}  {dt:7.2f} s")
+
+        def planner() -> int:
+            plan = syncer._plan()
+            syncer._apply_plan(plan)
+            return len(plan.to_index)
+
+        run("planner", planner)
+        if not args.skip_legacy:
+            run("legacy per-file", lambda: legacy_sync_metadata(syncer, repo))
+    finally:
+        with sf() as s:
+            s.execute(sqltext("DELETE FROM kb_documents WHERE path LIKE :p"), {"p": PREFIX + "%"})
+            s.commit()
+
+
+if __name__ == "__main__":
+    main()
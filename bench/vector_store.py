@@ -0,0 +1,98 @@
+"""
+NumpyVectorStore (app/db/vector_store.py): точный поиск перебором по memmap .npy без БД и pgvector.
+
+Загружает --rows синтетических векторов пачками по --batch (как sync пишет документы: дозапись в хвост,
+периодическое уплотнение), затем открывает каталог заново (как после перезапуска) и меряет p50/p95
+поиска top-k:
+  all        — по всему поколению;
+  scope N    — по N документам диалога (маска по document_id, скоринг только отобранных строк).
+Для проверки сравнивает выдачу с argsort по полной матрице в памяти.
+
+    python -m bench.vector_store [--rows 200000] [--dims 1024] [--docs 4000] [--dir /tmp/kb_vectors_bench]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+
+from app.db.vector_store import NumpyVectorStore
+
+
+def pct(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=200_000)
+    ap.add_argument("--dims", type=int, default=1024)
+    ap.add_argument("--docs", type=int, default=4000)
+    ap.add_argument("--batch", type=int, default=2000)
+    ap.add_argument("--queries", type=int, default=50)
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--scopes", default="20,400", help="сколько документов у диалога")
+    ap.add_argument("--dir", default="")
+    args = ap.parse_args()
+
+    root = args.dir or tempfile.mkdtemp(prefix="kb_vectors_bench_")
+    rng = np.random.default_rng(5)
+    doc_of = np.sort(rng.integers(0, args.docs, args.rows))
+    try:
+        store = NumpyVectorStore(root)
+        t0 = time.perf_counter()
+        for lo in range(0, args.rows, args.batch):
+            hi = min(args.rows, lo + args.batch)
+            vec = rng.normal(size=(hi - lo, args.dims)).astype(np.float32)
+            store.add(1, np.arange(lo, hi), doc_of[lo:hi], vec)
+        load = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        store = NumpyVectorStore(root)
+        st = store.stats()
+        print(
+            f"{args.rows} x {args.dims}: written in {load:.1f} s, reopened in {(time.perf_counter() - t0) * 1000:.1f} ms, "
+            f"{st['vector_store_mb']} MB on disk"
+        )
+
+        seg = store._gen(1)
+        full = np.concatenate([np.asarray(v) for v, _ in seg.parts()])
+        ids = np.concatenate([np.asarray(i) for _, i in seg.parts()])
+        queries = rng.normal(size=(args.queries, args.dims)).astype(np.float32)
+
+        def run(label: str, scopes) -> None:
+            lat, exact = [], 0
+            for q, scope in zip(queries, scopes):
+                t = time.perf_counter()
+                got = store.search(1, q, limit=args.k, document_ids=scope)
+                lat.append((time.perf_counter() - t) * 1000)
+                s = full @ (q / np.linalg.norm(q))
+                if scope is not None:
+                    s[~np.isin(ids[:, 1], list(scope))] = -np.inf
+                truth = ids[np.argsort(-s)[: args.k], 0].tolist()
+                exact += [c for c, _, _ in got] == truth
+            print(
+                f"  {label:<10} p50={pct(lat, 0.5):6.1f} ms  p95={pct(lat, 0.95):6.1f} ms  "
+                f"exact top-{args.k}: {exact}/{len(lat)}"
+            )
+
+        # прогрев page cache: первый проход читает файл с диска
+        store.search(1, queries[0], limit=args.k)
+        run("all", [None] * args.queries)
+        for n in [int(x) for x in args.scopes.split(",") if x.strip()]:
+            run(f"scope {n}", [rng.choice(args.docs, n, replace=False).tolist() for _ in range(args.queries)])
+    finally:
+        if not args.dir:
+            shutil.rmtree(root, ignore_errors=True)
+        elif os.path.isdir(root):
+            print(f"files kept in {root}")
+
+
+if __name__ == "__main__":
+    main()